@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Ask for build information
 read -r -p "Enter version (e.g. 1.0): " VERSION
 if [[ -z "$VERSION" ]]; then
@@ -49,12 +52,29 @@ if [[ ! -d "sunxi-tools" ]]; then
     exit 1
 fi
 
+# Customizations live in the build layer (tools/beike/layer.py) and squashfs-root is
+# left as extracted; without python3 the old in-place edits are the fallback
+BEIKE_TOOLS="${BEIKE_TOOLS:-$(cd "$(dirname "$0")/../tools" 2>/dev/null && pwd || true)}"
+USE_LAYER=""
+if command -v python3 >/dev/null 2>&1 && [[ -d "$BEIKE_TOOLS/beike" ]]; then
+    USE_LAYER=1
+elif [[ -d ".beike-layer" ]]; then
+    echo "This directory has a build layer (.beike-layer) but python3 isn't available to apply it."
+    exit 1
+fi
+beike_layer() { PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.layer "$@"; }
+
 # Update firmware information in config files
 echo "Updating firmware information..."
 SOFTWARE_VERSION="${BUILD_NUM}"
+trace_begin stamp_cfg
 
 for cfg_file in squashfs-root/res/cfg/220x176.cfg squashfs-root/res/cfg/320x240.cfg; do
-    if [[ -f "$cfg_file" ]]; then
+    if [[ -f "$cfg_file" && -n "$USE_LAYER" ]]; then
+        echo "  Updating $cfg_file (build layer)"
+        beike_layer set "$cfg_file" "product_type=${PRODUCT_TYPE}" "software_version=${SOFTWARE_VERSION}" \
+            "updated=${CURRENT_DATE}" "Manufacturer=${MANUFACTURER}" "date_number=${CURRENT_DATE}" >/dev/null
+    elif [[ -f "$cfg_file" ]]; then
         echo "  Updating $cfg_file"
         # Use sed to update the firmware_information section
         sed -i.bak "s/^product_type=.*/product_type=${PRODUCT_TYPE}/" "$cfg_file"
@@ -67,6 +87,7 @@ for cfg_file in squashfs-root/res/cfg/220x176.cfg squashfs-root/res/cfg/320x240.
         echo "  Warning: $cfg_file not found, skipping"
     fi
 done
+trace_end stamp_cfg
 
 # Create squashfs image
 echo "Creating $OUT from squashfs-root..."
@@ -78,7 +99,24 @@ if [[ -f ".mksquashfs_exclude" ]]; then
     EXCLUDE_OPTS="-ef .mksquashfs_exclude"
 fi
 
+# Build layer: edited files as pseudo files, deletions and .mksquashfs_exclude as -ef
+if [[ -n "$USE_LAYER" ]]; then
+    EXCLUDE_OPTS=$(beike_layer options)
+fi
+
+# Delta-friendly deterministic layout (tools/beike/delta.py) when BEIKE_DETERMINISTIC is set;
+# it takes in .mksquashfs_sort itself
+if [[ -n "${BEIKE_DETERMINISTIC:-}" && -n "$USE_LAYER" ]]; then
+    EXCLUDE_OPTS="$EXCLUDE_OPTS $(PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.delta options)"
+# Boot file ordering (python3 -m beike.bootorder make)
+elif [[ -f ".mksquashfs_sort" ]]; then
+    echo "Using boot file order from .mksquashfs_sort"
+    EXCLUDE_OPTS="$EXCLUDE_OPTS -sort .mksquashfs_sort"
+fi
+
 # Determine compression method
+trace_begin mksquashfs
+PACK_START=$SECONDS
 if [[ "$USE_EXPERIMENTAL" == "yes" ]]; then
     echo "Using experimental extra compression..."
     mksquashfs squashfs-root "$OUT" -comp xz -Xbcj arm -b 1M -no-xattrs $EXCLUDE_OPTS
@@ -86,8 +124,10 @@ else
     # Build with standard compression
     mksquashfs squashfs-root "$OUT" -comp xz -no-xattrs $EXCLUDE_OPTS
 fi
+trace_end mksquashfs "$(wc -c < "$OUT" | tr -d '[:space:]')"
 
 # Verify size against mtdblock2
+trace_begin size_check
 if [[ ! -f "mtdblock2" ]]; then
     echo "Warning: mtdblock2 not found. Cannot verify size."
 else
@@ -99,7 +139,9 @@ else
             echo "Image too large: ${out_size} bytes >= ${mtd_size} bytes"
             echo "Retrying with experimental extra compression..."
             rm -f "$OUT"
+            trace_begin mksquashfs_retry
             mksquashfs squashfs-root "$OUT" -comp xz -Xbcj arm -b 1M -no-xattrs $EXCLUDE_OPTS
+            trace_end mksquashfs_retry "$(wc -c < "$OUT" | tr -d '[:space:]')"
             
             # Check size again
             out_size=$(wc -c < "$OUT" | tr -d '[:space:]')
@@ -119,9 +161,23 @@ else
         echo "Size check passed: ${out_size} bytes < ${mtd_size} bytes"
     fi
 fi
+trace_end size_check
+
+PACK_SECONDS=$((SECONDS - PACK_START))
+
+# Record the build (python3 -m beike.history); fails here if a headroom margin is set and not met
+if [[ -n "$USE_LAYER" ]]; then
+    PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.history record "$OUT" --version "$VERSION" --build "$BUILD_NUM" \
+        --seconds "$PACK_SECONDS" --option "product=${PRODUCT_TYPE}" --option "manufacturer=${MANUFACTURER}" \
+        --option "compression=${USE_EXPERIMENTAL}" --option "deterministic=${BEIKE_DETERMINISTIC:-}" || exit 1
+    # Erase blocks changed against the previous image (what an adb update would write)
+    PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.delta compare "$OUT" || true
+fi
 
 # Copy into sunxi-tools for flashing
+trace_begin copy
 cp -f "$OUT" sunxi-tools/
+trace_end copy "$(wc -c < "$OUT" | tr -d '[:space:]')"
 
 echo "Build complete: $OUT"
 echo "To flash to device, run: ./flash.sh $OUT"
\ No newline at end of file
@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Script to change boot and shutdown logos on device
 # Images should be 220x176 pixels, JPEG format (baseline, not progressive)
 
@@ -117,8 +120,12 @@ fi
 if [[ -n "$BOOT_IMAGE" ]]; then
     echo ""
     echo "Flashing boot logo..."
+    trace_begin push_boot_logo
     adb push boot_logo_new.raw /data/
+    trace_end push_boot_logo "$TARGET_SIZE"
+    trace_begin dd_boot_logo
     adb shell "toolbox dd if=/data/boot_logo_new.raw of=/dev/block/mtdblock4 bs=131072 && sync"
+    trace_end dd_boot_logo "$TARGET_SIZE"
     echo "✓ Boot logo flashed"
 fi
 
@@ -126,8 +133,12 @@ fi
 if [[ -n "$SHUTDOWN_IMAGE" ]]; then
     echo ""
     echo "Flashing shutdown logo..."
+    trace_begin push_shutdown_logo
     adb push shutdown_logo_new.raw /data/
+    trace_end push_shutdown_logo "$TARGET_SIZE"
+    trace_begin dd_shutdown_logo
     adb shell "toolbox dd if=/data/shutdown_logo_new.raw of=/dev/block/mtdblock5 bs=131072 && sync"
+    trace_end dd_shutdown_logo "$TARGET_SIZE"
     echo "✓ Shutdown logo flashed"
 fi
 
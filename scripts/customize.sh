@@ -19,14 +19,32 @@ MENU_CFG="${CFG_DIR}/menu.cfg"
 CFG_220="${CFG_DIR}/220x176.cfg"
 CFG_320="${CFG_DIR}/320x240.cfg"
 
-# Function to update config value
+# Settings go into the build layer (tools/beike/layer.py) so squashfs-root stays as
+# extracted; without python3 they're edited in place like before
+BEIKE_TOOLS="${BEIKE_TOOLS:-$(cd "$(dirname "$0")/../tools" 2>/dev/null && pwd || true)}"
+USE_LAYER=""
+if command -v python3 >/dev/null 2>&1 && [[ -d "$BEIKE_TOOLS/beike" ]]; then
+    USE_LAYER=1
+fi
+beike() { PYTHONPATH="$BEIKE_TOOLS" python3 -m "beike.$1" "${@:2}"; }
+
+# Function to update config value (inside [section] when a fourth argument is given)
 update_config() {
     local file="$1"
     local key="$2"
     local value="$3"
+    local section="${4:-}"
     
-    if [[ -f "$file" ]]; then
-        sed -i.bak "s/^${key}=.*/${key}=${value}/" "$file"
+    if [[ ! -f "$file" ]]; then
+        return 0
+    fi
+    if [[ -n "$USE_LAYER" ]]; then
+        beike layer set "$file" "${key}=${value}" ${section:+--section "$section"} >/dev/null
+    elif [[ -n "$section" ]]; then
+        sed -i.bak "/^\[${section}\]/,/^${key}=/ s/^${key}=.*/${key}=${value}/" "$file"
+        rm -f "${file}.bak"
+    else
+        sed -i.bak "s/^\(${key} *= *\).*/\1${value}/" "$file"
         rm -f "${file}.bak"
     fi
 }
@@ -127,33 +145,39 @@ else
     echo ""
     echo "Updating menu.cfg..."
     
-    [[ -n "$LANGUAGE" ]] && sed -i.bak "/^\[language\]/,/^current=/ s/^current=.*/current=${LANGUAGE}/" "$MENU_CFG"
-    [[ -n "$VIDEO_RES" ]] && sed -i.bak "/^\[video_resolution\]/,/^current=/ s/^current=.*/current=${VIDEO_RES}/" "$MENU_CFG"
-    [[ -n "$VIDEO_BITRATE" ]] && sed -i.bak "/^\[video_bitrate\]/,/^current=/ s/^current=.*/current=${VIDEO_BITRATE}/" "$MENU_CFG"
-    [[ -n "$PHOTO_RES" ]] && sed -i.bak "/^\[photo_resolution\]/,/^current=/ s/^current=.*/current=${PHOTO_RES}/" "$MENU_CFG"
-    [[ -n "$PHOTO_QUALITY" ]] && sed -i.bak "/^\[photo_compression_quality\]/,/^current=/ s/^current=.*/current=${PHOTO_QUALITY}/" "$MENU_CFG"
-    [[ -n "$GSENSOR" ]] && sed -i.bak "/^\[gsensor\]/,/^current=/ s/^current=.*/current=${GSENSOR}/" "$MENU_CFG"
-    [[ -n "$SCREEN_SWITCH" ]] && sed -i.bak "/^\[screen_switch\]/,/^current=/ s/^current=.*/current=${SCREEN_SWITCH}/" "$MENU_CFG"
-    [[ -n "$VOICE_VOL" ]] && sed -i.bak "/^\[voicevol\]/,/^current=/ s/^current=.*/current=${VOICE_VOL}/" "$MENU_CFG"
-    [[ -n "$LIGHT_FREQ" ]] && sed -i.bak "/^\[light_freq\]/,/^current=/ s/^current=.*/current=${LIGHT_FREQ}/" "$MENU_CFG"
+    [[ -n "$LANGUAGE" ]] && update_config "$MENU_CFG" current "$LANGUAGE" language
+    [[ -n "$VIDEO_RES" ]] && update_config "$MENU_CFG" current "$VIDEO_RES" video_resolution
+    [[ -n "$VIDEO_BITRATE" ]] && update_config "$MENU_CFG" current "$VIDEO_BITRATE" video_bitrate
+    [[ -n "$PHOTO_RES" ]] && update_config "$MENU_CFG" current "$PHOTO_RES" photo_resolution
+    [[ -n "$PHOTO_QUALITY" ]] && update_config "$MENU_CFG" current "$PHOTO_QUALITY" photo_compression_quality
+    [[ -n "$GSENSOR" ]] && update_config "$MENU_CFG" current "$GSENSOR" gsensor
+    [[ -n "$SCREEN_SWITCH" ]] && update_config "$MENU_CFG" current "$SCREEN_SWITCH" screen_switch
+    [[ -n "$VOICE_VOL" ]] && update_config "$MENU_CFG" current "$VOICE_VOL" voicevol
+    [[ -n "$LIGHT_FREQ" ]] && update_config "$MENU_CFG" current "$LIGHT_FREQ" light_freq
     
     # Update switch settings
-    [[ -n "$POWER_ON_RECORD" ]] && sed -i.bak "s/^power_on_record=.*/power_on_record=${POWER_ON_RECORD}/" "$MENU_CFG"
-    [[ -n "$RECORD_SOUND" ]] && sed -i.bak "s/^record_sound=.*/record_sound=${RECORD_SOUND}/" "$MENU_CFG"
-    [[ -n "$TIME_WATERMARK" ]] && sed -i.bak "s/^time_water_mark=.*/time_water_mark=${TIME_WATERMARK}/" "$MENU_CFG"
-    [[ -n "$PHOTO_WATERMARK" ]] && sed -i.bak "s/^photo_water_mark=.*/photo_water_mark=${PHOTO_WATERMARK}/" "$MENU_CFG"
-    [[ -n "$WIFI_SWITCH" ]] && sed -i.bak "s/^wifi=.*/wifi=${WIFI_SWITCH}/" "$MENU_CFG"
-    [[ -n "$KEYTONE" ]] && sed -i.bak "s/^keytone=.*/keytone=${KEYTONE}/" "$MENU_CFG"
-    [[ -n "$LED_LIGHTS" ]] && sed -i.bak "s/^LED_lights = .*/LED_lights = ${LED_LIGHTS}/" "$MENU_CFG"
-    
-    rm -f "${MENU_CFG}.bak"
+    [[ -n "$POWER_ON_RECORD" ]] && update_config "$MENU_CFG" power_on_record "$POWER_ON_RECORD"
+    [[ -n "$RECORD_SOUND" ]] && update_config "$MENU_CFG" record_sound "$RECORD_SOUND"
+    [[ -n "$TIME_WATERMARK" ]] && update_config "$MENU_CFG" time_water_mark "$TIME_WATERMARK"
+    [[ -n "$PHOTO_WATERMARK" ]] && update_config "$MENU_CFG" photo_water_mark "$PHOTO_WATERMARK"
+    [[ -n "$WIFI_SWITCH" ]] && update_config "$MENU_CFG" wifi "$WIFI_SWITCH"
+    [[ -n "$KEYTONE" ]] && update_config "$MENU_CFG" keytone "$KEYTONE"
+    [[ -n "$LED_LIGHTS" ]] && update_config "$MENU_CFG" LED_lights "$LED_LIGHTS"
 fi
 
 echo ""
 echo "=== Debloating ==="
 read -r -p "Enable debloating (exclude files from build)? (y/N): " DEBLOAT
 
-if [[ "$DEBLOAT" =~ ^[Yy]$ ]]; then
+if [[ -n "$USE_LAYER" ]]; then
+    # Deletions in the build layer: fake feature drivers, exclude.txt, menu entries
+    if [[ "$DEBLOAT" =~ ^[Yy]$ ]]; then
+        beike cli customize --debloat
+        beike layer status
+    else
+        beike cli customize --no-debloat
+    fi
+elif [[ "$DEBLOAT" =~ ^[Yy]$ ]]; then
     echo "Configuring debloat options..."
     
     # Create .mksquashfs_exclude file
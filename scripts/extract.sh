@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Script to extract mtdblock2 into squashfs-root
 
 # Check for unsquashfs command
@@ -33,8 +36,16 @@ if [[ -d "squashfs-root" ]]; then
     fi
 fi
 
-# Extract
+# Extract, through the extraction cache when python3 is around (see tools/beike/store.py):
+# an image that was extracted before just gets linked back in
 echo "Extracting $MTDBLOCK..."
-unsquashfs "$MTDBLOCK"
+BEIKE_TOOLS="${BEIKE_TOOLS:-$(cd "$(dirname "$0")/../tools" 2>/dev/null && pwd || true)}"
+trace_begin unsquashfs
+if command -v python3 >/dev/null 2>&1 && [[ -d "$BEIKE_TOOLS/beike" ]]; then
+    PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.store extract "$MTDBLOCK" -d squashfs-root
+else
+    unsquashfs "$MTDBLOCK"
+fi
+trace_end unsquashfs "$(wc -c < "$MTDBLOCK" | tr -d '[:space:]')"
 
 echo "Done! Extracted to squashfs-root/"
@@ -1,7 +1,35 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Script to flash system image to device using sunxi-fel
+# Usage: flash.sh [system_vX.bin] [NAME=FILE ...]   e.g. flash.sh system_v1.0.bin boot_logo=boot.jpg
+
+# Partition offsets come from the detected partition table when python3 is around
+# (tools/beike/flash.py); extra NAME=FILE partitions go out in the same FEL session
+BEIKE_TOOLS="${BEIKE_TOOLS:-$(cd "$(dirname "$0")/../tools" 2>/dev/null && pwd || true)}"
+USE_BEIKE=""
+if command -v python3 >/dev/null 2>&1 && [[ -d "$BEIKE_TOOLS/beike" ]]; then
+    USE_BEIKE=1
+fi
+PARTS=()
+for part in "${@:2}"; do
+    part_file="${part#*=}"
+    if [[ "$part" != *=* || ! -f "$part_file" ]]; then
+        echo "Error: expected NAME=FILE with an existing file, got '$part'."
+        exit 1
+    fi
+    PARTS+=(--part "${part%%=*}=$(cd "$(dirname "$part_file")" && pwd)/$(basename "$part_file")")
+done
+if [[ ${#PARTS[@]} -gt 0 && -z "$USE_BEIKE" ]]; then
+    echo "Error: flashing extra partitions needs python3 and tools/beike."
+    exit 1
+fi
+if [[ -n "${1:-}" && -f "$1" ]]; then
+    IMAGE_PATH="$(cd "$(dirname "$1")" && pwd)/$(basename "$1")"
+fi
 
 # Check if we're in sunxi-tools directory or navigate to it
 if [[ ! -x "./sunxi-fel" ]]; then
@@ -14,7 +42,9 @@ if [[ ! -x "./sunxi-fel" ]]; then
 fi
 
 # Get image file
-if [[ -n "${1:-}" ]]; then
+if [[ -n "${IMAGE_PATH:-}" ]]; then
+    IMAGE="$IMAGE_PATH"
+elif [[ -n "${1:-}" ]]; then
     IMAGE="$1"
 else
     # List available system_v*.bin files
@@ -82,9 +112,19 @@ if [[ ! -x "./sunxi-fel" ]]; then
 fi
 
 echo "Flashing $IMAGE..."
-./sunxi-fel -p spiflash-write 2883584 "$IMAGE"
+if [[ -n "$USE_BEIKE" ]]; then
+    # Checks every image against its partition, writes them all and resets
+    IMAGE="$(cd "$(dirname "$IMAGE")" && pwd)/$(basename "$IMAGE")"
+    PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.cli -C .. flash "$IMAGE" ${PARTS[@]+"${PARTS[@]}"}
+else
+    trace_begin spiflash_write
+    ./sunxi-fel -p spiflash-write 2883584 "$IMAGE"
+    trace_end spiflash_write "$(wc -c < "$IMAGE" | tr -d '[:space:]')"
 
-echo "Resetting device..."
-./sunxi-fel wdreset
+    echo "Resetting device..."
+    trace_begin wdreset
+    ./sunxi-fel wdreset
+    trace_end wdreset
+fi
 
 echo "Done! Device flashed successfully."
@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Script to flash full restore image to device from sector 0 using sunxi-fel
 
 # Check if we're in sunxi-tools directory or navigate to it
@@ -88,10 +91,14 @@ if [[ ! -x "./sunxi-fel" ]]; then
 fi
 
 echo "Flashing $IMAGE from sector 0..."
+trace_begin spiflash_write
 ./sunxi-fel -p spiflash-write 0 "$IMAGE"
+trace_end spiflash_write "$img_size"
 
 echo "Resetting device..."
+trace_begin wdreset
 ./sunxi-fel wdreset
+trace_end wdreset
 
 echo "Done! Full restore completed successfully."
 echo "Device is rebooting..."
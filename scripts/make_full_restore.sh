@@ -1,6 +1,9 @@
 #!/usr/bin/env bash
 set -euo pipefail
 
+# Stage timing when BEIKE_TRACE is set (see trace.sh)
+source "$(dirname "$0")/trace.sh" 2>/dev/null || { trace_begin() { :; }; trace_end() { :; }; }
+
 # Script to create a full restore image from mtdblock files (no version prompt)
 
 OUT="full_restore.bin"
@@ -49,7 +52,9 @@ fi
 
 # Concatenate files
 echo "Creating $OUT..."
+trace_begin concatenate
 cat "${blocks[@]}" > "$OUT"
+trace_end concatenate "$total_size"
 
 # Verify size
 out_size=$(wc -c < "$OUT" | tr -d '[:space:]')
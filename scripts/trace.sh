@@ -0,0 +1,51 @@
+#!/usr/bin/env bash
+# Optional stage timing for the scripts, sourced by them.
+# Does nothing unless BEIKE_TRACE is set to an output file, e.g.
+#   BEIKE_TRACE=build.json ./build.sh
+# Spans are written to $BEIKE_TRACE.events and converted to Chrome trace JSON
+# (plus the shared run history) by tools/beike/trace.py when the script exits.
+
+if [[ -n "${BEIKE_TRACE:-}" ]]; then
+    # Scripts cd around (sunxi-tools), so pin the paths down now
+    BEIKE_TRACE="$(cd "$(dirname "$BEIKE_TRACE")" && pwd)/$(basename "$BEIKE_TRACE")"
+    BEIKE_TOOLS="${BEIKE_TOOLS:-$(cd "$(dirname "${BASH_SOURCE[0]}")/../tools" 2>/dev/null && pwd || true)}"
+    TRACE_NAME="$(basename "$0" .sh)"
+    : > "$BEIKE_TRACE.events"
+fi
+
+# "<B|E> <time> <children user cpu> <children sys cpu> <name> [bytes]"
+_trace_event() {
+    local now="${EPOCHREALTIME:-}" user sys
+    [[ -n "$now" ]] || now=$(date +%s)
+    times > "$BEIKE_TRACE.times"
+    { read -r _; read -r user sys; } < "$BEIKE_TRACE.times"
+    echo "$1 $now $user $sys $2 ${3:-}" >> "$BEIKE_TRACE.events"
+}
+
+trace_begin() {
+    [[ -n "${BEIKE_TRACE:-}" ]] || return 0
+    _trace_event B "$1"
+}
+
+# trace_end <name> [bytes processed]
+trace_end() {
+    [[ -n "${BEIKE_TRACE:-}" ]] || return 0
+    _trace_event E "$1" "${2:-}"
+}
+
+trace_finish() {
+    [[ -n "${BEIKE_TRACE:-}" ]] || return 0
+    rm -f "$BEIKE_TRACE.times"
+    if [[ -n "${BEIKE_TOOLS:-}" ]] && \
+        PYTHONPATH="$BEIKE_TOOLS" python3 -m beike.trace import "$BEIKE_TRACE.events" \
+            -o "$BEIKE_TRACE" --name "$TRACE_NAME" >&2; then
+        rm -f "$BEIKE_TRACE.events"
+    else
+        echo "Trace events left in $BEIKE_TRACE.events (convert with: python3 -m beike.trace import)" >&2
+    fi
+}
+
+if [[ -n "${BEIKE_TRACE:-}" ]]; then
+    trace_begin "$TRACE_NAME"
+    trap 'trace_end "$TRACE_NAME"; trace_finish' EXIT
+fi
@@ -0,0 +1,17 @@
+"""
+Beike Tools - Allwinner V3 Action Camera library
+Shared code behind the scripts and the ROM builder GUI
+"""
+
+import os
+
+
+def cache_dir(*parts):
+    """Return (and create) a directory under the user cache for beike tools"""
+    base = os.environ.get('BEIKE_CACHE_DIR')
+    if not base:
+        xdg = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        base = os.path.join(xdg, 'beike-tools')
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Workflow benchmarks
+Times extract, customize, build, flash, backup and restore end to end against the
+fake sunxi-fel/adb device (see fakedev.py), through both the shell scripts and the
+ROMBuilderGUI actions, and writes the results as JSON.
+
+    python3 -m beike.bench
+    python3 -m beike.bench --suite scripts --fel-rate 0 -o bench.json
+    python3 -m beike.bench --dump ../dumps/beike1gddrimx179spq_sdv-20191024 --keep
+
+Stages whose host tools are missing (mksquashfs, unsquashfs, a display for the GUI)
+are recorded as skipped rather than failing the run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import fakedev
+from .flash import DEFAULT_LAYOUT
+
+REPO_DIR = os.path.dirname(fakedev.TOOLS_DIR)
+SCRIPTS_DIR = os.path.join(REPO_DIR, 'scripts')
+DEFAULT_DUMP = os.path.join(REPO_DIR, 'dumps', 'beike1gddrimx179spq_sdv-20191024')
+
+# Answers for the interactive scripts, in prompt order
+CUSTOMIZE_ANSWERS = "Beike\nBench\nSports DV\n12345678\n2\n" + "\n" * 40
+BUILD_ANSWERS = "1.0\n1\nBeike\nBench\nno\n"
+
+
+class Skip(Exception):
+    """Raised by a stage that cannot run on this host"""
+
+
+class Bench:
+    def __init__(self, workspace, rates, verbose=False):
+        self.workspace = workspace
+        self.rates = rates
+        self.verbose = verbose
+        self.results = []
+        self.bin_dir = os.path.join(workspace, 'sunxi-tools')
+        self.env = dict(os.environ)
+        self.env['BEIKE_FAKE_DEVICE'] = os.path.join(workspace, '.fakedev')
+        self.env['PATH'] = self.bin_dir + os.pathsep + self.env.get('PATH', '')
+
+    def stage(self, suite, name, fn):
+        started = time.perf_counter()
+        result = {'suite': suite, 'stage': name}
+        try:
+            detail = fn()
+            result['status'] = 'ok'
+            if detail:
+                result.update(detail)
+        except Skip as e:
+            result['status'] = 'skipped'
+            result['reason'] = str(e)
+        except (subprocess.CalledProcessError, OSError, RuntimeError) as e:
+            result['status'] = 'failed'
+            result['reason'] = str(e)
+        result['seconds'] = round(time.perf_counter() - started, 4)
+        self.results.append(result)
+        mark = {'ok': '✓', 'skipped': '-', 'failed': '✗'}[result['status']]
+        reason = f"  ({result['reason']})" if 'reason' in result else ''
+        print(f"{mark} {suite:8} {name:10} {result['seconds']:8.3f}s{reason}")
+        return result
+
+    def sh(self, script, answers='', args=()):
+        """Run one of scripts/*.sh in the workspace, feeding its prompts"""
+        proc = subprocess.run(['bash', os.path.join(self.workspace, script)] + list(args),
+                              cwd=self.workspace, env=self.env, input=answers.encode(),
+                              stdout=None if self.verbose else subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+        if proc.returncode:
+            tail = (proc.stdout or b'').decode(errors='replace').strip().splitlines()[-1:]
+            raise RuntimeError(f"{script} exited {proc.returncode}: {' '.join(tail)}")
+
+    def reset_device(self):
+        os.environ['BEIKE_FAKE_DEVICE'] = self.env['BEIKE_FAKE_DEVICE']
+        fakedev.init_device(os.path.join(self.workspace, 'factory.bin'),
+                            state=self.env['BEIKE_FAKE_DEVICE'], **self.rates)
+
+    def flashed_system(self):
+        """The system partition as currently on the fake flash"""
+        part = DEFAULT_LAYOUT[2]
+        with open(os.path.join(self.env['BEIKE_FAKE_DEVICE'], 'flash.bin'), 'rb') as f:
+            f.seek(part.offset)
+            return f.read(part.size)
+
+
+def _require(*tools):
+    for tool in tools:
+        if not shutil.which(tool):
+            raise Skip(f"{tool} not found")
+
+
+def prepare_workspace(workspace, dump):
+    """Lay out a rom-building directory: mtdblocks, squashfs-root, scripts and fake tools"""
+    for part in DEFAULT_LAYOUT:
+        src = os.path.join(dump, part.block)
+        dst = os.path.join(workspace, part.block)
+        if os.path.exists(src):
+            shutil.copy(src, dst)
+        elif part.index == 2 and shutil.which('mksquashfs'):
+            subprocess.run(['mksquashfs', os.path.join(dump, 'squashfs-root'), dst,
+                            '-comp', 'xz', '-no-xattrs', '-quiet'], check=True, stdout=subprocess.DEVNULL)
+            with open(dst, 'ab') as f:
+                f.truncate(part.size)
+        else:
+            # No dump and no way to build one: random data keeps transfer timings honest
+            with open(dst, 'wb') as f:
+                f.write(os.urandom(part.size))
+
+    if os.path.isdir(os.path.join(dump, 'squashfs-root')):
+        shutil.copytree(os.path.join(dump, 'squashfs-root'), os.path.join(workspace, 'squashfs-root'),
+                        symlinks=True)
+    for name in os.listdir(SCRIPTS_DIR):
+        shutil.copy(os.path.join(SCRIPTS_DIR, name), workspace)
+    fakedev.install(os.path.join(workspace, 'sunxi-tools'))
+
+    with open(os.path.join(workspace, 'factory.bin'), 'wb') as out:
+        for part in DEFAULT_LAYOUT:
+            with open(os.path.join(workspace, part.block), 'rb') as f:
+                out.write(f.read())
+
+
+def _system_image(bench, name='system_v1.0.bin'):
+    """Use the built image if there is one, otherwise a stand-in sized like a typical build"""
+    path = os.path.join(bench.workspace, name)
+    if not os.path.exists(path):
+        with open(path, 'wb') as f:
+            f.write(os.urandom(DEFAULT_LAYOUT[2].size - DEFAULT_LAYOUT[2].size // 8))
+    return path
+
+
+def run_scripts(bench):
+    ws = bench.workspace
+
+    def extract():
+        _require('unsquashfs')
+        bench.sh('extract.sh', 'y\n')
+
+    def customize():
+        bench.sh('customize.sh', CUSTOMIZE_ANSWERS)
+        with open(os.path.join(ws, 'squashfs-root/res/cfg/220x176.cfg'), errors='replace') as f:
+            if 'Manufacturer=Bench' not in f.read():
+                raise RuntimeError("customize.sh did not update 220x176.cfg")
+
+    def build():
+        _require('mksquashfs')
+        bench.sh('build.sh', BUILD_ANSWERS)
+        return {'bytes': os.path.getsize(os.path.join(ws, 'system_v1.0.bin'))}
+
+    def flash():
+        image = _system_image(bench)
+        shutil.copy(image, os.path.join(ws, 'sunxi-tools'))
+        bench.sh('flash.sh', '\n', [os.path.basename(image)])
+        with open(image, 'rb') as f:
+            data = f.read()
+        if bench.flashed_system()[:len(data)] != data:
+            raise RuntimeError("flashed system partition does not match the image")
+        return {'bytes': len(data)}
+
+    def backup():
+        # Same adb pulls as docs/backup.md and ROMBuilderGUI.backup_device
+        backup_dir = os.path.join(ws, 'backup_scripts')
+        os.makedirs(backup_dir, exist_ok=True)
+        for part in DEFAULT_LAYOUT:
+            subprocess.run(['adb', 'pull', f'/dev/block/{part.block}', os.path.join(backup_dir, part.block)],
+                           env=bench.env, check=True, stdout=subprocess.DEVNULL)
+        return {'bytes': sum(p.size for p in DEFAULT_LAYOUT)}
+
+    def restore():
+        bench.sh('make_full_restore.sh', 'y\n')
+        shutil.copy(os.path.join(ws, 'full_restore.bin'), os.path.join(ws, 'sunxi-tools', 'full_restore_v1.0.bin'))
+        bench.sh('flash_full_restore.sh', 'yes\n\n', ['full_restore_v1.0.bin'])
+        return {'bytes': os.path.getsize(os.path.join(ws, 'full_restore.bin'))}
+
+    bench.reset_device()
+    for name, fn in (('extract', extract), ('customize', customize), ('build', build),
+                     ('flash', flash), ('backup', backup), ('restore', restore)):
+        bench.stage('scripts', name, fn)
+
+
+def run_gui(bench):
+    """Drive ROMBuilderGUI's actions with the dialogs answered automatically"""
+    try:
+        sys.path.insert(0, fakedev.TOOLS_DIR)
+        import rom_builder_gui as gui_module
+        gui_module.load_tk()
+        root = gui_module.tk.Tk()
+        root.withdraw()
+    except Exception as e:
+        def unavailable():
+            raise Skip(f"GUI unavailable: {e}")
+        bench.stage('gui', 'all', unavailable)
+        return
+
+    ws = bench.workspace
+    backup_dir = os.path.join(ws, 'backup_gui')
+    gui_module.messagebox.askyesno = lambda *a, **k: True
+    gui_module.messagebox.showerror = lambda *a, **k: None
+    gui_module.simpledialog.askstring = lambda *a, **k: '1.0'
+    gui_module.filedialog.askdirectory = lambda *a, **k: backup_dir
+    os.environ.update(bench.env)
+
+    app = gui_module.ROMBuilderGUI(root, drag_drop_enabled=False)
+    os.chdir(ws)
+
+    def action(method, *args):
+        """Call a GUI action and pump the event loop until its worker thread reports back"""
+        def fn():
+            app.status_var.set('')
+            method(*args)
+            while True:
+                root.update()
+                status = app.status_var.get()
+                if status and not status.endswith('...'):
+                    break
+                time.sleep(0.005)
+            if any(word in status.lower() for word in ('fail', 'error')):
+                raise RuntimeError(status)
+            return {'status_text': status}
+        return fn
+
+    def customize():
+        dialog = gui_module.CustomizeDialog(root, app)
+        dialog.wifi_ssid.set('Bench')
+        dialog.apply()
+        dialog.dialog.destroy()
+
+    def build():
+        _require('mksquashfs')
+        return action(app.build_rom_gui)()
+
+    def flash():
+        _system_image(bench)
+        return action(app.flash_rom_gui)()
+
+    def restore():
+        action(app.make_restore_gui)()
+        return action(app.full_restore_gui)()
+
+    bench.reset_device()
+    try:
+        bench.stage('gui', 'backup', action(app.backup_device))
+        backups = sorted(d for d in os.listdir(ws) if d.startswith('backup_2'))
+        if backups:
+            os.rename(os.path.join(ws, backups[-1]), backup_dir)
+        bench.stage('gui', 'extract', action(app.extract_mtdblocks_gui))
+        bench.stage('gui', 'customize', customize)
+        bench.stage('gui', 'build', build)
+        bench.stage('gui', 'flash', flash)
+        bench.stage('gui', 'restore', restore)
+    finally:
+        os.chdir(REPO_DIR)
+        root.destroy()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ROM workflows against a fake device")
+    parser.add_argument('--suite', choices=['all', 'scripts', 'gui'], default='all')
+    parser.add_argument('--dump', default=DEFAULT_DUMP, help="directory with mtdblock dumps and squashfs-root")
+    parser.add_argument('--fel-rate', type=int, help="fake SPI rate for sunxi-fel in bytes/s (0 = unlimited)")
+    parser.add_argument('--adb-rate', type=int, help="fake USB rate for adb in bytes/s (0 = unlimited)")
+    parser.add_argument('--mtd-write-rate', type=int, help="fake on-device MTD write rate in bytes/s")
+    parser.add_argument('-o', '--output', help="JSON output file (default: bench_<timestamp>.json)")
+    parser.add_argument('--keep', action='store_true', help="keep the workspace for inspection")
+    parser.add_argument('-v', '--verbose', action='store_true', help="show script output")
+    args = parser.parse_args(argv)
+
+    rates = {'fel_rate': args.fel_rate, 'adb_rate': args.adb_rate, 'mtd_write_rate': args.mtd_write_rate}
+    workspace = tempfile.mkdtemp(prefix='beike-bench-')
+    try:
+        prepare_workspace(workspace, args.dump)
+        bench = Bench(workspace, rates, args.verbose)
+        if args.suite in ('all', 'scripts'):
+            run_scripts(bench)
+        if args.suite in ('all', 'gui'):
+            run_gui(bench)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    finally:
+        if args.keep:
+            print(f"Workspace kept at {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                 'cpus': os.cpu_count()},
+        'device': dict(fakedev.DEFAULT_CONFIG, **{k: v for k, v in rates.items() if v is not None}),
+        'dump': os.path.abspath(args.dump),
+        'results': bench.results,
+    }
+    output = args.output or f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    failed = [r for r in bench.results if r['status'] == 'failed']
+    print(f"{'✗' if failed else '✓'} Results written to {output}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Android boot image (mtdblock1) parser and repacker
+The image is mmapped and the kernel, ramdisk and second stage are handed out as
+zero-copy memoryviews. Unpacking writes the kernel, the original compressed
+ramdisk and an editable ramdisk tree; repacking only rebuilds and recompresses
+the ramdisk when something in that tree (or its manifest) actually changed.
+
+    python3 -m beike.bootimg info mtdblock1
+    python3 -m beike.bootimg unpack mtdblock1 boot_unpacked
+    python3 -m beike.bootimg repack boot_unpacked boot_new.img --cmdline "loglevel=8"
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import stat
+import struct
+import sys
+
+from . import cpio
+from .flash import DEFAULT_LAYOUT
+
+BOOT_MAGIC = b'ANDROID!'
+BOOT_PARTITION_SIZE = DEFAULT_LAYOUT[1].size
+# magic, kernel_size, kernel_addr, ramdisk_size, ramdisk_addr, second_size, second_addr,
+# tags_addr, page_size, header_version, os_version, name, cmdline, id, extra_cmdline
+HEADER_FMT = '<8s10I16s512s32s1024s'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _pages(size, page_size):
+    return (size + page_size - 1) // page_size
+
+
+def _cstr(raw):
+    return raw.split(b'\x00', 1)[0].decode('latin-1')
+
+
+class BootImage:
+    """A parsed boot image over a bytes-like buffer (usually an mmap)"""
+    def __init__(self, buf):
+        if bytes(buf[:8]) != BOOT_MAGIC:
+            raise ValueError("not an Android boot image (no ANDROID! magic)")
+        self._buf = buf
+        self._view = memoryview(buf)
+        self._file = None
+        fields = struct.unpack_from(HEADER_FMT, buf, 0)
+        (_magic, self.kernel_size, self.kernel_addr, self.ramdisk_size, self.ramdisk_addr,
+         self.second_size, self.second_addr, self.tags_addr, self.page_size,
+         self.header_version, self.os_version, name, cmdline, self.id, extra) = fields
+        self.name = _cstr(name)
+        self.cmdline = _cstr(cmdline) + _cstr(extra)
+        if self.page_size not in (2048, 4096, 8192, 16384):
+            raise ValueError(f"unexpected page size {self.page_size}")
+
+    @classmethod
+    def open(cls, path):
+        """mmap a boot image file (or mtdblock1 dump)"""
+        f = open(path, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        image = cls(mm)
+        image._file = f
+        return image
+
+    def close(self):
+        self._view.release()
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def kernel_offset(self):
+        return self.page_size
+
+    @property
+    def ramdisk_offset(self):
+        return self.kernel_offset + _pages(self.kernel_size, self.page_size) * self.page_size
+
+    @property
+    def second_offset(self):
+        return self.ramdisk_offset + _pages(self.ramdisk_size, self.page_size) * self.page_size
+
+    @property
+    def image_size(self):
+        """Bytes actually used by the image (the partition is padded after this)"""
+        return self.second_offset + _pages(self.second_size, self.page_size) * self.page_size
+
+    @property
+    def kernel(self):
+        return self._view[self.kernel_offset:self.kernel_offset + self.kernel_size]
+
+    @property
+    def ramdisk(self):
+        return self._view[self.ramdisk_offset:self.ramdisk_offset + self.ramdisk_size]
+
+    @property
+    def second(self):
+        return self._view[self.second_offset:self.second_offset + self.second_size]
+
+    @property
+    def ramdisk_compression(self):
+        return 'gzip' if bytes(self.ramdisk[:2]) == GZIP_MAGIC else 'none'
+
+    def ramdisk_cpio(self):
+        """The uncompressed ramdisk archive"""
+        if self.ramdisk_compression == 'gzip':
+            return gzip.decompress(self.ramdisk)
+        return bytes(self.ramdisk)
+
+    def header_info(self):
+        return {'kernel_size': self.kernel_size, 'kernel_addr': self.kernel_addr,
+                'ramdisk_size': self.ramdisk_size, 'ramdisk_addr': self.ramdisk_addr,
+                'second_size': self.second_size, 'second_addr': self.second_addr,
+                'tags_addr': self.tags_addr, 'page_size': self.page_size,
+                'header_version': self.header_version, 'os_version': self.os_version,
+                'name': self.name, 'cmdline': self.cmdline, 'id': self.id.hex(),
+                'ramdisk_compression': self.ramdisk_compression, 'image_size': self.image_size}
+
+
+def image_id(kernel, ramdisk, second):
+    """The SHA1 id mkbootimg stores in the header"""
+    h = hashlib.sha1()
+    for part in (kernel, ramdisk, second):
+        h.update(part)
+        h.update(struct.pack('<I', len(part)))
+    return h.digest()
+
+
+def build_image(info, kernel, ramdisk, second=b'', cmdline=None):
+    """Assemble a boot image from parts; info is a header_info() style dict"""
+    page = info['page_size']
+    cmdline = (info.get('cmdline', '') if cmdline is None else cmdline).encode('latin-1')
+    if len(cmdline) > 512 + 1024 - 2:
+        raise ValueError(f"cmdline too long ({len(cmdline)} bytes)")
+    header = struct.pack(HEADER_FMT, BOOT_MAGIC, len(kernel), info['kernel_addr'], len(ramdisk),
+                         info['ramdisk_addr'], len(second), info['second_addr'], info['tags_addr'],
+                         page, info.get('header_version', 0), info.get('os_version', 0),
+                         info.get('name', '').encode('latin-1'), cmdline[:511], image_id(kernel, ramdisk, second),
+                         cmdline[511:])
+    out = bytearray(header)
+    for part in (b'', kernel, ramdisk, second):
+        if part:
+            out += part
+        out += b'\x00' * (_pages(len(out), page) * page - len(out))
+    return bytes(out)
+
+
+# ---------------------------------------------------------------------------
+# Unpack / repack
+# ---------------------------------------------------------------------------
+
+def _tree_fingerprint(root, manifest_path):
+    """Hash of the extracted ramdisk tree and its manifest, used to skip recompression"""
+    h = hashlib.sha256()
+    with open(manifest_path, 'rb') as f:
+        h.update(f.read())
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, root)
+            h.update(rel.encode('utf-8', 'surrogateescape') + b'\0')
+            if os.path.islink(full):
+                h.update(b'L' + os.readlink(full).encode('utf-8', 'surrogateescape'))
+            elif os.path.isfile(full):
+                with open(full, 'rb') as f:
+                    h.update(b'F' + hashlib.sha256(f.read()).digest())
+            else:
+                h.update(b'D')
+    return h.hexdigest()
+
+
+def extract_ramdisk(entries, root):
+    """Write cpio entries to a directory; device nodes only live in the manifest"""
+    os.makedirs(root, exist_ok=True)
+    for entry in entries:
+        path = os.path.join(root, entry.name)
+        if entry.is_dir:
+            os.makedirs(path, exist_ok=True)
+        elif entry.is_symlink:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.lexists(path):
+                os.remove(path)
+            os.symlink(entry.data.decode('utf-8', 'surrogateescape'), path)
+        elif entry.is_file:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(entry.data)
+            # Keep the files editable; real permissions are kept in the manifest
+            os.chmod(path, (entry.mode & 0o777) | 0o600)
+
+
+def unpack(image_path, out_dir):
+    """Unpack a boot image into out_dir, returns the header info dict"""
+    os.makedirs(out_dir, exist_ok=True)
+    with BootImage.open(image_path) as image:
+        info = image.header_info()
+        with open(os.path.join(out_dir, 'kernel'), 'wb') as f:
+            f.write(image.kernel)
+        with open(os.path.join(out_dir, 'ramdisk.img'), 'wb') as f:
+            f.write(image.ramdisk)
+        if image.second_size:
+            with open(os.path.join(out_dir, 'second'), 'wb') as f:
+                f.write(image.second)
+        entries = cpio.read_cpio(image.ramdisk_cpio())
+
+    root = os.path.join(out_dir, 'ramdisk')
+    extract_ramdisk(entries, root)
+    manifest_path = os.path.join(out_dir, 'ramdisk.json')
+    with open(manifest_path, 'w') as f:
+        json.dump([e.metadata() for e in entries], f, indent=1)
+
+    info['ramdisk_fingerprint'] = _tree_fingerprint(root, manifest_path)
+    with open(os.path.join(out_dir, 'bootimg.json'), 'w') as f:
+        json.dump(info, f, indent=1)
+    return info
+
+
+def _collect_entries(root, manifest):
+    """Rebuild the cpio entry list: manifest order first, then any new files"""
+    entries = []
+    seen = set()
+    next_ino = max([m['ino'] for m in manifest] + [300000]) + 1
+    for meta in manifest:
+        name = meta['name']
+        path = os.path.join(root, name)
+        mode = meta['mode']
+        special = not (stat.S_ISDIR(mode) or stat.S_ISREG(mode) or stat.S_ISLNK(mode))
+        if not special and not os.path.lexists(path):
+            continue  # deleted by the user
+        data = b''
+        if stat.S_ISREG(mode):
+            with open(path, 'rb') as f:
+                data = f.read()
+        elif stat.S_ISLNK(mode):
+            data = os.readlink(path).encode('utf-8', 'surrogateescape')
+        fields = {k: v for k, v in meta.items() if k != 'name'}
+        entries.append(cpio.Entry(name, data=data, **fields))
+        seen.add(name)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, root)
+            if rel in seen:
+                continue
+            st = os.lstat(full)
+            data = b''
+            if stat.S_ISLNK(st.st_mode):
+                data = os.readlink(full).encode('utf-8', 'surrogateescape')
+            elif stat.S_ISREG(st.st_mode):
+                with open(full, 'rb') as f:
+                    data = f.read()
+            entries.append(cpio.Entry(rel, st.st_mode, data, ino=next_ino))
+            next_ino += 1
+    return entries
+
+
+def repack(unpack_dir, out_path, cmdline=None, pad=False, limit=BOOT_PARTITION_SIZE):
+    """Rebuild a boot image from an unpack directory; returns a small report dict"""
+    with open(os.path.join(unpack_dir, 'bootimg.json'), 'r') as f:
+        info = json.load(f)
+    with open(os.path.join(unpack_dir, 'kernel'), 'rb') as f:
+        kernel = f.read()
+    second = b''
+    if os.path.exists(os.path.join(unpack_dir, 'second')):
+        with open(os.path.join(unpack_dir, 'second'), 'rb') as f:
+            second = f.read()
+
+    root = os.path.join(unpack_dir, 'ramdisk')
+    manifest_path = os.path.join(unpack_dir, 'ramdisk.json')
+    fingerprint = _tree_fingerprint(root, manifest_path)
+    recompressed = False
+    if fingerprint == info['ramdisk_fingerprint']:
+        # Untouched ramdisk: reuse the original compressed bytes as-is
+        with open(os.path.join(unpack_dir, 'ramdisk.img'), 'rb') as f:
+            ramdisk = f.read()
+    else:
+        cache_path = os.path.join(unpack_dir, 'ramdisk.new')
+        cache_key = os.path.join(unpack_dir, 'ramdisk.new.fingerprint')
+        cached = None
+        if os.path.exists(cache_path) and os.path.exists(cache_key):
+            with open(cache_key, 'r') as f:
+                if f.read() == fingerprint:
+                    with open(cache_path, 'rb') as rf:
+                        cached = rf.read()
+        if cached is not None:
+            ramdisk = cached
+        else:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+            archive = cpio.write_cpio(_collect_entries(root, manifest))
+            if info.get('ramdisk_compression') == 'gzip':
+                ramdisk = gzip.compress(archive, compresslevel=9, mtime=0)
+            else:
+                ramdisk = archive
+            recompressed = True
+            with open(cache_path, 'wb') as f:
+                f.write(ramdisk)
+            with open(cache_key, 'w') as f:
+                f.write(fingerprint)
+
+    image = build_image(info, kernel, ramdisk, second, cmdline)
+    if limit and len(image) > limit:
+        raise ValueError(f"boot image is {len(image)} bytes, partition is only {limit} bytes "
+                         f"({len(image) - limit} bytes over)")
+    with open(out_path, 'wb') as f:
+        f.write(image)
+        if pad and limit:
+            f.write(b'\x00' * (limit - len(image)))
+    return {'size': len(image), 'limit': limit, 'headroom': (limit or 0) - len(image),
+            'ramdisk_size': len(ramdisk), 'recompressed': recompressed,
+            'ramdisk_changed': fingerprint != info['ramdisk_fingerprint']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect, unpack and repack the boot image (mtdblock1)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('info', help="show header fields")
+    p.add_argument('image')
+
+    p = sub.add_parser('unpack', help="unpack kernel, ramdisk and ramdisk tree")
+    p.add_argument('image')
+    p.add_argument('out_dir')
+
+    p = sub.add_parser('repack', help="rebuild an image from an unpack directory")
+    p.add_argument('unpack_dir')
+    p.add_argument('out')
+    p.add_argument('--cmdline', help="override the kernel command line")
+    p.add_argument('--pad', action='store_true', help="pad output to the full partition size")
+    p.add_argument('--limit', type=int, default=BOOT_PARTITION_SIZE,
+                   help=f"partition size to check against (default {BOOT_PARTITION_SIZE})")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'info':
+            with BootImage.open(args.image) as image:
+                for key, value in image.header_info().items():
+                    print(f"{key:20} {hex(value) if key.endswith('_addr') else value}")
+        elif args.command == 'unpack':
+            info = unpack(args.image, args.out_dir)
+            print(f"✓ Unpacked to {args.out_dir}/ (kernel {info['kernel_size']} bytes, "
+                  f"ramdisk {info['ramdisk_size']} bytes {info['ramdisk_compression']})")
+        elif args.command == 'repack':
+            report = repack(args.unpack_dir, args.out, cmdline=args.cmdline, pad=args.pad, limit=args.limit)
+            state = "rebuilt" if report['recompressed'] else ("changed, cached" if report['ramdisk_changed'] else "unchanged")
+            print(f"✓ Wrote {args.out}: {report['size']} bytes, ramdisk {state}, "
+                  f"{report['headroom']} bytes free in partition")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
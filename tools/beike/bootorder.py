@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Boot file ordering for the system image
+Takes a record of which files the camera touches while booting (/proc/*/maps and fd
+snapshots pulled over adb, strace output, or a plain list of paths) and writes a
+mksquashfs sort file that packs those files first, in the order they were used, so
+boot reads one contiguous run of flash instead of blocks scattered over the image.
+build.sh and the GUI/CLI build pick up .mksquashfs_sort automatically.
+
+    python3 -m beike.bootorder capture --reboot -o boot_access.txt
+    python3 -m beike.bootorder make boot_access.txt
+    python3 -m beike.bootorder make boot_access.txt --include 'res/cfg/*.cfg' --dry-run
+
+It also prints how many bytes (and 64 KB flash windows) boot has to read with the
+default layout and with the sorted one, from a model of how mksquashfs lays out data
+blocks and fragments.
+"""
+
+import argparse
+import fnmatch
+import os
+import re
+import subprocess
+import sys
+import time
+
+from .flash import ERASE_BLOCK
+from .watch import BLOCK_SIZE, EXTRA_BLOCK_SIZE, SizeEstimator, load_excludes
+
+SORT_FILE = '.mksquashfs_sort'
+TOP_PRIORITY = 32767        # mksquashfs writes higher priorities first
+READ_RATE = 4 * 1024 * 1024     # kernel MTD reads off the SPI NOR (fakedev's mtd_read_rate)
+# sdv opens, reads and closes its cfgs, so they rarely show up in maps/fd snapshots
+DEFAULT_INCLUDE = ('res/cfg/*.cfg',)
+# Where the squashfs shows up on the device (init.rc symlinks /etc and /vendor into it)
+MOUNTS = (('/system/', ''), ('/vendor/', 'vendor/'), ('/etc/', 'etc/'))
+PATH_RE = re.compile(r'(/(?:system|vendor|etc)/[^\s"\')(,]+)')
+PROCESS_RE = re.compile(r'^== (\d+)')
+SNAPSHOT = "for p in /proc/[0-9]*; do echo \"== ${p#/proc/}\"; cat $p/maps; ls -l $p/fd; done 2>/dev/null"
+
+
+def capture(output, reboot=False, count=10, interval=1.0, log=print):
+    """Append count /proc snapshots, taken as early in boot as adb allows, to output"""
+    if reboot:
+        log("Rebooting device...")
+        subprocess.run(['adb', 'reboot'], capture_output=True)
+        time.sleep(3)
+    subprocess.run(['adb', 'wait-for-device'], capture_output=True)
+    with open(output, 'w') as f:
+        for n in range(count):
+            result = subprocess.run(['adb', 'shell', SNAPSHOT], capture_output=True)
+            if result.returncode:
+                raise OSError(f"adb shell failed: {result.stderr.decode(errors='replace').strip()}")
+            f.write(f"#### snapshot {n}\n")
+            f.write(result.stdout.decode(errors='replace').replace('\r\n', '\n'))
+            log(f"  snapshot {n + 1}/{count}")
+            if n + 1 < count:
+                time.sleep(interval)
+    return output
+
+
+def parse_trace(text):
+    """Device paths in first-use order
+
+    Snapshots come in order, and within one the lower pid started earlier (the shell
+    glob lists /proc as strings, so 10 comes before 9 unless we sort).
+    """
+    seen = {}
+    snapshot = pid = 0
+    for n, line in enumerate(text.splitlines()):
+        if line.startswith('#### snapshot'):
+            snapshot += 1
+            pid = 0
+            continue
+        m = PROCESS_RE.match(line)
+        if m:
+            pid = int(m.group(1))
+            continue
+        for path in PATH_RE.findall(line):
+            key = (snapshot, pid, n)
+            if path not in seen or key < seen[path]:
+                seen[path] = key
+    return [path for path, _key in sorted(seen.items(), key=lambda item: item[1])]
+
+
+def to_rootfs(path, root):
+    """squashfs-root relative path for a device path, or None if it isn't a file in the image"""
+    for prefix, rel in MOUNTS:
+        if path.startswith(prefix):
+            candidate = os.path.normpath(rel + path[len(prefix):])
+            break
+    else:
+        return None
+    full = os.path.join(root, candidate)
+    if not os.path.lexists(full):
+        return None
+    if os.path.islink(full):
+        # libfoo.so -> libfoo.so.12: the target holds the data
+        target = os.path.relpath(os.path.realpath(full), os.path.realpath(root))
+        if target.startswith('..') or not os.path.isfile(os.path.join(root, target)):
+            return None
+        return target
+    return candidate if os.path.isfile(full) else None
+
+
+def boot_files(traces, root, include=DEFAULT_INCLUDE, excludes=()):
+    """squashfs-root files in the order boot uses them, traced files first then includes"""
+    ordered = []
+    for text in traces:
+        for path in parse_trace(text):
+            rel = to_rootfs(path, root)
+            if rel and rel not in ordered and rel not in excludes:
+                ordered.append(rel)
+    every = default_order(root, excludes)
+    for pattern in include:
+        for rel in every:
+            if fnmatch.fnmatch(rel, pattern) and rel not in ordered:
+                ordered.append(rel)
+    return ordered
+
+
+def default_order(root, excludes=()):
+    """Regular files in the order mksquashfs writes them: depth first, names sorted"""
+    files = []
+
+    def walk(rel):
+        full = os.path.join(root, rel) if rel else root
+        for name in sorted(os.listdir(full)):
+            child = os.path.join(rel, name) if rel else name
+            if child in excludes:
+                continue
+            path = os.path.join(root, child)
+            if os.path.isdir(path) and not os.path.islink(path):
+                walk(child)
+            elif os.path.isfile(path) and not os.path.islink(path):
+                files.append(child)
+    walk('')
+    return files
+
+
+def write_sort_file(path, ordered):
+    """mksquashfs -sort format: '<path relative to squashfs-root> <priority>' per line"""
+    with open(path, 'w') as f:
+        for n, rel in enumerate(ordered):
+            f.write(f"{rel} {max(TOP_PRIORITY - n, 1)}\n")
+    return path
+
+
+def layout(order, sizes, block_size=BLOCK_SIZE):
+    """Where each file's data lands: rel -> list of (offset, length) the file needs to read
+
+    Files of at least a block get their own data blocks (the short last one too);
+    smaller files are packed into shared fragment blocks, written out as they fill.
+    """
+    extents = {}
+    offset = 0
+    fragment_files = []
+    fragment_fill = 0
+    fragment_bytes = 0
+
+    def flush():
+        nonlocal offset, fragment_files, fragment_fill, fragment_bytes
+        if fragment_files:
+            for rel in fragment_files:
+                extents[rel] = [(offset, fragment_bytes)]
+            offset += fragment_bytes
+        fragment_files, fragment_fill, fragment_bytes = [], 0, 0
+
+    for rel in order:
+        size, _mtime, blocks, tail = sizes[rel]
+        if size >= block_size:
+            extents[rel] = [(offset, blocks + tail)]
+            offset += blocks + tail
+            continue
+        if fragment_fill + size > block_size:
+            flush()
+        fragment_files.append(rel)
+        fragment_fill += size
+        fragment_bytes += tail
+    flush()
+    return extents
+
+
+def read_cost(extents, wanted):
+    """(bytes, 64 KB windows) boot reads from flash for the wanted files"""
+    ranges = sorted({extent for rel in wanted for extent in extents.get(rel, ())})
+    total = 0
+    end = -1
+    windows = set()
+    for start, length in ranges:
+        total += max(0, start + length - max(start, end))
+        end = max(end, start + length)
+        windows.update(range(start // ERASE_BLOCK, (start + max(length, 1) - 1) // ERASE_BLOCK + 1))
+    return total, len(windows)
+
+
+def report(root, ordered, extra=False, excludes=(), use_cache=True):
+    """Lines comparing boot reads with the default and the sorted layout"""
+    estimator = SizeEstimator(root, extra, excludes, use_cache)
+    estimator.scan()
+    estimator.save()
+    sizes = estimator.files
+    block_size = EXTRA_BLOCK_SIZE if extra else BLOCK_SIZE
+    every = [rel for rel in default_order(root, excludes) if rel in sizes]
+    wanted = [rel for rel in ordered if rel in sizes]
+    rest = [rel for rel in every if rel not in set(wanted)]
+
+    before = read_cost(layout(every, sizes, block_size), wanted)
+    after = read_cost(layout(wanted + rest, sizes, block_size), wanted)
+    needed = sum(sizes[rel][2] + sizes[rel][3] for rel in wanted)
+    out = [f"{len(wanted)} boot files, {needed / 1024:.0f} KB compressed"]
+    for label, (nbytes, windows) in (("Default order", before), ("Boot order", after)):
+        out.append(f"  {label:14} {nbytes / 1024:8.0f} KB read, {windows:4} x 64 KB windows "
+                   f"({windows * ERASE_BLOCK / READ_RATE:.2f}s at {READ_RATE // 1024 // 1024} MB/s)")
+    if before[1]:
+        saved = before[1] - after[1]
+        out.append(f"  Saves {saved} windows ({saved * 100 / before[1]:.0f}%), "
+                   f"{(before[0] - after[0]) / 1024:.0f} KB of unrelated fragment data")
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Order the system image for boot")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('capture', help="snapshot /proc/*/maps and fds over adb while the camera boots")
+    p.add_argument('-o', '--output', default='boot_access.txt')
+    p.add_argument('--reboot', action='store_true', help="reboot first and start snapshotting as soon as adb is up")
+    p.add_argument('--count', type=int, default=10)
+    p.add_argument('--interval', type=float, default=1.0, help="seconds between snapshots")
+    p = sub.add_parser('make', help="write .mksquashfs_sort from access traces")
+    p.add_argument('traces', nargs='+', help="capture output, strace logs or path lists")
+    p.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    p.add_argument('-o', '--output', help=f"sort file (default: <workdir>/{SORT_FILE})")
+    p.add_argument('--include', action='append', metavar='GLOB',
+                   help="also treat these squashfs-root paths as boot files (default: res/cfg/*.cfg)")
+    p.add_argument('--extra-compression', action='store_true', help="model 1 MB blocks like build.sh's extra mode")
+    p.add_argument('--dry-run', action='store_true', help="only print the order and the report")
+    p.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'capture':
+            capture(args.output, args.reboot, args.count, args.interval)
+            print(f"✓ Access trace written to {args.output}")
+            return 0
+
+        root = os.path.join(args.workdir, 'squashfs-root')
+        if not os.path.isdir(root):
+            raise ValueError(f"{root} not found")
+        traces = []
+        for path in args.traces:
+            with open(path, 'r', errors='replace') as f:
+                traces.append(f.read())
+        excludes = load_excludes(args.workdir)
+        include = args.include if args.include is not None else DEFAULT_INCLUDE
+        ordered = boot_files(traces, root, include, excludes)
+        if not ordered:
+            raise ValueError("no squashfs-root files found in the traces")
+
+        for n, rel in enumerate(ordered[:15]):
+            print(f"  {n + 1:3}. {rel}")
+        if len(ordered) > 15:
+            print(f"  ... {len(ordered) - 15} more")
+        print('\n'.join(report(root, ordered, args.extra_compression, excludes, not args.no_cache)))
+        if not args.dry_run:
+            path = write_sort_file(args.output or os.path.join(args.workdir, SORT_FILE), ordered)
+            print(f"✓ Wrote {path} ({len(ordered)} files), the next build will use it")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
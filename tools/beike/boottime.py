@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Boot timeline analyzer
+Reads dmesg and logcat (captured over adb, or saved text files) and lays out the boot:
+what each vendor module cost to insmod, when each service started and the gaps in
+between, the critical path to sdv being ready, and a ranked list of things worth
+deferring or removing.
+
+    python3 -m beike.boottime capture --reboot -o boot_stock
+    python3 -m beike.boottime analyze boot_stock
+    python3 -m beike.boottime analyze --dmesg dmesg.txt --logcat logcat.txt --trace boot.json
+
+Module timings need `initcall_debug` on the kernel command line and service events need
+`loglevel 7` in init.rc (both via `python3 -m beike.bootimg`); without them the
+timeline is coarser and says so.
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+DMESG_RE = re.compile(r'^(?:<\d+>)?\[\s*(\d+\.\d+)\]\s?(.*)$')
+CALLING_RE = re.compile(r'^calling\s+(\S+?)\+0x[0-9a-f]+/0x[0-9a-f]+(?: \[(\S+)\])? @ \d+')
+INITCALL_RE = re.compile(r'^initcall\s+(\S+?)\+0x[0-9a-f]+/0x[0-9a-f]+(?: \[(\S+)\])? returned (-?\d+) after (\d+) usecs')
+SERVICE_START_RE = re.compile(r"init: [Ss]tarting (?:service )?'([^']+)'")
+SERVICE_EXIT_RE = re.compile(r"init: (?:process '([^']+)', pid (\d+) exited|[Ss]ervice '([^']+)' \(pid (\d+)\) exited)")
+KERNEL_DONE_RE = re.compile(r'Freeing (?:unused kernel|init) memory')
+# logcat -v threadtime and -v time
+THREADTIME_RE = re.compile(r'^(\d\d-\d\d \d\d:\d\d:\d\d\.\d{3})\s+(\d+)\s+(\d+)\s+([VDIWEFS])\s+(.*?)\s*: (.*)$')
+TIME_RE = re.compile(r'^(\d\d-\d\d \d\d:\d\d:\d\d\.\d{3})\s+([VDIWEFS])/(.*?)\(\s*(\d+)\): (.*)$')
+
+# (pattern, verdict, why) checked against module and service names
+HINTS = [
+    (r'^xradio', 'defer', "WiFi driver, load it when WiFi is switched on"),
+    (r'^(bma|mma)', 'remove', "G-sensor driver for a sensor these cameras don't have"),
+    (r'^(imx\d+|ov\d+)', 'check', "image sensor driver, only the fitted sensor's is needed"),
+    (r'^(videobuf|vfe_|cci$)', 'keep', "camera pipeline, needed to record"),
+    (r'^startupSound$', 'defer', "plays startup.wav while everything else is starting"),
+    (r'^(dhcpcd|hostapd|wpa_supplicant)', 'defer', "WiFi, only needed once WiFi is on"),
+    (r'^debuggerd$', 'remove', "crash dumps, not needed on a release build"),
+    (r'^(sdv|media|vold|servicemanager|ueventd)$', 'keep', "needed to record"),
+]
+
+
+class Module:
+    def __init__(self, name):
+        self.name = name
+        self.calling = None     # initcall start
+        self.end = None         # initcall returned
+        self.init_us = 0
+        self.ret = 0
+        self.insmod = 0.0       # from its initcall starting to returning
+
+
+class Service:
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.exit = None
+        self.pid = None
+
+
+class Boot:
+    """Everything parsed out of one boot, in kernel (uptime) seconds"""
+    def __init__(self):
+        self.kernel_done = None
+        self.modules = {}
+        self.builtins = []      # (name, usecs) of built-in initcalls
+        self.services = {}
+        self.logcat = []        # (uptime, pid, tag, message)
+        self.logcat_aligned = False
+        self.ready = None
+        self.ready_what = None
+        self.last = 0.0
+        self.notes = []
+
+
+def parse_dmesg(text, boot=None):
+    boot = boot or Boot()
+    for line in text.splitlines():
+        m = DMESG_RE.match(line.rstrip('\r'))
+        if not m:
+            continue
+        ts, msg = float(m.group(1)), m.group(2)
+        boot.last = max(boot.last, ts)
+        if boot.kernel_done is None and KERNEL_DONE_RE.search(msg):
+            boot.kernel_done = ts
+        call = CALLING_RE.match(msg)
+        if call and call.group(2):
+            boot.modules.setdefault(call.group(2), Module(call.group(2))).calling = ts
+            continue
+        done = INITCALL_RE.match(msg)
+        if done:
+            func, module, ret, usecs = done.group(1), done.group(2), int(done.group(3)), int(done.group(4))
+            if not module:
+                boot.builtins.append((func, usecs))
+                continue
+            mod = boot.modules.setdefault(module, Module(module))
+            mod.end, mod.init_us, mod.ret = ts, usecs, ret
+            # only the module's own initcall: idle time and services between two insmods
+            # belong to neither of them
+            start = mod.calling if mod.calling is not None else ts - usecs / 1e6
+            mod.insmod = max(usecs / 1e6, ts - start)
+            continue
+        start = SERVICE_START_RE.search(msg)
+        if start:
+            name = start.group(1)
+            if name not in boot.services:
+                boot.services[name] = Service(name, ts)
+            continue
+        exited = SERVICE_EXIT_RE.search(msg)
+        if exited:
+            name = exited.group(1) or exited.group(3)
+            service = boot.services.get(name)
+            if service and service.exit is None:
+                service.exit = ts
+                service.pid = int(exited.group(2) or exited.group(4))
+    if not boot.modules:
+        boot.notes.append("no module initcalls in dmesg, boot with initcall_debug for per-module costs")
+    if not boot.services:
+        boot.notes.append("no init service events in dmesg, set loglevel 7 in init.rc to see them")
+    return boot
+
+
+def _wall(stamp, year):
+    return datetime.strptime(f"{year}-{stamp}", '%Y-%m-%d %H:%M:%S.%f').timestamp()
+
+
+def parse_logcat(text, boot, anchor=None):
+    """Add logcat lines, converted to uptime with an anchor (uptime, 'MM-DD HH:MM:SS' at the same moment)"""
+    year = datetime.now().year
+    rows = []
+    for line in text.splitlines():
+        line = line.rstrip('\r')
+        m = THREADTIME_RE.match(line)
+        if m:
+            rows.append((_wall(m.group(1), year), int(m.group(2)), m.group(5), m.group(6)))
+            continue
+        m = TIME_RE.match(line)
+        if m:
+            rows.append((_wall(m.group(1), year), int(m.group(4)), m.group(3), m.group(5)))
+    if not rows:
+        return boot
+    if anchor:
+        uptime, stamp = anchor
+        booted = _wall(stamp + '.000', year) - uptime
+        boot.logcat_aligned = True
+    else:
+        # No anchor: the first logcat lines come out once servicemanager is up
+        if 'servicemanager' in boot.services:
+            first = boot.services['servicemanager'].start
+        else:
+            first = min((s.start for s in boot.services.values()), default=boot.kernel_done or 0.0)
+        booted = rows[0][0] - first
+        boot.notes.append("logcat has no uptime anchor, aligned its first line to servicemanager starting")
+    for wall, pid, tag, msg in rows:
+        boot.logcat.append((round(wall - booted, 3), pid, tag, msg))
+        boot.last = max(boot.last, wall - booted)
+    return boot
+
+
+def parse_anchor(text):
+    """anchor.txt from capture: /proc/uptime, then date '+%m-%d %H:%M:%S'"""
+    lines = [l.strip() for l in text.splitlines() if l.strip()]
+    if len(lines) < 2:
+        return None
+    return float(lines[0].split()[0]), lines[1]
+
+
+def find_ready(boot, pattern=None):
+    """When sdv is usable: first line matching pattern, else sdv's first logcat line, else its start"""
+    if pattern:
+        regex = re.compile(pattern)
+        hits = [(ts, f"logcat {tag}: {msg}") for ts, _pid, tag, msg in boot.logcat if regex.search(f"{tag}: {msg}")]
+        if hits:
+            boot.ready, boot.ready_what = min(hits)
+            return boot
+        boot.notes.append(f"nothing matched --ready {pattern!r}")
+    sdv_lines = [(ts, f"first sdv log line ({tag})") for ts, _pid, tag, _msg in boot.logcat
+                 if 'sdv' in tag.lower()]
+    if sdv_lines:
+        boot.ready, boot.ready_what = min(sdv_lines)
+    elif 'sdv' in boot.services:
+        boot.ready, boot.ready_what = boot.services['sdv'].start, "sdv started (no logcat from it)"
+    else:
+        boot.ready, boot.ready_what = boot.last, "end of capture (sdv not seen)"
+    return boot
+
+
+def critical_path(boot):
+    """Sequential segments from power on to ready: (name, start, end)"""
+    ready = boot.ready
+    path = []
+    t = 0.0
+    if boot.kernel_done:
+        path.append(('kernel', 0.0, min(boot.kernel_done, ready)))
+        t = boot.kernel_done
+    # init runs insmod synchronously, so modules loaded before ready are all on the path
+    for mod in sorted((m for m in boot.modules.values() if m.end), key=lambda m: m.end):
+        if mod.end > ready:
+            break
+        start = max(t, mod.end - mod.insmod)
+        if start > t + 0.001:
+            path.append(('init', t, start))
+        path.append((f'insmod {mod.name}', start, mod.end))
+        t = mod.end
+    sdv = boot.services.get('sdv')
+    if sdv and t <= sdv.start <= ready:
+        path.append(('init/services until sdv starts', t, sdv.start))
+        t = sdv.start
+        if ready > t:
+            path.append(('sdv startup', t, ready))
+    elif ready > t:
+        path.append(('init/services', t, ready))
+    return path
+
+
+def _hint(name):
+    for pattern, verdict, why in HINTS:
+        if re.search(pattern, name):
+            return verdict, why
+    return None, None
+
+
+def candidates(boot):
+    """Modules and services ranked by what they cost before ready: (seconds, kind, name, verdict, why)"""
+    ranked = []
+    for mod in boot.modules.values():
+        if not mod.end or mod.end > boot.ready:
+            continue
+        verdict, why = _hint(mod.name)
+        if mod.ret:
+            verdict, why = 'remove', f"init failed ({mod.ret}), hardware not fitted?"
+        ranked.append((mod.insmod, 'module', mod.name, verdict or 'check', why or ''))
+    for service in boot.services.values():
+        if service.start > boot.ready or service.name == 'sdv':
+            continue
+        verdict, why = _hint(service.name)
+        # oneshots that finish before ready: their whole run competes with sdv for the single core
+        cost = (min(service.exit, boot.ready) - service.start) if service.exit else 0.0
+        if cost or verdict in ('defer', 'remove'):
+            ranked.append((cost, 'service', service.name, verdict or 'check', why or 'runs in parallel'))
+    ranked.sort(key=lambda c: (c[3] == 'keep', -c[0]))
+    return ranked
+
+
+def service_gaps(boot):
+    """(gap seconds, previous service, service) between consecutive starts"""
+    starts = sorted(boot.services.values(), key=lambda s: s.start)
+    return [(b.start - a.start, a.name, b.name) for a, b in zip(starts, starts[1:])]
+
+
+def format_report(boot):
+    out = [f"Ready at {boot.ready:.3f}s: {boot.ready_what}"]
+    if boot.kernel_done:
+        out.append(f"Kernel done at {boot.kernel_done:.3f}s")
+    for note in boot.notes:
+        out.append(f"Note: {note}")
+
+    if boot.modules:
+        out.append("\nModules (in load order):")
+        for mod in sorted(boot.modules.values(), key=lambda m: m.end or 1e9):
+            status = f"  returned {mod.ret}" if mod.ret else ''
+            out.append(f"  {(mod.end or 0):8.3f}s  {mod.name:24} insmod {mod.insmod * 1000:8.1f} ms  "
+                       f"init {mod.init_us / 1000:8.1f} ms{status}")
+    if boot.builtins:
+        slow = sorted(boot.builtins, key=lambda b: -b[1])[:5]
+        out.append("\nSlowest built-in initcalls: " + ', '.join(f"{n} {us / 1000:.1f} ms" for n, us in slow))
+
+    if boot.services:
+        out.append("\nServices:")
+        previous = None
+        for service in sorted(boot.services.values(), key=lambda s: s.start):
+            gap = f"  +{service.start - previous:.3f}s" if previous is not None else ''
+            ran = f"  exited at {service.exit:.3f}s ({service.exit - service.start:.3f}s)" if service.exit else ''
+            out.append(f"  {service.start:8.3f}s  {service.name:24}{gap}{ran}")
+            previous = service.start
+
+    out.append("\nCritical path:")
+    for name, start, end in critical_path(boot):
+        out.append(f"  {start:8.3f}s -> {end:8.3f}s  {(end - start) * 1000:8.1f} ms  {name}")
+
+    ranked = candidates(boot)
+    if ranked:
+        out.append("\nCandidates (cost before ready):")
+        for cost, kind, name, verdict, why in ranked:
+            out.append(f"  {cost * 1000:8.1f} ms  {verdict:6} {kind:7} {name:24} {why}")
+    return out
+
+
+def to_trace(boot, name='boot'):
+    """A trace.Tracer holding the boot, for Chrome trace export and the run history"""
+    from . import trace
+    run = trace.Tracer(name, ready=round(boot.ready, 3))
+
+    def add(span_name, start, end, depth=0, **args):
+        span = trace.Span(span_name, depth, args)
+        span.start, span.end = run.started + start, run.started + end
+        span.tid = depth    # critical path, modules and services on their own rows
+        run.spans.append(span)
+
+    for seg, start, end in critical_path(boot):
+        add(seg, start, end)
+    for mod in boot.modules.values():
+        if mod.end:
+            add(f'module {mod.name}', mod.end - mod.insmod, mod.end, 1, init_ms=mod.init_us / 1000, ret=mod.ret)
+    for service in boot.services.values():
+        add(f'service {service.name}', service.start, service.exit or boot.last, 2)
+    run.ended = run.started + boot.last
+    return run
+
+
+def capture(output, reboot=False, wait=40.0, log=print):
+    """Pull dmesg, logcat and an uptime/clock anchor into output/"""
+    def adb(*args):
+        result = subprocess.run(['adb'] + list(args), capture_output=True)
+        if result.returncode:
+            raise OSError(f"adb {' '.join(args)} failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout.decode(errors='replace').replace('\r\n', '\n')
+
+    if reboot:
+        log("Rebooting device...")
+        adb('reboot')
+        time.sleep(3)
+        adb('wait-for-device')
+        log(f"Waiting {wait:.0f}s for boot to finish...")
+        time.sleep(wait)
+    os.makedirs(output, exist_ok=True)
+    files = {
+        'anchor.txt': adb('shell', 'cat /proc/uptime; date "+%m-%d %H:%M:%S"'),
+        'dmesg.txt': adb('shell', 'dmesg'),
+        'logcat.txt': adb('logcat', '-d', '-v', 'threadtime'),
+    }
+    for name, text in files.items():
+        with open(os.path.join(output, name), 'w') as f:
+            f.write(text)
+    return output
+
+
+def load(dmesg=None, logcat=None, anchor=None, directory=None):
+    """Parse a capture directory and/or individual files into a Boot"""
+    def read(path):
+        with open(path, 'r', errors='replace') as f:
+            return f.read()
+
+    if directory:
+        dmesg = dmesg or os.path.join(directory, 'dmesg.txt')
+        candidate = os.path.join(directory, 'logcat.txt')
+        logcat = logcat or (candidate if os.path.exists(candidate) else None)
+        candidate = os.path.join(directory, 'anchor.txt')
+        anchor = anchor or (candidate if os.path.exists(candidate) else None)
+    if not dmesg or not os.path.exists(dmesg):
+        raise ValueError("dmesg capture not found")
+    boot = parse_dmesg(read(dmesg))
+    if logcat:
+        parse_logcat(read(logcat), boot, parse_anchor(read(anchor)) if anchor else None)
+    return boot
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Boot timeline from dmesg and logcat")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('capture', help="pull dmesg, logcat and a clock anchor over adb")
+    p.add_argument('-o', '--output', default=None, help="directory (default: boot_<timestamp>)")
+    p.add_argument('--reboot', action='store_true', help="reboot first and capture a fresh boot")
+    p.add_argument('--wait', type=float, default=40.0, help="seconds to let it boot after --reboot")
+    p = sub.add_parser('analyze', help="build the timeline")
+    p.add_argument('directory', nargs='?', help="a capture directory")
+    p.add_argument('--dmesg')
+    p.add_argument('--logcat')
+    p.add_argument('--anchor', help="anchor.txt to align logcat with dmesg")
+    p.add_argument('--ready', help="regex for the logcat line that means sdv is usable")
+    p.add_argument('--trace', help="write a Chrome trace (and add the boot to the trace history)")
+    p.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'capture':
+            output = args.output or f"boot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            capture(output, args.reboot, args.wait)
+            print(f"✓ Captured to {output}/")
+            print(f"Analyze with: python3 -m beike.boottime analyze {output}")
+            return 0
+
+        boot = find_ready(load(args.dmesg, args.logcat, args.anchor, args.directory), args.ready)
+        if args.trace:
+            path = to_trace(boot).finish(args.trace)
+            print(f"✓ Trace written to {path}")
+        if args.json:
+            json.dump({
+                'ready': boot.ready, 'ready_what': boot.ready_what, 'kernel_done': boot.kernel_done,
+                'modules': {m.name: {'end': m.end, 'insmod': round(m.insmod, 4), 'init_us': m.init_us, 'ret': m.ret}
+                            for m in boot.modules.values()},
+                'services': {s.name: {'start': s.start, 'exit': s.exit} for s in boot.services.values()},
+                'critical_path': [(name, round(start, 3), round(end, 3)) for name, start, end in critical_path(boot)],
+                'service_gaps': [(round(gap, 3), a, b) for gap, a, b in service_gaps(boot)],
+                'candidates': [(round(cost, 3), *rest) for cost, *rest in candidates(boot)],
+                'notes': boot.notes,
+            }, sys.stdout, indent=1)
+            print()
+        else:
+            print('\n'.join(format_report(boot)))
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+ROM builder from the command line
+The same operations as the GUI buttons, with no prompts and no Tk, so they can be
+scripted or run on a headless box. Run from your rom-building directory (or pass -C).
+
+    python3 -m beike.cli build --version 1.0 --build 8 --product Beike --manufacturer JoshAtticus
+    python3 -m beike.cli build --version 1.1 --build 9 --deterministic   # cfg edits change few blocks
+    python3 -m beike.cli customize --wifi-ssid "My Cam" --language 2 --debloat
+    python3 -m beike.cli flash system_v1.0.bin
+    python3 -m beike.cli flash system_v1.0.bin --part boot_logo=boot.jpg   # one FEL session
+    python3 -m beike.cli layout                     # partition table and where it came from
+    python3 -m beike.cli update system_v1.1.bin     # changed blocks only, over ADB
+    python3 -m beike.cli ramboot system_v1.1.bin    # boot it from RAM over FEL, no flashing
+    python3 -m beike.cli backup
+    python3 -m beike.cli backup --fel           # whole flash over FEL, no ADB needed
+    python3 -m beike.cli extract backup_20250101_120000
+    python3 -m beike.cli make-restore --version 1.0 && python3 -m beike.cli restore
+    python3 -m beike.cli logos --boot boot.jpg --shutdown shutdown.jpg
+    python3 -m beike.cli history chart size       # image size over recent builds
+    python3 -m beike.cli deps
+"""
+
+import argparse
+import sys
+
+
+def _switch(value):
+    return value.lower() in ('1', 'on', 'yes', 'true')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='beike', description="Build, flash and back up Beike camera ROMs")
+    parser.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('build', help="stamp firmware info and build system_v<version>.bin")
+    p.add_argument('--version', required=True)
+    p.add_argument('--build', required=True, help="build number")
+    p.add_argument('--product', default='Beike')
+    p.add_argument('--manufacturer', default='JoshAtticus')
+    p.add_argument('--extra-compression', action='store_true', help="ARM BCJ filter and 1 MB blocks")
+    p.add_argument('--deterministic', action='store_true',
+                   help="fixed times and file order, volatile cfgs last, so edits change few erase blocks")
+    p.add_argument('--against', help="image to count changed erase blocks against (default: previous build)")
+    p.add_argument('--min-headroom', metavar='SIZE',
+                   help="fail if less than this is left free in mtdblock2 (default: beike.history margin)")
+
+    p = sub.add_parser('customize', help="change ROM settings (kept in the build layer, see beike.layer)")
+    p.add_argument('--wifi-ssid')
+    p.add_argument('--wifi-pwd')
+    p.add_argument('--language', help="0-16 (2 = English)")
+    p.add_argument('--video-res', help="0-6 (0 = 4K 30FPS)")
+    p.add_argument('--photo-res', help="0-4 (4 = 16M)")
+    p.add_argument('--gsensor', help="0-3 (0 = off)")
+    for switch in ('power_on_record', 'record_sound', 'time_water_mark', 'wifi'):
+        p.add_argument(f"--{switch.replace('_', '-')}", dest=switch, type=_switch, metavar='on|off')
+    p.add_argument('--debloat', action='store_true', default=None, help="exclude fake features and unused drivers")
+    p.add_argument('--no-debloat', dest='debloat', action='store_false')
+
+    p = sub.add_parser('extract-system', help="unsquashfs mtdblock2 into squashfs-root")
+    p.add_argument('mtdblock2', nargs='?', default='mtdblock2')
+
+    p = sub.add_parser('flash', help="flash a system image (and other partitions) over FEL")
+    p.add_argument('image', nargs='?', help="default: newest system_v*.bin (unless --part is given)")
+    p.add_argument('--part', action='append', default=[], metavar='NAME=FILE',
+                   help="also write FILE to partition NAME (boot_logo, mtdblock5, ...) in the same session")
+
+    sub.add_parser('layout', help="show the detected flash partition layout")
+
+    p = sub.add_parser('update', help="write only the changed blocks of a system image over ADB (no FEL)")
+    p.add_argument('image', nargs='?', help="default: newest system_v*.bin")
+    p.add_argument('--no-verify', action='store_true', help="skip reading the written blocks back")
+    p.add_argument('--no-reboot', action='store_true')
+
+    p = sub.add_parser('ramboot', help="boot a system image from RAM over FEL without writing flash")
+    p.add_argument('image', nargs='?', help="default: newest system_v*.bin")
+    p.add_argument('--tree', help="boot a squashfs-root tree instead of an image (no unsquashfs needed)")
+    p.add_argument('--boot', default='mtdblock1', help="stock boot image (default: mtdblock1)")
+    p.add_argument('--uboot', help="u-boot-sunxi-with-spl.bin (default: in sunxi-tools/)")
+    p.add_argument('--bootargs', help="base kernel cmdline (copy yours from /proc/cmdline)")
+    p.add_argument('--keep-data', action='store_true', help="use the real /data instead of a tmpfs")
+    p.add_argument('--no-verify', action='store_true', help="don't wait for ADB to check what booted")
+
+    p = sub.add_parser('restore', help="flash a full restore image from sector 0 over FEL")
+    p.add_argument('image', nargs='?', help="default: newest full_restore_v*.bin")
+
+    p = sub.add_parser('backup', help="pull mtdblock0-7 over ADB (or read the whole flash over FEL)")
+    p.add_argument('-o', '--output', help="backup directory (default: backup_<timestamp>)")
+    p.add_argument('--raw', action='store_true', help="plain adb pull instead of streaming through the camera's gzip")
+    p.add_argument('--fel', action='store_true', help="read the flash over FEL, for devices that don't boot")
+    p.add_argument('--chunk', default='1M', help="FEL read size, a multiple of 64K (default: 1M)")
+    p.add_argument('--against', help="FEL: backup to compare with (default: the newest backup_*)")
+
+    p = sub.add_parser('extract', help="split a backup (or full restore image) into uboot/boot/system/data/logos")
+    p.add_argument('backup_dir', metavar='backup', help="backup directory or full_restore_v*.bin")
+
+    p = sub.add_parser('make-restore', help="concatenate mtdblocks into full_restore_v<version>.bin")
+    p.add_argument('--version', required=True)
+
+    p = sub.add_parser('logos', help="flash boot/shutdown JPEG logos over ADB")
+    p.add_argument('--boot')
+    p.add_argument('--shutdown')
+
+    p = sub.add_parser('history', help="recorded builds: size/headroom trends and regressions (see beike.history)")
+    p.add_argument('args', nargs=argparse.REMAINDER, help="list, show, chart, check or margin and their options")
+
+    sub.add_parser('deps', help="check host dependencies")
+    args = parser.parse_args(argv)
+
+    from . import core
+    workdir = args.workdir
+    try:
+        if args.command == 'build':
+            from .history import parse_size
+            core.build_rom(args.version, args.build, args.product, args.manufacturer, workdir,
+                           extra_compression=args.extra_compression,
+                           min_headroom=parse_size(args.min_headroom) if args.min_headroom else None,
+                           deterministic=args.deterministic, against=args.against)
+        elif args.command == 'history':
+            from . import history
+            return history.main(['-C', workdir] + args.args)
+        elif args.command == 'customize':
+            switches = {k: getattr(args, k) for k in ('power_on_record', 'record_sound', 'time_water_mark', 'wifi')
+                        if getattr(args, k) is not None}
+            core.customize(workdir, args.wifi_ssid, args.wifi_pwd, args.language, args.video_res,
+                           args.photo_res, args.gsensor, switches, args.debloat)
+        elif args.command == 'extract-system':
+            core.extract_system(args.mtdblock2, workdir)
+        elif args.command == 'flash':
+            writes = []
+            for item in args.part:
+                name, sep, path = item.partition('=')
+                if not sep:
+                    print(f"✗ --part {item}: expected NAME=FILE", file=sys.stderr)
+                    return 1
+                writes.append((name, path))
+            image = args.image or (None if writes else core.latest_image('system_v', workdir))
+            if image:
+                writes.insert(0, ('system', image))
+            if not writes:
+                print(f"✗ No system_v*.bin found in {workdir}", file=sys.stderr)
+                return 1
+            print(f"Flashing {', '.join(f'{path} to {name}' for name, path in writes)}...")
+            core.flash_partitions(writes, workdir)
+            print("\n✓ Flash complete! Device is rebooting.")
+        elif args.command == 'layout':
+            for part in core.detect_layout(workdir):
+                print(f"  {part.block:10} {part.name:14} offset {part.offset:8} (0x{part.offset:06x})  "
+                      f"size {part.size:8} ({part.size // 1024} KB)")
+        elif args.command == 'restore':
+            image = args.image or core.latest_image('full_restore_v', workdir)
+            if not image:
+                print(f"✗ No full_restore_v*.bin found in {workdir}", file=sys.stderr)
+                return 1
+            print(f"Flashing {image}...")
+            core.full_restore(image, workdir)
+        elif args.command == 'update':
+            image = args.image or core.latest_image('system_v', workdir)
+            if not image:
+                print(f"✗ No system_v*.bin found in {workdir}", file=sys.stderr)
+                return 1
+            print(f"Updating to {image} over ADB...")
+            core.adb_update_system(image, workdir, verify=not args.no_verify, reboot=not args.no_reboot)
+        elif args.command == 'ramboot':
+            image = None if args.tree else (args.image or core.latest_image('system_v', workdir))
+            if not image and not args.tree:
+                print(f"✗ No system_v*.bin found in {workdir}", file=sys.stderr)
+                return 1
+            print(f"Booting {image or args.tree} from RAM...")
+            core.ram_boot(image, workdir, tree=args.tree, boot=args.boot, uboot=args.uboot,
+                          bootargs=args.bootargs, keep_data=args.keep_data, verify=not args.no_verify)
+        elif args.command == 'backup' and args.fel:
+            chunk = args.chunk.upper()
+            scale = {'K': 1024, 'M': 1024 * 1024}.get(chunk[-1:], 1)
+            core.fel_backup(workdir, args.output, chunk=int(chunk.rstrip('KM')) * scale, against=args.against)
+        elif args.command == 'backup':
+            core.backup_device(workdir, args.output, compress=not args.raw)
+        elif args.command == 'extract':
+            core.extract_mtdblocks(args.backup_dir)
+        elif args.command == 'make-restore':
+            core.make_restore(args.version, workdir)
+        elif args.command == 'logos':
+            core.flash_logos(args.boot, args.shutdown, workdir)
+        elif args.command == 'deps':
+            status = core.check_dependencies(workdir)
+            for name, installed in status.items():
+                print(f"{'✓' if installed else '✗'} {name}")
+            return 0 if all(status.values()) else 1
+    except core.OperationError as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    except OSError as e:
+        print(f"✗ Error: {e}", file=sys.stderr)
+        return 1
+    except ValueError as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,1031 @@
+"""
+ROM operations without a GUI
+Everything the ROM builder buttons do (build, flash, backup, extract, restore
+images, logos, customization, dependency checks) as plain functions. Each one
+logs through a callback (print by default), records stage timings with
+beike.trace and raises OperationError when a step fails.
+"""
+
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import sqlite3
+import subprocess
+import tempfile
+import zlib
+from datetime import datetime
+
+from . import layer, store, trace
+from . import flash
+from .flash import ERASE_BLOCK, partition_by_name
+from .partimage import JPEG_MAGIC, PartitionImage, write_padded
+
+CFG_DIR = 'res/cfg'         # inside squashfs-root; edits go to the build layer (beike.layer)
+CFG_FILES = (f'{CFG_DIR}/220x176.cfg', f'{CFG_DIR}/320x240.cfg')
+MENU_CFG = f'{CFG_DIR}/menu.cfg'
+EXCLUDE_FILE = '.mksquashfs_exclude'
+SORT_FILE = '.mksquashfs_sort'
+GZIP_MAGIC = b'\x1f\x8b'
+PULL_CHUNK = 64 * 1024
+LOGO_PARTITIONS = ('boot_logo', 'shutdown_logo')
+
+DEPENDENCIES = [
+    ("Homebrew", "which brew"),
+    ("squashfs-tools", "which mksquashfs"),
+    ("libusb", "brew list libusb"),
+    ("pkg-config", "which pkg-config"),
+    ("sunxi-tools", "test -f sunxi-tools/sunxi-fel && echo found"),
+    ("adb", "which adb"),
+]
+
+
+class OperationError(Exception):
+    """A step failed; the message is meant for the user"""
+
+
+def _path(workdir, name):
+    return name if os.path.isabs(name) else os.path.join(workdir, name)
+
+
+def _finish(tracer, log):
+    try:
+        log(f"Stage timings saved to {tracer.finish()}")
+    except OSError as e:
+        log(f"✗ Could not save stage timings: {e}")
+
+
+def run_command(cmd, log=print, tracer=None, cwd=None, shell=False):
+    """Run a command, streaming its output to log; returns the exit code"""
+    process = subprocess.Popen(cmd, shell=shell, cwd=cwd, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True, bufsize=1)
+    for line in process.stdout:
+        log(line.rstrip())
+    if tracer:
+        return tracer.wait(process)
+    return process.wait()
+
+
+def latest_image(prefix, workdir='.'):
+    """Newest <prefix>*.bin in workdir (e.g. system_v, full_restore_v), or None"""
+    images = sorted(f for f in os.listdir(workdir) if f.startswith(prefix) and f.endswith('.bin'))
+    return images[-1] if images else None
+
+
+def _check_adb(tracer):
+    try:
+        with tracer.span('adb_devices'):
+            result = tracer.run(['adb', 'devices'], capture_output=True, text=True)
+    except FileNotFoundError:
+        raise OperationError("ADB not found. Please install Android Platform Tools")
+    if 'device' not in result.stdout.replace('List of devices attached', ''):
+        raise OperationError("No device connected via ADB")
+
+
+# ---------------------------------------------------------------------------
+# Build
+# ---------------------------------------------------------------------------
+
+def stamp_firmware_info(workdir, product_type, build_num, manufacturer, date=None, log=print):
+    """Set the firmware_information keys of the resolution cfgs in the build layer; returns their size"""
+    date = date or datetime.now().strftime("%Y%m%d")
+    build = layer.Layer(workdir)
+    stamped = []
+    for cfg_file in CFG_FILES:
+        if not os.path.isfile(build.source(cfg_file)):
+            continue
+        log(f"  Updating {cfg_file}")
+        for key, value in (('product_type', product_type), ('software_version', build_num), ('updated', date),
+                           ('Manufacturer', manufacturer), ('date_number', date)):
+            build.set(cfg_file, key, value)
+        stamped.append(cfg_file)
+    rendered = build.render()
+    build.save()
+    return sum(os.path.getsize(rendered[cfg_file]) for cfg_file in stamped)
+
+
+def build_rom(version, build_num, product_type, manufacturer, workdir='.', log=print,
+              extra_compression=False, min_headroom=None, deterministic=False, against=None):
+    """Stamp the cfgs and mksquashfs squashfs-root plus the build layer into system_v<version>.bin
+
+    extra_compression is build.sh's experimental mode (ARM BCJ filter, 1 MB blocks),
+    deterministic the delta-friendly layout of beike.delta. squashfs-root itself is
+    never written; returns the image path. The build is recorded in beike.history,
+    and fails if it leaves less than min_headroom bytes (default: the margin set
+    there) free in the system partition. The erase blocks that changed are counted
+    against `against` (default: the newest other system_v*.bin, else mtdblock2).
+    """
+    if not all([version, build_num, product_type, manufacturer]):
+        raise OperationError("Please fill in all build settings")
+
+    from . import delta
+    current_date = datetime.now().strftime("%Y%m%d")
+    out_file = f"system_v{version}.bin"
+    reference = delta.reference_image(workdir, _path(workdir, out_file), against)
+    tracer = trace.Tracer('build', version=version, build=build_num, deterministic=deterministic)
+    try:
+        log(f"Version: {version}")
+        log(f"Build Number: {build_num}")
+        log(f"Product Type: {product_type}")
+        log(f"Manufacturer: {manufacturer}")
+        log(f"Build Date: {current_date}\n")
+
+        log("Updating firmware information...")
+        with tracer.span('stamp_cfg') as span:
+            span.bytes = stamp_firmware_info(workdir, product_type, build_num, manufacturer,
+                                             current_date, log)
+
+        log(f"\nCreating {out_file}...")
+        if os.path.exists(_path(workdir, EXCLUDE_FILE)):
+            log(f"Using exclusions from {EXCLUDE_FILE}")
+        with tracer.span('layer'):
+            try:
+                exclude_opts = layer.Layer(workdir).pack_options(log)
+            except (ValueError, OSError) as e:
+                raise OperationError(f"Build layer: {e}")
+        if deterministic:
+            # takes in .mksquashfs_sort itself, behind the volatile paths
+            exclude_opts += delta.pack_options(workdir, log)
+        elif os.path.exists(_path(workdir, SORT_FILE)):
+            log("Using boot file order")
+            exclude_opts += ['-sort', SORT_FILE]
+
+        cmd = ['mksquashfs', 'squashfs-root', out_file, '-comp', 'xz', '-no-xattrs'] + exclude_opts
+        if extra_compression:
+            log("Using experimental extra compression...")
+            cmd += ['-Xbcj', 'arm', '-b', '1M']
+        with tracer.span('mksquashfs') as pack:
+            try:
+                code = run_command(cmd, log, tracer, cwd=workdir)
+            except FileNotFoundError:
+                raise OperationError("mksquashfs not found in PATH. Install squashfs-tools.")
+            if os.path.exists(_path(workdir, out_file)):
+                pack.bytes = os.path.getsize(_path(workdir, out_file))
+        if code:
+            raise OperationError(f"mksquashfs failed with exit code {code}")
+
+        from . import history
+        build = None
+        with tracer.span('history'):
+            options = {'product': product_type, 'manufacturer': manufacturer,
+                       'extra_compression': extra_compression, 'deterministic': deterministic,
+                       'layer': not layer.Layer(workdir).empty,
+                       'exclude': os.path.exists(_path(workdir, EXCLUDE_FILE)),
+                       'sort': os.path.exists(_path(workdir, SORT_FILE))}
+            try:
+                db = history.connect()
+                try:
+                    build = history.record(workdir, _path(workdir, out_file), version, build_num, options,
+                                           seconds=pack.end - tracer.started, compress_seconds=pack.duration,
+                                           compress_cpu=pack.cpu, peak_rss=pack.rss or None, db=db)
+                    if min_headroom is None:
+                        min_headroom = history.get_margin(db, workdir)
+                    log(f"\n{history.describe(db, build, min_headroom)}")
+                finally:
+                    db.close()
+            except (sqlite3.Error, OSError, ValueError) as e:
+                log(f"Warning: build not recorded in the history: {e}")
+        if reference:
+            with tracer.span('compare', reference=os.path.basename(reference)):
+                try:
+                    log(delta.format_compare(delta.compare(_path(workdir, out_file), reference)))
+                except (ValueError, OSError) as e:
+                    log(f"Warning: could not compare with {reference}: {e}")
+        problem = build and history.headroom_problem(build, min_headroom)
+        if problem:
+            raise OperationError(problem)
+        log(f"\n✓ Build complete: {out_file}")
+        return _path(workdir, out_file)
+    finally:
+        _finish(tracer, log)
+
+
+def customize(workdir='.', wifi_ssid=None, wifi_pwd=None, language=None, video_res=None,
+              photo_res=None, gsensor=None, switches=None, debloat=None, log=print):
+    """Record ROM settings in the build layer; None leaves a setting alone
+
+    switches maps menu.cfg switch keys (power_on_record, record_sound,
+    time_water_mark, wifi) to booleans. debloat=True makes the layer delete the
+    fake feature drivers and exclude.txt's paths and hides the fake features,
+    debloat=False takes all of that back out.
+    """
+    build = layer.Layer(workdir)
+    if not os.path.isdir(build.base):
+        raise OperationError("squashfs-root not found, extract the firmware first")
+
+    # WiFi settings
+    for cfg_file in CFG_FILES:
+        if os.path.isfile(build.source(cfg_file)):
+            if wifi_ssid is not None:
+                build.set(cfg_file, 'wifi_ssid', wifi_ssid)
+            if wifi_pwd is not None:
+                build.set(cfg_file, 'wifi_pwd', wifi_pwd)
+
+    # menu.cfg
+    has_menu = os.path.isfile(build.source(MENU_CFG))
+    if has_menu:
+        for section, value in (('language', language), ('video_resolution', video_res),
+                               ('photo_resolution', photo_res), ('gsensor', gsensor)):
+            if value is not None:
+                build.set(MENU_CFG, 'current', value, section)
+        for key, enabled in (switches or {}).items():
+            build.set(MENU_CFG, key, int(enabled))
+
+    if debloat is not None:
+        build.undelete(reason='debloat')
+        # the list customize used to write; the layer does its job now
+        if os.path.exists(_path(workdir, EXCLUDE_FILE)):
+            os.remove(_path(workdir, EXCLUDE_FILE))
+    if debloat:
+        # Fake feature drivers
+        for root, dirs, files in os.walk(os.path.join(build.base, 'vendor/modules')):
+            for file in sorted(files):
+                if file.startswith(('mma', 'bma')):
+                    build.delete(os.path.relpath(os.path.join(root, file), build.base), 'debloat')
+
+        exclude_txt = _path(workdir, 'exclude.txt')
+        if os.path.exists(exclude_txt):
+            with open(exclude_txt, 'r') as excl:
+                for line in excl:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        try:
+                            build.delete(line, 'debloat')
+                        except ValueError as e:
+                            log(f"  ⚠ exclude.txt: {e}")
+
+        # Disable fake features in menu
+        if has_menu:
+            build.set(MENU_CFG, 'count', 0, 'gsensor')
+            build.set(MENU_CFG, 'count', 0, 'park_mode')
+    elif debloat is not None:
+        build.unset(MENU_CFG, 'count', 'gsensor')
+        build.unset(MENU_CFG, 'count', 'park_mode')
+
+    try:
+        build.render()
+    except ValueError as e:
+        raise OperationError(str(e))
+    build.save()
+    log("✓ ROM customization applied (build layer, squashfs-root untouched)")
+
+
+def extract_system(mtdblock2, workdir='.', log=print):
+    """Extract an mtdblock2 into workdir/squashfs-root (which must not exist)
+
+    Goes through the extraction cache (beike.store), so an image that was extracted
+    before comes back as links to the cached files instead of another unsquashfs.
+    """
+    dest = _path(workdir, 'squashfs-root')
+    tracer = trace.Tracer('extract_system', image=os.path.basename(mtdblock2))
+    try:
+        with tracer.span('extract') as span:
+            span.bytes = os.path.getsize(mtdblock2)
+            key = store.extract(mtdblock2, dest, log=log)
+        # customizations carry over to the new base; record which one it is
+        build = layer.Layer(workdir)
+        build.set_base(key, os.path.basename(mtdblock2))
+        build.save()
+    except (ValueError, OSError) as e:
+        raise OperationError(str(e))
+    finally:
+        _finish(tracer, log)
+    log("\n✓ Extracted to squashfs-root/")
+    return dest
+
+
+# ---------------------------------------------------------------------------
+# Flash (FEL)
+# ---------------------------------------------------------------------------
+
+def detect_layout(workdir='.', log=print):
+    """The flash layout for the device this workdir is about (see beike.flash.detect_layout)"""
+    try:
+        layout, source = flash.detect_layout([workdir, latest_backup(workdir)])
+    except ValueError as e:
+        raise OperationError(f"Partition table: {e}")
+    log(f"Partition layout from {source}")
+    return layout
+
+
+def _fel_write(images, name, workdir, log):
+    """Write [(offset, path)] in one sunxi-fel run (one FEL session), then reset the device"""
+    tools_dir = _path(workdir, 'sunxi-tools')
+    if not os.path.exists(os.path.join(tools_dir, 'sunxi-fel')):
+        raise OperationError("Cannot find sunxi-tools/sunxi-fel. Install sunxi-tools first.")
+
+    tracer = trace.Tracer(name, image=','.join(os.path.basename(path) for _offset, path in images))
+    try:
+        cmd = ['./sunxi-fel', '-p']
+        with tracer.span('copy') as span:
+            span.bytes = 0
+            for offset, image in images:
+                staged = os.path.join(tools_dir, os.path.basename(image))
+                if os.path.abspath(image) != os.path.abspath(staged):
+                    shutil.copy(image, staged)
+                span.bytes += os.path.getsize(staged)
+                cmd += ['spiflash-write', str(offset), os.path.basename(staged)]
+
+        log("Flashing to device..." if images[0][0] else "Flashing from sector 0...")
+        with tracer.span('spiflash_write') as span:
+            span.bytes = sum(os.path.getsize(path) for _offset, path in images)
+            code = run_command(cmd, log, tracer, cwd=tools_dir)
+        if code:
+            raise OperationError(f"sunxi-fel failed with exit code {code}")
+
+        log("\nResetting device...")
+        with tracer.span('wdreset'):
+            tracer.run(['./sunxi-fel', 'wdreset'], cwd=tools_dir)
+    finally:
+        _finish(tracer, log)
+
+
+def flash_partitions(writes, workdir='.', log=print, layout=None):
+    """Write images to partitions by name ([('system', 'system_v1.bin'), ('boot_logo', 'boot.jpg')])
+
+    Everything goes out in one FEL session, so system plus logos is a single replug.
+    Offsets come from the detected layout; logos are padded to their partition so
+    nothing of the old picture is left behind.
+    """
+    layout = layout or detect_layout(workdir, log)
+    try:
+        plan = flash.plan_writes([(name, _path(workdir, path)) for name, path in writes], layout)
+    except (ValueError, OSError) as e:
+        raise OperationError(str(e))
+    logos = [partition_by_name(name, layout) for name in LOGO_PARTITIONS]
+    images = []
+    padded = []
+    try:
+        for part, path in plan:
+            log(f"  {part.name} ({part.block}) @ {part.offset}: {os.path.basename(path)}, "
+                f"{os.path.getsize(path)} of {part.size} bytes")
+            if part in logos:
+                raw = write_padded(path, _path(workdir, os.path.join('sunxi-tools', f"{part.name}.raw")), part.size)
+                padded.append(raw)
+                path = raw
+            images.append((part.offset, path))
+        _fel_write(images, 'flash', workdir, log)
+    finally:
+        for raw in padded:
+            os.remove(raw)
+
+
+def flash_system(image, workdir='.', log=print):
+    """Write a system image to the system partition over FEL and reset the device"""
+    flash_partitions([('system', image)], workdir, log)
+    log("\n✓ Flash complete! Device is rebooting.")
+
+
+def full_restore(image, workdir='.', log=print):
+    """Write a full restore image from sector 0 over FEL and reset the device"""
+    _fel_write([(0, _path(workdir, image))], 'full_restore', workdir, log)
+    log("\n✓ Full restore complete! Device is rebooting.")
+
+
+def ram_boot(image=None, workdir='.', log=print, tree=None, boot='mtdblock1', uboot=None,
+             bootargs=None, keep_data=False, verify=True, timeout=90):
+    """Boot a system image (or a squashfs-root tree) from DRAM over FEL, writing no flash
+
+    image is unsquashed to a temporary tree first, and squashfs-root gets the build
+    layer applied in one (like build_rom packs it). boot is the stock boot image
+    (mtdblock1 from a backup), uboot a mainline u-boot-sunxi-with-spl.bin (default:
+    sunxi-tools/). With verify, waits for ADB and checks the candidate is what's running.
+    """
+    from . import ramboot
+
+    tools_dir = _path(workdir, 'sunxi-tools')
+    if not os.path.exists(os.path.join(tools_dir, 'sunxi-fel')):
+        raise OperationError("Cannot find sunxi-tools/sunxi-fel. Install sunxi-tools first.")
+    uboot = os.path.abspath(_path(workdir, uboot) if uboot else os.path.join(tools_dir, ramboot.UBOOT_NAME))
+    if not os.path.exists(uboot):
+        raise OperationError(f"{uboot} not found. FEL can't load the stock bootloader; build mainline "
+                             f"U-Boot for the V3s (LicheePi_Zero_defconfig) and put {ramboot.UBOOT_NAME} there")
+    boot = _path(workdir, boot)
+    if not os.path.exists(boot):
+        raise OperationError(f"{boot} not found (the stock mtdblock1 from a backup)")
+    if not image and not tree:
+        raise OperationError("Nothing to boot: give a system image or a tree")
+
+    tracer = trace.Tracer('ramboot', image=os.path.basename(image or tree))
+    try:
+        ramboot.check_uboot(uboot)
+        with tempfile.TemporaryDirectory() as tmp:
+            if image:
+                tree = os.path.join(tmp, 'system')
+                with tracer.span('unsquashfs'):
+                    try:
+                        store.extract(_path(workdir, image), tree, 'auto', log=log)
+                    except (ValueError, OSError) as e:
+                        raise OperationError(str(e))
+            else:
+                tree = _path(workdir, tree)
+                build = layer.Layer(workdir)
+                if not build.empty and os.path.realpath(tree) == os.path.realpath(build.base):
+                    # boot what the next build would pack, not the stock tree under the layer
+                    tree = os.path.join(tmp, 'system')
+                    with tracer.span('export_layer'):
+                        try:
+                            count = build.export(tree)
+                        except (ValueError, OSError) as e:
+                            raise OperationError(str(e))
+                    log(f"Applied the build layer ({count} changed files)")
+            log("Preparing kernel, initrd and boot script...")
+            with tracer.span('prepare') as span:
+                plan = ramboot.prepare(boot, tree, os.path.join(tools_dir, 'ramboot'),
+                                       bootargs or ramboot.DEFAULT_BOOTARGS, keep_data)
+                span.bytes = sum(os.path.getsize(path) for _addr, path in plan)
+            build_prop = None
+            if os.path.exists(os.path.join(tree, 'build.prop')):
+                with open(os.path.join(tree, 'build.prop'), 'rb') as f:
+                    build_prop = f.read()
+
+        for addr, path in plan:
+            log(f"  0x{addr:08x} {os.path.basename(path)} ({os.path.getsize(path) // 1024} KB)")
+        log("\nLoading into DRAM over FEL...")
+        plan = [(addr, os.path.relpath(path, tools_dir)) for addr, path in plan]
+        with tracer.span('fel_load') as span:
+            span.bytes = os.path.getsize(uboot) + sum(
+                os.path.getsize(os.path.join(tools_dir, path)) for _addr, path in plan)
+            code = run_command(['./sunxi-fel'] + ramboot.fel_args(uboot, plan), log, tracer, cwd=tools_dir)
+        if code:
+            raise OperationError(f"sunxi-fel failed with exit code {code}")
+        if not verify:
+            log("\n✓ Loaded. Device is booting from RAM; power cycle to go back to flash.")
+            return
+
+        log("Waiting for ADB...")
+        with tracer.span('wait_adb'):
+            try:
+                tracer.run(['adb', 'wait-for-device'], capture_output=True, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                raise OperationError(f"Device didn't come up over ADB within {timeout}s (check the serial console)")
+        with tracer.span('verify'):
+            cmdline = tracer.run(['adb', 'shell', 'cat /proc/cmdline'], capture_output=True).stdout
+            if ramboot.RAMBOOT_MARK.encode() not in cmdline:
+                raise OperationError("Device came up but not from RAM (cmdline has no "
+                                     f"{ramboot.RAMBOOT_MARK}); it probably booted from flash")
+            if build_prop:
+                running = tracer.run(['adb', 'shell', 'cat /system/build.prop'], capture_output=True).stdout
+                if running.replace(b'\r\n', b'\n') != build_prop:
+                    raise OperationError("Device booted from RAM but /system/build.prop isn't the candidate's")
+        log("\n✓ Running from RAM, flash untouched. Power cycle to go back to the flashed ROM.")
+    except ValueError as e:
+        raise OperationError(str(e))
+    finally:
+        _finish(tracer, log)
+
+
+# ---------------------------------------------------------------------------
+# System update over ADB (no FEL)
+# ---------------------------------------------------------------------------
+
+def _adb_read_blocks(tracer, block, first, count):
+    """Raw erase blocks straight off a device partition"""
+    cmd = ['adb', 'exec-out', f'toolbox dd if=/dev/block/{block} bs={ERASE_BLOCK} skip={first} count={count}']
+    result = tracer.run(cmd, capture_output=True)
+    if result.returncode:
+        raise OperationError(f"Reading {block} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+
+def adb_update_system(image, workdir='.', log=print, verify=True, reboot=True):
+    """Write only the changed 64 KB blocks of a system image to mtdblock2 over ADB
+
+    Reads the current partition back, then streams each run of changed blocks
+    through `adb exec-in` into dd on the device (nothing is staged in /data) and
+    reads the runs back to verify. Returns the number of blocks written.
+    """
+    image = _path(workdir, image)
+    size = os.path.getsize(image)
+    limit = partition_by_name('system', detect_layout(workdir, log)).size
+    if size >= limit:
+        raise OperationError(f"Image too large: {size} >= {limit} bytes")
+    if not size:
+        raise OperationError(f"{image} is empty")
+    with open(image, 'rb') as f:
+        # mapped, not read; unmapped once the last view of it is gone
+        new = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    count = -(-size // ERASE_BLOCK)
+    full = size // ERASE_BLOCK
+
+    tracer = trace.Tracer('adb_update', image=os.path.basename(image))
+    try:
+        _check_adb(tracer)
+        log(f"Reading current mtdblock2 ({count} blocks)...")
+        with tracer.span('read_device') as span:
+            old = _adb_read_blocks(tracer, 'mtdblock2', 0, count)
+            span.bytes = len(old)
+        if len(old) < count * ERASE_BLOCK:
+            raise OperationError(f"Short read from mtdblock2: {len(old)} bytes")
+
+        # Pad the last block with what is already there so every write is whole blocks;
+        # that block is the only part of the image that gets copied
+        tail = bytes(new[full * ERASE_BLOCK:]) + old[size:count * ERASE_BLOCK] if full < count else b''
+
+        def blocks(first, last):
+            return tail if first == full else new[first * ERASE_BLOCK:(last + 1) * ERASE_BLOCK]
+
+        from .fwdiff import block_ranges, changed_blocks
+        with tracer.span('diff'):
+            changed = changed_blocks(memoryview(old)[:full * ERASE_BLOCK], new[:full * ERASE_BLOCK])
+            if tail and tail != old[full * ERASE_BLOCK:]:
+                changed.append(full)
+            runs = []
+            for first, last in block_ranges(changed):
+                # the padded block goes out on its own, the rest straight from the mapping
+                runs += [(first, full - 1), (full, full)] if first < full <= last else [(first, last)]
+        if not changed:
+            log("✓ Device already has this image, nothing to write")
+            return 0
+        log(f"{len(changed)} of {count} blocks changed ({len(changed) * ERASE_BLOCK // 1024} KB to write)\n")
+
+        with tracer.span('write') as span:
+            for first, last in runs:
+                data = blocks(first, last)
+                log(f"  Writing blocks {first}-{last} ({len(data) // 1024} KB)...")
+                cmd = ['adb', 'exec-in', f'toolbox dd of=/dev/block/mtdblock2 bs={ERASE_BLOCK} seek={first}']
+                result = tracer.run(cmd, input=data, capture_output=True)
+                if result.returncode:
+                    raise OperationError(f"Write failed at block {first}: "
+                                         f"{result.stderr.decode(errors='replace').strip()}")
+                span.bytes += len(data)
+
+        if verify:
+            log("\nVerifying...")
+            with tracer.span('verify') as span:
+                bad = []
+                for first, last in runs:
+                    back = _adb_read_blocks(tracer, 'mtdblock2', first, last - first + 1)
+                    span.bytes += len(back)
+                    if back != blocks(first, last):
+                        bad.append(f"{first}-{last}")
+            if bad:
+                raise OperationError(f"Verify failed for blocks {', '.join(bad)}. Flash over FEL before rebooting.")
+            log("✓ Read back matches")
+
+        with tracer.span('sync'):
+            tracer.run(['adb', 'shell', 'sync'], capture_output=True)
+        if reboot:
+            log("Rebooting device...")
+            with tracer.span('reboot'):
+                tracer.run(['adb', 'reboot'], capture_output=True)
+        log(f"\n✓ Update complete: {len(changed)} blocks written")
+        return len(changed)
+    finally:
+        _finish(tracer, log)
+
+
+# ---------------------------------------------------------------------------
+# Backup / restore images (ADB)
+# ---------------------------------------------------------------------------
+
+def _device_has_gzip(tracer):
+    """True if the camera's gzip (zlib minigzip) can stream to us over exec-out"""
+    result = tracer.run(['adb', 'exec-out', 'gzip -1 < /dev/null'], capture_output=True)
+    return result.returncode == 0 and result.stdout[:2] == GZIP_MAGIC
+
+
+def _pull_gzip(tracer, block, dest):
+    """Stream a partition through the camera's gzip, inflating and hashing as it arrives
+
+    Returns (sha256, bytes, bytes over USB), or None if the stream was not usable.
+    minigzip unlinks any file it is given, so the block device only ever goes in as stdin.
+    """
+    process = subprocess.Popen(['adb', 'exec-out', f'gzip -1 < /dev/block/{block}'],
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    inflate = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    digest = hashlib.sha256()
+    size = usb = 0
+    ok = True
+    with open(dest + '.part', 'wb') as out:
+        for chunk in iter(lambda: process.stdout.read(PULL_CHUNK), b''):
+            usb += len(chunk)
+            try:
+                data = inflate.decompress(chunk)
+            except zlib.error:
+                ok = False
+                process.kill()
+                break
+            digest.update(data)
+            out.write(data)
+            size += len(data)
+    process.stdout.close()
+    if tracer.wait(process) or not ok or not inflate.eof:
+        os.remove(dest + '.part')
+        return None
+    os.replace(dest + '.part', dest)
+    return digest.hexdigest(), size, usb
+
+
+def _pull_raw(tracer, block, dest):
+    """adb pull a partition as-is; returns (sha256, bytes, bytes over USB) or None"""
+    result = tracer.run(['adb', 'pull', f'/dev/block/{block}', dest], capture_output=True, text=True)
+    if result.returncode or not os.path.exists(dest):
+        return None
+    digest = hashlib.sha256()
+    with open(dest, 'rb') as f:
+        for chunk in iter(lambda: f.read(PULL_CHUNK), b''):
+            digest.update(chunk)
+    size = os.path.getsize(dest)
+    return digest.hexdigest(), size, size
+
+
+def backup_device(workdir='.', backup_dir=None, log=print, compress=True):
+    """Pull mtdblock0-7 into backup_<timestamp>/; returns the directory
+
+    With compress, each partition is streamed through the camera's own gzip (the
+    erased and padding space costs next to nothing over USB) and falls back to a raw
+    adb pull if that doesn't work. Hashes go into SHA256SUMS next to the blocks.
+    """
+    backup_dir = backup_dir or f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    target = _path(workdir, backup_dir)
+    os.makedirs(target, exist_ok=True)
+    log(f"Created backup directory: {backup_dir}")
+
+    tracer = trace.Tracer('backup', backup_dir=backup_dir)
+    sums = []
+    total = total_usb = 0
+    try:
+        _check_adb(tracer)
+        if compress:
+            with tracer.span('gzip_probe'):
+                compress = _device_has_gzip(tracer)
+            if not compress:
+                log("gzip not usable on the device, pulling raw partitions")
+
+        for i in range(8):
+            block = f'mtdblock{i}'
+            log(f"\nBacking up {block}...")
+            dest = os.path.join(target, block)
+            with tracer.span(f'pull_{block}') as span:
+                pulled = _pull_gzip(tracer, block, dest) if compress else None
+                if compress and not pulled:
+                    log(f"  gzip stream failed, pulling {block} raw")
+                pulled = pulled or _pull_raw(tracer, block, dest)
+                if pulled:
+                    span.bytes = pulled[1]
+                    span.args['usb_bytes'] = pulled[2]
+            if not pulled:
+                log(f"✗ Failed to backup {block}")
+                continue
+            digest, size, usb = pulled
+            sums.append(f"{digest}  {block}\n")
+            total += size
+            total_usb += usb
+            if usb < size:
+                log(f"✓ {block} backed up ({size // 1024} KB, {usb // 1024} KB over USB)")
+            else:
+                log(f"✓ {block} backed up")
+
+        with open(os.path.join(target, 'SHA256SUMS'), 'w') as f:
+            f.writelines(sums)
+    finally:
+        _finish(tracer, log)
+    if total and total_usb < total:
+        log(f"\nTransferred {total_usb / 1048576:.2f} MB for {total / 1048576:.2f} MB of partitions "
+            f"({100 - total_usb * 100 / total:.0f}% saved)")
+    log(f"\n✓ Backup complete: {backup_dir}/")
+    return target
+
+
+def latest_backup(workdir='.', exclude=None):
+    """Newest backup_* directory with a SHA256SUMS manifest, or None"""
+    backups = sorted(d for d in os.listdir(workdir)
+                     if d.startswith('backup_') and d != exclude
+                     and os.path.exists(os.path.join(workdir, d, 'SHA256SUMS')))
+    return _path(workdir, backups[-1]) if backups else None
+
+
+def read_manifest(backup_dir):
+    """{mtdblockN: sha256} from a backup's SHA256SUMS"""
+    sums = {}
+    with open(os.path.join(backup_dir, 'SHA256SUMS'), 'r') as f:
+        for line in f:
+            if line.strip():
+                digest, name = line.split(None, 1)
+                sums[name.strip()] = digest
+    return sums
+
+
+class _PartitionSink:
+    """One mtdblock being filled from the flash stream: hashed, written, compared as it goes"""
+    def __init__(self, part, target, prior=None):
+        self.part = part
+        self.dest = os.path.join(target, part.block)
+        self.out = open(self.dest + '.part', 'wb')
+        self.digest = hashlib.sha256()
+        self.prior = None
+        self.changed = set()
+        if prior and part.block in prior and prior.size(part.block) == part.size:
+            self.prior = prior.view(part.block)
+        self.compared = self.prior is not None
+
+    def feed(self, offset, data):
+        """data starts at offset within the partition"""
+        self.out.write(data)
+        self.digest.update(data)
+        if self.prior is not None:
+            old = self.prior[offset:offset + len(data)]
+            for start in range(0, len(data), ERASE_BLOCK):
+                if data[start:start + ERASE_BLOCK] != old[start:start + ERASE_BLOCK]:
+                    self.changed.add((offset + start) // ERASE_BLOCK)
+
+    def close(self):
+        self.out.close()
+        os.replace(self.dest + '.part', self.dest)
+        if self.prior is not None:
+            self.prior.release()
+            self.prior = None
+        return self.digest.hexdigest()
+
+
+def fel_backup(workdir='.', backup_dir=None, log=print, chunk=1024 * 1024, against=None):
+    """Read the whole SPI flash over FEL into backup_<timestamp>/mtdblock0-7; returns the directory
+
+    Works on devices that don't boot far enough for ADB. The flash is read in chunks
+    with the next chunk already on its way while the last one is split into
+    partitions, hashed into SHA256SUMS and compared against the previous backup
+    (against, default: the newest backup_* with a manifest).
+    """
+    tools_dir = _path(workdir, 'sunxi-tools')
+    if not os.path.exists(os.path.join(tools_dir, 'sunxi-fel')):
+        raise OperationError("Cannot find sunxi-tools/sunxi-fel. Install sunxi-tools first.")
+    if chunk <= 0 or chunk % ERASE_BLOCK:
+        raise OperationError(f"Chunk size must be a multiple of {ERASE_BLOCK} bytes")
+
+    backup_dir = backup_dir or f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    target = _path(workdir, backup_dir)
+    prior = _path(workdir, against) if against else latest_backup(workdir, os.path.basename(backup_dir))
+    prior_sums = read_manifest(prior) if prior else {}
+    os.makedirs(target, exist_ok=True)
+    log(f"Created backup directory: {backup_dir}")
+    if prior:
+        log(f"Comparing against {os.path.basename(prior)}")
+
+    layout = detect_layout(workdir, log)
+    size = layout[-1].end
+    tracer = trace.Tracer('fel_backup', backup_dir=backup_dir, chunk=chunk)
+    sinks = []
+    pending = None
+    prior_image = None
+    try:
+        if prior:
+            try:
+                prior_image = PartitionImage.open(prior)
+            except (ValueError, OSError):
+                prior_image = None
+        with tracer.span('spiflash_info'):
+            info = tracer.run(['./sunxi-fel', 'spiflash-info'], cwd=tools_dir, capture_output=True, text=True)
+        if info.returncode:
+            raise OperationError("sunxi-fel can't talk to the device. Is it in FEL mode?")
+        m = re.search(r'size: (\d+) bytes', info.stdout)
+        if m and int(m.group(1)) != size:
+            log(f"Warning: flash reports {m.group(1)} bytes, the partition layout covers {size}")
+
+        sinks = [_PartitionSink(part, target, prior_image) for part in layout]
+        chunks = [(offset, min(chunk, size - offset)) for offset in range(0, size, chunk)]
+        scratch = [os.path.join(target, f'.chunk{i}') for i in range(2)]
+
+        def start(n):
+            offset, length = chunks[n]
+            return subprocess.Popen(['./sunxi-fel', 'spiflash-read', str(offset), str(length),
+                                     os.path.abspath(scratch[n % 2])],
+                                    cwd=tools_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        log(f"Reading {size // 1024} KB in {len(chunks)} chunks...")
+        started = datetime.now()
+        pending = start(0)
+        for n, (offset, length) in enumerate(chunks):
+            with tracer.span('spiflash_read', offset=offset) as span:
+                code = tracer.wait(pending, span)
+                span.bytes = length
+            if code:
+                raise OperationError(f"sunxi-fel spiflash-read failed at offset {offset} (exit code {code})")
+            with open(scratch[n % 2], 'rb') as f:
+                data = f.read()
+            if len(data) != length:
+                raise OperationError(f"Short read at offset {offset}: {len(data)} of {length} bytes")
+            if n + 1 < len(chunks):
+                pending = start(n + 1)
+            # split into partitions while the next chunk is read
+            with tracer.span('split'):
+                for sink in sinks:
+                    lo, hi = max(offset, sink.part.offset), min(offset + length, sink.part.end)
+                    if lo < hi:
+                        sink.feed(lo - sink.part.offset, data[lo - offset:hi - offset])
+            log(f"  {(offset + length) * 100 // size:3d}%  {(offset + length) // 1024} KB")
+
+        sums = []
+        for sink in sinks:
+            digest = sink.close()
+            sums.append(f"{digest}  {sink.part.block}\n")
+            old = prior_sums.get(sink.part.block)
+            if old is None:
+                log(f"✓ {sink.part.block} backed up ({sink.part.size // 1024} KB)")
+            elif old == digest:
+                log(f"✓ {sink.part.block} backed up, unchanged")
+            elif sink.compared:
+                log(f"✓ {sink.part.block} backed up, {len(sink.changed)} of "
+                    f"{sink.part.size // ERASE_BLOCK} blocks differ")
+            else:
+                log(f"✓ {sink.part.block} backed up, differs")
+        sinks = []
+        with open(os.path.join(target, 'SHA256SUMS'), 'w') as f:
+            f.writelines(sums)
+        for path in scratch:
+            if os.path.exists(path):
+                os.remove(path)
+        seconds = (datetime.now() - started).total_seconds()
+        log(f"\nRead {size / 1048576:.2f} MB in {seconds:.1f}s ({size / 1024 / max(seconds, 0.001):.0f} KB/s)")
+    finally:
+        if pending and pending.poll() is None:
+            pending.kill()
+            pending.wait()
+        for sink in sinks:
+            sink.out.close()
+            if sink.prior is not None:
+                sink.prior.release()
+        if prior_image:
+            prior_image.close()
+        _finish(tracer, log)
+    log(f"\n✓ Backup complete: {backup_dir}/")
+    return target
+
+
+def _extract_logo(image, block, extract_dir, name, log):
+    # Find JPEG start marker
+    jpeg_start = image.find(block, JPEG_MAGIC)
+    if jpeg_start != -1:
+        image.save(block, os.path.join(extract_dir, f'{name}.jpg'), jpeg_start)
+        log(f"✓ Extracted as {name}.jpg")
+    else:
+        image.save(block, os.path.join(extract_dir, f'{name}.raw'))
+        log(f"✓ Copied as {name}.raw (no JPEG marker found)")
+
+
+def extract_mtdblocks(backup_dir, log=print):
+    """Split a backup (or a full restore image) into uboot/boot/system/data/logos under <name>_extracted"""
+    backup_dir = backup_dir.rstrip('/')
+    extract_dir = f"{backup_dir if os.path.isdir(backup_dir) else os.path.splitext(backup_dir)[0]}_extracted"
+    try:
+        image = PartitionImage.open(backup_dir)
+    except (ValueError, OSError) as e:
+        raise OperationError(f"Cannot read {backup_dir}: {e}")
+    os.makedirs(extract_dir, exist_ok=True)
+    tracer = trace.Tracer('extract', backup_dir=backup_dir)
+
+    def block(n, span, name):
+        """Save mtdblock<n> as name, if the backup has it; returns the path"""
+        if f'mtdblock{n}' not in image:
+            return None
+        span.bytes = image.save(f'mtdblock{n}', os.path.join(extract_dir, name))
+        return os.path.join(extract_dir, name)
+
+    try:
+        # mtdblock0 - uboot (just copy)
+        with tracer.span('mtdblock0_uboot') as span:
+            log("\nmtdblock0 (uboot) - copying...")
+            if block(0, span, 'uboot.bin'):
+                log("✓ Copied as uboot.bin")
+
+        # mtdblock1 - boot.img
+        with tracer.span('mtdblock1_boot') as span:
+            log("\nmtdblock1 (boot.img) - copying...")
+            if block(1, span, 'boot.img'):
+                log("✓ Copied as boot.img")
+                try:
+                    from . import bootimg
+                    info = bootimg.unpack(os.path.join(extract_dir, 'boot.img'),
+                                          os.path.join(extract_dir, 'boot_unpacked'))
+                    log(f"✓ Unpacked kernel + ramdisk to boot_unpacked/ (cmdline: '{info['cmdline']}')")
+                    log("  (Repack with: python3 -m beike.bootimg repack boot_unpacked boot_new.img)")
+                except (ValueError, OSError) as e:
+                    log(f"✗ Failed to unpack boot.img: {e}")
+
+        # mtdblock2 - squashfs system
+        with tracer.span('mtdblock2_system') as span:
+            log("\nmtdblock2 (squashfs system) - extracting...")
+            system = block(2, span, 'system.squashfs')
+            if system:
+                try:
+                    store.extract(system, os.path.join(extract_dir, 'squashfs-root'), log=log)
+                    log("✓ Extracted to squashfs-root/")
+                except (ValueError, OSError) as e:
+                    log(f"✗ Failed to extract: {e}")
+
+        # mtdblock3 - jffs2 data
+        with tracer.span('mtdblock3_data') as span:
+            log("\nmtdblock3 (jffs2 data) - copying...")
+            if block(3, span, 'data.jffs2'):
+                log("✓ Copied as data.jffs2")
+                try:
+                    from . import jffs2
+                    with jffs2.JFFS2Image.open(os.path.join(extract_dir, 'data.jffs2')) as data:
+                        count = data.extract(os.path.join(extract_dir, 'data'))
+                    log(f"✓ Extracted {count} entries to data/")
+                except (ValueError, OSError) as e:
+                    log(f"✗ Failed to extract data.jffs2: {e}")
+
+        # mtdblock4/5 - logos
+        for n, name, label in ((4, 'boot_logo', 'boot logo'), (5, 'shutdown_logo', 'shutdown logo')):
+            with tracer.span(f'mtdblock{n}_{name}') as span:
+                log(f"\nmtdblock{n} ({label}) - extracting...")
+                if f'mtdblock{n}' in image:
+                    span.bytes = image.size(f'mtdblock{n}')
+                    _extract_logo(image, f'mtdblock{n}', extract_dir, name, log)
+    finally:
+        image.close()
+        _finish(tracer, log)
+
+    log(f"\n✓ Extraction complete: {extract_dir}/")
+    return extract_dir
+
+
+def make_restore(version, workdir='.', log=print):
+    """Concatenate consecutive mtdblock files into full_restore_v<version>.bin; returns its path"""
+    if not os.path.exists(_path(workdir, 'mtdblock0')):
+        raise OperationError("mtdblock0 not found (required)")
+
+    image = PartitionImage.open(workdir)
+    blocks = []
+    for part in image:
+        if part.index != len(blocks) or len(blocks) == 7:
+            break
+        blocks.append(part.block)
+
+    log(f"Found {len(blocks)} mtdblock files:")
+    total_size = 0
+    for block in blocks:
+        size = image.size(block)
+        total_size += size
+        log(f"  {block}: {size} bytes")
+    log(f"\nTotal size: {total_size} bytes")
+
+    out_file = f"full_restore_v{version}.bin"
+    log(f"\nCreating {out_file}...")
+    tracer = trace.Tracer('make_restore', version=version)
+    try:
+        with tracer.span('concatenate') as span:
+            with open(_path(workdir, out_file), 'wb') as outf:
+                span.bytes = image.write_to(outf, blocks)
+    finally:
+        image.close()
+        _finish(tracer, log)
+    log(f"\n✓ Created {out_file}")
+    return _path(workdir, out_file)
+
+
+def flash_logos(boot=None, shutdown=None, workdir='.', log=print):
+    """Pad JPEG logos to their partition (detected layout) and dd them to it over ADB"""
+    if not boot and not shutdown:
+        raise OperationError("No logo files given")
+    layout = detect_layout(workdir, log)
+    logos = {}
+    for which, path in (('boot', boot), ('shutdown', shutdown)):
+        if path:
+            part = partition_by_name(f'{which}_logo', layout)
+            size = os.path.getsize(path)
+            if size > part.size:
+                raise OperationError(f"{which.capitalize()} logo too large: {size} bytes, "
+                                     f"{part.name} ({part.block}) holds {part.size}")
+            logos[which] = (path, part)
+
+    tracer = trace.Tracer('change_logos')
+    try:
+        _check_adb(tracer)
+        for which, (path, part) in logos.items():
+            log(f"\nProcessing {which} logo...")
+            raw = write_padded(path, _path(workdir, f'{which}_logo_new.raw'), part.size)
+
+            log(f"Flashing {which} logo...")
+            try:
+                with tracer.span(f'push_{which}_logo') as span:
+                    span.bytes = part.size
+                    tracer.run(['adb', 'push', raw, '/data/'])
+                with tracer.span(f'dd_{which}_logo') as span:
+                    span.bytes = part.size
+                    tracer.run(['adb', 'shell', f'toolbox dd if=/data/{which}_logo_new.raw '
+                                f'of=/dev/block/{part.block} bs={part.size} && sync'])
+            finally:
+                os.remove(raw)
+            log(f"✓ {which.capitalize()} logo flashed")
+    finally:
+        _finish(tracer, log)
+    log("\n✓ Done! Power cycle device to see new logos.")
+
+
+# ---------------------------------------------------------------------------
+# Dependencies
+# ---------------------------------------------------------------------------
+
+def check_dependencies(workdir='.'):
+    """{name: installed} for the host tools the workflows need"""
+    status = {}
+    for name, cmd in DEPENDENCIES:
+        try:
+            result = subprocess.run(cmd, shell=True, capture_output=True, timeout=2, cwd=workdir)
+            status[name] = result.returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            status[name] = False
+    return status
@@ -0,0 +1,96 @@
+"""
+cpio "newc" archive reader/writer
+The format used by Android ramdisks (see boot image mtdblock1)
+"""
+
+import stat
+
+NEWC_MAGIC = b'070701'
+TRAILER = 'TRAILER!!!'
+FIELDS = ('ino', 'mode', 'uid', 'gid', 'nlink', 'mtime', 'filesize',
+          'devmajor', 'devminor', 'rdevmajor', 'rdevminor', 'namesize', 'check')
+
+
+def _pad4(n):
+    return (4 - n % 4) % 4
+
+
+class Entry:
+    """One archive member; data is bytes (file contents or symlink target)"""
+    def __init__(self, name, mode, data=b'', uid=0, gid=0, mtime=0, ino=0, nlink=1,
+                 devmajor=0, devminor=0, rdevmajor=0, rdevminor=0):
+        self.name = name
+        self.mode = mode
+        self.data = data
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.ino = ino
+        self.nlink = nlink
+        self.devmajor = devmajor
+        self.devminor = devminor
+        self.rdevmajor = rdevmajor
+        self.rdevminor = rdevminor
+
+    @property
+    def is_dir(self):
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self):
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self):
+        return stat.S_ISLNK(self.mode)
+
+    def metadata(self):
+        """Everything except the data, as a JSON friendly dict"""
+        return {'name': self.name, 'mode': self.mode, 'uid': self.uid, 'gid': self.gid,
+                'mtime': self.mtime, 'ino': self.ino, 'nlink': self.nlink,
+                'devmajor': self.devmajor, 'devminor': self.devminor,
+                'rdevmajor': self.rdevmajor, 'rdevminor': self.rdevminor}
+
+
+def read_cpio(buf):
+    """Parse a newc archive from a buffer, returning a list of Entry (trailer excluded)"""
+    view = memoryview(buf)
+    entries = []
+    pos = 0
+    while pos + 110 <= len(view):
+        if bytes(view[pos:pos + 6]) != NEWC_MAGIC:
+            raise ValueError(f"bad cpio magic at offset {pos}")
+        values = [int(bytes(view[pos + 6 + i * 8:pos + 14 + i * 8]), 16) for i in range(13)]
+        header = dict(zip(FIELDS, values))
+        pos += 110
+        name = bytes(view[pos:pos + header['namesize'] - 1]).decode('utf-8', 'surrogateescape')
+        pos += header['namesize']
+        pos += _pad4(110 + header['namesize'])
+        data = bytes(view[pos:pos + header['filesize']])
+        pos += header['filesize'] + _pad4(header['filesize'])
+        if name == TRAILER:
+            break
+        entries.append(Entry(name, header['mode'], data, header['uid'], header['gid'], header['mtime'],
+                             header['ino'], header['nlink'], header['devmajor'], header['devminor'],
+                             header['rdevmajor'], header['rdevminor']))
+    return entries
+
+
+def _header(entry, namesize, filesize):
+    values = (entry.ino, entry.mode, entry.uid, entry.gid, entry.nlink, entry.mtime, filesize,
+              entry.devmajor, entry.devminor, entry.rdevmajor, entry.rdevminor, namesize, 0)
+    return NEWC_MAGIC + b''.join(b'%08x' % v for v in values)
+
+
+def write_cpio(entries):
+    """Serialise entries (plus trailer) into a newc archive"""
+    out = bytearray()
+    trailer = Entry(TRAILER, 0, nlink=1)
+    for entry in list(entries) + [trailer]:
+        name = entry.name.encode('utf-8', 'surrogateescape') + b'\x00'
+        out += _header(entry, len(name), len(entry.data))
+        out += name
+        out += b'\x00' * _pad4(110 + len(name))
+        out += entry.data
+        out += b'\x00' * _pad4(len(entry.data))
+    return bytes(out)
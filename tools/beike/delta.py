@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Delta-friendly system image layout
+A normal mksquashfs run stamps the build time into the superblock and every inode
+and writes files in directory order, so a one byte edit to menu.cfg moves the data
+of everything after it and the whole image comes out different. A deterministic
+build fixes the times, gives every top-level directory a fixed priority and sends
+the files that keep getting edited (res/cfg, etc/hawkview, res/lang, build.prop) to
+the very end of the data, where they and their tail fragments sit right before the
+metadata tables. A cfg change then touches the superblock, the last fragment
+block and the tables: a handful of 64 KB erase blocks for `cli update` to write.
+
+    python3 -m beike.cli build --version 1.1 --build 9 --deterministic
+    python3 -m beike.delta compare system_v1.1.bin system_v1.0.bin
+    python3 -m beike.delta options --show            # what gets added to mksquashfs
+    BEIKE_DETERMINISTIC=1 ./build.sh
+
+Inode numbers follow the (name sorted) directory scan, so with the tree, the times
+and the order fixed they come out the same too. Files .mksquashfs_sort puts first for
+boot keep their place unless they are one of the volatile paths; those always go last.
+"""
+
+import argparse
+import glob
+import mmap
+import os
+import sys
+
+from .bootorder import SORT_FILE
+from .flash import ERASE_BLOCK
+from .fwdiff import block_ranges, changed_blocks
+from .layer import LAYER_DIR, Layer
+
+# Edited the most go last (lowest priority is written last); everything else is 1
+VOLATILE = (
+    ('build.prop', -1),
+    ('res/lang', -2),
+    ('etc/hawkview', -3),
+    ('res/cfg', -4),
+)
+# 2019-10-24, the reference firmware; SOURCE_DATE_EPOCH overrides it
+DEFAULT_TIME = 1571875200
+
+
+def build_time():
+    """The fixed time stamped on the filesystem and every inode"""
+    return int(os.environ.get('SOURCE_DATE_EPOCH') or DEFAULT_TIME)
+
+
+def _volatile(rel):
+    return any(rel == path or rel.startswith(path + '/') for path, _priority in VOLATILE)
+
+
+def sort_entries(workdir):
+    """[(path, priority)] for mksquashfs -sort: boot order first, volatile paths last
+
+    Directories pass their priority on to everything in them that isn't listed
+    itself, and that includes the layer's pseudo files, which mksquashfs can't
+    match by path: an edited res/cfg file still lands with the rest of res/cfg.
+    """
+    base = Layer(workdir).base
+    entries = []
+    boot = os.path.join(workdir, SORT_FILE)
+    if os.path.exists(boot):
+        with open(boot, 'r') as f:
+            for line in f:
+                if line.strip():
+                    rel, priority = line.rstrip('\n').rsplit(None, 1)
+                    if not _volatile(rel):
+                        entries.append((rel, int(priority)))
+    listed = {rel for rel, _priority in entries}
+    for name in sorted(os.listdir(base)):
+        if name not in listed and not _volatile(name):
+            entries.append((name, 1))
+    for rel, priority in VOLATILE:
+        if os.path.lexists(os.path.join(base, rel)):
+            entries.append((rel, priority))
+    return entries
+
+
+def pack_options(workdir, log=print):
+    """mksquashfs options for a deterministic, delta-friendly build (sort file written to the layer dir)"""
+    root = os.path.join(workdir, LAYER_DIR)
+    os.makedirs(root, exist_ok=True)
+    entries = sort_entries(workdir)
+    with open(os.path.join(root, 'pack.sort'), 'w') as f:
+        f.write(''.join(f"{rel} {priority}\n" for rel, priority in entries))
+    stamp = str(build_time())
+    log(f"Deterministic layout: fixed time {stamp}, {sum(1 for _r, p in entries if p < 0)} volatile paths last")
+    return ['-sort', f"{LAYER_DIR}/pack.sort", '-mkfs-time', stamp, '-all-time', stamp,
+            '-always-use-fragments', '-reproducible']
+
+
+def reference_image(workdir, output=None, against=None):
+    """Image to count changed blocks against: against, else the newest other system_v*.bin, else mtdblock2"""
+    if against:
+        return against
+    output = os.path.realpath(output) if output else None
+    images = sorted(glob.glob(os.path.join(workdir, 'system_v*.bin')), key=os.path.getmtime, reverse=True)
+    for path in images + [os.path.join(workdir, 'mtdblock2')]:
+        if os.path.realpath(path) != output and os.path.isfile(path) and os.path.getsize(path):
+            return path
+    return None
+
+
+def compare(image, reference, block_size=ERASE_BLOCK):
+    """Erase blocks of image that differ from reference, the way `cli update` would write them
+
+    Only the blocks the new image covers count (an update leaves the rest of the
+    partition alone), so a padded mtdblock2 works as the reference too.
+    """
+    size = os.path.getsize(image)
+    if not size or not os.path.getsize(reference):
+        raise ValueError("can't compare an empty image")
+    with open(image, 'rb') as fa, open(reference, 'rb') as fb, \
+            mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ) as new, \
+            mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as old:
+        total = -(-size // block_size)
+        new_view, old_view = memoryview(new), memoryview(old)
+        try:
+            # the partial last block is compared as far as the image goes, like the update pads it
+            blocks = changed_blocks(old_view[:size], new_view, block_size)
+        finally:
+            new_view.release()
+            old_view.release()
+    return {'image': image, 'reference': reference, 'total_blocks': total,
+            'changed_blocks': len(blocks), 'ranges': block_ranges(blocks)}
+
+
+def format_compare(result):
+    changed, total = result['changed_blocks'], result['total_blocks']
+    line = (f"{changed} of {total} erase blocks differ from {os.path.basename(result['reference'])} "
+            f"({changed * ERASE_BLOCK // 1024} KB for `cli update` to write)")
+    if result['ranges'] and len(result['ranges']) <= 8:
+        line += ": " + ', '.join(f"{a}" if a == b else f"{a}-{b}" for a, b in result['ranges'])
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deterministic, delta-friendly system image builds")
+    parser.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('compare', help="count the erase blocks an image changes against a reference")
+    p.add_argument('image')
+    p.add_argument('reference', nargs='?', help="default: newest other system_v*.bin, else mtdblock2")
+    p = sub.add_parser('options', help="write the sort file and print the mksquashfs options (build.sh uses this)")
+    p.add_argument('--show', action='store_true', help="print the sort file too")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'compare':
+            reference = reference_image(args.workdir, args.image, args.reference)
+            if not reference:
+                raise ValueError("no reference image (give one, or build twice)")
+            print(format_compare(compare(args.image, reference)))
+        else:
+            options = pack_options(args.workdir, log=lambda line: print(line, file=sys.stderr))
+            print(' '.join(options))
+            if args.show:
+                with open(os.path.join(args.workdir, LAYER_DIR, 'pack.sort'), 'r') as f:
+                    sys.stdout.write(f.read())
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Minimal ELF reader
+Enough of the section and symbol tables to say where a file offset lives
+(section, virtual address, nearest symbol) in the camera's ARM binaries
+"""
+
+import bisect
+import struct
+
+ELF_MAGIC = b'\x7fELF'
+
+SHT_SYMTAB = 2
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+
+
+class Section:
+    """One section header"""
+    def __init__(self, name, sh_type, addr, offset, size, link=0, entsize=0):
+        self.name = name
+        self.type = sh_type
+        self.addr = addr
+        self.offset = offset
+        self.size = size
+        self.link = link
+        self.entsize = entsize
+
+    def __repr__(self):
+        return f"Section({self.name!r}, addr=0x{self.addr:x}, offset=0x{self.offset:x}, size={self.size})"
+
+
+class ELFFile:
+    """Parsed section and symbol tables of an ELF image held in a buffer (bytes or mmap)"""
+    def __init__(self, buf):
+        if buf[:4] != ELF_MAGIC:
+            raise ValueError("not an ELF file")
+        self.is64 = buf[4] == 2
+        self.endian = '<' if buf[5] == 1 else '>'
+        self.buf = buf
+        self.sections = []
+        self._symbols = []
+        self._symbol_addrs = []
+        self._sections_by_offset = []
+        self._section_offsets = []
+        self._parse_sections()
+        self._parse_symbols()
+
+    def _unpack(self, fmt, offset):
+        fmt = self.endian + fmt
+        return struct.unpack_from(fmt, self.buf, offset)
+
+    def _cstring(self, offset):
+        end = self.buf.find(b'\x00', offset)
+        if end == -1:
+            end = len(self.buf)
+        return bytes(self.buf[offset:end]).decode('latin-1')
+
+    def _parse_sections(self):
+        if self.is64:
+            shoff, = self._unpack('Q', 0x28)
+            shentsize, shnum, shstrndx = self._unpack('HHH', 0x3a)
+            fmt = 'IIQQQQIIQQ'
+        else:
+            shoff, = self._unpack('I', 0x20)
+            shentsize, shnum, shstrndx = self._unpack('HHH', 0x2e)
+            fmt = 'IIIIIIIIII'
+        if shoff == 0 or shoff + shnum * shentsize > len(self.buf):
+            return
+
+        raw = []
+        for i in range(shnum):
+            name, sh_type, _flags, addr, offset, size, link, _info, _align, entsize = \
+                self._unpack(fmt, shoff + i * shentsize)
+            raw.append((name, sh_type, addr, offset, size, link, entsize))
+
+        strtab_off = raw[shstrndx][3] if shstrndx < len(raw) else None
+        for name, sh_type, addr, offset, size, link, entsize in raw:
+            label = self._cstring(strtab_off + name) if strtab_off is not None else ''
+            self.sections.append(Section(label, sh_type, addr, offset, size, link, entsize))
+
+        self._sections_by_offset = sorted(
+            (s for s in self.sections if s.size and s.type != SHT_NOBITS and s.type != 0),
+            key=lambda s: s.offset)
+        self._section_offsets = [s.offset for s in self._sections_by_offset]
+
+    def _parse_symbols(self):
+        # Prefer the full symbol table, fall back to the dynamic one (most of the firmware is stripped)
+        tables = [s for s in self.sections if s.type == SHT_SYMTAB] or \
+                 [s for s in self.sections if s.type == SHT_DYNSYM]
+        symbols = {}
+        for table in tables:
+            if table.link >= len(self.sections):
+                continue
+            strtab = self.sections[table.link]
+            entsize = table.entsize or (24 if self.is64 else 16)
+            for off in range(table.offset, table.offset + table.size, entsize):
+                if self.is64:
+                    name, info, _other, shndx, value, size = self._unpack('IBBHQQ', off)
+                else:
+                    name, value, size, info, _other, shndx = self._unpack('IIIBBH', off)
+                if shndx == 0 or value == 0 or (info & 0xf) not in (1, 2):
+                    continue  # undefined, or not an object/function
+                # Thumb function addresses have the low bit set
+                value &= ~1
+                symbols.setdefault(value, (value, size, self._cstring(strtab.offset + name)))
+        self._symbols = sorted(symbols.values())
+        self._symbol_addrs = [s[0] for s in self._symbols]
+
+    def section_for_offset(self, offset):
+        """Return the section containing a file offset, or None"""
+        i = bisect.bisect_right(self._section_offsets, offset) - 1
+        if i < 0:
+            return None
+        section = self._sections_by_offset[i]
+        if offset < section.offset + section.size:
+            return section
+        return None
+
+    def symbol_for_addr(self, addr):
+        """Return (name, delta) for the symbol covering a virtual address, or None"""
+        i = bisect.bisect_right(self._symbol_addrs, addr) - 1
+        if i < 0:
+            return None
+        value, size, name = self._symbols[i]
+        if size and addr >= value + size:
+            return None
+        return name, addr - value
+
+    def context(self, offset):
+        """Describe a file offset as a dict with section, vaddr and symbol when known"""
+        info = {}
+        section = self.section_for_offset(offset)
+        if section is None:
+            return info
+        info['section'] = section.name
+        if section.addr:
+            vaddr = section.addr + (offset - section.offset)
+            info['vaddr'] = vaddr
+            symbol = self.symbol_for_addr(vaddr)
+            if symbol:
+                info['symbol'] = symbol[0]
+                info['symbol_offset'] = symbol[1]
+        return info
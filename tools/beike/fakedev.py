@@ -0,0 +1,908 @@
+#!/usr/bin/env python3
+"""
+File-backed stand-ins for sunxi-fel and adb
+Emulates the subcommands the tools use against a fake camera: an 8 MB SPI NOR
+with erase-block semantics (stored as flash.bin) plus a tiny /data filesystem.
+sunxi-fel uboot/write also fake a RAM boot: the loaded script, zImage and initrd are
+checked like U-Boot and the kernel would, and adb then sees the RAM rootfs.
+Transfers are slowed down to a configurable SPI/USB rate so timings mean something.
+
+    python3 -m beike.fakedev init --flash full_restore.bin
+    python3 -m beike.fakedev install sunxi-tools    # writes sunxi-tools/sunxi-fel and sunxi-tools/adb
+    PATH=$PWD/sunxi-tools:$PATH ./flash.sh system_v1.0.bin
+
+State lives in $BEIKE_FAKE_DEVICE (default: ~/.cache/beike-tools/fakedev).
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shlex
+import shutil
+import sys
+import time
+import zlib
+
+from . import cache_dir, cpio
+from .flash import DEFAULT_LAYOUT, ERASE_BLOCK, FLASH_SIZE
+from .logcat import PRIORITIES, Entry, encode_entry
+from .ramboot import SPL_MAGIC, ZIMAGE_MAGIC, parse_script
+
+DEFAULT_CONFIG = {
+    'fel_rate': 200 * 1024,          # sunxi-fel spiflash-write/read, bytes per second
+    'adb_rate': 8 * 1024 * 1024,     # adb push/pull over USB 2.0
+    'mtd_read_rate': 4 * 1024 * 1024,
+    'mtd_write_rate': 150 * 1024,    # erase + program through the kernel MTD driver
+    'gzip_rate': 6 * 1024 * 1024,    # /system/bin/gzip -1 on the camera's CPU
+    'fel_dram_rate': 1024 * 1024,    # sunxi-fel write/uboot into DRAM over USB
+    'logcat_rate': 200,              # log lines per second while sdv is recording
+    'cpu_load': 0.6,                 # how busy sdv + mediaserver keep the CPU in /proc/stat
+    'gzip': True,                    # set false to emulate firmware without bin/gzip
+    'erase_block': ERASE_BLOCK,
+    'serial': 'FAKE0123456789',
+}
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def state_dir():
+    path = os.environ.get('BEIKE_FAKE_DEVICE') or cache_dir('fakedev')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_config(state=None):
+    state = state or state_dir()
+    config = dict(DEFAULT_CONFIG)
+    path = os.path.join(state, 'config.json')
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            config.update(json.load(f))
+    return config
+
+
+def _throttle(nbytes, rate, started):
+    """Sleep so that nbytes took at least nbytes/rate seconds since started"""
+    if rate and rate > 0:
+        remaining = nbytes / rate - (time.monotonic() - started)
+        if remaining > 0:
+            time.sleep(remaining)
+
+
+def _log(state, line):
+    with open(os.path.join(state, 'commands.log'), 'a') as f:
+        f.write(f"{time.time():.3f} {line}\n")
+
+
+class FakeFlash:
+    """SPI NOR backed by a file: writes erase the covering blocks, programming can only clear bits"""
+    def __init__(self, path, erase_block=ERASE_BLOCK, size=FLASH_SIZE):
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                f.write(b'\xff' * size)
+        self.path = path
+        self.erase_block = erase_block
+        self._f = open(path, 'r+b')
+        self.mm = mmap.mmap(self._f.fileno(), 0)
+        self.size = len(self.mm)
+        self.erase_count = 0
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self._f.close()
+
+    def _check(self, offset, length):
+        if offset < 0 or offset + length > self.size:
+            raise ValueError(f"range 0x{offset:x}+{length} is outside the {self.size} byte flash")
+
+    def read(self, offset, length):
+        self._check(offset, length)
+        return self.mm[offset:offset + length]
+
+    def erase(self, offset, length):
+        """Erase every block touched by the range; returns the erased (start, end)"""
+        self._check(offset, length)
+        start = offset - offset % self.erase_block
+        end = -(-(offset + length) // self.erase_block) * self.erase_block
+        self.mm[start:end] = b'\xff' * (end - start)
+        self.erase_count += (end - start) // self.erase_block
+        return start, end
+
+    def program(self, offset, data):
+        """NOR programming: bits can only go from 1 to 0"""
+        self._check(offset, len(data))
+        current = self.mm[offset:offset + len(data)]
+        if current == b'\xff' * len(data):
+            self.mm[offset:offset + len(data)] = data
+        else:
+            self.mm[offset:offset + len(data)] = bytes(a & b for a, b in zip(current, data))
+
+    def write(self, offset, data):
+        """What spiflash-write does: erase the covering blocks, then program"""
+        start, end = self.erase(offset, len(data))
+        self.program(offset, data)
+        return start, end
+
+    def update(self, offset, data):
+        """What the mtdblock driver does: read the covering blocks, merge, erase, program them back"""
+        self._check(offset, len(data))
+        start = offset - offset % self.erase_block
+        end = -(-(offset + len(data)) // self.erase_block) * self.erase_block
+        merged = bytearray(self.mm[start:end])
+        merged[offset - start:offset - start + len(data)] = data
+        self.erase(start, end - start)
+        self.program(start, bytes(merged))
+        return start, end
+
+
+# ---------------------------------------------------------------------------
+# sunxi-fel
+# ---------------------------------------------------------------------------
+
+FEL_USAGE = """sunxi-fel (beike fake) commands (can be chained):
+  spiflash-info
+  spiflash-read addr length file
+  spiflash-write addr file
+  write addr file
+  uboot file-with-spl       runs U-Boot after the other commands
+  wdreset
+  version"""
+
+
+def _dram_read(dram, addr, length):
+    """Bytes at addr from what was written this session, or None if not all loaded"""
+    for start, data in dram.items():
+        if start <= addr and addr + length <= start + len(data):
+            return data[addr - start:addr - start + length]
+    return None
+
+
+def _unpack_initramfs(data):
+    """Entries from concatenated gzipped cpio archives, like the kernel's unpack_to_rootfs"""
+    entries = []
+    while data:
+        data = data.lstrip(b'\x00')
+        if not data:
+            break
+        if data[:2] != b'\x1f\x8b':
+            raise ValueError("initramfs: junk in compressed archive")
+        stream = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        entries += cpio.read_cpio(stream.decompress(data))
+        data = stream.unused_data
+    return entries
+
+
+def _fake_uboot(state, uboot, dram):
+    """What mainline U-Boot does after a FEL boot: source the script, bootz, and the kernel
+    brings up the rootfs. The booted rootfs is extracted to state/ramfs for the fake adb."""
+    with open(uboot, 'rb') as f:
+        if f.read(12)[4:12] != SPL_MAGIC:
+            raise ValueError("uboot: no SPL header (eGON.BT0)")
+    scripts = [parse_script(data) for data in dram.values()]
+    scripts = [s for s in scripts if s]
+    if not scripts:
+        raise ValueError("U-Boot: no boot script loaded, stopping at the prompt")
+    env = {}
+    kernel = None
+    for line in scripts[0].splitlines():
+        words = shlex.split(line)
+        if words[:1] == ['setenv'] and len(words) >= 2:
+            env[words[1]] = ' '.join(words[2:])
+        elif words[:1] == ['bootz']:
+            kernel = _dram_read(dram, int(words[1], 16), 0x30)
+    if not kernel or int.from_bytes(kernel[0x24:0x28], 'little') != ZIMAGE_MAGIC:
+        raise ValueError("bootz: bad Linux ARM zImage magic")
+    m = re.search(r'\binitrd=(0x[0-9a-f]+),(0x[0-9a-f]+)', env.get('bootargs', ''))
+    if not m:
+        raise ValueError("kernel: no initrd= on the cmdline, would mount root from flash")
+    initrd = _dram_read(dram, int(m.group(1), 16), int(m.group(2), 16))
+    if initrd is None:
+        raise ValueError("kernel: initrd= points at memory that wasn't loaded")
+    entries = _unpack_initramfs(initrd)
+
+    ramfs = os.path.join(state, 'ramfs')
+    shutil.rmtree(ramfs, ignore_errors=True)
+    for entry in entries:
+        target = os.path.join(ramfs, entry.name)
+        if entry.is_dir:
+            os.makedirs(target, exist_ok=True)
+        elif entry.is_file:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(entry.data)
+    names = {e.name for e in entries}
+    if 'init' not in names or 'system/build.prop' not in names:
+        raise ValueError("kernel: rootfs has no /init or /system, init would fail")
+    with open(os.path.join(ramfs, 'init.rc'), 'r', errors='replace') as f:
+        if re.search(r'^\s*mount\s.*mtdblock2', f.read(), re.MULTILINE):
+            raise ValueError("init: init.rc still mounts mtdblock2 over the RAM /system")
+    os.makedirs(os.path.join(ramfs, 'proc'), exist_ok=True)
+    os.makedirs(os.path.join(ramfs, 'data'), exist_ok=True)
+    with open(os.path.join(ramfs, 'proc', 'cmdline'), 'w') as f:
+        f.write(env['bootargs'] + '\n')
+    with open(os.path.join(state, 'ramboot.json'), 'w') as f:
+        json.dump({'bootargs': env['bootargs'], 'files': len(entries)}, f)
+
+
+def power_cycle(state):
+    """Back to booting from flash: whatever was RAM booted is gone"""
+    with open(os.path.join(state, 'booted'), 'w') as f:
+        f.write(f"{time.time():.3f}\n")
+    shutil.rmtree(os.path.join(state, 'ramfs'), ignore_errors=True)
+    for name in ('ramboot.json', 'binds.json'):
+        if os.path.exists(os.path.join(state, name)):
+            os.remove(os.path.join(state, name))
+
+
+def fel_main(argv):
+    state = state_dir()
+    config = load_config(state)
+    args = [a for a in argv if a not in ('-p', '--progress', '-v', '--verbose')]
+    progress = '-p' in argv or '--progress' in argv
+    _log(state, 'sunxi-fel ' + ' '.join(shlex.quote(a) for a in argv))
+    if not args:
+        print(FEL_USAGE)
+        return 1
+
+    flash = FakeFlash(os.path.join(state, 'flash.bin'), config['erase_block'])
+    dram = {}
+    uboot = None
+    try:
+        while args:
+            command = args.pop(0)
+            if command == 'version':
+                print("AW_FEL_VERSION 0x1681 (V3s, fake) SCRATCHPAD 0x00007e00")
+            elif command == 'spiflash-info':
+                print(f"Manufacturer: Fake (EFh), model: 40h, size: {flash.size} bytes.")
+            elif command == 'spiflash-read':
+                offset, length, out = int(args.pop(0), 0), int(args.pop(0), 0), args.pop(0)
+                started = time.monotonic()
+                with open(out, 'wb') as f:
+                    f.write(flash.read(offset, length))
+                _throttle(length, config['fel_rate'], started)
+                if progress:
+                    print(f"100% [{length} bytes]", file=sys.stderr)
+            elif command == 'spiflash-write':
+                offset, path = int(args.pop(0), 0), args.pop(0)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                started = time.monotonic()
+                if offset % config['erase_block']:
+                    print(f"Warning: offset 0x{offset:x} is not erase block aligned, "
+                          f"surrounding data in the block will be erased", file=sys.stderr)
+                flash.write(offset, data)
+                _throttle(len(data), config['fel_rate'], started)
+                if progress:
+                    print(f"100% [{len(data)} bytes]", file=sys.stderr)
+            elif command == 'write':
+                addr, path = int(args.pop(0), 0), args.pop(0)
+                with open(path, 'rb') as f:
+                    data = f.read()
+                started = time.monotonic()
+                dram[addr] = data
+                _throttle(len(data), config['fel_dram_rate'], started)
+                if progress:
+                    print(f"100% [{len(data)} bytes]", file=sys.stderr)
+            elif command == 'uboot':
+                uboot = args.pop(0)
+                started = time.monotonic()
+                _throttle(os.path.getsize(uboot), config['fel_dram_rate'], started)
+            elif command == 'wdreset':
+                with open(os.path.join(state, 'resets'), 'a') as f:
+                    f.write(f"{time.time():.3f}\n")
+                power_cycle(state)
+            else:
+                print(f"Invalid command {command}", file=sys.stderr)
+                return 1
+        if uboot:
+            power_cycle(state)
+            _fake_uboot(state, uboot, dram)
+    except (IndexError, ValueError, OSError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    finally:
+        flash.close()
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# adb
+# ---------------------------------------------------------------------------
+
+MTDBLOCK_RE = re.compile(r'^/dev/block/mtdblock(\d+)$')
+
+
+class FakeDevice:
+    """Maps device paths onto the fake flash (mtdblocks) and a host directory (everything else)"""
+    def __init__(self, state, config):
+        self.state = state
+        self.config = config
+        self.root = os.path.join(state, 'fs')
+        if os.path.exists(os.path.join(state, 'ramboot.json')):
+            # booted from RAM over FEL: rootfs (with /system and a tmpfs /data) is the initramfs
+            self.root = os.path.join(state, 'ramfs')
+        os.makedirs(os.path.join(self.root, 'data'), exist_ok=True)
+        self.flash = FakeFlash(os.path.join(state, 'flash.bin'), config['erase_block'])
+        self.binds = {}
+        if os.path.exists(os.path.join(state, 'binds.json')):
+            with open(os.path.join(state, 'binds.json'), 'r') as f:
+                self.binds = json.load(f)
+
+    def close(self):
+        self.flash.close()
+
+    def save_binds(self):
+        with open(os.path.join(self.state, 'binds.json'), 'w') as f:
+            json.dump(self.binds, f, indent=1)
+
+    def resolve(self, path):
+        """Follow bind mounts (longest mount point first)"""
+        path = os.path.normpath(path)
+        for target in sorted(self.binds, key=len, reverse=True):
+            if path == target or path.startswith(target + '/'):
+                return self.binds[target] + path[len(target):]
+        return path
+
+    def uptime(self):
+        try:
+            with open(os.path.join(self.state, 'booted'), 'r') as f:
+                booted = float(f.read())
+        except (OSError, ValueError):
+            booted = os.path.getmtime(self.state)
+        return max(time.time() - booted, 0.01)
+
+    def proc(self, path):
+        """/proc and thermal files that change over time, or None for anything else
+
+        Counters are smooth functions of uptime (so deltas between samples make sense),
+        scaled by the cpu_load setting to fake a heavier or lighter ROM.
+        """
+        up = self.uptime()
+        load = self.config.get('cpu_load', 0.6)
+        jiffies = up * 100
+        if path == '/proc/uptime':
+            return f"{up:.2f} {up * (1 - load):.2f}\n".encode()
+        if path == '/proc/stat':
+            user = int(jiffies * load * 0.7 + 30 * math.sin(up / 20))
+            system = int(jiffies * load * 0.25)
+            irq, softirq = int(jiffies * load * 0.02), int(jiffies * load * 0.03)
+            iowait = int(jiffies * 0.02)
+            idle = int(jiffies) - user - system - irq - softirq - iowait
+            cpu = f"{user} 0 {system} {idle} {iowait} {irq} {softirq} 0 0 0"
+            return (f"cpu  {cpu}\ncpu0 {cpu}\nintr {int(up * 900 * load)}\nctxt {int(up * 1500 * load)}\n"
+                    f"btime {int(time.time() - up)}\nprocesses {int(up / 10) + 80}\n"
+                    f"procs_running {1 + int(2 * load * (1 + math.sin(up)))}\nprocs_blocked 0\n").encode()
+        if path == '/proc/meminfo':
+            free = int(30000 - load * 20000 + 2000 * math.sin(up / 30))
+            return (f"MemTotal:         121236 kB\nMemFree:        {free:8} kB\nBuffers:            1204 kB\n"
+                    f"Cached:           25112 kB\nSwapCached:            0 kB\n").encode()
+        m = re.match(r'^/proc/(\d+)/stat$', path)
+        if m and int(m.group(1)) in FAKE_PROCESSES:
+            pid = int(m.group(1))
+            name, cpu_share, rss = FAKE_PROCESSES[pid]
+            utime = int(jiffies * load * cpu_share * 0.8 + 10 * math.sin(up / 15) + 10)
+            stime = int(jiffies * load * cpu_share * 0.2)
+            cutime = int(jiffies * 0.002) if pid == FAKE_SHELL_PID else 0
+            rss = int(rss * (1 + 0.05 * math.sin(up / 40)))
+            return (f"{pid} ({name}) S 1 {pid} 0 0 -1 4194560 {int(up * 20)} 0 {int(up / 30)} 0 {utime} {stime} "
+                    f"{cutime} 0 20 0 {12 if cpu_share else 1} 0 {int(up / 10)} {rss * 4096 * 3} {rss}\n").encode()
+        m = re.match(r'^/sys/class/thermal/thermal_zone0/(temp|type)$', path)
+        if m:
+            if m.group(1) == 'type':
+                return b"sunxi-ths\n"
+            return f"{int(40000 + 25000 * load + 3000 * math.sin(up / 90))}\n".encode()
+        return None
+
+    def mounts(self):
+        """/proc/mounts: the stock mounts plus any binds (which show the /data device)"""
+        lines = ["rootfs / rootfs ro,relatime 0 0",
+                 "/dev/block/mtdblock2 /system squashfs ro,relatime 0 0",
+                 "/dev/block/mtdblock3 /data jffs2 rw,nosuid,nodev,relatime 0 0"]
+        lines += [f"/dev/block/mtdblock3 {target} jffs2 rw,nosuid,nodev,relatime 0 0" for target in self.binds]
+        return ('\n'.join(lines) + '\n').encode()
+
+    def partition(self, path):
+        m = MTDBLOCK_RE.match(path)
+        if m and int(m.group(1)) < len(DEFAULT_LAYOUT):
+            return DEFAULT_LAYOUT[int(m.group(1))]
+        return None
+
+    def host_path(self, path):
+        if not path.startswith('/'):
+            path = '/data/' + path
+        return os.path.join(self.root, self.resolve(path).lstrip('/'))
+
+    def read(self, path, skip=0, length=None):
+        if path == '/dev/null':
+            return b''
+        if path == '/proc/mounts':
+            return self.mounts()
+        generated = self.proc(path)
+        if generated is not None:
+            return generated
+        part = self.partition(path)
+        if part:
+            skip = min(skip, part.size)
+            length = part.size - skip if length is None else min(length, part.size - skip)
+            started = time.monotonic()
+            data = self.flash.read(part.offset + skip, length)
+            _throttle(len(data), self.config['mtd_read_rate'], started)
+            return data
+        with open(self.host_path(path), 'rb') as f:
+            f.seek(skip)
+            return f.read() if length is None else f.read(length)
+
+    def write(self, path, data, seek=0, append=False):
+        part = self.partition(path)
+        if part:
+            # like the real block device: write what fits, then ENOSPC
+            fits = data[:max(0, part.size - seek)]
+            started = time.monotonic()
+            if fits:
+                # mtdblock does read-modify-write, a partial block keeps the rest of its data
+                self.flash.update(part.offset + seek, fits)
+            _throttle(len(fits), self.config['mtd_write_rate'], started)
+            if len(fits) < len(data):
+                raise OSError(28, f"{path}: No space left on device")
+            return
+        if (self.resolve(path) + '/').startswith('/system/'):
+            raise OSError(30, f"{path}: Read-only file system")
+        target = self.host_path(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        mode = 'ab' if append else ('r+b' if seek and os.path.exists(target) else 'wb')
+        with open(target, mode) as f:
+            if mode == 'r+b':
+                f.seek(seek)
+            f.write(data)
+
+    def exists(self, path):
+        return bool(self.partition(path)) or os.path.exists(self.host_path(path))
+
+
+def _dd(device, args, stdin, stdout):
+    opts = dict(a.split('=', 1) for a in args if '=' in a)
+    bs = int(opts.get('bs', 512))
+    skip = int(opts.get('skip', 0)) * bs
+    length = int(opts['count']) * bs if 'count' in opts else None
+    if 'if' in opts:
+        # seek like the real block device instead of reading the whole partition
+        data = device.read(opts['if'], skip, length)
+    else:
+        data = stdin.read()[skip:]
+        if length is not None:
+            data = data[:length]
+    if 'of' in opts:
+        device.write(opts['of'], data, seek=int(opts.get('seek', 0)) * bs)
+    else:
+        stdout.write(data)
+    records = -(-len(data) // bs)
+    sys.stderr.write(f"{records}+0 records in\n{records}+0 records out\n{len(data)} bytes transferred\n")
+    return 0
+
+
+def _gzip(device, args, stdin, stdout):
+    """zlib's minigzip as shipped in /system/bin: stdin to stdout, -d, -1..-9"""
+    data = stdin.read()
+    started = time.monotonic()
+    if '-d' in args:
+        stdout.write(gzip.decompress(data))
+    else:
+        levels = [int(a[1:]) for a in args if re.match(r'^-[1-9]$', a)]
+        stdout.write(gzip.compress(data, levels[-1] if levels else 6))
+    _throttle(len(data), device.config['gzip_rate'], started)
+    return 0
+
+
+# pid -> (name, share of the busy CPU, rss pages) for /proc/<pid>/stat and ps
+FAKE_SHELL_PID = 400
+FAKE_PROCESSES = {
+    1: ('init', 0.0, 120),
+    98: ('mediaserver', 0.55, 5200),
+    120: ('sdv', 0.25, 2100),
+    160: ('adbd', 0.0, 150),
+    FAKE_SHELL_PID: ('sh', 0.0, 90),
+}
+
+# (pid, tid, priority, tag, message) for logcat: what boot leaves in the buffer, then
+# what sdv and mediaserver keep saying while recording ({n} counts up)
+FAKE_BOOT_LOG = (
+    (1, 1, 'I', 'init', "starting 'media'"),
+    (98, 98, 'I', 'mediaserver', "ServiceManager: 0x2a0"),
+    (98, 104, 'I', 'CameraHardware', "open camera 0: imx175"),
+    (98, 104, 'W', 'CameraHardware', "sensor_list_cfg.ini: no entry for imx179, using defaults"),
+    (1, 1, 'I', 'init', "starting 'sdv'"),
+    (120, 120, 'I', 'sdv', "sdv start, menu.cfg loaded"),
+    (120, 131, 'D', 'sdv', "wifi off"),
+    (120, 120, 'I', 'sdv', "record start 1080P30"),
+)
+FAKE_CHATTER = (
+    (120, 133, 'D', 'sdv', "record: frame {n}"),
+    (98, 140, 'V', 'VideoEncoder', "enc frame {n} size 41{n3:03d}"),
+    (98, 104, 'D', 'CameraHardware', "isp: exp 33ms gain 1{n3:03d}"),
+    (120, 133, 'D', 'sdv', "record: frame {n}"),
+    (98, 140, 'V', 'VideoEncoder', "enc frame {n} size 39{n3:03d}"),
+    (98, 141, 'I', 'MuxerWriter', "chunk {n} written"),
+)
+
+
+def _logcat(device, args, stdout):
+    """logcat [-B] [-d]: the boot log, then (without -d) recording chatter at logcat_rate"""
+    binary = '-B' in args
+
+    def emit(entries):
+        if binary:
+            stdout.write(b''.join(encode_entry(e) for e in entries))
+        else:
+            stdout.write(''.join(e.line() + '\n' for e in entries).encode())
+        if hasattr(stdout, 'flush'):
+            stdout.flush()
+
+    now = time.time()
+    emit([Entry(now - 30 + i * 0.5, pid, tid, PRIORITIES[prio], tag, message)
+          for i, (pid, tid, prio, tag, message) in enumerate(FAKE_BOOT_LOG)])
+    if '-d' in args:
+        return 0
+    rate = device.config.get('logcat_rate', 200)
+    n = 0
+    try:
+        while True:
+            started = time.monotonic()
+            batch = max(1, int(rate / 20))
+            entries = []
+            for _ in range(batch):
+                pid, tid, prio, tag, message = FAKE_CHATTER[n % len(FAKE_CHATTER)]
+                entries.append(Entry(time.time(), pid, tid, PRIORITIES[prio], tag,
+                                     message.format(n=n // len(FAKE_CHATTER), n3=n % 1000)))
+                n += 1
+            emit(entries)
+            time.sleep(max(0.0, batch / rate - (time.monotonic() - started)) if rate else 0.05)
+    except (BrokenPipeError, KeyboardInterrupt):
+        return 0
+
+
+class _DeviceInput:
+    """stdin redirected from a device path (`cmd < /dev/block/mtdblock3`)"""
+    def __init__(self, device, path):
+        self.device = device
+        self.path = path
+
+    def read(self):
+        return self.device.read(self.path)
+
+
+def run_shell(device, command, stdin, stdout):
+    """Tiny sh: commands joined with && or ;, plus < redirects (enough for what the tools send)"""
+    status = 0
+    for chain in command.split(';'):
+        for part in chain.split('&&'):
+            words = shlex.split(part)
+            if not words:
+                continue
+            if words[0] == 'toolbox':
+                words = words[1:]
+            source = stdin
+            if '<' in words[:-1]:
+                at = words.index('<')
+                source = _DeviceInput(device, words[at + 1])
+                words = words[:at] + words[at + 2:]
+            words = [w.replace('$$', str(FAKE_SHELL_PID)) for w in words]
+            name, args = words[0], words[1:]
+            try:
+                if name == 'gzip' and device.config.get('gzip', True):
+                    status = _gzip(device, args, source, stdout)
+                elif name == 'dd':
+                    status = _dd(device, args, source, stdout)
+                elif name in ('sync', 'true'):
+                    status = 0
+                elif name == 'cat':
+                    # like toolbox cat: complain about a missing file and go on with the rest
+                    status = 0
+                    for path in args:
+                        try:
+                            stdout.write(device.read(path))
+                        except OSError:
+                            sys.stderr.write(f"cat: {path}: No such file or directory\n")
+                            status = 1
+                elif name == 'rm':
+                    for path in [a for a in args if not a.startswith('-')]:
+                        if (device.resolve(path) + '/').startswith('/system/'):
+                            raise OSError(30, "Read-only file system")
+                        target = device.host_path(path)
+                        if os.path.isdir(target):
+                            shutil.rmtree(target)
+                        elif os.path.exists(target):
+                            os.remove(target)
+                    status = 0
+                elif name == 'ls':
+                    for path in [a for a in args if not a.startswith('-')] or ['/data']:
+                        if path.rstrip('/') == '/sys/class/thermal':
+                            stdout.write(b"thermal_zone0\n")
+                            continue
+                        target = device.host_path(path)
+                        if not os.path.exists(target):
+                            stdout.write(f"{path}: No such file or directory\n".encode())
+                            continue
+                        names = sorted(os.listdir(target)) if os.path.isdir(target) else [path]
+                        stdout.write(('\n'.join(names) + '\n').encode())
+                    status = 0
+                elif name == 'md5':
+                    for path in args:
+                        try:
+                            digest = hashlib.md5(device.read(path)).hexdigest()
+                            stdout.write(f"{digest}  {path}\n".encode())
+                        except OSError:
+                            stdout.write(f"could not open {path}, No such file or directory\n".encode())
+                    status = 0
+                elif name == 'mkdir':
+                    for path in [a for a in args if not a.startswith('-')]:
+                        os.makedirs(device.host_path(path), exist_ok=True)
+                    status = 0
+                elif name == 'mount':
+                    # toolbox mount -o bind src dst, the only kind the tools use
+                    if args[:2] != ['-o', 'bind'] or len(args) != 4:
+                        raise ValueError("only mount -o bind is emulated")
+                    source, target = os.path.normpath(args[2]), os.path.normpath(args[3])
+                    if not os.path.exists(device.host_path(source)) or not os.path.exists(device.host_path(target)):
+                        raise OSError(2, "No such file or directory")
+                    if os.path.isdir(device.host_path(source)) != os.path.isdir(device.host_path(target)):
+                        raise OSError(20, "Not a directory")
+                    device.binds[target] = device.resolve(source)
+                    device.save_binds()
+                    status = 0
+                elif name == 'umount':
+                    target = os.path.normpath(args[0])
+                    if target not in device.binds:
+                        raise OSError(22, "Invalid argument")
+                    del device.binds[target]
+                    device.save_binds()
+                    status = 0
+                elif name in ('start', 'stop'):
+                    with open(os.path.join(device.state, 'services.log'), 'a') as f:
+                        f.write(f"{time.time():.3f} {name} {' '.join(args)}\n")
+                    status = 0
+                elif name == 'logcat':
+                    status = _logcat(device, args, stdout)
+                elif name == 'getprop':
+                    props = {}
+                    try:
+                        for line in device.read('/system/build.prop').decode(errors='replace').splitlines():
+                            if '=' in line and not line.startswith('#'):
+                                key, value = line.split('=', 1)
+                                props[key.strip()] = value.strip()
+                    except OSError:
+                        pass
+                    if args:
+                        stdout.write(f"{props.get(args[0], '')}\n".encode())
+                    else:
+                        stdout.write(''.join(f"[{k}]: [{v}]\n" for k, v in sorted(props.items())).encode())
+                    status = 0
+                elif name == 'ps':
+                    lines = ["USER     PID   PPID  VSIZE  RSS     WCHAN    PC         NAME"]
+                    for pid, (pname, _share, rss) in sorted(FAKE_PROCESSES.items()):
+                        path = {'mediaserver': '/system/bin/mediaserver', 'sdv': '/system/bin/sdv',
+                                'adbd': '/sbin/adbd', 'sh': '/system/bin/sh'}.get(pname, f'/{pname}')
+                        lines.append(f"root      {pid:<5} 1     {rss * 12:<6} {rss * 4:<7} ffffffff 00000000 S {path}")
+                    stdout.write(('\n'.join(lines) + '\n').encode())
+                    status = 0
+                elif name == 'echo':
+                    stdout.write((' '.join(args) + '\n').encode())
+                    status = 0
+                else:
+                    sys.stderr.write(f"{name}: not found\n")
+                    status = 127
+            except (OSError, KeyError, ValueError) as e:
+                sys.stderr.write(f"{name}: {e}\n")
+                status = 1
+            if status:
+                break
+    return status
+
+
+def _interactive_shell(device, stdout):
+    """adb shell with no command: a pty echoes each line after a prompt, output ends in \\r\\n"""
+    prompt = b"root@sun8i:/ # "
+    stdout.write(prompt)
+    stdout.flush()
+    for line in sys.stdin.buffer:
+        command = line.decode(errors='replace').rstrip('\r\n')
+        stdout.write(command.encode() + b"\r\n")
+        if command.strip() == 'exit':
+            break
+        out = _Capture()
+        run_shell(device, command, open(os.devnull, 'rb'), out)
+        stdout.write(b''.join(out.chunks).replace(b'\n', b'\r\n') + prompt)
+        stdout.flush()
+    return 0
+
+
+class _Capture:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+class _UsbOut:
+    """Binary stdout that pays the USB transfer time for what goes through it"""
+    def __init__(self, out, rate):
+        self.out = out
+        self.rate = rate
+
+    def write(self, data):
+        started = time.monotonic()
+        self.out.write(data)
+        _throttle(len(data), self.rate, started)
+
+    def flush(self):
+        self.out.flush()
+
+
+def adb_main(argv):
+    state = state_dir()
+    config = load_config(state)
+    _log(state, 'adb ' + ' '.join(shlex.quote(a) for a in argv))
+    args = list(argv)
+    while args and args[0] in ('-d', '-e'):
+        args.pop(0)
+    if len(args) >= 2 and args[0] == '-s':
+        args = args[2:]
+    if not args:
+        print("Android Debug Bridge (beike fake)")
+        return 1
+
+    if args[0] == 'devices':
+        print("List of devices attached")
+        print(f"{config['serial']}\tdevice\n")
+        return 0
+    if args[0] == 'wait-for-device':
+        return 0
+    if args[0] == 'get-serialno':
+        print(config['serial'])
+        return 0
+
+    device = FakeDevice(state, config)
+    stdout = sys.stdout.buffer
+    try:
+        command = args[0]
+        if command == 'push':
+            src, dst = args[1], args[2]
+            with open(src, 'rb') as f:
+                data = f.read()
+            started = time.monotonic()
+            if dst.endswith('/'):
+                dst += os.path.basename(src)
+            device.write(dst, data)
+            _throttle(len(data), config['adb_rate'], started)
+            print(f"{src}: 1 file pushed. {len(data)} bytes")
+        elif command == 'pull':
+            src = args[1]
+            dst = args[2] if len(args) > 2 else os.path.basename(src)
+            if os.path.isdir(dst):
+                dst = os.path.join(dst, os.path.basename(src))
+            data = device.read(src)
+            started = time.monotonic()
+            with open(dst, 'wb') as f:
+                f.write(data)
+            _throttle(len(data), config['adb_rate'], started)
+            print(f"{src}: 1 file pulled. {len(data)} bytes")
+        elif command == 'shell' and len(args) == 1:
+            return _interactive_shell(device, stdout)
+        elif command == 'shell':
+            # adb shell has no stdin and turns \n into \r\n on these old devices; stay binary clean
+            return run_shell(device, ' '.join(args[1:]), open(os.devnull, 'rb'), stdout)
+        elif command == 'exec-out':
+            return run_shell(device, ' '.join(args[1:]), open(os.devnull, 'rb'), _UsbOut(stdout, config['adb_rate']))
+        elif command == 'exec-in':
+            return run_shell(device, ' '.join(args[1:]), sys.stdin.buffer, stdout)
+        elif command == 'logcat':
+            return _logcat(device, args[1:], stdout)
+        elif command == 'reboot':
+            power_cycle(state)
+            return 0
+        else:
+            print(f"adb: unknown command {command}", file=sys.stderr)
+            return 1
+    except (IndexError, OSError, ValueError) as e:
+        print(f"adb: error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        stdout.flush()
+        device.close()
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Setup
+# ---------------------------------------------------------------------------
+
+WRAPPER = """#!/bin/sh
+# beike fake {tool} - see tools/beike/fakedev.py
+PYTHONPATH="{tools}${{PYTHONPATH:+:$PYTHONPATH}}" exec "{python}" -m beike.fakedev {tool} "$@"
+"""
+
+
+def install(directory):
+    """Write sunxi-fel and adb wrapper scripts into a directory"""
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for tool in ('sunxi-fel', 'adb'):
+        path = os.path.join(directory, tool)
+        with open(path, 'w') as f:
+            f.write(WRAPPER.format(tool=tool, tools=TOOLS_DIR, python=sys.executable))
+        os.chmod(path, 0o755)
+        paths.append(path)
+    return paths
+
+
+def init_device(flash_image=None, state=None, system=None, **config):
+    """Reset the fake device, optionally loading a full flash image (e.g. a full_restore bin)
+
+    system is a squashfs-root tree to show as the mounted /system (the fake can't unsquash mtdblock2).
+    """
+    state = state or state_dir()
+    os.makedirs(state, exist_ok=True)
+    for name in ('flash.bin', 'commands.log', 'resets'):
+        if os.path.exists(os.path.join(state, name)):
+            os.remove(os.path.join(state, name))
+    power_cycle(state)
+    shutil.rmtree(os.path.join(state, 'fs'), ignore_errors=True)
+    data = b''
+    if flash_image:
+        with open(flash_image, 'rb') as f:
+            data = f.read(FLASH_SIZE)
+    with open(os.path.join(state, 'flash.bin'), 'wb') as f:
+        f.write(data + b'\xff' * (FLASH_SIZE - len(data)))
+    settings = load_config(state)
+    settings.update({k: v for k, v in config.items() if v is not None})
+    with open(os.path.join(state, 'config.json'), 'w') as f:
+        json.dump(settings, f, indent=1)
+    os.makedirs(os.path.join(state, 'fs', 'data'), exist_ok=True)
+    if system:
+        shutil.copytree(system, os.path.join(state, 'fs', 'system'), symlinks=True)
+    return state
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] == 'sunxi-fel':
+        return fel_main(argv[1:])
+    if argv and argv[0] == 'adb':
+        return adb_main(argv[1:])
+
+    parser = argparse.ArgumentParser(description="Fake sunxi-fel/adb device for testing and benchmarks")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('init', help="reset the fake device")
+    p.add_argument('--flash', help="full flash image to load (default: erased)")
+    p.add_argument('--fel-rate', type=int, help="FEL SPI transfer rate in bytes/s (0 = unlimited)")
+    p.add_argument('--adb-rate', type=int, help="adb USB transfer rate in bytes/s (0 = unlimited)")
+    p.add_argument('--mtd-write-rate', type=int, help="on-device MTD write rate in bytes/s")
+    p.add_argument('--mtd-read-rate', type=int, help="on-device MTD read rate in bytes/s")
+    p.add_argument('--system', help="squashfs-root tree to mount as /system")
+    p.add_argument('--gzip', action=argparse.BooleanOptionalAction,
+                   help="whether the firmware has /system/bin/gzip (--no-gzip to emulate one without)")
+    p = sub.add_parser('install', help="write sunxi-fel and adb wrappers into a directory")
+    p.add_argument('directory')
+    sub.add_parser('sunxi-fel', help="run the fake sunxi-fel")
+    sub.add_parser('adb', help="run the fake adb")
+    args = parser.parse_args(argv)
+
+    if args.command == 'init':
+        state = init_device(args.flash, system=args.system, fel_rate=args.fel_rate, adb_rate=args.adb_rate,
+                            mtd_write_rate=args.mtd_write_rate, mtd_read_rate=args.mtd_read_rate,
+                            gzip=args.gzip)
+        print(f"✓ Fake device ready in {state}")
+    elif args.command == 'install':
+        for path in install(args.directory):
+            print(f"✓ {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+SPI NOR flash layout for the Beike cameras
+Sizes come from the reference dump in dumps/ (see docs/memory_map.md). Other units
+can be laid out differently, so detect_layout() looks for the real table first: an
+mtdparts= in the boot image cmdline (mtdblock1) or the U-Boot environment
+(mtdblock0), then the sizes of a backup's mtdblock files.
+"""
+
+import mmap
+import os
+import re
+
+FLASH_SIZE = 8 * 1024 * 1024
+ERASE_BLOCK = 64 * 1024
+
+
+class Partition:
+    """One MTD partition on the SPI flash"""
+    def __init__(self, index, name, offset, size):
+        self.index = index
+        self.name = name
+        self.offset = offset
+        self.size = size
+
+    @property
+    def block(self):
+        """mtdblock file/device name, e.g. mtdblock2"""
+        return f"mtdblock{self.index}"
+
+    @property
+    def end(self):
+        return self.offset + self.size
+
+    def __repr__(self):
+        return f"Partition({self.block}, {self.name!r}, offset={self.offset}, size={self.size})"
+
+
+def make_layout(parts):
+    """Build a layout from a list of (name, size), laid out back to back from offset 0"""
+    layout = []
+    offset = 0
+    for index, (name, size) in enumerate(parts):
+        layout.append(Partition(index, name, offset, size))
+        offset += size
+    return layout
+
+
+DEFAULT_LAYOUT = make_layout([
+    ('uboot', 262144),
+    ('boot', 2621440),
+    ('system', 4915200),
+    ('data', 327680),
+    ('boot_logo', 65536),
+    ('shutdown_logo', 65536),
+    ('mtdblock6', 65536),
+    ('mtdblock7', 65536),
+])
+
+# Never written by name: a bad bootloader means FEL is the only way back
+PROTECTED = ('uboot',)
+
+# The offset flash.sh has always used for system images
+SYSTEM_INDEX = 2
+SYSTEM_OFFSET = DEFAULT_LAYOUT[SYSTEM_INDEX].offset
+
+
+def partition_at(offset, layout=None):
+    """Return the partition containing an absolute flash offset, or None"""
+    for part in layout or DEFAULT_LAYOUT:
+        if part.offset <= offset < part.end:
+            return part
+    return None
+
+
+def partition_by_name(name, layout=None):
+    """Look up a partition by name ('system') or block name ('mtdblock2')
+
+    A detected layout may use the kernel's names (rootfs, say); the default names
+    still work on it and mean the partition with the same index.
+    """
+    layout = layout or DEFAULT_LAYOUT
+    for part in layout:
+        if name in (part.name, part.block):
+            return part
+    for default in DEFAULT_LAYOUT:
+        if name == default.name and default.index < len(layout):
+            return layout[default.index]
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Detection
+# ---------------------------------------------------------------------------
+
+def _size(text):
+    match = re.fullmatch(r'(0x[0-9a-fA-F]+|\d+)([kKmMgG]?)', text)
+    if not match:
+        raise ValueError(f"bad mtdparts size {text!r}")
+    return int(match.group(1), 0) * {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}[match.group(2).lower()]
+
+
+def parse_mtdparts(text, flash_size=FLASH_SIZE):
+    """Layout from an mtdparts value ('spi0.0:256k(uboot),2560k(boot),-(rest)'), first device only
+
+    Partitions without @offset follow the previous one; '-' takes the rest of the flash.
+    """
+    text = text.strip().split(';')[0]
+    if text.startswith('mtdparts='):
+        text = text[len('mtdparts='):]
+    _mtd_id, sep, parts = text.partition(':')
+    if not sep or not parts:
+        raise ValueError(f"no partitions in mtdparts {text!r}")
+    layout = []
+    offset = 0
+    for index, spec in enumerate(parts.split(',')):
+        match = re.fullmatch(r'(-|[0-9a-fA-Fx]+[kKmMgG]?)(?:@([0-9a-fA-Fx]+[kKmMgG]?))?(?:\(([^)]*)\))?(ro)?(lk)?', spec)
+        if not match:
+            raise ValueError(f"bad mtdparts entry {spec!r}")
+        if match.group(2):
+            offset = _size(match.group(2))
+        size = flash_size - offset if match.group(1) == '-' else _size(match.group(1))
+        layout.append(Partition(index, match.group(3) or f"mtdblock{index}", offset, size))
+        offset += size
+    return layout
+
+
+def find_mtdparts(data):
+    """The first literal mtdparts=... string in a blob (env variables referencing others skipped)"""
+    for match in re.finditer(rb'mtdparts=([^\x00\s]+)', data):
+        value = match.group(1).decode('latin-1')
+        if '$' not in value and ':' in value:
+            return value
+    return None
+
+
+def check_layout(layout, flash_size=FLASH_SIZE):
+    """Raise ValueError if partitions overlap, run off the flash or aren't erase block aligned"""
+    previous = None
+    for part in sorted(layout, key=lambda p: p.offset):
+        if part.size <= 0:
+            raise ValueError(f"{part.block} ({part.name}) is empty")
+        if part.offset % ERASE_BLOCK or part.size % ERASE_BLOCK:
+            raise ValueError(f"{part.block} ({part.name}) isn't aligned to {ERASE_BLOCK // 1024} KB erase blocks")
+        if part.end > flash_size:
+            raise ValueError(f"{part.block} ({part.name}) ends at {part.end}, past the {flash_size} byte flash")
+        if previous and part.offset < previous.end:
+            raise ValueError(f"{part.block} ({part.name}) overlaps {previous.block} ({previous.name})")
+        previous = part
+
+
+def detect_layout(dirs=('.',)):
+    """(layout, where it came from) for the first of dirs (workdir, backups) that tells us
+
+    Tries the mtdparts= of mtdblock1's cmdline, then of the U-Boot environment in
+    mtdblock0, then the mtdblock file sizes, and falls back to DEFAULT_LAYOUT. A lone
+    mtdblock2 still caps the system partition in the fallback, like build.sh checks it.
+    """
+    from .bootimg import BootImage
+
+    dirs = [d for d in dirs if d and os.path.isdir(d)]
+    for directory in dirs:
+        boot = os.path.join(directory, 'mtdblock1')
+        if os.path.exists(boot):
+            try:
+                with BootImage.open(boot) as image:
+                    found = find_mtdparts(image.cmdline.encode('latin-1'))
+            except (ValueError, OSError):
+                found = None
+            if found:
+                layout = parse_mtdparts(found)
+                check_layout(layout)
+                return layout, f"boot cmdline in {boot}"
+        uboot = os.path.join(directory, 'mtdblock0')
+        if os.path.exists(uboot) and os.path.getsize(uboot):
+            with open(uboot, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                found = find_mtdparts(mm)
+            if found:
+                layout = parse_mtdparts(found)
+                check_layout(layout)
+                return layout, f"U-Boot environment in {uboot}"
+    for directory in dirs:
+        sizes = []
+        while os.path.exists(os.path.join(directory, f"mtdblock{len(sizes)}")):
+            sizes.append(os.path.getsize(os.path.join(directory, f"mtdblock{len(sizes)}")))
+        # a backup has every block; a work folder with one or two loose mtdblocks says nothing
+        if len(sizes) >= 3:
+            names = [p.name for p in DEFAULT_LAYOUT]
+            layout = make_layout([(names[i] if i < len(names) else f"mtdblock{i}", size)
+                                  for i, size in enumerate(sizes)])
+            check_layout(layout)
+            return layout, f"mtdblock sizes in {directory}"
+    for directory in dirs:
+        system = os.path.join(directory, 'mtdblock2')
+        if os.path.exists(system) and os.path.getsize(system):
+            layout = [Partition(p.index, p.name, p.offset, os.path.getsize(system) if p.index == 2 else p.size)
+                      for p in DEFAULT_LAYOUT]
+            return layout, f"built-in default, system sized by {system}"
+    return DEFAULT_LAYOUT, "built-in default (reference dump)"
+
+
+def plan_writes(writes, layout=None):
+    """[(partition, path)] for [(name, path)], after checking each fits and none collide
+
+    Raises ValueError for unknown or protected partitions, images bigger than their
+    partition (a system image has to leave room, as the GUI always checked it against
+    mtdblock2) and two images aimed at the same (or overlapping) partitions.
+    """
+    layout = layout or DEFAULT_LAYOUT
+    planned = []
+    for name, path in writes:
+        part = partition_by_name(name, layout)
+        if not part:
+            raise ValueError(f"no partition called {name} (have: {', '.join(p.name for p in layout)})")
+        if part.name in PROTECTED or part.index == 0:
+            raise ValueError(f"{part.name} ({part.block}) holds the bootloader, write it with a full restore")
+        size = os.path.getsize(path)
+        if size > part.size or (part.index == SYSTEM_INDEX and size >= part.size):
+            raise ValueError(f"{os.path.basename(path)} is {size} bytes, {part.name} ({part.block}) holds {part.size}")
+        if not size:
+            raise ValueError(f"{path} is empty")
+        for other, other_path in planned:
+            if part.offset < other.end and other.offset < part.end:
+                raise ValueError(f"{os.path.basename(path)} and {os.path.basename(other_path)} "
+                                 f"both go to {part.name} ({part.block})")
+        planned.append((part, path))
+    return sorted(planned, key=lambda item: item[0].offset)
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Firmware diff engine
+Compares two squashfs-root trees, two backup/dump directories or two raw images.
+Trees are compared through a hash index first (cached by size/mtime, so rerunning
+over the dump archive is quick) and only files that differ get looked at:
+cfg/ini/prop files key by key, xml element by element, ELF files section by
+section. Raw images are compared per 64 KB erase block.
+
+    python3 -m beike.fwdiff dumps/old dumps/new
+    python3 -m beike.fwdiff backup_x/mtdblock2 system_v1.1.bin
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import stat
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+from . import cache_dir
+from .elf import ELF_MAGIC, SHT_NOBITS, ELFFile
+from .flash import DEFAULT_LAYOUT, ERASE_BLOCK, FLASH_SIZE, partition_at
+
+KV_SUFFIXES = ('.cfg', '.ini', '.prop', '.conf', '.kl', '.fstab')
+XML_SUFFIXES = ('.xml',)
+MTDBLOCK_RE = re.compile(r'^mtdblock(\d+)$')
+
+
+# ---------------------------------------------------------------------------
+# Hash index
+# ---------------------------------------------------------------------------
+
+def hash_file(path):
+    """sha256 of a file via mmap"""
+    h = hashlib.sha256()
+    if os.path.getsize(path):
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            h.update(mm)
+    return h.hexdigest()
+
+
+def _index_cache_path(root):
+    key = hashlib.sha256(os.path.realpath(root).encode()).hexdigest()[:24]
+    return os.path.join(cache_dir('index'), f"{key}.json")
+
+
+def build_index(root, use_cache=True, jobs=None):
+    """Map relative path -> entry dict (type, size, mode, sha256 or link target)"""
+    cached = {}
+    cache_path = _index_cache_path(root)
+    if use_cache and os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+    index = {}
+    to_hash = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in dirnames + filenames:
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, root)
+            st = os.lstat(full)
+            if stat.S_ISLNK(st.st_mode):
+                index[rel] = {'type': 'link', 'target': os.readlink(full)}
+            elif stat.S_ISDIR(st.st_mode):
+                index[rel] = {'type': 'dir', 'mode': stat.S_IMODE(st.st_mode)}
+            elif stat.S_ISREG(st.st_mode):
+                entry = {'type': 'file', 'size': st.st_size, 'mode': stat.S_IMODE(st.st_mode),
+                         'mtime': st.st_mtime_ns}
+                old = cached.get(rel)
+                if old and old.get('size') == st.st_size and old.get('mtime') == st.st_mtime_ns and old.get('sha256'):
+                    entry['sha256'] = old['sha256']
+                else:
+                    to_hash.append((rel, full))
+                index[rel] = entry
+
+    # hashlib drops the GIL on big buffers, so threads are enough here
+    if to_hash:
+        with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as pool:
+            for (rel, _full), digest in zip(to_hash, pool.map(lambda item: hash_file(item[1]), to_hash)):
+                index[rel]['sha256'] = digest
+
+    if use_cache and to_hash:
+        tmp = cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, cache_path)
+    return index
+
+
+# ---------------------------------------------------------------------------
+# Structured content diffs
+# ---------------------------------------------------------------------------
+
+def parse_kv(text):
+    """Parse cfg/ini/prop style text into {(section, key): value}, keeping duplicate keys apart"""
+    values = {}
+    section = ''
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+            continue
+        if '=' not in line:
+            continue
+        key, value = line.split('=', 1)
+        key = (section, key.strip())
+        n = 1
+        unique = key
+        while unique in values:
+            n += 1
+            unique = (section, f"{key[1]}#{n}")
+        values[unique] = value.strip()
+    return values
+
+
+def diff_kv(a_text, b_text):
+    """List of human readable key/value changes between two cfg files"""
+    a, b = parse_kv(a_text), parse_kv(b_text)
+    changes = []
+    for key in sorted(set(a) | set(b)):
+        label = f"[{key[0]}] {key[1]}" if key[0] else key[1]
+        if key not in b:
+            changes.append(f"- {label}={a[key]}")
+        elif key not in a:
+            changes.append(f"+ {label}={b[key]}")
+        elif a[key] != b[key]:
+            changes.append(f"~ {label}: {a[key]} -> {b[key]}")
+    return changes
+
+
+def flatten_xml(text):
+    """Flatten an XML document into {element path[@attr]: value}"""
+    root = ET.fromstring(text)
+    values = {}
+
+    def walk(elem, path):
+        counts = {}
+        if elem.text and elem.text.strip():
+            values[path] = elem.text.strip()
+        for name, value in elem.attrib.items():
+            values[f"{path}@{name}"] = value
+        for child in elem:
+            if not isinstance(child.tag, str):
+                continue
+            n = counts.get(child.tag, 0)
+            counts[child.tag] = n + 1
+            walk(child, f"{path}/{child.tag}[{n}]")
+
+    walk(root, f"/{root.tag}")
+    return values
+
+
+def diff_xml(a_text, b_text):
+    """List of attribute/text changes between two XML documents"""
+    a, b = flatten_xml(a_text), flatten_xml(b_text)
+    changes = []
+    for key in sorted(set(a) | set(b)):
+        if key not in b:
+            changes.append(f"- {key}={a[key]}")
+        elif key not in a:
+            changes.append(f"+ {key}={b[key]}")
+        elif a[key] != b[key]:
+            changes.append(f"~ {key}: {a[key]} -> {b[key]}")
+    return changes
+
+
+def section_hashes(buf):
+    """{section name: sha256} for an ELF buffer"""
+    elf = ELFFile(buf)
+    hashes = {}
+    for section in elf.sections:
+        if not section.name or section.type == SHT_NOBITS:
+            continue
+        data = buf[section.offset:section.offset + section.size]
+        hashes[section.name] = (section.size, hashlib.sha256(data).hexdigest())
+    return hashes
+
+
+def diff_elf(a_path, b_path):
+    """List of section level changes between two ELF files"""
+    with open(a_path, 'rb') as fa, open(b_path, 'rb') as fb, \
+            mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ) as a, \
+            mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) as b:
+        ha, hb = section_hashes(a), section_hashes(b)
+    changes = []
+    for name in sorted(set(ha) | set(hb), key=lambda n: (n not in ha, n)):
+        if name not in hb:
+            changes.append(f"- section {name}")
+        elif name not in ha:
+            changes.append(f"+ section {name} ({hb[name][0]} bytes)")
+        elif ha[name] != hb[name]:
+            delta = hb[name][0] - ha[name][0]
+            changes.append(f"~ section {name} ({ha[name][0]} -> {hb[name][0]} bytes, {delta:+d})")
+    return changes
+
+
+def _read_text(path):
+    with open(path, 'rb') as f:
+        return f.read().decode('utf-8', 'replace')
+
+
+def _is_elf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == ELF_MAGIC
+
+
+def diff_file_content(a_path, b_path, rel=''):
+    """Pick the most useful comparison for a pair of differing files"""
+    name = (rel or b_path).lower()
+    try:
+        if name.endswith(KV_SUFFIXES):
+            return 'cfg', diff_kv(_read_text(a_path), _read_text(b_path))
+        if name.endswith(XML_SUFFIXES):
+            return 'xml', diff_xml(_read_text(a_path), _read_text(b_path))
+        if _is_elf(a_path) and _is_elf(b_path):
+            return 'elf', diff_elf(a_path, b_path)
+    except (ET.ParseError, ValueError, IndexError):
+        pass
+    a_size, b_size = os.path.getsize(a_path), os.path.getsize(b_path)
+    return 'binary', [f"~ {a_size} -> {b_size} bytes ({b_size - a_size:+d})"]
+
+
+# ---------------------------------------------------------------------------
+# Raw image diff
+# ---------------------------------------------------------------------------
+
+def changed_blocks(a, b, block_size=ERASE_BLOCK):
+    """Indices of erase blocks that differ between two buffers (missing tail blocks count as changed)"""
+    a_view, b_view = memoryview(a), memoryview(b)
+    longest = max(len(a_view), len(b_view))
+    changed = []
+    for i, start in enumerate(range(0, longest, block_size)):
+        # memoryview equality is a single memcmp per block
+        if a_view[start:start + block_size] != b_view[start:start + block_size]:
+            changed.append(i)
+    return changed
+
+
+def block_ranges(blocks):
+    """Collapse a sorted list of block indices into (first, last) runs"""
+    ranges = []
+    for index in blocks:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return [tuple(r) for r in ranges]
+
+
+def diff_images(a_path, b_path, block_size=ERASE_BLOCK, base_offset=None):
+    """Compare two raw images per erase block"""
+    a_size, b_size = os.path.getsize(a_path), os.path.getsize(b_path)
+    with open(a_path, 'rb') as fa, open(b_path, 'rb') as fb:
+        a = mmap.mmap(fa.fileno(), 0, access=mmap.ACCESS_READ) if a_size else b''
+        b = mmap.mmap(fb.fileno(), 0, access=mmap.ACCESS_READ) if b_size else b''
+        try:
+            blocks = changed_blocks(a, b, block_size)
+        finally:
+            for m in (a, b):
+                if isinstance(m, mmap.mmap):
+                    m.close()
+
+    total = (max(a_size, b_size) + block_size - 1) // block_size
+    result = {'a': a_path, 'b': b_path, 'a_size': a_size, 'b_size': b_size,
+              'block_size': block_size, 'total_blocks': total,
+              'changed_blocks': len(blocks), 'ranges': block_ranges(blocks)}
+
+    # Full flash images: say which partitions the changes land in
+    if base_offset is None and a_size == b_size == FLASH_SIZE:
+        base_offset = 0
+    if base_offset is not None:
+        parts = {}
+        for index in blocks:
+            part = partition_at(base_offset + index * block_size, DEFAULT_LAYOUT)
+            label = part.block if part else 'outside layout'
+            parts[label] = parts.get(label, 0) + 1
+        result['partitions'] = parts
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Tree and directory diff
+# ---------------------------------------------------------------------------
+
+def diff_trees(a_root, b_root, content=True, use_cache=True):
+    """Compare two directory trees by hash index, then describe changed files"""
+    a_index = build_index(a_root, use_cache)
+    b_index = build_index(b_root, use_cache)
+    result = {'a': a_root, 'b': b_root, 'added': [], 'removed': [], 'changed': [], 'unchanged': 0}
+
+    for rel in sorted(set(a_index) | set(b_index)):
+        a, b = a_index.get(rel), b_index.get(rel)
+        if a is None:
+            result['added'].append(rel)
+        elif b is None:
+            result['removed'].append(rel)
+        elif a['type'] != b['type']:
+            result['changed'].append({'path': rel, 'kind': 'type', 'details': [f"~ {a['type']} -> {b['type']}"]})
+        elif a['type'] == 'link':
+            if a['target'] != b['target']:
+                result['changed'].append({'path': rel, 'kind': 'link',
+                                          'details': [f"~ -> {a['target']} became -> {b['target']}"]})
+            else:
+                result['unchanged'] += 1
+        elif a['type'] == 'file' and (a['sha256'] != b['sha256'] or a['mode'] != b['mode']):
+            details = []
+            kind = 'mode'
+            if a['mode'] != b['mode']:
+                details.append(f"~ mode {a['mode']:o} -> {b['mode']:o}")
+            if a['sha256'] != b['sha256']:
+                kind = 'content'
+                if content:
+                    kind, more = diff_file_content(os.path.join(a_root, rel), os.path.join(b_root, rel), rel)
+                    details.extend(more)
+            result['changed'].append({'path': rel, 'kind': kind, 'details': details})
+        else:
+            result['unchanged'] += 1
+    return result
+
+
+def _mtdblocks(directory):
+    found = {}
+    for name in os.listdir(directory):
+        m = MTDBLOCK_RE.match(name)
+        if m and os.path.isfile(os.path.join(directory, name)):
+            found[int(m.group(1))] = os.path.join(directory, name)
+    return found
+
+
+def diff_paths(a, b, content=True, use_cache=True):
+    """Compare any two firmware things: files, dump/backup directories or trees"""
+    reports = []
+    if os.path.isfile(a) and os.path.isfile(b):
+        if (_is_elf(a) and _is_elf(b)) or a.lower().endswith(KV_SUFFIXES + XML_SUFFIXES):
+            _kind, details = diff_file_content(a, b)
+            reports.append({'kind': 'file', 'a': a, 'b': b, 'details': details})
+        else:
+            reports.append(dict(diff_images(a, b), kind='image'))
+        return reports
+
+    if not (os.path.isdir(a) and os.path.isdir(b)):
+        raise ValueError("compare two files or two directories")
+
+    a_blocks, b_blocks = _mtdblocks(a), _mtdblocks(b)
+    if a_blocks and b_blocks:
+        # Backup / dump directories: partition images plus any extracted rootfs
+        for index in sorted(set(a_blocks) | set(b_blocks)):
+            if index not in a_blocks or index not in b_blocks:
+                side = 'b' if index in b_blocks else 'a'
+                reports.append({'kind': 'missing', 'path': f"mtdblock{index}", 'only_in': side})
+                continue
+            report = diff_images(a_blocks[index], b_blocks[index],
+                                 base_offset=DEFAULT_LAYOUT[index].offset if index < len(DEFAULT_LAYOUT) else None)
+            reports.append(dict(report, kind='image'))
+        a_root, b_root = os.path.join(a, 'squashfs-root'), os.path.join(b, 'squashfs-root')
+        if os.path.isdir(a_root) and os.path.isdir(b_root):
+            reports.append(dict(diff_trees(a_root, b_root, content, use_cache), kind='tree'))
+        return reports
+
+    reports.append(dict(diff_trees(a, b, content, use_cache), kind='tree'))
+    return reports
+
+
+def format_report(report):
+    """Render one report as text lines"""
+    lines = []
+    kind = report['kind']
+    if kind == 'image':
+        lines.append(f"image {report['a']} vs {report['b']}: {report['changed_blocks']}/{report['total_blocks']} "
+                     f"erase blocks differ ({report['block_size'] // 1024} KB blocks)")
+        if report['a_size'] != report['b_size']:
+            lines.append(f"  size {report['a_size']} -> {report['b_size']} bytes")
+        for first, last in report['ranges']:
+            start, end = first * report['block_size'], (last + 1) * report['block_size'] - 1
+            lines.append(f"  blocks {first}-{last}  (0x{start:06x}-0x{end:06x})")
+        for part, count in sorted(report.get('partitions', {}).items()):
+            lines.append(f"  {part}: {count} block(s)")
+    elif kind == 'missing':
+        lines.append(f"{report['path']} only in {report['only_in']}")
+    elif kind == 'file':
+        lines.append(f"file {report['a']} vs {report['b']}:")
+        lines.extend(f"  {d}" for d in report['details'] or ['(identical)'])
+    elif kind == 'tree':
+        lines.append(f"tree {report['a']} vs {report['b']}: {len(report['added'])} added, "
+                     f"{len(report['removed'])} removed, {len(report['changed'])} changed, "
+                     f"{report['unchanged']} unchanged")
+        lines.extend(f"  + {p}" for p in report['added'])
+        lines.extend(f"  - {p}" for p in report['removed'])
+        for change in report['changed']:
+            lines.append(f"  ~ {change['path']} ({change['kind']})")
+            lines.extend(f"      {d}" for d in change['details'])
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Diff firmware dumps, squashfs trees, backups and images")
+    parser.add_argument('a', help="old file or directory")
+    parser.add_argument('b', help="new file or directory")
+    parser.add_argument('--no-content', action='store_true', help="only list changed files, skip content diffs")
+    parser.add_argument('--no-cache', action='store_true', help="rehash everything")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        reports = diff_paths(args.a, args.b, content=not args.no_content, use_cache=not args.no_cache)
+    except ValueError as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 2
+
+    if args.json:
+        json.dump(reports, sys.stdout, indent=1)
+        print()
+    else:
+        for report in reports:
+            print('\n'.join(format_report(report)))
+
+    differs = any(r.get('changed_blocks') or r.get('added') or r.get('removed') or r.get('changed')
+                  or r.get('details') or r['kind'] == 'missing' for r in reports)
+    return 1 if differs else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
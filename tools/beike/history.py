@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Build history
+Every build (beike.core.build_rom, so the GUI and the CLI, and build.sh when python3
+is around) is recorded in a SQLite database in the tools cache: the hash of the tree
+that was packed (squashfs-root through the build layer and excludes), the options,
+the image size and its headroom under mtdblock2, uncompressed bytes per top-level
+directory, and how long mksquashfs took and how much memory it needed. history
+lists and charts that, and flags builds that grew or slowed down compared to a
+baseline, so the rootfs creeping towards the partition size shows up long before
+a build fails.
+
+    python3 -m beike.history                          # this folder's builds
+    python3 -m beike.history chart size -n 30
+    python3 -m beike.history chart --dir lib
+    python3 -m beike.history check --baseline 12 --threshold 2
+    python3 -m beike.history margin 256K              # builds fail with less headroom
+    python3 -m beike.history show 14
+
+Builds are kept per rom-building directory (-C, default: current).
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from . import cache_dir, layer
+from .fwdiff import build_index, hash_file
+from .watch import load_excludes, partition_limit
+
+DB_NAME = 'builds.sqlite'
+DEFAULT_THRESHOLD = 5.0     # percent
+# growth below this many bytes is noise however big it is in percent (a tiny dir doubling)
+MIN_DIR_GROWTH = 16 * 1024
+METRICS = {
+    'size': ('image_size', "image size"),
+    'headroom': ('headroom', "headroom under mtdblock2"),
+    'time': ('compress_seconds', "mksquashfs time"),
+    'memory': ('peak_rss', "mksquashfs peak memory"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    workdir TEXT NOT NULL,
+    started REAL NOT NULL,
+    version TEXT,
+    build TEXT,
+    options TEXT,
+    tree_hash TEXT,
+    image_size INTEGER,
+    partition_size INTEGER,
+    seconds REAL,
+    compress_seconds REAL,
+    compress_cpu REAL,
+    peak_rss INTEGER
+);
+CREATE INDEX IF NOT EXISTS builds_workdir ON builds (workdir, id);
+CREATE TABLE IF NOT EXISTS build_dirs (
+    build_id INTEGER NOT NULL REFERENCES builds (id) ON DELETE CASCADE,
+    dir TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    files INTEGER NOT NULL,
+    PRIMARY KEY (build_id, dir)
+);
+CREATE TABLE IF NOT EXISTS settings (
+    workdir TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (workdir, key)
+);
+"""
+
+
+def parse_size(text):
+    """'256K', '1M', '65536' -> bytes"""
+    text = str(text).strip().upper().rstrip('B')
+    scale = {'K': 1024, 'M': 1024 * 1024}.get(text[-1:], 1)
+    try:
+        return int(float(text.rstrip('KM')) * scale)
+    except ValueError:
+        raise ValueError(f"bad size {text!r} (e.g. 256K, 1M)")
+
+
+def _kb(n):
+    return f"{n / 1024:,.0f} KB"
+
+
+def _key(workdir):
+    return os.path.realpath(workdir)
+
+
+def connect(path=None):
+    """Open (and create) the history database"""
+    db = sqlite3.connect(path or os.path.join(cache_dir(), DB_NAME))
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(SCHEMA)
+    return db
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+
+def _excluded(rel, excludes):
+    parts = rel.split(os.sep)
+    return any(os.path.join(*parts[:i]) in excludes for i in range(1, len(parts) + 1))
+
+
+def tree_summary(workdir):
+    """(sha256 of the tree mksquashfs packs, {top-level dir: [bytes, files]})
+
+    The tree is squashfs-root with the build layer's files in place of the base ones
+    and its deletions and the .mksquashfs_exclude list left out; hashes come from
+    the fwdiff index cache, so only files that changed since the last build are read.
+    """
+    build = layer.Layer(workdir)
+    rendered = {} if build.empty else build.render()
+    excludes = load_excludes(workdir)
+    index = build_index(build.base)
+    h = hashlib.sha256()
+    dirs = {}
+    for rel in sorted(set(index) | set(rendered)):
+        if rel in rendered:
+            size, line = os.path.getsize(rendered[rel]), f"file layer {hash_file(rendered[rel])}"
+        elif _excluded(rel, excludes):
+            continue
+        else:
+            entry = index[rel]
+            size = entry.get('size', 0)
+            line = f"{entry['type']} {entry.get('mode', '')} {entry.get('sha256') or entry.get('target', '')}"
+        h.update(f"{rel}\0{line}\n".encode('utf-8', 'surrogateescape'))
+        if line.startswith('dir'):
+            continue
+        top = rel.split(os.sep)[0] if os.sep in rel else '.'
+        totals = dirs.setdefault(top, [0, 0])
+        totals[0] += size
+        totals[1] += 1
+    return h.hexdigest(), dirs
+
+
+def record(workdir, image, version=None, build=None, options=None, seconds=None,
+           compress_seconds=None, compress_cpu=None, peak_rss=None, db=None):
+    """Add a build of workdir's tree that produced image; returns its row"""
+    tree_hash, dirs = tree_summary(workdir)
+    own = db is None
+    db = db or connect()
+    try:
+        with db:
+            cursor = db.execute(
+                "INSERT INTO builds (workdir, started, version, build, options, tree_hash, image_size, "
+                "partition_size, seconds, compress_seconds, compress_cpu, peak_rss) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (_key(workdir), time.time(), version, build, json.dumps(options or {}, sort_keys=True),
+                 tree_hash, os.path.getsize(image), partition_limit(workdir), seconds, compress_seconds,
+                 compress_cpu, peak_rss))
+            db.executemany("INSERT INTO build_dirs (build_id, dir, bytes, files) VALUES (?, ?, ?, ?)",
+                           [(cursor.lastrowid, top, size, files) for top, (size, files) in dirs.items()])
+        return get_build(db, cursor.lastrowid)
+    finally:
+        if own:
+            db.close()
+
+
+# ---------------------------------------------------------------------------
+# Queries
+# ---------------------------------------------------------------------------
+
+def _row(row):
+    build = dict(row)
+    build['options'] = json.loads(build['options'] or '{}')
+    build['headroom'] = build['partition_size'] - build['image_size']
+    return build
+
+
+def get_build(db, build_id):
+    row = db.execute("SELECT * FROM builds WHERE id = ?", (build_id,)).fetchone()
+    if not row:
+        raise ValueError(f"no build #{build_id}")
+    return _row(row)
+
+
+def list_builds(db, workdir, limit=None):
+    """workdir's builds, oldest first (the last limit of them)"""
+    rows = db.execute("SELECT * FROM builds WHERE workdir = ? ORDER BY id DESC LIMIT ?",
+                      (_key(workdir), limit or -1)).fetchall()
+    return [_row(row) for row in reversed(rows)]
+
+
+def previous_build(db, build):
+    """The build of the same folder before this one, or None"""
+    row = db.execute("SELECT * FROM builds WHERE workdir = ? AND id < ? ORDER BY id DESC LIMIT 1",
+                     (build['workdir'], build['id'])).fetchone()
+    return _row(row) if row else None
+
+
+def dir_sizes(db, build_id):
+    """{dir: (bytes, files)} for a build"""
+    return {row['dir']: (row['bytes'], row['files'])
+            for row in db.execute("SELECT * FROM build_dirs WHERE build_id = ?", (build_id,))}
+
+
+def get_margin(db, workdir):
+    """Minimum headroom (bytes) set for workdir, or None"""
+    row = db.execute("SELECT value FROM settings WHERE workdir = ? AND key = 'margin'", (_key(workdir),)).fetchone()
+    return int(row['value']) if row else None
+
+
+def set_margin(db, workdir, margin):
+    with db:
+        if margin:
+            db.execute("INSERT OR REPLACE INTO settings (workdir, key, value) VALUES (?, 'margin', ?)",
+                       (_key(workdir), str(margin)))
+        else:
+            db.execute("DELETE FROM settings WHERE workdir = ? AND key = 'margin'", (_key(workdir),))
+
+
+# ---------------------------------------------------------------------------
+# Regressions
+# ---------------------------------------------------------------------------
+
+def _growth(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) * 100.0 / old
+
+
+def regressions(db, build, baseline, threshold=DEFAULT_THRESHOLD):
+    """Lines for what grew by more than threshold percent between baseline and build"""
+    found = []
+    for column, label, fmt in (('image_size', "image size", _kb),
+                               ('compress_seconds', "mksquashfs time", lambda v: f"{v:.1f}s"),
+                               ('peak_rss', "mksquashfs peak memory", lambda v: f"{v / 1048576:.0f} MB")):
+        old, new = baseline[column], build[column]
+        growth = _growth(old, new)
+        if growth is not None and growth > threshold:
+            found.append(f"{label} {fmt(old)} -> {fmt(new)} ({growth:+.1f}%)")
+    old_dirs, new_dirs = dir_sizes(db, baseline['id']), dir_sizes(db, build['id'])
+    for top in sorted(new_dirs):
+        old = old_dirs.get(top, (0, 0))[0]
+        new = new_dirs[top][0]
+        growth = _growth(old, new)
+        if new - old >= MIN_DIR_GROWTH and (growth is None or growth > threshold):
+            found.append(f"{top}/ {_kb(old)} -> {_kb(new)}"
+                         f" ({'new' if growth is None else f'{growth:+.1f}%'})")
+    return found
+
+
+def headroom_problem(build, margin):
+    """Message if the image leaves less than margin bytes free in the partition, else None"""
+    if margin is None or build['headroom'] >= margin:
+        return None
+    if build['headroom'] < 0:
+        return (f"Image is {_kb(-build['headroom'])} over the {_kb(build['partition_size'])} "
+                f"system partition")
+    return (f"Only {_kb(build['headroom'])} left under the {_kb(build['partition_size'])} system partition, "
+            f"the margin is {_kb(margin)} (python3 -m beike.history margin)")
+
+
+def describe(db, build, margin=None):
+    """One line for the build log: size, headroom and the change since the previous build"""
+    line = f"Image {_kb(build['image_size'])}, {_kb(build['headroom'])} headroom"
+    previous = previous_build(db, build)
+    if previous:
+        delta = build['image_size'] - previous['image_size']
+        same = "same tree, " if previous['tree_hash'] == build['tree_hash'] else ""
+        line += f" ({same}{delta / 1024:+,.0f} KB since build #{previous['id']})"
+    if margin is not None:
+        line += f", margin {_kb(margin)}"
+    return f"Build #{build['id']}: {line}"
+
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+
+def chart(values, labels, fmt, width=40):
+    """Text bar chart; bars start at the smallest value so small trends still show"""
+    known = [v for v in values if v is not None]
+    if not known:
+        return []
+    lo, hi = min(known), max(known)
+    lines = []
+    for label, value in zip(labels, values):
+        if value is None:
+            lines.append(f"  {label}  {'-':>12}")
+            continue
+        bar = 1 + round((value - lo) * (width - 1) / (hi - lo)) if hi > lo else width
+        lines.append(f"  {label}  {fmt(value):>12}  {'█' * bar}")
+    return lines
+
+
+def _when(started):
+    return time.strftime('%Y-%m-%d %H:%M', time.localtime(started))
+
+
+def _label(build):
+    return f"#{build['id']:<4} {_when(build['started'])}  v{build['version'] or '?':<8}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build history: image size, headroom and build time per build")
+    parser.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('list', help="recent builds (the default)")
+    p.add_argument('-n', type=int, default=20, help="number of builds (default: 20)")
+    p = sub.add_parser('show', help="options and per-directory sizes of one build")
+    p.add_argument('id', type=int, nargs='?', help="default: the latest")
+    p = sub.add_parser('chart', help="trend of a metric over recent builds")
+    p.add_argument('metric', nargs='?', default='size', choices=sorted(METRICS))
+    p.add_argument('--dir', help="chart the uncompressed size of a top-level directory instead")
+    p.add_argument('-n', type=int, default=20, help="number of builds (default: 20)")
+    p = sub.add_parser('check', help="flag growth against a baseline build; exit 1 if there is any")
+    p.add_argument('--build', type=int, help="build to check (default: the latest)")
+    p.add_argument('--baseline', type=int, help="build to compare with (default: the one before)")
+    p.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                   help=f"percent growth that counts (default: {DEFAULT_THRESHOLD:g})")
+    p = sub.add_parser('margin', help="show or set the minimum headroom under mtdblock2 (0 to clear)")
+    p.add_argument('size', nargs='?', help="e.g. 256K or 1M")
+    p = sub.add_parser('record', help="record an image built outside beike (build.sh)")
+    p.add_argument('image')
+    p.add_argument('--version')
+    p.add_argument('--build')
+    p.add_argument('--seconds', type=float, help="mksquashfs wall time")
+    p.add_argument('--option', action='append', default=[], metavar='KEY=VALUE')
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir
+    try:
+        db = connect()
+    except (sqlite3.Error, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    try:
+        if args.command == 'record':
+            options = dict(item.partition('=')[::2] for item in args.option)
+            try:
+                build = record(workdir, args.image, args.version, args.build, options,
+                               compress_seconds=args.seconds, db=db)
+            except (sqlite3.Error, OSError) as e:
+                # a broken cache shouldn't fail the build that called us
+                print(f"Warning: build not recorded in the history: {e}")
+                return 0
+            margin = get_margin(db, workdir)
+            print(describe(db, build, margin))
+            problem = headroom_problem(build, margin)
+            if problem:
+                print(f"✗ {problem}", file=sys.stderr)
+                return 1
+        elif args.command == 'margin':
+            if args.size is not None:
+                set_margin(db, workdir, parse_size(args.size))
+            margin = get_margin(db, workdir)
+            print(f"Minimum headroom: {_kb(margin) if margin else 'not set'}")
+        elif args.command == 'show':
+            builds = list_builds(db, workdir, 1)
+            build = get_build(db, args.id) if args.id else (builds[0] if builds else None)
+            if not build:
+                print("No builds recorded yet")
+                return 0
+            print(f"Build #{build['id']}  {_when(build['started'])}  v{build['version']} build {build['build']}")
+            print(f"  {'tree':17} {build['tree_hash'][:16]}")
+            print(f"  {'image':17} {_kb(build['image_size'])} of {_kb(build['partition_size'])} "
+                  f"({_kb(build['headroom'])} headroom)")
+            if build['compress_seconds'] is not None:
+                print(f"  {'mksquashfs':17} {build['compress_seconds']:.1f}s"
+                      + (f", cpu {build['compress_cpu']:.1f}s" if build['compress_cpu'] else '')
+                      + (f", peak {build['peak_rss'] / 1048576:.0f} MB" if build['peak_rss'] else ''))
+            for key, value in sorted(build['options'].items()):
+                print(f"  {key:17} {value}")
+            for top, (size, files) in sorted(dir_sizes(db, build['id']).items(), key=lambda item: -item[1][0]):
+                print(f"    {top + '/':20} {_kb(size):>12}  {files} files")
+        elif args.command == 'chart':
+            builds = list_builds(db, workdir, args.n)
+            if args.dir:
+                values = [dir_sizes(db, b['id']).get(args.dir.strip('/'), (None,))[0] for b in builds]
+                title, fmt = f"{args.dir.strip('/')}/ (uncompressed)", _kb
+            else:
+                column, title = METRICS[args.metric]
+                values = [b[column] for b in builds]
+                fmt = {'time': lambda v: f"{v:.1f}s",
+                       'memory': lambda v: f"{v / 1048576:.0f} MB"}.get(args.metric, _kb)
+            lines = chart(values, [_label(b) for b in builds], fmt)
+            if not lines:
+                print("No builds recorded yet")
+                return 0
+            print(title)
+            print('\n'.join(lines))
+        elif args.command == 'check':
+            builds = list_builds(db, workdir, 1)
+            build = get_build(db, args.build) if args.build else (builds[0] if builds else None)
+            if not build:
+                print("No builds recorded yet")
+                return 0
+            baseline = get_build(db, args.baseline) if args.baseline else previous_build(db, build)
+            problems = regressions(db, build, baseline, args.threshold) if baseline else []
+            problem = headroom_problem(build, get_margin(db, workdir))
+            if problem:
+                problems.append(problem)
+            against = f" against #{baseline['id']}" if baseline else " (no baseline)"
+            if not problems:
+                print(f"✓ Build #{build['id']}{against}: nothing grew more than {args.threshold:g}%")
+                return 0
+            print(f"✗ Build #{build['id']}{against}:")
+            for line in problems:
+                print(f"  {line}")
+            return 1
+        else:
+            builds = list_builds(db, workdir, getattr(args, 'n', 20))
+            if not builds:
+                print("No builds recorded yet")
+                return 0
+            previous = None
+            for build in builds:
+                delta = f"{(build['image_size'] - previous['image_size']) / 1024:+8,.0f} KB" if previous else ' ' * 11
+                took = f"{build['compress_seconds']:6.1f}s" if build['compress_seconds'] is not None else '      -'
+                print(f"{_label(build)}  {_kb(build['image_size']):>10} {delta}  "
+                      f"free {_kb(build['headroom']):>10}  {took}  {build['tree_hash'][:10]}")
+                previous = build
+    except (ValueError, OSError, sqlite3.Error) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
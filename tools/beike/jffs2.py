@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+JFFS2 reader and writer for the data partition (mtdblock3)
+The image is mmapped and the node log is scanned once to build an inode/dirent
+index; file data is only decompressed when a file is actually read. The writer
+builds a fresh, padded partition image from a directory (e.g. to preseed /data
+in a restore image). extract leaves the owners and modes it can't set on the host
+in .jffs2-attrs.json, and build puts them back, so extract, edit, build keeps
+/data's permissions.
+
+    python3 -m beike.jffs2 ls mtdblock3
+    python3 -m beike.jffs2 cat misc/wifi/hostapd.conf backup_*/mtdblock3
+    python3 -m beike.jffs2 extract mtdblock3 data/
+    python3 -m beike.jffs2 build data/ data_new.jffs2
+"""
+
+import argparse
+import binascii
+import fnmatch
+import json
+import lzma
+import mmap
+import os
+import stat
+import struct
+import sys
+import zlib
+
+from .flash import DEFAULT_LAYOUT, ERASE_BLOCK
+
+JFFS2_MAGIC = 0x1985
+NODETYPE_DIRENT = 0xe001
+NODETYPE_INODE = 0xe002
+NODETYPE_CLEANMARKER = 0x2003
+NODETYPE_PADDING = 0x2004
+
+COMPR_NONE = 0x00
+COMPR_ZERO = 0x01
+COMPR_RTIME = 0x02
+COMPR_ZLIB = 0x06
+COMPR_LZMA = 0x08
+
+NODE_HEADER = struct.Struct('<HHII')
+# ino, version, mode, uid, gid, isize, atime, mtime, ctime, offset, csize, dsize, compr, usercompr, flags, data_crc, node_crc
+INODE = struct.Struct('<IIIHHIIIIIIIBBHII')
+# pino, version, ino, mctime, nsize, type, unused, node_crc, name_crc
+DIRENT = struct.Struct('<IIIIBB2sII')
+INODE_SIZE = NODE_HEADER.size + INODE.size
+DIRENT_SIZE = NODE_HEADER.size + DIRENT.size
+
+DATA_PARTITION_SIZE = DEFAULT_LAYOUT[3].size
+PAGE_SIZE = 4096
+ROOT_INO = 1
+ATTRS_FILE = '.jffs2-attrs.json'    # {path: [mode, uid, gid]}, '.' is the root
+
+DT_DIR = 4
+DT_REG = 8
+DT_LNK = 10
+
+
+def crc32(data):
+    """The kernel's crc32 as used by JFFS2 (no pre/post inversion)"""
+    return binascii.crc32(data, 0xffffffff) ^ 0xffffffff
+
+
+def _align4(n):
+    return (n + 3) & ~3
+
+
+def rtime_decompress(data, destlen):
+    """Decompress the JFFS2 'rtime' format"""
+    out = bytearray(destlen)
+    positions = [0] * 256
+    outpos = pos = 0
+    while outpos < destlen:
+        value = data[pos]
+        repeat = data[pos + 1]
+        pos += 2
+        out[outpos] = value
+        outpos += 1
+        backoffs = positions[value]
+        positions[value] = outpos
+        for _ in range(repeat):
+            out[outpos] = out[backoffs]
+            outpos += 1
+            backoffs += 1
+    return bytes(out)
+
+
+def decompress(compr, data, dsize):
+    if compr == COMPR_NONE:
+        return bytes(data)
+    if compr == COMPR_ZERO:
+        return b'\x00' * dsize
+    if compr == COMPR_ZLIB:
+        return zlib.decompress(data)
+    if compr == COMPR_RTIME:
+        return rtime_decompress(data, dsize)
+    if compr == COMPR_LZMA:
+        filters = [{'id': lzma.FILTER_LZMA1, 'lc': 0, 'lp': 0, 'pb': 0, 'dict_size': 0x2000}]
+        return lzma.LZMADecompressor(lzma.FORMAT_RAW, filters=filters).decompress(data)[:dsize]
+    raise ValueError(f"unsupported JFFS2 compression type {compr}")
+
+
+class DataNode:
+    """Where one inode node lives in the image; data stays in the mmap until read"""
+    __slots__ = ('version', 'mode', 'uid', 'gid', 'isize', 'mtime', 'offset',
+                 'csize', 'dsize', 'compr', 'data_pos')
+
+    def __init__(self, version, mode, uid, gid, isize, mtime, offset, csize, dsize, compr, data_pos):
+        self.version = version
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.isize = isize
+        self.mtime = mtime
+        self.offset = offset
+        self.csize = csize
+        self.dsize = dsize
+        self.compr = compr
+        self.data_pos = data_pos
+
+
+class JFFS2Image:
+    """Index of a JFFS2 image; build with JFFS2Image.open(path) or JFFS2Image(buffer)"""
+    def __init__(self, buf):
+        self.buf = buf
+        self._file = None
+        self.inodes = {}    # ino -> [DataNode]
+        self.dirents = {}   # (pino, name) -> (version, ino, type)
+        self.bad_nodes = 0
+        self._scan()
+        self._build_tree()
+
+    @classmethod
+    def open(cls, path):
+        f = open(path, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        image = cls(mm)
+        image._file = f
+        return image
+
+    def close(self):
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+        if self._file:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _scan(self):
+        buf = self.buf
+        size = len(buf)
+        magic = struct.pack('<H', JFFS2_MAGIC)
+        pos = 0
+        while pos + NODE_HEADER.size <= size:
+            pos = buf.find(magic, pos)
+            if pos == -1:
+                break
+            if pos & 3:
+                pos = _align4(pos)
+                continue
+            node_magic, nodetype, totlen, hdr_crc = NODE_HEADER.unpack_from(buf, pos)
+            if crc32(buf[pos:pos + 8]) != hdr_crc or totlen < NODE_HEADER.size or pos + totlen > size:
+                pos += 4
+                continue
+            if nodetype == NODETYPE_INODE:
+                self._add_inode(pos)
+            elif nodetype == NODETYPE_DIRENT:
+                self._add_dirent(pos)
+            pos += _align4(totlen)
+
+    def _add_inode(self, pos):
+        fields = INODE.unpack_from(self.buf, pos + NODE_HEADER.size)
+        (ino, version, mode, uid, gid, isize, _atime, mtime, _ctime, offset,
+         csize, dsize, compr, _usercompr, _flags, _data_crc, node_crc) = fields
+        if crc32(self.buf[pos:pos + INODE_SIZE - 8]) != node_crc:
+            self.bad_nodes += 1
+            return
+        node = DataNode(version, mode, uid, gid, isize, mtime, offset, csize, dsize, compr, pos + INODE_SIZE)
+        self.inodes.setdefault(ino, []).append(node)
+
+    def _add_dirent(self, pos):
+        pino, version, ino, _mctime, nsize, dtype, _unused, node_crc, name_crc = \
+            DIRENT.unpack_from(self.buf, pos + NODE_HEADER.size)
+        if crc32(self.buf[pos:pos + DIRENT_SIZE - 8]) != node_crc:
+            self.bad_nodes += 1
+            return
+        name = bytes(self.buf[pos + DIRENT_SIZE:pos + DIRENT_SIZE + nsize]).decode('utf-8', 'surrogateescape')
+        key = (pino, name)
+        old = self.dirents.get(key)
+        if old is None or version > old[0]:
+            self.dirents[key] = (version, ino, dtype)
+
+    def _build_tree(self):
+        for nodes in self.inodes.values():
+            nodes.sort(key=lambda n: n.version)
+        self.children = {}  # pino -> {name: ino}
+        for (pino, name), (_version, ino, _dtype) in self.dirents.items():
+            if ino == 0:
+                continue  # unlinked
+            self.children.setdefault(pino, {})[name] = ino
+
+    # -- lookups ------------------------------------------------------------
+
+    def stat(self, ino):
+        """Latest metadata node for an inode"""
+        nodes = self.inodes.get(ino)
+        if not nodes:
+            if ino == ROOT_INO:
+                return DataNode(0, stat.S_IFDIR | 0o755, 0, 0, 0, 0, 0, 0, 0, 0, 0)
+            raise KeyError(f"inode {ino} has no nodes")
+        return nodes[-1]
+
+    def lookup(self, path):
+        """Inode number for a path relative to the partition root"""
+        ino = ROOT_INO
+        for part in [p for p in path.strip('/').split('/') if p]:
+            ino = self.children.get(ino, {}).get(part)
+            if ino is None:
+                raise FileNotFoundError(path)
+        return ino
+
+    def read_ino(self, ino):
+        """Replay an inode's data nodes in version order to get the current contents"""
+        nodes = self.inodes.get(ino, [])
+        if not nodes:
+            return b''
+        size = nodes[-1].isize
+        data = bytearray(size)
+        for node in nodes:
+            if node.dsize:
+                chunk = decompress(node.compr, self.buf[node.data_pos:node.data_pos + node.csize], node.dsize)
+                end = min(node.offset + node.dsize, size)
+                if node.offset < end:
+                    data[node.offset:end] = chunk[:end - node.offset]
+        return bytes(data)
+
+    def read(self, path):
+        return self.read_ino(self.lookup(path))
+
+    def walk(self, ino=ROOT_INO, prefix=''):
+        """Yield (path, ino, metadata) for every live entry, parents before children"""
+        for name in sorted(self.children.get(ino, {})):
+            child = self.children[ino][name]
+            path = f"{prefix}{name}"
+            try:
+                meta = self.stat(child)
+            except KeyError:
+                continue
+            yield path, child, meta
+            if stat.S_ISDIR(meta.mode):
+                yield from self.walk(child, path + '/')
+
+    def extract(self, out_dir):
+        """Write the whole filesystem to a directory, returns the number of entries
+
+        Modes, owners and groups go to ATTRS_FILE in out_dir as well; on the host
+        files and directories stay readable and writable by you.
+        """
+        count = 0
+        os.makedirs(out_dir, exist_ok=True)
+        root = self.stat(ROOT_INO)
+        attrs = {'.': [stat.S_IMODE(root.mode), root.uid, root.gid]}
+        dirs = []
+        for path, ino, meta in self.walk():
+            target = os.path.join(out_dir, path)
+            if stat.S_ISDIR(meta.mode):
+                os.makedirs(target, exist_ok=True)
+                dirs.append((target, meta))
+            elif stat.S_ISLNK(meta.mode):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.symlink(self.read_ino(ino).decode('utf-8', 'surrogateescape'), target)
+            elif stat.S_ISREG(meta.mode):
+                with open(target, 'wb') as f:
+                    f.write(self.read_ino(ino))
+                os.chmod(target, (meta.mode & 0o777) | 0o600)
+            else:
+                continue  # sockets, fifos and device nodes can't be recreated meaningfully
+            if stat.S_ISREG(meta.mode):
+                os.utime(target, (meta.mtime, meta.mtime))
+            attrs[path] = [stat.S_IMODE(meta.mode), meta.uid, meta.gid]
+            count += 1
+        # directories last and deepest first: writing into them bumps their mtime
+        for target, meta in reversed(dirs):
+            os.chmod(target, stat.S_IMODE(meta.mode) | 0o700)
+            os.utime(target, (meta.mtime, meta.mtime))
+        with open(os.path.join(out_dir, ATTRS_FILE), 'w') as f:
+            json.dump(attrs, f, indent=1, sort_keys=True)
+        return count
+
+
+# ---------------------------------------------------------------------------
+# Writer
+# ---------------------------------------------------------------------------
+
+class _Writer:
+    """Lays nodes out in erase blocks: cleanmarker first, no node crossing a block boundary"""
+    def __init__(self, size, erase_block, cleanmarkers=True):
+        self.size = size
+        self.erase_block = erase_block
+        self.cleanmarkers = cleanmarkers
+        self.out = bytearray()
+        self._new_block()
+
+    def _new_block(self):
+        if self.cleanmarkers:
+            self.out += _node_header(NODETYPE_CLEANMARKER, NODE_HEADER.size)
+
+    def add(self, node):
+        node += b'\xff' * (_align4(len(node)) - len(node))
+        used = len(self.out) % self.erase_block
+        if used and used + len(node) > self.erase_block:
+            self.out += b'\xff' * (self.erase_block - used)
+            self._new_block()
+        elif not used and self.out:
+            # the last node filled its block exactly, this one starts the next
+            self._new_block()
+        if len(node) > self.erase_block - NODE_HEADER.size:
+            raise ValueError("node larger than an erase block")
+        self.out += node
+        if len(self.out) > self.size:
+            raise ValueError(f"filesystem does not fit in {self.size} bytes")
+
+    def finish(self, pad=True):
+        if not pad:
+            return bytes(self.out)
+        data = self.out + b'\xff' * (self.size - len(self.out))
+        # Every untouched erase block still gets its cleanmarker so the kernel doesn't re-erase it
+        if self.cleanmarkers:
+            marker = _node_header(NODETYPE_CLEANMARKER, NODE_HEADER.size)
+            first_free = (len(self.out) + self.erase_block - 1) // self.erase_block * self.erase_block
+            for block in range(first_free, self.size, self.erase_block):
+                data[block:block + len(marker)] = marker
+        return bytes(data)
+
+
+def _node_header(nodetype, totlen):
+    head = struct.pack('<HHI', JFFS2_MAGIC, nodetype, totlen)
+    return head + struct.pack('<I', crc32(head))
+
+
+def make_inode_node(ino, version, mode, uid, gid, isize, mtime, offset, data, dsize, compr):
+    header = _node_header(NODETYPE_INODE, INODE_SIZE + len(data))
+    body = INODE.pack(ino, version, mode, uid, gid, isize, mtime, mtime, mtime, offset,
+                      len(data), dsize, compr, 0, 0, crc32(data), 0)
+    node_crc = crc32(header + body[:-8])
+    body = body[:-4] + struct.pack('<I', node_crc)
+    return header + body + data
+
+
+def make_dirent_node(pino, version, ino, mctime, name, dtype):
+    raw = name.encode('utf-8', 'surrogateescape')
+    header = _node_header(NODETYPE_DIRENT, DIRENT_SIZE + len(raw))
+    body = DIRENT.pack(pino, version, ino, mctime, len(raw), dtype, b'\x00\x00', 0, crc32(raw))
+    node_crc = crc32(header + body[:-8])
+    body = body[:-8] + struct.pack('<II', node_crc, crc32(raw))
+    return header + body + raw
+
+
+def _dtype(mode):
+    if stat.S_ISDIR(mode):
+        return DT_DIR
+    if stat.S_ISLNK(mode):
+        return DT_LNK
+    return DT_REG
+
+
+def build_image(src_dir, size=DATA_PARTITION_SIZE, erase_block=ERASE_BLOCK, uid=0, gid=0,
+                mtime=None, pad=True, compress=True):
+    """Build a JFFS2 image from a directory tree; returns the image bytes
+
+    Mode, uid and gid come from the tree's ATTRS_FILE (written by extract) where it
+    lists the path, else from the host file's mode and uid/gid.
+    """
+    writer = _Writer(size, erase_block)
+    next_ino = ROOT_INO + 1
+    inos = {src_dir: ROOT_INO}
+    attrs = {}
+    if os.path.exists(os.path.join(src_dir, ATTRS_FILE)):
+        with open(os.path.join(src_dir, ATTRS_FILE), 'r') as f:
+            attrs = json.load(f)
+
+    def meta(rel, st):
+        """(mode with the host's file type, uid, gid) for a path"""
+        mode, owner, group = attrs.get(rel, (stat.S_IMODE(st.st_mode), uid, gid))
+        return stat.S_IFMT(st.st_mode) | mode, owner, group
+
+    st = os.stat(src_dir)
+    root_mtime = int(st.st_mtime) if mtime is None else mtime
+    mode, owner, group = meta('.', st)
+    writer.add(make_inode_node(ROOT_INO, 1, mode, owner, group, 0, root_mtime, 0, b'', 0, COMPR_NONE))
+
+    for dirpath, dirnames, filenames in os.walk(src_dir):
+        dirnames.sort()
+        pino = inos[dirpath]
+        for name in sorted(dirnames + filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, src_dir).replace(os.sep, '/')
+            if rel == ATTRS_FILE:
+                continue
+            st = os.lstat(full)
+            if not (stat.S_ISDIR(st.st_mode) or stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)):
+                continue
+            mode, owner, group = meta(rel, st)
+            ino = next_ino
+            next_ino += 1
+            inos[full] = ino
+            node_mtime = int(st.st_mtime) if mtime is None else mtime
+            writer.add(make_dirent_node(pino, 1, ino, node_mtime, name, _dtype(st.st_mode)))
+
+            if stat.S_ISLNK(st.st_mode):
+                data = os.readlink(full).encode('utf-8', 'surrogateescape')
+            elif stat.S_ISREG(st.st_mode):
+                with open(full, 'rb') as f:
+                    data = f.read()
+            else:
+                data = b''
+
+            version = 1
+            if not data:
+                writer.add(make_inode_node(ino, version, mode, owner, group, 0, node_mtime, 0, b'', 0, COMPR_NONE))
+                continue
+            for offset in range(0, len(data), PAGE_SIZE):
+                chunk = data[offset:offset + PAGE_SIZE]
+                payload, compr = chunk, COMPR_NONE
+                if compress:
+                    packed = zlib.compress(chunk, 9)
+                    if len(packed) < len(chunk):
+                        payload, compr = packed, COMPR_ZLIB
+                writer.add(make_inode_node(ino, version, mode, owner, group, len(data), node_mtime,
+                                           offset, payload, len(chunk), compr))
+                version += 1
+    return writer.finish(pad)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Read and build JFFS2 images (mtdblock3 / data partition)")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('ls', help="list files")
+    p.add_argument('image')
+    p.add_argument('pattern', nargs='?', default='*', help="glob to filter paths")
+
+    p = sub.add_parser('cat', help="print a file from one or more images")
+    p.add_argument('path', help="path inside the image, globs allowed (e.g. misc/wifi/*.conf)")
+    p.add_argument('images', nargs='+')
+
+    p = sub.add_parser('extract', help="extract everything to a directory")
+    p.add_argument('image')
+    p.add_argument('out_dir')
+
+    p = sub.add_parser('build', help="build a padded image from a directory")
+    p.add_argument('src_dir')
+    p.add_argument('out')
+    p.add_argument('--size', type=int, default=DATA_PARTITION_SIZE,
+                   help=f"partition size (default {DATA_PARTITION_SIZE})")
+    p.add_argument('--erase-block', type=int, default=ERASE_BLOCK)
+    p.add_argument('--mtime', type=int, help="use a fixed timestamp for every node")
+    p.add_argument('--no-pad', action='store_true', help="don't pad to the partition size")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'ls':
+            with JFFS2Image.open(args.image) as image:
+                for path, ino, meta in image.walk():
+                    if fnmatch.fnmatch(path, args.pattern):
+                        print(f"{stat.filemode(meta.mode)} {meta.uid:5} {meta.gid:5} {meta.isize:8} {path}")
+        elif args.command == 'cat':
+            for image_path in args.images:
+                with JFFS2Image.open(image_path) as image:
+                    for path, ino, meta in image.walk():
+                        if stat.S_ISREG(meta.mode) and fnmatch.fnmatch(path, args.path):
+                            if len(args.images) > 1 or any(c in args.path for c in '*?['):
+                                print(f"==> {image_path}:{path} <==")
+                            sys.stdout.write(image.read_ino(ino).decode('utf-8', 'replace'))
+                            sys.stdout.flush()
+        elif args.command == 'extract':
+            with JFFS2Image.open(args.image) as image:
+                count = image.extract(args.out_dir)
+                print(f"✓ Extracted {count} entries to {args.out_dir}/")
+                if image.bad_nodes:
+                    print(f"  ({image.bad_nodes} nodes with bad CRCs were skipped)")
+        elif args.command == 'build':
+            data = build_image(args.src_dir, size=args.size, erase_block=args.erase_block,
+                               mtime=args.mtime, pad=not args.no_pad)
+            with open(args.out, 'wb') as f:
+                f.write(data)
+            print(f"✓ Wrote {args.out} ({len(data)} bytes)")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
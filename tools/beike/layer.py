@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Build layer: customizations kept beside squashfs-root instead of written into it
+Firmware stamping, customize (GUI dialog, CLI, customize.sh) and debloating record
+what they change here - cfg key edits, replacement or new files, deletions - and
+squashfs-root stays exactly what came out of the firmware. mksquashfs gets the
+layer at pack time as pseudo file definitions (-pf, the edited files fed in through
+cat) plus excludes (-ef), so no copy of the tree is ever made and any build can be
+reproduced from the base image and .beike-layer/.
+
+    python3 -m beike.layer status
+    python3 -m beike.layer set res/cfg/menu.cfg current=2 --section language
+    python3 -m beike.layer add etc/media_profiles.xml my_profiles.xml
+    python3 -m beike.layer rm vendor/modules/bma250.ko
+    python3 -m beike.layer reset                       # back to the plain firmware
+    python3 -m beike.layer export -d /tmp/tree         # base + layer as a real tree
+
+Edits are applied to the bytes of the base file (cfgs are GBK, not UTF-8), keyed by
+(section, key) so setting a value again replaces the earlier edit instead of piling up.
+"""
+
+import argparse
+import json
+import os
+import re
+import shlex
+import shutil
+import stat
+import sys
+import time
+
+LAYER_DIR = '.beike-layer'
+BASE_DIR = 'squashfs-root'
+EXCLUDE_FILE = '.mksquashfs_exclude'
+
+
+def _pseudo_name(rel):
+    """A path as a pseudo file definition wants it (whitespace and quotes escaped)"""
+    return re.sub(r'([\s"\'\\])', r'\\\1', rel)
+
+
+def _norm(rel):
+    rel = rel.replace(os.sep, '/').strip('/')
+    if rel.startswith(BASE_DIR + '/'):
+        rel = rel[len(BASE_DIR) + 1:]
+    rel = os.path.normpath(rel).replace(os.sep, '/')
+    if rel in ('', '.') or rel.startswith('../'):
+        raise ValueError(f"{rel or '/'}: not a path inside {BASE_DIR}")
+    return rel
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def edit_text(data, key, value, section=None):
+    """data (bytes) with key's value replaced, inside [section] when given"""
+    text = data.decode('latin-1')
+    value = str(value).encode('utf-8').decode('latin-1').replace('\\', '\\\\')
+    key = re.escape(key)
+    if section is None:
+        text = re.sub(rf'^({key}[ \t]*=[ \t]*)[^\r\n]*', rf'\g<1>{value}', text, flags=re.MULTILINE)
+    else:
+        text = re.sub(rf'(^\[{re.escape(section)}\].*?^{key}[ \t]*=[ \t]*)[^\r\n]*', rf'\g<1>{value}',
+                      text, count=1, flags=re.MULTILINE | re.DOTALL)
+    return text.encode('latin-1')
+
+
+class Layer:
+    """.beike-layer/ of a rom-building directory
+
+    layer.json holds {'base', 'edits': {rel: [[section, key, value], ...]},
+    'files': {rel: mode}, 'delete': {rel: reason}}; added files live under files/,
+    and render() writes the edited ones under render/ for mksquashfs to cat.
+    """
+
+    def __init__(self, workdir='.'):
+        self.workdir = workdir
+        self.root = os.path.join(workdir, LAYER_DIR)
+        self.base = os.path.join(workdir, BASE_DIR)
+        self.state = {'base': None, 'edits': {}, 'files': {}, 'delete': {}}
+        try:
+            with open(os.path.join(self.root, 'layer.json'), 'r') as f:
+                self.state.update(json.load(f))
+        except (OSError, ValueError):
+            pass
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        self.state['updated'] = time.time()
+        tmp = self.path('layer.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.state, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path('layer.json'))
+
+    @property
+    def empty(self):
+        return not (self.state['edits'] or self.state['files'] or self.state['delete'])
+
+    # -- changes -------------------------------------------------------------
+
+    def set_base(self, key, name):
+        """Remember which image squashfs-root came from (the store key is its sha256)"""
+        self.state['base'] = {'key': key, 'name': name}
+
+    def set(self, rel, key, value, section=None):
+        rel = _norm(rel)
+        edits = self.state['edits'].setdefault(rel, [])
+        for edit in edits:
+            if edit[0] == section and edit[1] == key:
+                edit[2] = str(value)
+                return
+        edits.append([section, key, str(value)])
+
+    def unset(self, rel, key=None, section=None):
+        """Drop the edits of rel (just key's, when given); returns how many went"""
+        rel = _norm(rel)
+        edits = self.state['edits'].get(rel, [])
+        keep = [e for e in edits if key is not None and (e[0], e[1]) != (section, key)]
+        if keep:
+            self.state['edits'][rel] = keep
+        else:
+            self.state['edits'].pop(rel, None)
+        return len(edits) - len(keep)
+
+    def add(self, rel, source):
+        """Put source in the image at rel, replacing the base file if there is one"""
+        rel = _norm(rel)
+        if not os.path.isfile(source):
+            raise ValueError(f"{source} is not a file")
+        for deleted in self.state['delete']:
+            if rel == deleted or rel.startswith(deleted + '/'):
+                raise ValueError(f"{rel} is under {deleted}, which the layer deletes")
+        dest = self.path('files', rel)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(source, dest + '.tmp')
+        os.replace(dest + '.tmp', dest)
+        base = os.path.join(self.base, rel)
+        mode = os.stat(base if os.path.isfile(base) else source).st_mode
+        self.state['files'][rel] = stat.S_IMODE(mode)
+
+    def delete(self, rel, reason='user'):
+        rel = _norm(rel)
+        added = [r for r in self.state['files'] if r == rel or r.startswith(rel + '/')]
+        if added:
+            raise ValueError(f"the layer adds {added[0]}, remove it first")
+        self.state['delete'][rel] = reason
+
+    def undelete(self, rel=None, reason=None):
+        """Stop deleting rel (or everything deleted for reason); returns how many"""
+        drop = [r for r, why in self.state['delete'].items()
+                if (rel is None or r == _norm(rel)) and (reason is None or why == reason)]
+        for r in drop:
+            del self.state['delete'][r]
+        return len(drop)
+
+    def remove(self, rel):
+        """Forget everything the layer does to rel"""
+        rel = _norm(rel)
+        found = rel in self.state['files'] or rel in self.state['edits'] or rel in self.state['delete']
+        if self.state['files'].pop(rel, None) is not None:
+            os.remove(self.path('files', rel))
+        self.state['edits'].pop(rel, None)
+        self.state['delete'].pop(rel, None)
+        return found
+
+    def reset(self):
+        base = self.state['base']
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.state = {'base': base, 'edits': {}, 'files': {}, 'delete': {}}
+
+    # -- packing -------------------------------------------------------------
+
+    def source(self, rel):
+        """Where rel's content comes from before edits: the layer's copy, else the base"""
+        if rel in self.state['files']:
+            return self.path('files', rel)
+        return os.path.join(self.base, rel)
+
+    def render(self):
+        """{rel: file holding the content the image gets} for every file the layer changes"""
+        out = {}
+        for rel in sorted(set(self.state['files']) | set(self.state['edits'])):
+            source = self.source(rel)
+            edits = self.state['edits'].get(rel)
+            if not edits:
+                out[rel] = source
+                continue
+            if not os.path.isfile(source):
+                raise ValueError(f"{rel}: edited but not in {BASE_DIR} or the layer")
+            with open(source, 'rb') as f:
+                data = f.read()
+            for section, key, value in edits:
+                data = edit_text(data, key, value, section)
+            dest = self.path('render', rel)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            # left alone when unchanged, so mtimes (and anything watching them) stay put
+            if not os.path.isfile(dest) or os.path.getsize(dest) != len(data) or _read(dest) != data:
+                with open(dest, 'wb') as f:
+                    f.write(data)
+            out[rel] = dest
+        return out
+
+    def deleted(self, rel):
+        """Whether rel is left out of the image (it or a directory above it is deleted)"""
+        parts = rel.split('/')
+        return any('/'.join(parts[:i]) in self.state['delete'] for i in range(1, len(parts) + 1))
+
+    def excludes(self):
+        """Base paths mksquashfs should leave out: deletions plus everything the layer replaces"""
+        paths = set(self.state['delete'])
+        paths.update(rel for rel in set(self.state['files']) | set(self.state['edits'])
+                     if os.path.lexists(os.path.join(self.base, rel)))
+        return sorted(paths)
+
+    def pseudo(self, rendered):
+        """Pseudo file definitions for the rendered files and any directories they need"""
+        root = os.stat(self.base)
+        lines = []
+        made = set()
+        for rel, path in sorted(rendered.items()):
+            parts = rel.split('/')[:-1]
+            for i in range(1, len(parts) + 1):
+                parent = '/'.join(parts[:i])
+                if parent not in made and not os.path.isdir(os.path.join(self.base, parent)):
+                    lines.append(f"{_pseudo_name(parent)} d 755 {root.st_uid} {root.st_gid}")
+                made.add(parent)
+            base = os.path.join(self.base, rel)
+            if os.path.isfile(base):
+                st = os.stat(base)
+                mode = stat.S_IMODE(st.st_mode)
+            else:
+                st = root
+                mode = self.state['files'].get(rel, 0o644)
+            lines.append(f"{_pseudo_name(rel)} f {mode:o} {st.st_uid} {st.st_gid} "
+                         f"cat {shlex.quote(os.path.abspath(path))}")
+        return lines
+
+    def pack_options(self, log=print):
+        """mksquashfs options (relative to workdir) that apply the layer and any exclude list"""
+        excludes = self.excludes()
+        if os.path.exists(os.path.join(self.workdir, EXCLUDE_FILE)):
+            with open(os.path.join(self.workdir, EXCLUDE_FILE), 'r') as f:
+                excludes += [line.strip() for line in f if line.strip()]
+        options = []
+        if not self.empty:
+            rendered = self.render()
+            with open(self.path('pack.pseudo'), 'w') as f:
+                f.write(''.join(line + '\n' for line in self.pseudo(rendered)))
+            options += ['-pf', f"{LAYER_DIR}/pack.pseudo"]
+            log(f"Applying build layer: {len(rendered)} changed, {len(self.state['delete'])} deleted")
+        if excludes:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.path('pack.exclude'), 'w') as f:
+                f.write(''.join(line + '\n' for line in excludes))
+            options += ['-ef', f"{LAYER_DIR}/pack.exclude"]
+        return options
+
+    def export(self, dest):
+        """Write base + layer out as a real tree at dest (for ram boot, diffing, inspection)"""
+        if os.path.lexists(dest):
+            raise ValueError(f"{dest} already exists")
+        rendered = self.render()
+
+        def ignore(directory, names):
+            rel = os.path.relpath(directory, self.base).replace(os.sep, '/')
+            return [n for n in names if self.deleted(n if rel == '.' else f"{rel}/{n}")]
+
+        shutil.copytree(self.base, dest, symlinks=True, ignore=ignore)
+        for rel, path in rendered.items():
+            full = os.path.join(dest, rel)
+            os.makedirs(os.path.dirname(full), exist_ok=True)
+            shutil.copyfile(path, full)
+            base = os.path.join(self.base, rel)
+            os.chmod(full, stat.S_IMODE(os.stat(base).st_mode) if os.path.isfile(base)
+                     else self.state['files'].get(rel, 0o644))
+        return len(rendered)
+
+    def describe(self):
+        """Lines saying what the layer does"""
+        lines = []
+        base = self.state['base']
+        if base:
+            lines.append(f"base: {base['name']} ({base['key'][:12]})")
+        for rel in sorted(set(self.state['files']) | set(self.state['edits'])):
+            what = 'replaced' if rel in self.state['files'] and os.path.exists(os.path.join(self.base, rel)) else \
+                   'added' if rel in self.state['files'] else 'edited'
+            edits = ', '.join(f"{f'[{s}] ' if s else ''}{k}={v}" for s, k, v in self.state['edits'].get(rel, []))
+            lines.append(f"  ~ {rel} ({what}{': ' + edits if edits else ''})")
+        for rel, reason in sorted(self.state['delete'].items()):
+            lines.append(f"  - {rel}{f' ({reason})' if reason != 'user' else ''}")
+        return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Customizations kept beside squashfs-root, applied at build time")
+    parser.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help="show what the layer changes")
+    p = sub.add_parser('set', help="set cfg keys in a file")
+    p.add_argument('file', help="path inside squashfs-root (e.g. res/cfg/menu.cfg)")
+    p.add_argument('values', nargs='+', metavar='KEY=VALUE')
+    p.add_argument('--section', help="only inside this [section]")
+    p = sub.add_parser('add', help="add or replace a file")
+    p.add_argument('file', help="path inside squashfs-root")
+    p.add_argument('source', help="file to put there")
+    p = sub.add_parser('rm', help="leave a file or directory out of the image")
+    p.add_argument('files', nargs='+')
+    p = sub.add_parser('revert', help="forget what the layer does to these paths")
+    p.add_argument('files', nargs='+')
+    sub.add_parser('reset', help="drop every customization")
+    sub.add_parser('options', help="print the mksquashfs options that apply the layer (for build.sh)")
+    p = sub.add_parser('export', help="write base + layer out as a tree")
+    p.add_argument('-d', '--dest', required=True)
+    args = parser.parse_args(argv)
+
+    try:
+        layer = Layer(args.workdir)
+        if not os.path.isdir(layer.base) and args.command not in ('status', 'reset'):
+            raise ValueError(f"{layer.base} not found, extract the firmware first")
+        if args.command == 'status':
+            lines = layer.describe()
+            print('\n'.join(lines) if lines else "No build layer")
+            if not layer.empty:
+                print(f"{len(layer.state['edits'])} edited, {len(layer.state['files'])} added/replaced, "
+                      f"{len(layer.state['delete'])} deleted")
+            return 0
+        if args.command == 'options':
+            print(' '.join(layer.pack_options(log=lambda message: print(message, file=sys.stderr))))
+            return 0
+        if args.command == 'set':
+            for item in args.values:
+                key, sep, value = item.partition('=')
+                if not sep or not key:
+                    raise ValueError(f"{item}: expected KEY=VALUE")
+                layer.set(args.file, key, value, args.section)
+        elif args.command == 'add':
+            layer.add(args.file, args.source)
+        elif args.command == 'rm':
+            for rel in args.files:
+                layer.delete(rel)
+        elif args.command == 'revert':
+            for rel in args.files:
+                if not layer.remove(rel):
+                    print(f"  {rel}: not in the layer")
+        elif args.command == 'reset':
+            layer.reset()
+        elif args.command == 'export':
+            count = layer.export(args.dest)
+            print(f"✓ {args.dest}: {BASE_DIR} with {count} changed file{'s' if count != 1 else ''}")
+            return 0
+        layer.render()      # catch edits to files that aren't there now, not at build time
+        layer.save()
+        print(f"✓ Build layer: {len(layer.state['edits'])} edited, {len(layer.state['files'])} added/replaced, "
+              f"{len(layer.state['delete'])} deleted")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""
+Logcat viewer
+Streams `logcat -B` (the binary entry format, no text parsing on either end) over one
+adb exec-out connection into a fixed-size ring buffer with per-tag, per-pid and
+per-priority indexes, so filtering a few hundred thousand lines is instant. The raw
+stream can be recorded to gzip files that rotate by size, and read back later.
+
+    python3 -m beike.logcat stream --tag sdv --tag CameraHardware -p W
+    python3 -m beike.logcat stream --record                  # -> ~/.cache/beike-tools/logcat/
+    python3 -m beike.logcat show logcat_20250101_120000_000.bin.gz --pid 812 --grep 'enc|fps'
+    python3 -m beike.logcat show session/*.bin.gz --stats
+
+The GUI's Logcat tab is the same ring and stream; it redraws from the indexes on a
+timer, so a chatty recording session never waits for Tk.
+"""
+
+import argparse
+import array
+import collections
+import gzip
+import heapq
+import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from . import cache_dir
+
+# struct logger_entry: len, __pad (v1) or hdr_size (v2+), pid, tid, sec, nsec
+HEADER = struct.Struct('<HHiiii')
+MAX_HEADER = 100
+MAX_PAYLOAD = 5 * 1024      # LOGGER_ENTRY_MAX_PAYLOAD is 4076 on v1, 5 KB later
+PRIORITIES = {'V': 2, 'D': 3, 'I': 4, 'W': 5, 'E': 6, 'F': 7, 'S': 8}
+PRIORITY_CHARS = {n: c for c, n in PRIORITIES.items()}
+DEFAULT_CAPACITY = 200000
+ROTATE_BYTES = 8 * 1024 * 1024      # raw bytes per recording file
+READ_CHUNK = 64 * 1024
+
+
+class Entry(collections.namedtuple('Entry', 'time pid tid priority tag message')):
+    __slots__ = ()
+
+    def line(self):
+        """threadtime format, like logcat -v threadtime"""
+        stamp = time.strftime('%m-%d %H:%M:%S', time.localtime(self.time))
+        millis = int(self.time * 1000) % 1000
+        prio = PRIORITY_CHARS.get(self.priority, '?')
+        prefix = f"{stamp}.{millis:03d} {self.pid:5} {self.tid:5} {prio} {self.tag:8}: "
+        return '\n'.join(prefix + part for part in self.message.split('\n'))
+
+
+def encode_entry(entry):
+    """One logger_entry (v1 header), as logcat -B writes it"""
+    payload = (bytes([entry.priority]) + entry.tag.encode() + b'\x00'
+               + entry.message.encode() + b'\x00')
+    sec = int(entry.time)
+    return HEADER.pack(len(payload), 0, entry.pid, entry.tid, sec,
+                       int((entry.time - sec) * 1e9)) + payload
+
+
+class BinaryParser:
+    """Cuts a logcat -B byte stream into entries; feed() it chunks as they come in"""
+
+    def __init__(self):
+        self.pending = b''
+        self.entries = 0
+
+    def feed(self, data):
+        buf = self.pending + data if self.pending else data
+        pos = 0
+        out = []
+        while len(buf) - pos >= HEADER.size:
+            length, hdr_size, pid, tid, sec, nsec = HEADER.unpack_from(buf, pos)
+            hdr_size = hdr_size or HEADER.size
+            if hdr_size < HEADER.size or hdr_size > MAX_HEADER or length > MAX_PAYLOAD:
+                raise ValueError(f"not a logcat -B stream (bad entry header at byte {self.entries})")
+            end = pos + hdr_size + length
+            if end > len(buf):
+                break
+            payload = buf[pos + hdr_size:end]
+            tag_end = payload.find(b'\x00', 1)
+            if tag_end < 0:
+                tag_end = len(payload)
+            out.append(Entry(sec + nsec / 1e9, pid, tid, payload[0] if payload else 0,
+                             payload[1:tag_end].decode(errors='replace'),
+                             payload[tag_end + 1:].rstrip(b'\x00\n').decode(errors='replace')))
+            pos = end
+        self.pending = buf[pos:]
+        self.entries += len(out)
+        return out
+
+
+class Filter:
+    """What the viewer shows: any of tags, any of pids, at least min_priority, matching grep"""
+
+    def __init__(self, tags=None, pids=None, min_priority=0, grep=None):
+        self.tags = set(tags) if tags else None
+        self.pids = set(pids) if pids else None
+        self.min_priority = min_priority or 0
+        self.grep = re.compile(grep) if grep else None
+
+    def __bool__(self):
+        return bool(self.tags or self.pids or self.min_priority or self.grep)
+
+    def match(self, entry):
+        return ((self.tags is None or entry.tag in self.tags)
+                and (self.pids is None or entry.pid in self.pids)
+                and entry.priority >= self.min_priority
+                and (self.grep is None or self.grep.search(entry.message) is not None))
+
+
+class LogRing:
+    """The newest capacity entries, in columns, with indexes updated as entries come and go
+
+    Entries are numbered by seq (never reused); an entry lives in slot seq % capacity.
+    Each index maps a tag, pid or priority to a deque of seqs, oldest first, so
+    adding appends and evicting pops from the left: both O(1) however big it gets.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.times = array.array('d', bytes(8 * capacity))
+        self.pids = array.array('i', bytes(4 * capacity))
+        self.tids = array.array('i', bytes(4 * capacity))
+        self.priorities = array.array('B', bytes(capacity))
+        self.tag_ids = array.array('I', bytes(4 * capacity))
+        self.messages = [None] * capacity
+        self.tags = []          # tag id -> name
+        self.tag_lookup = {}
+        self.by_tag = {}
+        self.by_pid = {}
+        self.by_priority = {}
+        self.first = 0          # oldest seq still held
+        self.next = 0           # seq the next entry gets
+
+    def __len__(self):
+        return self.next - self.first
+
+    def append(self, entries):
+        with self.lock:
+            for entry in entries:
+                if self.next - self.first == self.capacity:
+                    self._evict()
+                seq = self.next
+                slot = seq % self.capacity
+                tag_id = self.tag_lookup.get(entry.tag)
+                if tag_id is None:
+                    tag_id = self.tag_lookup[entry.tag] = len(self.tags)
+                    self.tags.append(entry.tag)
+                self.times[slot] = entry.time
+                self.pids[slot] = entry.pid
+                self.tids[slot] = entry.tid
+                self.priorities[slot] = entry.priority
+                self.tag_ids[slot] = tag_id
+                self.messages[slot] = entry.message
+                for index, key in ((self.by_tag, tag_id), (self.by_pid, entry.pid),
+                                   (self.by_priority, entry.priority)):
+                    seqs = index.get(key)
+                    if seqs is None:
+                        seqs = index[key] = collections.deque()
+                    seqs.append(seq)
+                self.next += 1
+
+    def _evict(self):
+        slot = self.first % self.capacity
+        for index, key in ((self.by_tag, self.tag_ids[slot]), (self.by_pid, self.pids[slot]),
+                           (self.by_priority, self.priorities[slot])):
+            seqs = index[key]
+            seqs.popleft()
+            if not seqs:
+                del index[key]
+        self.messages[slot] = None
+        self.first += 1
+
+    def entry(self, seq):
+        slot = seq % self.capacity
+        return Entry(self.times[slot], self.pids[slot], self.tids[slot], self.priorities[slot],
+                     self.tags[self.tag_ids[slot]], self.messages[slot])
+
+    def _candidates(self, flt):
+        """Newest-first seqs that can match flt, from the narrowest index that applies"""
+        options = []
+        if flt.tags is not None:
+            options.append([self.by_tag[self.tag_lookup[t]] for t in flt.tags if t in self.tag_lookup])
+        if flt.pids is not None:
+            options.append([self.by_pid[p] for p in flt.pids if p in self.by_pid])
+        if flt.min_priority:
+            options.append([seqs for prio, seqs in self.by_priority.items() if prio >= flt.min_priority])
+        if not options:
+            return range(self.next - 1, self.first - 1, -1)
+        narrowest = min(options, key=lambda lists: sum(map(len, lists)))
+        if len(narrowest) == 1:
+            return reversed(narrowest[0])
+        return heapq.merge(*(reversed(seqs) for seqs in narrowest), reverse=True)
+
+    def query(self, flt=None, after=-1, limit=None):
+        """Entries matching flt with seq > after, oldest first: at most the newest limit of them
+
+        Returns (entries, last seq looked at) so a viewer can ask for just what's new.
+        """
+        flt = flt or Filter()
+        found = []
+        with self.lock:
+            newest = self.next - 1
+            tag_ids = {self.tag_lookup[t] for t in flt.tags if t in self.tag_lookup} if flt.tags else None
+            for seq in self._candidates(flt):
+                if seq <= after or (limit is not None and len(found) >= limit):
+                    break
+                slot = seq % self.capacity
+                if ((tag_ids is None or self.tag_ids[slot] in tag_ids)
+                        and (flt.pids is None or self.pids[slot] in flt.pids)
+                        and self.priorities[slot] >= flt.min_priority
+                        and (flt.grep is None or flt.grep.search(self.messages[slot]))):
+                    found.append(self.entry(seq))
+        found.reverse()
+        return found, newest
+
+    def counts(self):
+        """{tag: entries held}, {pid: entries held}, {priority char: entries held}"""
+        with self.lock:
+            return ({self.tags[t]: len(seqs) for t, seqs in self.by_tag.items()},
+                    {p: len(seqs) for p, seqs in self.by_pid.items()},
+                    {PRIORITY_CHARS.get(p, '?'): len(seqs) for p, seqs in self.by_priority.items()})
+
+
+class Recorder:
+    """Raw logcat -B bytes into <prefix>_NNN.bin.gz files of about rotate bytes each
+
+    write() takes whole entries only, so a file always ends on an entry boundary
+    and every one of them parses on its own.
+    """
+
+    def __init__(self, directory=None, rotate=ROTATE_BYTES):
+        self.directory = directory or cache_dir('logcat')
+        os.makedirs(self.directory, exist_ok=True)
+        self.prefix = f"logcat_{time.strftime('%Y%m%d_%H%M%S')}"
+        self.rotate = rotate
+        self.files = []
+        self.out = None
+        self.written = 0
+
+    def write(self, data):
+        if self.out is None:
+            path = os.path.join(self.directory, f"{self.prefix}_{len(self.files):03d}.bin.gz")
+            self.out = gzip.open(path, 'wb', compresslevel=1)
+            self.files.append(path)
+        self.out.write(data)
+        self.written += len(data)
+        if self.written >= self.rotate:
+            self.close()
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+            self.written = 0
+
+
+class LogcatStream:
+    """adb exec-out logcat -B on a thread, feeding a ring (and a recorder)
+
+    One connection for the whole session; if it drops (camera rebooted, cable pulled)
+    it waits for the device and reconnects, skipping entries already seen.
+    """
+
+    def __init__(self, ring, recorder=None, buffers=('main',), on_entries=None, log=print):
+        self.ring = ring
+        self.recorder = recorder
+        self.buffers = buffers
+        self.on_entries = on_entries
+        self.log = log
+        self.process = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.bytes = 0
+        self.last_time = 0.0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopping.set()
+        if self.process and self.process.poll() is None:
+            self.process.kill()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=5)
+        if self.recorder:
+            self.recorder.close()
+
+    def _run(self):
+        cmd = ['adb', 'exec-out', 'logcat', '-B']
+        for name in self.buffers:
+            cmd += ['-b', name]
+        while not self.stopping.is_set():
+            try:
+                self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            except FileNotFoundError:
+                self.log("✗ adb not found")
+                return
+            parser = BinaryParser()
+            fd = self.process.stdout.fileno()
+            try:
+                while True:
+                    data = os.read(fd, READ_CHUNK)
+                    if not data:
+                        break
+                    self.bytes += len(data)
+                    held = parser.pending
+                    entries = parser.feed(data)
+                    if self.last_time:
+                        # a reconnect dumps the device's buffer again
+                        entries = [e for e in entries if e.time > self.last_time]
+                        if self.recorder and entries:
+                            self.recorder.write(b''.join(map(encode_entry, entries)))
+                    elif self.recorder:
+                        # the unfinished entry at the end waits for the next chunk
+                        chunk = held + data if held else data
+                        whole = len(chunk) - len(parser.pending)
+                        if whole:
+                            self.recorder.write(chunk[:whole])
+                    if entries:
+                        self.ring.append(entries)
+                        if self.on_entries:
+                            self.on_entries(entries)
+            except ValueError as e:
+                self.log(f"✗ {e}")
+                self.process.kill()
+                return
+            finally:
+                self.process.stdout.close()
+                self.process.wait()
+            with self.ring.lock:
+                if len(self.ring):
+                    self.last_time = self.ring.times[(self.ring.next - 1) % self.ring.capacity]
+            if self.stopping.is_set():
+                break
+            self.log("logcat connection lost, waiting for the device...")
+            subprocess.run(['adb', 'wait-for-device'], capture_output=True)
+            self.stopping.wait(1)
+
+
+def read_files(paths):
+    """Entries from recorded (optionally gzipped) logcat -B files, in order
+
+    One parser runs across all of them, so the files of a rotated recording read
+    back as the one stream they were cut from.
+    """
+    parser = BinaryParser()
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(READ_CHUNK), b''):
+                yield from parser.feed(chunk)
+
+
+def parse_priority(value):
+    if not value:
+        return 0
+    prio = PRIORITIES.get(value[0].upper())
+    if prio is None:
+        raise ValueError(f"priority must be one of {''.join(PRIORITIES)}")
+    return prio
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream, filter and record the camera's logcat")
+    sub = parser.add_subparsers(dest='command', required=True)
+    stream_parser = sub.add_parser('stream', help="follow logcat from the device")
+    stream_parser.add_argument('--record', nargs='?', const='', metavar='DIR',
+                               help="also save the raw stream (default dir: ~/.cache/beike-tools/logcat)")
+    stream_parser.add_argument('--rotate', type=int, default=ROTATE_BYTES // 1024 // 1024, metavar='MB',
+                               help="start a new recording file every MB of log")
+    stream_parser.add_argument('-b', '--buffer', action='append', dest='buffers',
+                               help="log buffer(s) to read (default: main)")
+    show_parser = sub.add_parser('show', help="filter recorded .bin/.bin.gz files")
+    show_parser.add_argument('files', nargs='+')
+    show_parser.add_argument('--tail', type=int, help="only the last N matching lines")
+    show_parser.add_argument('--stats', action='store_true', help="entries per tag, pid and priority")
+    for p in (stream_parser, show_parser):
+        p.add_argument('--tag', action='append', help="only these tags (repeatable)")
+        p.add_argument('--pid', action='append', type=int, help="only these pids (repeatable)")
+        p.add_argument('-p', '--priority', help="lowest priority to show: V D I W E F")
+        p.add_argument('--grep', help="regular expression the message must match")
+        p.add_argument('--capacity', type=int, default=DEFAULT_CAPACITY, help="entries kept in memory")
+    args = parser.parse_args(argv)
+
+    try:
+        flt = Filter(args.tag, args.pid, parse_priority(args.priority), args.grep)
+        ring = LogRing(args.capacity)
+        if args.command == 'show':
+            batch = []
+            for entry in read_files(args.files):
+                batch.append(entry)
+                if len(batch) >= 4096:
+                    ring.append(batch)
+                    batch = []
+            ring.append(batch)
+            if args.stats:
+                tags, pids, prios = ring.counts()
+                print(f"{len(ring)} entries")
+                for title, counts in (("Priority", prios), ("Tag", tags), ("Pid", pids)):
+                    print(f"  {title}:")
+                    for key, n in sorted(counts.items(), key=lambda item: -item[1])[:20]:
+                        print(f"    {n:8}  {key}")
+                return 0
+            entries, _last = ring.query(flt, limit=args.tail)
+            sys.stdout.write(''.join(entry.line() + '\n' for entry in entries))
+            return 0
+
+        recorder = Recorder(args.record or None, args.rotate * 1024 * 1024) if args.record is not None else None
+        out = sys.stdout
+
+        def show(entries):
+            text = ''.join(entry.line() + '\n' for entry in entries if flt.match(entry))
+            if text:
+                out.write(text)
+                out.flush()
+
+        stream = LogcatStream(ring, recorder, tuple(args.buffers or ('main',)), show,
+                              log=lambda message: print(message, file=sys.stderr)).start()
+        try:
+            while stream.thread.is_alive():
+                stream.thread.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stream.stop()
+        if recorder and recorder.files:
+            print(f"✓ Recorded {len(recorder.files)} file{'s' if len(recorder.files) != 1 else ''} "
+                  f"in {recorder.directory}", file=sys.stderr)
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
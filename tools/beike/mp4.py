@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""
+MP4 recording analyzer
+Reads the sample tables (stts, ctts, stsz, stco/co64, stsc, stss) of the camera's
+recordings straight out of an mmap, without decoding any video, and works out the
+frame rate, frame-interval jitter, dropped and duplicated frames, bitrate per second
+and GOP structure. Each recording is checked against the media_profiles.xml
+EncoderProfile for its resolution, so a bitrate mod can be judged from numbers.
+
+    python3 -m beike.mp4 /Volumes/SDCARD/DCIM
+    python3 -m beike.mp4 VID_0001.MP4 --seconds
+    python3 -m beike.mp4 /Volumes/SDCARD --profiles squashfs-root/etc/media_profiles.xml --json
+
+Profiles come from squashfs-root/etc/media_profiles.xml when there is one, else
+from configs/media_profiles.xml. A whole card is analyzed in parallel.
+"""
+
+import argparse
+import array
+import json
+import mmap
+import os
+import statistics
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+CONTAINERS = {b'moov', b'trak', b'mdia', b'minf', b'stbl', b'edts', b'dinf'}
+EXTENSIONS = ('.mp4', '.mov')
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_PATHS = ('squashfs-root/etc/media_profiles.xml',
+                 os.path.join(TOOLS_DIR, '..', 'configs', 'media_profiles.xml'))
+REPEAT_BYTES = 64           # a P frame this small is the encoder repeating the last one
+MIN_BITRATE = 0.8           # flag below this share of the profile's bitRate
+MIN_FPS = 0.97
+
+
+class Track:
+    def __init__(self):
+        self.handler = None
+        self.codec = None
+        self.width = self.height = 0
+        self.timescale = 0
+        self.duration = 0
+        self.deltas = array.array('I')      # decode duration of each sample
+        self.offsets = None                 # ctts composition offsets, or None
+        self.sizes = array.array('I')
+        self.sync = None                    # 1-based keyframe numbers, None = all keyframes
+        self.chunks = array.array('Q')
+        self.stsc = []                      # (first chunk, samples per chunk)
+
+
+def _be_array(typecode, data):
+    values = array.array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+
+
+def boxes(mm, start, end):
+    """(type, payload start, box end) for the boxes in mm[start:end]; a box cut short ends at end"""
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', mm, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                break
+            size = struct.unpack_from('>Q', mm, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header:
+            break
+        yield kind, pos + header, min(pos + size, end)
+        pos += size
+
+
+def _parse_table(track, kind, mm, start, end):
+    if kind == b'mdhd':
+        version = mm[start]
+        if version == 1:
+            track.timescale, track.duration = struct.unpack_from('>IQ', mm, start + 20)
+        else:
+            track.timescale, track.duration = struct.unpack_from('>II', mm, start + 12)
+    elif kind == b'hdlr':
+        track.handler = bytes(mm[start + 8:start + 12]).decode('latin-1')
+    elif kind == b'stsd':
+        entry = start + 8
+        if entry + 36 <= end:
+            track.codec = bytes(mm[entry + 4:entry + 8]).decode('latin-1')
+            if track.handler == 'vide':
+                track.width, track.height = struct.unpack_from('>HH', mm, entry + 32)
+    elif kind == b'stts':
+        count = struct.unpack_from('>I', mm, start + 4)[0]
+        pairs = _be_array('I', mm[start + 8:start + 8 + count * 8])
+        for n in range(0, len(pairs), 2):
+            track.deltas.extend(array.array('I', [pairs[n + 1]]) * pairs[n])
+    elif kind == b'ctts':
+        count = struct.unpack_from('>I', mm, start + 4)[0]
+        pairs = _be_array('i', mm[start + 8:start + 8 + count * 8])
+        track.offsets = array.array('i')
+        for n in range(0, len(pairs), 2):
+            track.offsets.extend(array.array('i', [pairs[n + 1]]) * pairs[n])
+    elif kind == b'stsz':
+        size, count = struct.unpack_from('>II', mm, start + 4)
+        if size:
+            track.sizes = array.array('I', [size]) * count
+        else:
+            track.sizes = _be_array('I', mm[start + 12:start + 12 + count * 4])
+    elif kind in (b'stco', b'co64'):
+        count = struct.unpack_from('>I', mm, start + 4)[0]
+        if kind == b'stco':
+            track.chunks = array.array('Q', _be_array('I', mm[start + 8:start + 8 + count * 4]))
+        else:
+            track.chunks = _be_array('Q', mm[start + 8:start + 8 + count * 8])
+    elif kind == b'stsc':
+        count = struct.unpack_from('>I', mm, start + 4)[0]
+        values = _be_array('I', mm[start + 8:start + 8 + count * 12])
+        track.stsc = [(values[n], values[n + 1]) for n in range(0, len(values), 3)]
+    elif kind == b'stss':
+        count = struct.unpack_from('>I', mm, start + 4)[0]
+        track.sync = _be_array('I', mm[start + 8:start + 8 + count * 4])
+
+
+def read_tracks(mm):
+    """(tracks, has_moov) from a mapped MP4/MOV"""
+    tracks = []
+    found_moov = False
+
+    def walk(start, end, track):
+        nonlocal found_moov
+        for kind, payload, box_end in boxes(mm, start, end):
+            if kind == b'moov':
+                found_moov = True
+            if kind == b'trak':
+                track = Track()
+                tracks.append(track)
+                walk(payload, box_end, track)
+            elif kind in CONTAINERS:
+                walk(payload, box_end, track)
+            elif track is not None:
+                _parse_table(track, kind, mm, payload, box_end)
+
+    walk(0, len(mm), None)
+    return tracks, found_moov
+
+
+def data_end(track):
+    """Where the track's last sample ends, from stco + stsc + stsz"""
+    if not track.chunks or not track.stsc or not track.sizes:
+        return 0
+    per_chunk = track.stsc[-1][1]
+    return track.chunks[-1] + sum(track.sizes[-per_chunk:])
+
+
+# ---------------------------------------------------------------------------
+# Analysis
+# ---------------------------------------------------------------------------
+
+def analyze_video(track):
+    """Frame timing, bitrate and GOP numbers for a video track"""
+    n = len(track.sizes)
+    scale = track.timescale or 1
+    dts = array.array('q', [0]) * n
+    t = 0
+    for i in range(min(n, len(track.deltas))):
+        dts[i] = t
+        t += track.deltas[i]
+    if track.offsets and len(track.offsets) == n:
+        pts = sorted(d + o for d, o in zip(dts, track.offsets))
+    else:
+        pts = list(dts)
+    intervals = [b - a for a, b in zip(pts, pts[1:])]
+    result = {'frames': n, 'codec': track.codec, 'width': track.width, 'height': track.height,
+              'duration': (t or track.duration) / scale,
+              'b_frames': bool(track.offsets and any(track.offsets))}
+    if not intervals:
+        return result
+    nominal = statistics.median(intervals) or 1
+    span = (pts[-1] - pts[0]) or 1
+    dropped = sum(round(iv / nominal) - 1 for iv in intervals if iv >= 1.5 * nominal)
+    duplicated = sum(1 for iv in intervals if iv <= 0.5 * nominal)
+    # drops and duplicates are counted on their own, jitter is how far the rest wander
+    deviations = [abs(iv - nominal) * 1000 / scale for iv in intervals if 0.5 * nominal < iv < 1.5 * nominal]
+    sync = set(track.sync) if track.sync is not None else None
+    repeated = sum(1 for i, size in enumerate(track.sizes)
+                   if size <= REPEAT_BYTES and (sync is None or i + 1 not in sync))
+
+    # bitrate per second of presentation time
+    seconds = {}
+    for i in range(n):
+        second = int((dts[i] + (track.offsets[i] if result['b_frames'] else 0) - pts[0]) / scale)
+        seconds[second] = seconds.get(second, 0) + track.sizes[i]
+    per_second = [seconds.get(s, 0) * 8 for s in range(max(seconds) + 1)] if seconds else []
+    # the last second is usually partial
+    full = per_second[:-1] if len(per_second) > 2 else per_second
+
+    if track.sync is not None and len(track.sync):
+        keys = list(track.sync)
+        gops = [b - a for a, b in zip(keys, keys[1:])] + [n + 1 - keys[-1]]
+    else:
+        gops = [1] * n
+    result.update({
+        'fps': (len(pts) - 1) * scale / span,
+        'nominal_fps': scale / nominal,
+        'jitter_ms': statistics.pstdev(deviations) if deviations else 0,
+        'max_deviation_ms': max(deviations) if deviations else 0,
+        'dropped': dropped,
+        'duplicated': duplicated,
+        'repeated': repeated,
+        'bitrate': sum(track.sizes) * 8 / (span / scale + nominal / scale),
+        'per_second': per_second,
+        'min_second': min(full) if full else 0,
+        'max_second': max(full) if full else 0,
+        'gop': statistics.mean(gops) if gops else 0,
+        'gop_min': min(gops) if gops else 0,
+        'gop_max': max(gops) if gops else 0,
+        'keyframes': len(track.sync) if track.sync is not None else n,
+    })
+    return result
+
+
+def analyze_file(path):
+    """Everything for one recording, as a dict (error set if it couldn't be read)"""
+    result = {'path': path, 'size': 0, 'flags': []}
+    try:
+        result['size'] = os.path.getsize(path)
+        if not result['size']:
+            result['error'] = "empty file"
+            return result
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            tracks, has_moov = read_tracks(mm)
+    except (OSError, ValueError, struct.error) as e:
+        result['error'] = str(e)
+        return result
+    if not has_moov:
+        result['error'] = "no moov box (recording never finalized, e.g. power cut)"
+        return result
+    video = [t for t in tracks if t.handler == 'vide']
+    audio = [t for t in tracks if t.handler == 'soun']
+    if not video:
+        result['error'] = "no video track"
+        return result
+    result['video'] = analyze_video(video[0])
+    if audio:
+        a = audio[0]
+        result['audio'] = {'codec': a.codec, 'samples': len(a.sizes),
+                           'bitrate': sum(a.sizes) * 8 / (a.duration / a.timescale) if a.duration and a.timescale else 0}
+    result['truncated'] = any(data_end(t) > result['size'] for t in tracks)
+    return result
+
+
+def _job(path):
+    try:
+        return analyze_file(path)
+    except Exception as e:      # keep one odd file from killing the whole card
+        return {'path': path, 'size': 0, 'flags': [], 'error': f"{type(e).__name__}: {e}"}
+
+
+def analyze_paths(paths, jobs=None):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                files += [os.path.join(dirpath, name) for name in sorted(filenames)
+                          if name.lower().endswith(EXTENSIONS) and not name.startswith('._')]
+        else:
+            files.append(path)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(files) < 2:
+        return [_job(path) for path in files]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_job, files))
+
+
+# ---------------------------------------------------------------------------
+# Profiles
+# ---------------------------------------------------------------------------
+
+def load_profiles(path):
+    """[{camera, quality, width, height, fps, bitrate}] from a media_profiles.xml"""
+    profiles = []
+    root = ET.parse(path).getroot()
+    for cams in root.iter('CamcorderProfiles'):
+        for profile in cams.iter('EncoderProfile'):
+            video = profile.find('Video')
+            if video is None:
+                continue
+            profiles.append({'camera': int(cams.get('cameraId', 0)), 'quality': profile.get('quality'),
+                             'width': int(video.get('width')), 'height': int(video.get('height')),
+                             'fps': int(video.get('frameRate')), 'bitrate': int(video.get('bitRate'))})
+    return profiles
+
+
+def default_profiles():
+    for path in PROFILE_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def match_profile(profiles, video):
+    """The back camera's profile for this resolution with the nearest frame rate, or None"""
+    same = [p for p in profiles if (p['width'], p['height']) == (video['width'], video['height'])]
+    if not same:
+        return None
+    fps = video.get('nominal_fps', 0)
+    return min(same, key=lambda p: (p['camera'], abs(p['fps'] - fps), 'timelapse' in (p['quality'] or '')))
+
+
+def check(result, profiles, min_bitrate=MIN_BITRATE):
+    """Add flags for whatever falls short; returns the flags"""
+    flags = result['flags']
+    if 'error' in result:
+        flags.append(result['error'])
+        return flags
+    video = result['video']
+    if result.get('truncated'):
+        flags.append("sample data runs past the end of the file (truncated)")
+    if video.get('dropped'):
+        flags.append(f"{video['dropped']} dropped frames")
+    if video.get('duplicated'):
+        flags.append(f"{video['duplicated']} duplicated timestamps")
+    if video.get('repeated'):
+        flags.append(f"{video['repeated']} repeated (skip) frames")
+    if video.get('fps') and video['max_deviation_ms'] * video['nominal_fps'] / 1000 > 0.25:
+        flags.append(f"frame timing jitter up to {video['max_deviation_ms']:.1f} ms")
+    profile = match_profile(profiles, video) if profiles else None
+    result['profile'] = profile
+    if profile and video.get('fps'):
+        if video['fps'] < profile['fps'] * MIN_FPS:
+            flags.append(f"{video['fps']:.2f} fps, profile {profile['quality']} asks for {profile['fps']}")
+        if video['bitrate'] < profile['bitrate'] * min_bitrate:
+            flags.append(f"{video['bitrate'] / 1e6:.1f} Mbps is {video['bitrate'] * 100 / profile['bitrate']:.0f}% "
+                         f"of the profile's {profile['bitrate'] / 1e6:g} Mbps")
+    return flags
+
+
+def format_result(result):
+    name = os.path.basename(result['path'])
+    mark = '✗' if result['flags'] else '✓'
+    if 'video' not in result:
+        return f"{mark} {name}: {result.get('error', 'unreadable')}"
+    v = result['video']
+    if not v.get('fps'):
+        return f"{mark} {name}: {v['frames']} frames, too short to analyze"
+    profile = result.get('profile')
+    share = f" ({v['bitrate'] * 100 / profile['bitrate']:.0f}% of {profile['quality']})" if profile else ''
+    line = (f"{mark} {name}: {v['width']}x{v['height']} {v['fps']:.2f} fps, {v['duration']:.0f}s, "
+            f"{v['bitrate'] / 1e6:.1f} Mbps{share} [{v['min_second'] / 1e6:.1f}-{v['max_second'] / 1e6:.1f}/s], "
+            f"GOP {v['gop']:.0f} ({v['gop'] / (v['nominal_fps'] or 1):.1f}s), jitter {v['jitter_ms']:.2f} ms")
+    return line + ''.join(f"\n    ✗ {flag}" for flag in result['flags'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check MP4 recordings for dropped frames and bitrate")
+    parser.add_argument('paths', nargs='+', help="recordings or directories (e.g. the card's DCIM)")
+    parser.add_argument('--profiles', help="media_profiles.xml to check against (default: squashfs-root's, else configs/)")
+    parser.add_argument('--min-bitrate', type=float, default=MIN_BITRATE * 100, metavar='PERCENT',
+                        help="flag recordings below this share of the profile's bitRate (default: 80)")
+    parser.add_argument('--seconds', action='store_true', help="print the bitrate of every second")
+    parser.add_argument('-j', '--jobs', type=int, help="worker processes (default: all cores)")
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        profiles_path = args.profiles or default_profiles()
+        profiles = load_profiles(profiles_path) if profiles_path else []
+        results = analyze_paths(args.paths, args.jobs)
+        if not results:
+            raise ValueError("no .mp4/.mov files found")
+        for result in results:
+            check(result, profiles, args.min_bitrate / 100)
+        if args.json:
+            print(json.dumps(results, indent=1))
+        else:
+            if profiles_path:
+                print(f"Profiles from {os.path.normpath(profiles_path)}")
+            for result in results:
+                print(format_result(result))
+                if args.seconds and 'video' in result:
+                    for second, bits in enumerate(result['video'].get('per_second', [])):
+                        print(f"    {second:5}s {bits / 1e6:7.2f} Mbps")
+            flagged = sum(1 for r in results if r['flags'])
+            print(f"{len(results)} recordings, {flagged} flagged")
+        return 1 if any(r['flags'] for r in results) else 0
+    except (ValueError, OSError, ET.ParseError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
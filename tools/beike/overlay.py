@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Live config overlay
+Pushes the config files you've changed in squashfs-root or the build layer (res/cfg,
+hawkview tuning, media_profiles.xml, camera.cfg) to /data/overlay over ADB and bind mounts them over
+their /system paths, then restarts sdv and mediaserver so they read the new values.
+Only files whose md5 differs from what the camera sees are sent, so a tweak takes a
+few seconds instead of a rebuild and reflash.
+
+    python3 -m beike.overlay push                      # changed configs in squashfs-root
+    python3 -m beike.overlay push --path 'etc/hawkview/*'
+    python3 -m beike.overlay status
+    python3 -m beike.overlay down                      # back to the flashed /system
+
+Binds don't survive a reboot and /data/overlay is removed by down, so the camera is
+never left running something that isn't in a ROM. Which binds are up is recorded per
+device serial in the beike cache; status checks that against /proc/mounts.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import posixpath
+import subprocess
+import sys
+import time
+
+from . import cache_dir, layer
+
+OVERLAY_DIR = '/data/overlay'
+# What sdv and mediaserver read at start; everything else needs a real build
+DEFAULT_PATHS = ('res/cfg/*.cfg', 'etc/camera.cfg', 'etc/media_profiles.xml', 'etc/hawkview/*')
+# init service names: sdv reads res/cfg, mediaserver ("media") the camera HAL's configs
+SERVICES = ('sdv', 'media')
+MD5_BATCH = 16              # paths per md5 call, old adb shell lines are short
+NOT_FOUND = ('No such file', 'could not open')
+
+
+def _adb(*args, check=True):
+    result = subprocess.run(['adb'] + list(args), capture_output=True)
+    if check and result.returncode:
+        raise OSError(f"adb {' '.join(args[:2])} failed: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout.decode(errors='replace').replace('\r\n', '\n')
+
+
+def shell(command):
+    """adb shell output; old adbd doesn't pass the exit status back, check effects instead"""
+    return _adb('shell', command, check=False)
+
+
+def serial():
+    serialno = _adb('get-serialno').strip()
+    if not serialno or serialno == 'unknown':
+        raise OSError("No device connected via ADB")
+    return serialno
+
+
+def local_files(root, paths=DEFAULT_PATHS):
+    """squashfs-root relative path -> md5 for the regular files matching paths"""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, root).replace(os.sep, '/')
+            if os.path.islink(full) or not any(fnmatch.fnmatch(rel, p) for p in paths):
+                continue
+            files[rel] = _md5(full)
+    return files
+
+
+def _md5(path):
+    with open(path, 'rb') as f:
+        return hashlib.md5(f.read()).hexdigest()
+
+
+def build_tree(root, build):
+    """rel -> ('f', file with its content) / ('l', link target) / ('d', None) for the next build
+
+    That's squashfs-root with the build layer's changes on top and its deletions
+    left out: what a directory bind has to carry so nothing else in it goes missing.
+    """
+    entries = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in list(dirnames) + sorted(filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, root).replace(os.sep, '/')
+            if build.deleted(rel):
+                if name in dirnames:
+                    dirnames.remove(name)
+            elif os.path.islink(full):
+                entries[rel] = ('l', os.readlink(full))
+            elif os.path.isdir(full):
+                entries[rel] = ('d', None)
+            elif os.path.isfile(full):
+                entries[rel] = ('f', full)
+    for rel, path in build.render().items():
+        if not build.deleted(rel):
+            entries[rel] = ('f', path)
+    return entries
+
+
+def device_md5(rels):
+    """rel -> md5 of /system/<rel> as the camera sees it (binds included); missing files left out"""
+    sums = {}
+    rels = list(rels)
+    for start in range(0, len(rels), MD5_BATCH):
+        batch = ['/system/' + rel for rel in rels[start:start + MD5_BATCH]]
+        for line in shell('md5 ' + ' '.join(batch)).splitlines():
+            parts = line.split()
+            if len(parts) == 2 and len(parts[0]) == 32 and parts[1].startswith('/system/'):
+                sums[parts[1][len('/system/'):]] = parts[0]
+    return sums
+
+
+def device_dir_exists(rel):
+    out = shell(f'ls /system/{rel}')
+    return not any(marker in out for marker in NOT_FOUND)
+
+
+def mounted():
+    """Mount points under /system (anything there besides /system itself is one of ours)"""
+    points = []
+    for line in shell('cat /proc/mounts').splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].startswith('/system/'):
+            points.append(fields[1])
+    return points
+
+
+# ---------------------------------------------------------------------------
+# Record
+# ---------------------------------------------------------------------------
+
+def record_path(serialno):
+    return os.path.join(cache_dir('overlay'), f"{serialno}.json")
+
+
+def load_record(serialno):
+    try:
+        with open(record_path(serialno), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'serial': serialno, 'binds': {}}
+
+
+def save_record(record):
+    record['updated'] = time.time()
+    path = record_path(record['serial'])
+    if not record['binds']:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    with open(path, 'w') as f:
+        json.dump(record, f, indent=1, sort_keys=True)
+
+
+# ---------------------------------------------------------------------------
+# Operations
+# ---------------------------------------------------------------------------
+
+def plan(local, sums, record, tree=None):
+    """(bind target, kind, files to push) for each changed file
+
+    A file the camera already has gets a file bind. A new file can't be bound on its
+    own (there's nothing to mount over), so its nearest existing directory is bound
+    instead, with everything tree has under it pushed (not just the files matching
+    the paths) so the directory stays complete. Files under a directory that's
+    already bound just need pushing.
+    """
+    dir_binds = [t for t, entry in record['binds'].items() if entry['kind'] == 'dir']
+    changed = [rel for rel, digest in local.items() if sums.get(rel) != digest]
+    steps = {}
+    covered = set()
+    for rel in changed:
+        inside = [t for t in dir_binds if rel.startswith(t + '/')]
+        if inside:
+            steps.setdefault(inside[0], ('push', []))[1].append(rel)
+        elif rel in sums:
+            steps[rel] = ('file', [rel])
+        else:
+            target = posixpath.dirname(rel)
+            while target and not device_dir_exists(target):
+                target = posixpath.dirname(target)
+            if not target:
+                raise ValueError(f"{rel}: no existing /system directory to bind over")
+            steps[target] = ('dir', sorted(r for r in (tree or local) if r.startswith(target + '/')))
+    for target, (kind, _files) in steps.items():
+        if kind == 'dir':
+            covered.update(t for t in steps if t.startswith(target + '/'))
+    return [(t, kind, files) for t, (kind, files) in sorted(steps.items()) if t not in covered]
+
+
+def restart(log=print):
+    """Restart sdv last so it finds mediaserver up (the other way round its camera open fails)"""
+    log(f"Restarting {', '.join(SERVICES)}...")
+    for name in SERVICES:
+        shell(f'stop {name}')
+    for name in reversed(SERVICES):
+        shell(f'start {name}')
+
+
+def push(workdir='.', paths=DEFAULT_PATHS, do_restart=True, log=print):
+    """Overlay the changed config files; returns the updated record"""
+    root = os.path.join(workdir, 'squashfs-root')
+    if not os.path.isdir(root):
+        raise ValueError(f"{root} not found")
+    record = load_record(serial())
+    local = local_files(root, paths)
+    # what the next build would put there: the build layer's changes over squashfs-root
+    build = layer.Layer(workdir)
+    tree = build_tree(root, build)
+    for rel, (kind, path) in tree.items():
+        if kind == 'f' and path != os.path.join(root, rel) and any(fnmatch.fnmatch(rel, p) for p in paths):
+            local[rel] = _md5(path)
+    for rel in [rel for rel in local if build.deleted(rel)]:
+        del local[rel]
+    if not local:
+        raise ValueError(f"no files in {root} match {', '.join(paths)}")
+    steps = plan(local, device_md5(local), record, tree)
+    if not steps:
+        log(f"Nothing to push, the camera already has all {len(local)} files")
+        return record
+
+    points = mounted()
+    for target, kind, files in steps:
+        log(f"  {target} ({kind}, {len(files)} file{'s' if len(files) != 1 else ''})")
+        if kind != 'push':
+            # binds below this one (an earlier file bind, say) would hide the new copies
+            for point in sorted(points, reverse=True):
+                if point == '/system/' + target or point.startswith(f'/system/{target}/'):
+                    shell(f'umount {point}')
+                    record['binds'].pop(point[len('/system/'):], None)
+        sums = {}
+        for rel in files:
+            entry_kind, data = tree[rel]
+            if entry_kind == 'd':
+                shell(f'mkdir -p {OVERLAY_DIR}/{rel}')
+                continue
+            shell(f'mkdir -p {OVERLAY_DIR}/{posixpath.dirname(rel)}')
+            if entry_kind == 'l':
+                shell(f'ln -sf {data} {OVERLAY_DIR}/{rel}')
+            else:
+                _adb('push', data, f'{OVERLAY_DIR}/{rel}')
+                sums[rel] = local.get(rel) or _md5(data)
+        if kind == 'push':
+            record['binds'][target]['files'].update(sums)
+            continue
+        shell(f'mount -o bind {OVERLAY_DIR}/{target} /system/{target}')
+        record['binds'][target] = {'kind': kind, 'files': sums, 'pushed': time.time()}
+
+    missing = [t for t, _kind, _files in steps if '/system/' + t not in mounted()]
+    save_record(record)
+    if missing:
+        raise OSError(f"bind mount failed for {', '.join(missing)} (is adbd running as root?)")
+    if do_restart:
+        restart(log)
+    return record
+
+
+def status(log=print):
+    """Log the recorded binds against /proc/mounts; returns (active, gone, stray)"""
+    record = load_record(serial())
+    points = set(mounted())
+    active = [t for t in sorted(record['binds']) if '/system/' + t in points]
+    gone = [t for t in sorted(record['binds']) if '/system/' + t not in points]
+    stray = sorted(p for p in points if p[len('/system/'):] not in record['binds'])
+    for target in active:
+        entry = record['binds'][target]
+        log(f"  ✓ /system/{target} ({entry['kind']}, {len(entry['files'])} file{'s' if len(entry['files']) != 1 else ''}, "
+            f"pushed {time.strftime('%H:%M:%S', time.localtime(entry['pushed']))})")
+    for target in gone:
+        log(f"  ✗ /system/{target} not mounted (camera rebooted?)")
+    for point in stray:
+        log(f"  ? {point} mounted but not in this host's record")
+    if gone and not active:
+        # all gone means the camera rebooted, forget them
+        record['binds'] = {}
+        save_record(record)
+    return active, gone, stray
+
+
+def down(do_restart=True, log=print):
+    """Unmount every bind under /system, delete /data/overlay and restart the services"""
+    record = load_record(serial())
+    points = mounted()
+    for point in sorted(points, reverse=True):
+        log(f"  umount {point}")
+        shell(f'umount {point}')
+    shell(f'rm -r {OVERLAY_DIR}')
+    left = mounted()
+    record['binds'] = {}
+    save_record(record)
+    if left:
+        raise OSError(f"still mounted: {', '.join(left)}")
+    if points and do_restart:
+        restart(log)
+    return len(points)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Try config changes on the camera without reflashing")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('push', help="push changed configs and bind mount them over /system")
+    p.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    p.add_argument('--path', action='append', metavar='GLOB',
+                   help="squashfs-root paths to overlay (default: res/cfg, hawkview, media_profiles.xml, camera.cfg)")
+    p.add_argument('--no-restart', action='store_true', help="don't restart sdv and mediaserver")
+    sub.add_parser('status', help="show which overlays are mounted")
+    p = sub.add_parser('down', help="remove all overlays")
+    p.add_argument('--no-restart', action='store_true')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'push':
+            record = push(args.workdir, args.path or DEFAULT_PATHS, not args.no_restart)
+            print(f"✓ {len(record['binds'])} overlay{'s' if len(record['binds']) != 1 else ''} active, "
+                  f"remove with: python3 -m beike.overlay down")
+        elif args.command == 'status':
+            active, gone, stray = status()
+            if not (active or gone or stray):
+                print("No overlays, the camera is running the flashed /system")
+        else:
+            count = down(not args.no_restart)
+            print(f"✓ Removed {count} overlay{'s' if count != 1 else ''}")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Partitions of a backup directory or full flash image, without reading them in
+A backup (mtdblock0, mtdblock1, ...) has each file mmapped; a full restore image is
+mmapped once and cut up by the flash layout (its own mtdparts= if it has one, else
+the reference layout). Partitions come out as zero-copy memoryviews, and hashing,
+searching and saving work on the mapping, so memory stays flat however big the
+image is.
+
+    python3 -m beike.partimage backup_20250101_120000
+    python3 -m beike.partimage full_restore_v1.0.bin --save boot_logo boot.raw
+
+Views handed out by view() must be released (use them as context managers) before
+the image is closed.
+"""
+
+import argparse
+import hashlib
+import mmap
+import os
+import shutil
+import sys
+
+from .flash import DEFAULT_LAYOUT, ERASE_BLOCK, find_mtdparts, make_layout, parse_mtdparts, partition_by_name
+
+JPEG_MAGIC = b'\xff\xd8\xff'
+# (offset, magic, what it is) for identify()
+SIGNATURES = (
+    (0, b'ANDROID!', 'boot image'),
+    (0, b'hsqs', 'squashfs'),
+    (0, b'\x85\x19', 'jffs2'),
+    (0, b'\x19\x85', 'jffs2'),
+    (0, JPEG_MAGIC, 'jpeg'),
+    (4, b'eGON.BT0', 'spl'),
+)
+
+
+def _map(path):
+    """(file, mmap) for path; empty files get (None, b'') since they can't be mapped"""
+    if not os.path.getsize(path):
+        return None, b''
+    f = open(path, 'rb')
+    return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def write_padded(src, dest, size):
+    """Copy src to dest and zero-fill it to size bytes (the fill is a truncate, not a buffer)"""
+    have = os.path.getsize(src)
+    if have > size:
+        raise ValueError(f"{os.path.basename(src)} is {have} bytes, more than {size}")
+    with open(src, 'rb') as fin, open(dest, 'wb') as fout:
+        shutil.copyfileobj(fin, fout)
+        fout.truncate(size)
+    return dest
+
+
+class PartitionImage:
+    """mtdblock partitions of a backup directory or a full flash image, mmapped"""
+    def __init__(self, path, layout=None):
+        self.path = path
+        self._files = []
+        self._maps = []
+        self._entries = {}     # partition index -> (mmap or b'', offset in it)
+        try:
+            if os.path.isdir(path):
+                self._open_dir(path)
+            else:
+                self._open_image(path, layout)
+        except Exception:
+            self.close()
+            raise
+
+    @classmethod
+    def open(cls, path, layout=None):
+        """A backup directory (mtdblock0, mtdblock1, ...) or a full restore image"""
+        if not os.path.exists(path):
+            raise ValueError(f"{path} not found")
+        return cls(path, layout)
+
+    def _add_map(self, path):
+        f, mm = _map(path)
+        if f:
+            self._files.append(f)
+            self._maps.append(mm)
+        return mm
+
+    def _open_dir(self, path):
+        # a missing block keeps its default size so the offsets after it stay put
+        parts = []
+        while len(parts) < len(DEFAULT_LAYOUT) or os.path.exists(os.path.join(path, f"mtdblock{len(parts)}")):
+            block = os.path.join(path, f"mtdblock{len(parts)}")
+            default = DEFAULT_LAYOUT[len(parts)] if len(parts) < len(DEFAULT_LAYOUT) else None
+            parts.append((default.name if default else f"mtdblock{len(parts)}",
+                          os.path.getsize(block) if os.path.exists(block) else default.size))
+        self.layout = make_layout(parts)
+        for part in self.layout:
+            block = os.path.join(path, part.block)
+            if os.path.exists(block):
+                self._entries[part.index] = (self._add_map(block), 0)
+        if not self._entries:
+            raise ValueError(f"no mtdblock files in {path}")
+
+    def _open_image(self, path, layout):
+        mm = self._add_map(path)
+        if not layout:
+            found = find_mtdparts(mm)
+            layout = parse_mtdparts(found) if found else DEFAULT_LAYOUT
+        # a restore image made from the first few blocks stops early; keep the whole ones
+        self.layout = [part for part in layout if part.end <= len(mm)]
+        if not self.layout:
+            raise ValueError(f"{path} ({len(mm)} bytes) doesn't hold a whole partition")
+        for part in self.layout:
+            self._entries[part.index] = (mm, part.offset)
+
+    def close(self):
+        for mm in self._maps:
+            mm.close()
+        for f in self._files:
+            f.close()
+        self._maps = []
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __iter__(self):
+        """The partitions that are actually there"""
+        return iter([part for part in self.layout if part.index in self._entries])
+
+    def __contains__(self, name):
+        return self.partition(name) is not None
+
+    def partition(self, name):
+        """The Partition for a name ('system') or block ('mtdblock2'), or None"""
+        part = partition_by_name(name, self.layout)
+        return part if part and part.index in self._entries else None
+
+    def _locate(self, name):
+        part = self.partition(name)
+        if not part:
+            raise ValueError(f"{self.path} has no {name} partition")
+        buf, base = self._entries[part.index]
+        return part, buf, base
+
+    def size(self, name):
+        return self._locate(name)[0].size
+
+    def view(self, name, start=0, end=None):
+        """Zero-copy memoryview of a partition (or a slice of it); release it when done"""
+        part, buf, base = self._locate(name)
+        end = part.size if end is None else min(end, part.size)
+        return memoryview(buf)[base + start:base + max(start, end)]
+
+    def find(self, name, needle, start=0):
+        """Offset of needle within a partition, or -1 (searched in place)"""
+        part, buf, base = self._locate(name)
+        found = buf.find(needle, base + start, base + part.size)
+        return found - base if found >= 0 else -1
+
+    def sha256(self, name):
+        h = hashlib.sha256()
+        with self.view(name) as view:
+            h.update(view)
+        return h.hexdigest()
+
+    def block_hashes(self, name, block_size=ERASE_BLOCK):
+        """sha256 of each erase block of a partition"""
+        hashes = []
+        with self.view(name) as view:
+            for start in range(0, len(view), block_size):
+                hashes.append(hashlib.sha256(view[start:start + block_size]).hexdigest())
+        return hashes
+
+    def identify(self, name):
+        """What the partition starts with ('squashfs', 'jpeg', ...), or None if blank/unknown"""
+        part, buf, base = self._locate(name)
+        head = buf[base:base + min(part.size, 16)]
+        for offset, magic, label in SIGNATURES:
+            if head[offset:offset + len(magic)] == magic:
+                return label
+        if head and head.strip(b'\xff') == b'':
+            return 'erased'
+        return None
+
+    def save(self, name, dest, start=0, end=None):
+        """Write a partition (or part of one) to dest; returns the bytes written"""
+        with self.view(name, start, end) as view, open(dest, 'wb') as f:
+            return f.write(view)
+
+    def write_to(self, f, names=None):
+        """Write partitions back to back into an open file; returns the bytes written"""
+        written = 0
+        for part in self:
+            if names is None or part.name in names or part.block in names:
+                with self.view(part.block) as view:
+                    written += f.write(view)
+        return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Partitions of a backup directory or full flash image")
+    parser.add_argument('path', help="backup directory or full_restore_v*.bin")
+    parser.add_argument('--save', nargs=2, metavar=('NAME', 'FILE'), help="write one partition out")
+    parser.add_argument('--hash', action='store_true', help="also sha256 each partition")
+    args = parser.parse_args(argv)
+
+    try:
+        with PartitionImage.open(args.path) as image:
+            if args.save:
+                written = image.save(args.save[0], args.save[1])
+                print(f"✓ {args.save[0]}: {written} bytes to {args.save[1]}")
+                return 0
+            for part in image:
+                line = (f"  {part.block:10} {part.name:14} offset {part.offset:8}  size {part.size:8}  "
+                        f"{image.identify(part.block) or '-'}")
+                if args.hash:
+                    line += f"  {image.sha256(part.block)[:16]}"
+                print(line)
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Boot a candidate ROM from RAM over FEL
+Loads U-Boot, the kernel from mtdblock1 and an initrd holding the stock ramdisk plus
+the candidate system tree into DRAM, and boots it with a cmdline that points the
+kernel at that initrd. init.rc is patched to use the /system already in the rootfs
+instead of mounting mtdblock2, and /data is a tmpfs, so nothing touches SPI flash.
+Power cycling (or wdreset) goes straight back to whatever is flashed.
+
+    python3 -m beike.ramboot prepare --boot mtdblock1 --tree squashfs-root -o ramboot/
+    python3 -m beike.cli ramboot system_v1.1.bin       # does the same plus the FEL load
+
+The stock kernel has no phram, loop or ramdisk block driver, so the squashfs can't be
+mounted straight from RAM; the system goes in as a second initramfs archive instead.
+Needs a mainline u-boot-sunxi-with-spl.bin for the V3/V3s (FEL can't load the
+vendor bootloader); by default it is looked for in sunxi-tools/.
+"""
+
+import argparse
+import gzip
+import os
+import re
+import shlex
+import stat
+import struct
+import sys
+import time
+import zlib
+
+from . import cpio
+from .bootimg import BootImage
+
+# Low in DRAM so U-Boot relocating itself to the top of a 64 MB part can't clobber them
+KERNEL_ADDR = 0x41000000
+INITRD_ADDR = 0x41800000
+SCRIPT_ADDR = 0x43100000
+INITRD_LIMIT = SCRIPT_ADDR - INITRD_ADDR
+MACHID = '1029'             # sun8i, the vendor 3.4 kernel boots with ATAGs
+DEFAULT_BOOTARGS = 'console=ttyS0,115200 init=/init loglevel=4'
+RAMBOOT_MARK = 'androidboot.ramboot=1'
+UBOOT_NAME = 'u-boot-sunxi-with-spl.bin'
+SPL_MAGIC = b'eGON.BT0'
+ZIMAGE_MAGIC = 0x016f2818
+
+# mkimage legacy header, for the boot script (-T script)
+IH_MAGIC = 0x27051956
+IH_HEADER = struct.Struct('>7I4B32s')
+IH_OS_LINUX, IH_ARCH_ARM, IH_TYPE_SCRIPT = 5, 2, 6
+
+FLASH_MOUNT_RE = re.compile(r'^(\s*)(wait|setupfs|mount)\s.*?/dev/block/mtdblock(\d+)\b')
+
+
+def patch_rc(text, keep_data=False):
+    """Stop init mounting mtdblock2 (and mtdblock3 unless keep_data); returns (text, changes)"""
+    out = []
+    changes = 0
+    for line in text.splitlines(keepends=True):
+        m = FLASH_MOUNT_RE.match(line)
+        block = int(m.group(3)) if m else None
+        if block == 2 or (block == 3 and not keep_data):
+            indent, command = m.group(1), m.group(2)
+            out.append(f"{indent}# ramboot: {line.strip()}\n")
+            if block == 3 and command == 'mount':
+                out.append(f"{indent}mount tmpfs tmpfs /data\n")
+            changes += 1
+            continue
+        out.append(line)
+    return ''.join(out), changes
+
+
+def ramdisk_archive(image, keep_data=False):
+    """The boot image's ramdisk with its rc files patched, gzipped"""
+    entries = cpio.read_cpio(image.ramdisk_cpio())
+    changes = 0
+    for entry in entries:
+        if entry.is_file and entry.name.endswith('.rc') and '/' not in entry.name:
+            text, n = patch_rc(entry.data.decode('latin-1'), keep_data)
+            if n:
+                entry.data = text.encode('latin-1')
+                changes += n
+    if not changes:
+        raise ValueError("no mtdblock2 mount found in the ramdisk's rc files")
+    return gzip.compress(cpio.write_cpio(entries), 6)
+
+
+def system_archive(tree):
+    """A squashfs-root tree as a gzipped cpio of system/..."""
+    entries = [cpio.Entry('system', stat.S_IFDIR | 0o755, ino=1, nlink=2)]
+    ino = 2
+    for dirpath, dirnames, filenames in os.walk(tree):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            full = os.path.join(dirpath, name)
+            rel = os.path.relpath(full, tree).replace(os.sep, '/')
+            st = os.lstat(full)
+            if stat.S_ISLNK(st.st_mode):
+                data = os.readlink(full).encode()
+            elif stat.S_ISREG(st.st_mode):
+                with open(full, 'rb') as f:
+                    data = f.read()
+            elif stat.S_ISDIR(st.st_mode):
+                data = b''
+            else:
+                continue
+            entries.append(cpio.Entry(f'system/{rel}', st.st_mode, data, mtime=int(st.st_mtime), ino=ino))
+            ino += 1
+    return gzip.compress(cpio.write_cpio(entries), 6)
+
+
+def initrd(boot_image, tree, keep_data=False):
+    """Stock ramdisk followed by the system archive; the kernel unpacks both into rootfs"""
+    first = ramdisk_archive(boot_image, keep_data)
+    first += b'\x00' * (-len(first) % 512)
+    return first + system_archive(tree)
+
+
+def script_image(text):
+    """A U-Boot script image, like mkimage -A arm -O linux -T script -C none"""
+    body = text.encode() + b'\x00'
+    payload = struct.pack('>II', len(body), 0) + body
+    name = b'beike ramboot'
+    fields = [IH_MAGIC, 0, int(time.time()), len(payload), 0, 0, zlib.crc32(payload),
+              IH_OS_LINUX, IH_ARCH_ARM, IH_TYPE_SCRIPT, 0, name]
+    header = IH_HEADER.pack(*fields)
+    fields[1] = zlib.crc32(header)
+    return IH_HEADER.pack(*fields) + payload
+
+
+def parse_script(data):
+    """Script text from a script image, or None if data isn't one"""
+    if len(data) < IH_HEADER.size or struct.unpack_from('>I', data)[0] != IH_MAGIC:
+        return None
+    fields = list(IH_HEADER.unpack_from(data))
+    if fields[9] != IH_TYPE_SCRIPT:
+        return None
+    hcrc = fields[1]
+    fields[1] = 0
+    if zlib.crc32(IH_HEADER.pack(*fields)) != hcrc:
+        raise ValueError("script header CRC mismatch")
+    payload = data[IH_HEADER.size:IH_HEADER.size + fields[3]]
+    if zlib.crc32(payload) != fields[6]:
+        raise ValueError("script data CRC mismatch")
+    length = struct.unpack_from('>I', payload)[0]
+    return payload[8:8 + length].rstrip(b'\x00').decode()
+
+
+def boot_script(bootargs, initrd_size):
+    args = f"{bootargs} initrd=0x{INITRD_ADDR:x},0x{initrd_size:x} {RAMBOOT_MARK}"
+    return (f"setenv machid {MACHID}\n"
+            f"setenv bootargs \"{args}\"\n"
+            f"bootz 0x{KERNEL_ADDR:x}\n")
+
+
+def prepare(boot, tree, out_dir, bootargs=DEFAULT_BOOTARGS, keep_data=False):
+    """Write the kernel, initrd and boot script to out_dir; returns [(address, path)] to load"""
+    os.makedirs(out_dir, exist_ok=True)
+    with BootImage.open(boot) as image:
+        kernel = bytes(image.kernel)
+        if len(kernel) < 0x30 or struct.unpack_from('<I', kernel, 0x24)[0] != ZIMAGE_MAGIC:
+            raise ValueError(f"{boot}: kernel is not a zImage")
+        rd = initrd(image, tree, keep_data)
+    if len(rd) > INITRD_LIMIT:
+        raise ValueError(f"initrd is {len(rd)} bytes, only {INITRD_LIMIT} fit below the boot script")
+    plan = []
+    for addr, name, data in ((KERNEL_ADDR, 'ramboot_zImage', kernel),
+                             (INITRD_ADDR, 'ramboot_initrd.gz', rd),
+                             (SCRIPT_ADDR, 'ramboot.scr', script_image(boot_script(bootargs, len(rd))))):
+        path = os.path.join(out_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        plan.append((addr, path))
+    return plan
+
+
+def check_uboot(path):
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    if head[4:12] != SPL_MAGIC:
+        raise ValueError(f"{path} doesn't start with an SPL (no eGON.BT0), use u-boot-sunxi-with-spl.bin")
+
+
+def fel_args(uboot, plan):
+    """sunxi-fel arguments: U-Boot runs after all the writes and sources the script"""
+    args = ['-p', 'uboot', uboot]
+    for addr, path in plan:
+        args += ['write', f'0x{addr:x}', path]
+    return args
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prepare a RAM boot (no flash writes) for FEL")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('prepare', help="write the kernel, initrd and boot script, print the sunxi-fel command")
+    p.add_argument('--boot', default='mtdblock1', help="boot image (default: mtdblock1)")
+    p.add_argument('--tree', default='squashfs-root', help="system tree to boot (default: squashfs-root)")
+    p.add_argument('-o', '--output', default='ramboot')
+    p.add_argument('--bootargs', default=DEFAULT_BOOTARGS, help="base kernel cmdline (copy yours from /proc/cmdline)")
+    p.add_argument('--keep-data', action='store_true', help="mount the real /data (jffs2 on flash) instead of a tmpfs")
+    p.add_argument('--uboot', default=os.path.join('sunxi-tools', UBOOT_NAME))
+    args = parser.parse_args(argv)
+
+    try:
+        plan = prepare(args.boot, args.tree, args.output, args.bootargs, args.keep_data)
+        for addr, path in plan:
+            print(f"  0x{addr:08x}  {path} ({os.path.getsize(path)} bytes)")
+        print("✓ Load with:")
+        print('  sunxi-fel ' + ' '.join(shlex.quote(a) for a in fel_args(args.uboot, plan)))
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
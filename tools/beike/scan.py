@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Firmware string and pattern scanner
+mmaps binaries and whole mtdblock images, pulls out ASCII/UTF-16 strings and
+runs any number of regex/byte patterns in a single pass per file. Files are
+spread across CPU cores and results are cached by file hash.
+
+Example (which binary uses the SD card speed test strings?):
+    grep -i "speed test" squashfs-root/res/lang/en.bin > pats.txt
+    python3 -m beike.scan -F -f pats.txt squashfs-root/bin squashfs-root/lib
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import string
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from . import cache_dir
+from .elf import ELF_MAGIC, ELFFile
+
+CACHE_VERSION = 1
+
+
+class ScanOptions:
+    """What to look for in each file"""
+    def __init__(self, patterns=None, strings=False, min_len=4, utf16=True, elf_context=True):
+        # patterns is a list of (name, bytes regex)
+        self.patterns = list(patterns or [])
+        self.strings = strings
+        self.min_len = min_len
+        self.utf16 = utf16
+        self.elf_context = elf_context
+
+    def fingerprint(self):
+        """Stable key for the cache so changed options never reuse old results"""
+        h = hashlib.sha256()
+        h.update(repr((CACHE_VERSION, self.strings, self.min_len, self.utf16, self.elf_context)).encode())
+        for name, pattern in self.patterns:
+            h.update(name.encode() + b'\0' + pattern + b'\0')
+        return h.hexdigest()[:16]
+
+
+def fixed_pattern(text, utf16=False):
+    """Regex for a literal string, optionally matching its UTF-16LE form as well"""
+    raw = text.encode('utf-8')
+    alternatives = [re.escape(raw)]
+    if utf16:
+        alternatives.append(re.escape(text.encode('utf-16-le')))
+    return b'|'.join(alternatives)
+
+
+def hex_pattern(text):
+    """Regex for a hex byte string like 'ffd8ff' or 'ff d8 ?? e0' (?? is a wildcard)"""
+    tokens = text.replace(' ', '')
+    if not tokens or len(tokens) % 2:
+        raise ValueError(f"hex pattern {text!r} is not a whole number of bytes")
+    out = []
+    for i in range(0, len(tokens), 2):
+        pair = tokens[i:i + 2]
+        if pair == '??':
+            out.append(b'.')
+        elif all(c in string.hexdigits for c in pair):
+            out.append(re.escape(bytes([int(pair, 16)])))
+        else:
+            raise ValueError(f"hex pattern {text!r}: {pair!r} is not a hex byte")
+    return b''.join(out)
+
+
+# \1 style backreferences and (?(1)...) conditionals; a false hit only costs a separate pass
+BACKREF_RE = re.compile(rb'\\[1-9]|\(\?\(\d')
+
+
+def _scoped(pattern):
+    """Leading inline flags like (?i) only apply to the whole regex, so make them (?i:...)"""
+    m = re.match(rb'\(\?([imsx]+)\)', pattern)
+    return b'(?%s:%s)' % (m.group(1), pattern[m.end():]) if m else pattern
+
+
+def compile_matcher(patterns):
+    """[(regex, pattern index or None for the combined one)] to run over each file
+
+    Every pattern goes into one alternation so each file is walked once, except
+    ones with numbered backreferences (or group conditionals): wrapping them in
+    a named group renumbers their groups, so they run on their own.
+    """
+    if not patterns:
+        return None
+    combined = [(i, pattern) for i, (_name, pattern) in enumerate(patterns) if not BACKREF_RE.search(pattern)]
+    matcher = []
+    if combined:
+        parts = [b'(?P<p%d>%s)' % (i, _scoped(pattern)) for i, pattern in combined]
+        matcher.append((re.compile(b'|'.join(parts), re.DOTALL), None))
+    matcher += [(re.compile(pattern, re.DOTALL), i) for i, (_name, pattern) in enumerate(patterns)
+                if BACKREF_RE.search(pattern)]
+    return matcher
+
+
+def _strings_regex(min_len, utf16):
+    ascii_re = rb'[\x20-\x7e\t]{%d,}' % min_len
+    if not utf16:
+        return re.compile(ascii_re)
+    return re.compile(rb'(?P<a>' + ascii_re + rb')|(?P<u>(?:[\x20-\x7e\t]\x00){%d,})' % min_len)
+
+
+def file_digest(buf):
+    """sha256 hex digest of a buffer"""
+    return hashlib.sha256(buf).hexdigest()
+
+
+def _describe(elf, offset, full=True):
+    if elf is None:
+        return {}
+    info = elf.context(offset)
+    if not full:
+        info = {'section': info['section']} if 'section' in info else {}
+    return info
+
+
+def scan_buffer(buf, options, matcher=None):
+    """Scan one in-memory (or mmapped) buffer, return the hit and string lists"""
+    elf = None
+    if options.elf_context and buf[:4] == ELF_MAGIC:
+        try:
+            elf = ELFFile(buf)
+        except (ValueError, IndexError, struct.error):
+            elf = None
+
+    hits = []
+    if matcher is None:
+        matcher = compile_matcher(options.patterns)
+    for regex, fixed in matcher or ():
+        for m in regex.finditer(buf):
+            index = fixed if fixed is not None else int(m.lastgroup[1:])
+            hit = {
+                'pattern': options.patterns[index][0],
+                'offset': m.start(),
+                'match': m.group().decode('latin-1') if b'\x00' not in m.group()
+                         else m.group().decode('utf-16-le', 'replace'),
+            }
+            hit.update(_describe(elf, m.start()))
+            hits.append(hit)
+    if matcher and len(matcher) > 1:
+        hits.sort(key=lambda hit: hit['offset'])
+
+    strings = []
+    if options.strings:
+        for m in _strings_regex(options.min_len, options.utf16).finditer(buf):
+            if options.utf16 and m.lastgroup == 'u':
+                entry = {'offset': m.start(), 'encoding': 'utf-16le',
+                         'text': m.group().decode('utf-16-le')}
+            else:
+                entry = {'offset': m.start(), 'encoding': 'ascii', 'text': m.group().decode('ascii')}
+            entry.update(_describe(elf, m.start(), full=False))
+            strings.append(entry)
+
+    return hits, strings
+
+
+def scan_file(path, options, use_cache=True):
+    """Scan a single file (mmapped), using the hash-keyed cache when possible"""
+    size = os.path.getsize(path)
+    result = {'path': path, 'size': size, 'sha256': None, 'hits': [], 'strings': []}
+    if size == 0:
+        return result
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        digest = file_digest(mm)
+        result['sha256'] = digest
+
+        cache_file = None
+        if use_cache:
+            cache_file = os.path.join(cache_dir('scan', digest[:2]), f"{digest}-{options.fingerprint()}.json")
+            if os.path.exists(cache_file):
+                try:
+                    with open(cache_file, 'r') as cf:
+                        cached = json.load(cf)
+                    result['hits'] = cached['hits']
+                    result['strings'] = cached['strings']
+                    result['cached'] = True
+                    return result
+                except (OSError, ValueError, KeyError):
+                    pass
+
+        result['hits'], result['strings'] = scan_buffer(mm, options)
+
+    if cache_file:
+        tmp = cache_file + '.tmp'
+        with open(tmp, 'w') as cf:
+            json.dump({'hits': result['hits'], 'strings': result['strings']}, cf)
+        os.replace(tmp, cache_file)
+    return result
+
+
+def iter_files(paths):
+    """Expand files and directories into regular file paths (symlinks are skipped)"""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full = os.path.join(root, name)
+                    if os.path.isfile(full) and not os.path.islink(full):
+                        yield full
+        elif os.path.isfile(path):
+            yield path
+
+
+def _scan_job(args):
+    path, options, use_cache = args
+    try:
+        return scan_file(path, options, use_cache)
+    except OSError as e:
+        return {'path': path, 'error': str(e), 'hits': [], 'strings': []}
+
+
+def scan_paths(paths, options, jobs=None, use_cache=True):
+    """Scan many files in parallel, yielding results in input order"""
+    files = list(iter_files(paths))
+    jobs = jobs or os.cpu_count() or 1
+    work = [(path, options, use_cache) for path in files]
+    if jobs == 1 or len(files) < 2:
+        for item in work:
+            yield _scan_job(item)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for result in pool.map(_scan_job, work, chunksize=max(1, len(work) // (jobs * 4))):
+            yield result
+
+
+def _format_context(entry):
+    parts = []
+    if 'section' in entry:
+        parts.append(entry['section'])
+    if 'symbol' in entry:
+        parts.append(f"{entry['symbol']}+0x{entry['symbol_offset']:x}")
+    return f" [{' '.join(parts)}]" if parts else ""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scan firmware binaries and images for strings and patterns")
+    parser.add_argument('paths', nargs='+', help="files or directories (e.g. squashfs-root/bin, mtdblock2)")
+    parser.add_argument('-e', '--regex', action='append', default=[], help="regex to search for (repeatable)")
+    parser.add_argument('-x', '--hex', action='append', default=[], help="hex byte pattern, ?? = any byte")
+    parser.add_argument('-f', '--patterns-file', help="file with one pattern per line")
+    parser.add_argument('-F', '--fixed', action='store_true', help="treat -e and -f patterns as literal strings")
+    parser.add_argument('-s', '--strings', action='store_true', help="dump all strings like strings(1)")
+    parser.add_argument('-n', '--min-len', type=int, default=4, help="minimum string length (default 4)")
+    parser.add_argument('--no-utf16', action='store_true', help="ASCII only")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument('--no-cache', action='store_true', help="ignore and don't write the result cache")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    utf16 = not args.no_utf16
+    texts = list(args.regex)
+    if args.patterns_file:
+        with open(args.patterns_file, 'r', encoding='utf-8', errors='replace') as f:
+            texts.extend(line.rstrip('\r\n') for line in f if line.strip())
+
+    patterns = []
+    for text in texts:
+        if args.fixed:
+            patterns.append((text, fixed_pattern(text, utf16)))
+        else:
+            patterns.append((text, text.encode('utf-8')))
+    for text in args.hex:
+        try:
+            patterns.append((text, hex_pattern(text)))
+        except ValueError as e:
+            parser.error(str(e))
+
+    if not patterns and not args.strings:
+        parser.error("nothing to do: give patterns (-e/-x/-f) and/or --strings")
+    for text, pattern in patterns:
+        try:
+            re.compile(_scoped(pattern), re.DOTALL)
+        except re.error as e:
+            parser.error(f"bad pattern {text!r}: {e}")
+    try:
+        compile_matcher(patterns)
+    except re.error as e:
+        # named groups p0, p1... are ours; a pattern reusing one of them ends up here
+        parser.error(f"patterns don't combine: {e}")
+
+    options = ScanOptions(patterns, strings=args.strings, min_len=args.min_len, utf16=utf16)
+    results = scan_paths(args.paths, options, jobs=args.jobs, use_cache=not args.no_cache)
+
+    if args.json:
+        json.dump(list(results), sys.stdout, indent=1)
+        print()
+        return 0
+
+    found = False
+    for result in results:
+        if 'error' in result:
+            print(f"{result['path']}: error: {result['error']}", file=sys.stderr)
+            continue
+        for hit in result['hits']:
+            found = True
+            print(f"{result['path']}:0x{hit['offset']:x}{_format_context(hit)} {hit['pattern']!r}: {hit['match']}")
+        for entry in result['strings']:
+            found = True
+            print(f"{result['path']}:0x{entry['offset']:x}{_format_context(entry)} {entry['text']}")
+    return 0 if found else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+SD card sustained write benchmark
+Writes to a card in a reader (or a file/loop device standing in for one) the way the
+recorder does: cluster aligned sequential chunks with the page cache bypassed
+(O_DIRECT), plus a small FAT/directory update back at the start of the volume every
+few MB. Measures sustained throughput and write latency tails, then works out the
+highest bitrate each recording mode can use on that card and can write a
+media_profiles.xml with those ceilings (see mods/video_bitrate.md).
+
+    python3 -m beike.sdbench /media/sdcard/bench.bin --size 2G
+    sudo python3 -m beike.sdbench /dev/sdb --yes -o media_profiles.xml
+    python3 -m beike.sdbench card.img --template squashfs-root/etc/media_profiles.xml -o media_profiles.xml
+
+Writing to a block device DESTROYS what is on it, reformat the card afterwards.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import re
+import stat
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_TEMPLATE = os.path.join(REPO_DIR, 'configs', 'media_profiles.xml')
+
+CLUSTER = 32 * 1024         # FAT32 default cluster on SDHC cards
+CHUNK = 256 * 1024          # what the muxer hands to write() at a time
+FAT_WRITE = 4096            # one FAT sector/page plus the directory entry
+FAT_EVERY = 4 * 1024 * 1024
+DATA_OFFSET = 4 * 1024 * 1024   # SD cards align the data area to their 4 MB allocation unit
+F_NOCACHE = 48              # macOS fcntl, O_DIRECT's closest equivalent
+
+# (menu.cfg video_resolution index, name, width, height, fps)
+MODES = [
+    (0, '4K 30FPS', 3840, 2160, 30),
+    (1, '2.7K 30FPS', 2704, 1520, 30),
+    (2, '1080P 60FPS', 1920, 1080, 60),
+    (3, '1080P 30FPS', 1920, 1080, 30),
+    (4, '720P 120FPS', 1280, 720, 120),
+    (5, '720P 60FPS', 1280, 720, 60),
+    (6, '720P 30FPS', 1280, 720, 30),
+]
+
+
+def parse_size(text):
+    """'512M', '2G', '65536' -> bytes"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def open_target(path, size, allow_device=False):
+    """Open for unbuffered writes; returns (fd, is_device, direct)"""
+    is_device = os.path.exists(path) and stat.S_ISBLK(os.stat(path).st_mode)
+    if is_device and not allow_device:
+        raise ValueError(f"{path} is a block device, everything on it will be overwritten (pass --yes)")
+    flags = os.O_WRONLY | (0 if is_device else os.O_CREAT)
+    direct = hasattr(os, 'O_DIRECT')
+    try:
+        fd = os.open(path, flags | (os.O_DIRECT if direct else 0), 0o644)
+    except OSError:
+        # tmpfs and some FUSE filesystems refuse O_DIRECT
+        direct = False
+        fd = os.open(path, flags, 0o644)
+    if not direct and sys.platform == 'darwin':
+        import fcntl
+        fcntl.fcntl(fd, F_NOCACHE, 1)
+        direct = True
+    if not is_device:
+        os.ftruncate(fd, size + DATA_OFFSET)
+    return fd, is_device, direct
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_benchmark(path, size, chunk=CHUNK, cluster=CLUSTER, fat_every=FAT_EVERY,
+                  allow_device=False, window=1.0, log=print):
+    """Write size bytes in the recorder's pattern; returns a results dict"""
+    if chunk % cluster:
+        raise ValueError(f"chunk ({chunk}) must be a multiple of the cluster size ({cluster})")
+    fd, is_device, direct = open_target(path, size, allow_device)
+    if not direct:
+        log("Warning: could not bypass the page cache, every chunk is fdatasync'd instead")
+    # mmap buffers are page aligned, which O_DIRECT needs
+    data = mmap.mmap(-1, chunk)
+    data.write(os.urandom(chunk))
+    fat = mmap.mmap(-1, FAT_WRITE)
+    fat.write(os.urandom(FAT_WRITE))
+
+    latencies = []
+    fat_latencies = []
+    windows = []
+    written = 0
+    since_fat = 0
+    fat_sector = 0
+    started = window_start = time.perf_counter()
+    window_bytes = 0
+    try:
+        while written < size:
+            t = time.perf_counter()
+            os.pwrite(fd, data, DATA_OFFSET + written)
+            if not direct:
+                os.fdatasync(fd)
+            now = time.perf_counter()
+            latencies.append(now - t)
+            written += chunk
+            since_fat += chunk
+            window_bytes += chunk
+
+            if since_fat >= fat_every:
+                # the FAT and the directory entry live before the data area
+                t = time.perf_counter()
+                os.pwrite(fd, fat, (fat_sector * FAT_WRITE) % DATA_OFFSET)
+                if not direct:
+                    os.fdatasync(fd)
+                now = time.perf_counter()
+                fat_latencies.append(now - t)
+                fat_sector += 1
+                since_fat = 0
+
+            if now - window_start >= window:
+                windows.append(window_bytes / (now - window_start))
+                log(f"  {written / 1048576:8.0f} MB  {windows[-1] / 1048576:7.2f} MB/s")
+                window_start, window_bytes = now, 0
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        data.close()
+        fat.close()
+    elapsed = time.perf_counter() - started
+    if window_bytes and time.perf_counter() - window_start > window / 4:
+        windows.append(window_bytes / (time.perf_counter() - window_start))
+    if not windows:
+        windows.append(written / elapsed)
+
+    every = latencies + fat_latencies
+    return {
+        'target': path,
+        'device': is_device,
+        'direct': direct,
+        'bytes': written,
+        'seconds': round(elapsed, 3),
+        'chunk': chunk,
+        'cluster': cluster,
+        'fat_every': fat_every,
+        'average_mbps': round(written / elapsed / 1048576, 3),
+        # slow windows are what drop frames, so sustained is the 10th percentile
+        'sustained_mbps': round(_percentile(windows, 10) / 1048576, 3),
+        'worst_window_mbps': round(min(windows) / 1048576, 3) if windows else 0.0,
+        'latency_ms': {
+            'p50': round(_percentile(every, 50) * 1000, 2),
+            'p99': round(_percentile(every, 99) * 1000, 2),
+            'p99.9': round(_percentile(every, 99.9) * 1000, 2),
+            'max': round(max(every) * 1000, 2) if every else 0.0,
+        },
+        'fat_latency_ms_max': round(max(fat_latencies) * 1000, 2) if fat_latencies else 0.0,
+    }
+
+
+def bitrate_ceiling(results, width, height, fps, audio_bps=128000, headroom=0.8,
+                    buffer_bytes=4 * 1024 * 1024, bpp=0.3, encoder_max=None, overhead=0.02):
+    """Highest video bitrate (bits/s) a mode can record at on the measured card
+
+    The smallest of: what the card sustains (less headroom, audio and container
+    overhead), what the recorder's buffer can ride out during the worst write stall,
+    and what the encoder can usefully spend at this resolution (bpp bits per pixel,
+    None to leave that out).
+    """
+    card = results['sustained_mbps'] * 1048576 * 8 * headroom / (1 + overhead) - audio_bps
+    stall = results['latency_ms']['max'] / 1000
+    buffered = buffer_bytes * 8 / stall if stall > 0 else card
+    ceiling = min(card, buffered)
+    if bpp:
+        ceiling = min(ceiling, width * height * fps * bpp)
+    if encoder_max:
+        ceiling = min(ceiling, encoder_max)
+    # round down to 0.5 Mbps like the hand-edited profiles
+    return max(0, int(ceiling // 500000 * 500000))
+
+
+PROFILE_RE = re.compile(r'(<EncoderProfile\b[^>]*>)(.*?)(</EncoderProfile>)', re.DOTALL)
+VIDEO_RE = re.compile(r'<Video\b[^>]*/>')
+CAP_RE = re.compile(r'<VideoEncoderCap\b[^>]*name="h264"[^>]*/>')
+
+
+def _attr(tag, name):
+    m = re.search(rf'\b{name}="([^"]*)"', tag)
+    return m.group(1) if m else None
+
+
+def _set_attr(tag, name, value):
+    return re.sub(rf'\b{name}="[^"]*"', f'{name}="{value}"', tag)
+
+
+def encoder_max_bitrate(xml):
+    """maxBitRate of the h264 VideoEncoderCap, or None"""
+    cap = CAP_RE.search(xml)
+    return int(_attr(cap.group(0), 'maxBitRate')) if cap else None
+
+
+def apply_ceilings(xml, results, **kwargs):
+    """Lower each EncoderProfile's video bitRate to its ceiling; returns (xml, changes)
+
+    A ceiling only ever lowers a profile, and only when the card can't keep up,
+    never just because it is past the useful bits per pixel (bpp is ignored).
+    Only bitRate attributes are touched, so comments, the DOCTYPE and formatting survive.
+    """
+    encoder_max = encoder_max_bitrate(xml)
+    kwargs = dict(kwargs, bpp=None)
+    changes = []
+
+    def profile(m):
+        head, body, tail = m.groups()
+        quality = _attr(head, 'quality')
+        video = VIDEO_RE.search(body)
+        if quality is None or not video:
+            return m.group(0)
+        tag = video.group(0)
+        audio = re.search(r'<Audio\b[^>]*/>', body)
+        audio_bps = int(_attr(audio.group(0), 'bitRate')) if audio else 0
+        old = int(_attr(tag, 'bitRate'))
+        mode = (int(_attr(tag, 'width')), int(_attr(tag, 'height')), int(_attr(tag, 'frameRate')))
+        new = min(old, bitrate_ceiling(results, *mode, audio_bps=audio_bps, encoder_max=encoder_max, **kwargs))
+        changes.append((quality, old, new))
+        return head + body.replace(tag, _set_attr(tag, 'bitRate', new)) + tail
+
+    return PROFILE_RE.sub(profile, xml), changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sustained write benchmark for SD cards, with safe bitrate caps")
+    parser.add_argument('target', help="file on the card, a loop device or the card's block device")
+    parser.add_argument('--size', default='1G', help="bytes to write (default: 1G, use more than the card's cache)")
+    parser.add_argument('--chunk', default='256K', help="write size (default: 256K)")
+    parser.add_argument('--cluster', default='32K', help="FAT cluster size to align to (default: 32K, exFAT: 128K)")
+    parser.add_argument('--fat-every', default='4M', help="FAT/directory update interval (default: 4M)")
+    parser.add_argument('--buffer', default='4M', help="recorder buffer that has to ride out stalls (default: 4M)")
+    parser.add_argument('--headroom', type=float, default=0.8, help="fraction of the sustained rate to use (default: 0.8)")
+    parser.add_argument('--bpp', type=float, default=0.3, help="bits per pixel past which bitrate is wasted (default: 0.3)")
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE, help="media_profiles.xml to start from")
+    parser.add_argument('-o', '--output', help="write a media_profiles.xml with the ceilings")
+    parser.add_argument('--json', help="save the raw results")
+    parser.add_argument('--keep', action='store_true', help="keep the test file")
+    parser.add_argument('--yes', action='store_true', help="allow overwriting a block device")
+    args = parser.parse_args(argv)
+
+    try:
+        size = parse_size(args.size)
+        is_file = not os.path.exists(args.target) or stat.S_ISREG(os.stat(args.target).st_mode)
+        print(f"Writing {size / 1048576:.0f} MB to {args.target}...")
+        try:
+            results = run_benchmark(args.target, size, parse_size(args.chunk), parse_size(args.cluster),
+                                    parse_size(args.fat_every), allow_device=args.yes)
+        finally:
+            if is_file and not args.keep and os.path.exists(args.target):
+                os.remove(args.target)
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+
+    lat = results['latency_ms']
+    print(f"\nAverage {results['average_mbps']:.2f} MB/s, sustained {results['sustained_mbps']:.2f} MB/s "
+          f"(worst second {results['worst_window_mbps']:.2f} MB/s)")
+    print(f"Write latency p50 {lat['p50']} ms, p99 {lat['p99']} ms, p99.9 {lat['p99.9']} ms, max {lat['max']} ms")
+
+    template = None
+    if os.path.exists(args.template):
+        with open(args.template, 'r', newline='') as f:
+            template = f.read()
+    ceilings = dict(buffer_bytes=parse_size(args.buffer), headroom=args.headroom, bpp=args.bpp,
+                    encoder_max=encoder_max_bitrate(template) if template else None)
+    print("\nHighest safe video bitrate per mode:")
+    for index, name, width, height, fps in MODES:
+        ceiling = bitrate_ceiling(results, width, height, fps, **ceilings)
+        print(f"  {index}  {name:12} {ceiling / 1e6:6.1f} Mbps")
+    results['ceilings'] = {name: bitrate_ceiling(results, w, h, fps, **ceilings) for _, name, w, h, fps in MODES}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if args.output:
+        if template is None:
+            print(f"✗ Template not found: {args.template}", file=sys.stderr)
+            return 1
+        ceilings.pop('encoder_max')
+        xml, changes = apply_ceilings(template, results, **ceilings)
+        try:
+            with open(args.output, 'w', newline='') as f:
+                f.write(xml)
+        except OSError as e:
+            print(f"✗ {e}", file=sys.stderr)
+            return 1
+        print(f"\n✓ Wrote {args.output}")
+        for quality, old, new in changes:
+            print(f"  {quality:16} {old / 1e6:6.1f} -> {new / 1e6:6.1f} Mbps")
+        print("Copy it to squashfs-root/etc/media_profiles.xml and rebuild")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
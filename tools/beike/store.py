@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Extraction cache
+unsquashfs each system image once into a content-addressed store (one object per
+distinct file content + mode) and build any squashfs-root from it as clones (or
+copies where the filesystem can't clone). Extracting an image the store has seen
+is a few thousand clones, and every tree shares the same objects.
+
+    python3 -m beike.store extract mtdblock2                  # -> squashfs-root
+    python3 -m beike.store extract system_v1.1.bin -d v1.1-root
+    python3 -m beike.store list
+    python3 -m beike.store verify --repair
+    python3 -m beike.store unshare squashfs-root/res/cfg/menu.cfg
+
+Clones (APFS, btrfs, XFS) are copy-on-write, so editing a tree never reaches the
+store. Hardlinks are only used when asked for (--link hardlink, to save space on
+ext4): they are shared with the store, so anything that rewrites a file in place
+(echo >>, some editors) has to run unshare on it first. verify catches objects
+that were changed anyway and drops them so the next extract rebuilds them.
+"""
+
+import argparse
+import ctypes
+import errno
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import cache_dir
+
+LINK_MODES = ('auto', 'clone', 'hardlink', 'copy')
+FICLONE = 0x40049409        # linux/fs.h _IOW(0x94, 9, int)
+HASH_CHUNK = 1024 * 1024
+# Errors that mean "this filesystem can't do that", not "something is broken"
+UNSUPPORTED = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+               errno.EPERM, errno.EMLINK)
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _clone(src, dst):
+    """Copy-on-write copy of src at dst, or OSError if the filesystem can't"""
+    if sys.platform == 'darwin':
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0):
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), dst)
+        return
+    import fcntl
+    with open(src, 'rb') as s:
+        fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            fcntl.ioctl(fd, FICLONE, s.fileno())
+        except OSError:
+            os.close(fd)
+            os.remove(dst)
+            raise
+        os.close(fd)
+
+
+def unshare(path):
+    """Give path its own copy of its data if it's hardlinked (to the store); returns True if it was"""
+    st = os.lstat(path)
+    if not stat.S_ISREG(st.st_mode) or st.st_nlink < 2:
+        return False
+    fd, tmp = tempfile.mkstemp(prefix='.unshare-', dir=os.path.dirname(path) or '.')
+    os.close(fd)
+    try:
+        shutil.copy2(path, tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return True
+
+
+class Store:
+    """objects/<sha256[:2]>/<sha256>-<mode> plus trees/<image sha256>.json manifests
+
+    A manifest lists (path, kind, mode, data, mtime) for every entry of the image's
+    tree: data is the object name for files and the target for symlinks. Objects
+    are never written after they're stored; each manifest also keeps the (size,
+    mtime) an object had when it was stored so in-place edits can be spotted.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or cache_dir('store')
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(self.root, 'trees'), exist_ok=True)
+
+    def object_path(self, name):
+        return os.path.join(self.root, 'objects', name[:2], name)
+
+    def tree_path(self, key):
+        return os.path.join(self.root, 'trees', f"{key}.json")
+
+    def load_tree(self, key):
+        try:
+            with open(self.tree_path(key), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def trees(self):
+        out = []
+        for name in sorted(os.listdir(os.path.join(self.root, 'trees'))):
+            if name.endswith('.json'):
+                tree = self.load_tree(name[:-5])
+                if tree:
+                    out.append(tree)
+        return out
+
+    # -- ingest --------------------------------------------------------------
+
+    def ingest(self, image, log=print):
+        """unsquashfs image into the store (if it isn't there yet); returns its key"""
+        key = file_hash(image)
+        if self.load_tree(key):
+            return key
+        tmp = tempfile.mkdtemp(prefix='ingest-', dir=self.root)
+        try:
+            extracted = os.path.join(tmp, 'root')
+            log(f"Unsquashing {os.path.basename(image)} into the extraction cache...")
+            try:
+                result = subprocess.run(['unsquashfs', '-n', '-d', extracted, os.path.abspath(image)],
+                                        capture_output=True, text=True)
+            except FileNotFoundError:
+                raise OSError("unsquashfs not found in PATH. Install squashfs-tools.")
+            if result.returncode:
+                raise ValueError(f"unsquashfs failed: {(result.stderr or result.stdout).strip()}")
+            tree = self.add_tree(extracted, key, os.path.basename(image))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        log(f"  {len(tree['entries'])} entries, {tree['new_objects']} new objects "
+            f"({tree['new_bytes'] / 1024:.0f} KB added to the store)")
+        return key
+
+    def add_tree(self, source, key, name):
+        """Move the files of an extracted tree (on the store's filesystem) into objects"""
+        entries = []
+        stats = {}
+        new_objects = new_bytes = 0
+        os.chmod(source, 0o755)
+        for dirpath, dirnames, filenames in os.walk(source):
+            dirnames.sort()
+            for entry in dirnames + sorted(filenames):
+                full = os.path.join(dirpath, entry)
+                rel = os.path.relpath(full, source).replace(os.sep, '/')
+                st = os.lstat(full)
+                mode = stat.S_IMODE(st.st_mode)
+                if stat.S_ISDIR(st.st_mode):
+                    entries.append([rel, 'd', mode, None, st.st_mtime])
+                    # files get moved out, so the directory has to be writable here
+                    os.chmod(full, mode | stat.S_IRWXU)
+                elif stat.S_ISLNK(st.st_mode):
+                    entries.append([rel, 'l', mode, os.readlink(full), st.st_mtime])
+                elif stat.S_ISREG(st.st_mode):
+                    obj = f"{file_hash(full)}-{mode:o}"
+                    path = self.object_path(obj)
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.replace(full, path)
+                        new_objects += 1
+                        new_bytes += st.st_size
+                    ost = os.stat(path)
+                    stats[obj] = [ost.st_size, ost.st_mtime_ns]
+                    entries.append([rel, 'f', mode, obj, st.st_mtime])
+                # device nodes and fifos don't survive an unprivileged unsquashfs anyway
+        tree = {'key': key, 'name': name, 'added': time.time(), 'entries': entries, 'objects': stats,
+                'new_objects': new_objects, 'new_bytes': new_bytes}
+        tmp = self.tree_path(key) + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(tree, f)
+        os.replace(tmp, self.tree_path(key))
+        return tree
+
+    # -- materialize ---------------------------------------------------------
+
+    def materialize(self, key, dest, link='auto'):
+        """Build the tree for key at dest (which must not exist); returns {method: files}
+
+        auto tries a clone, then a plain copy, and remembers which one worked so the
+        rest of the files don't retry what the filesystem can't do. It never
+        hardlinks: an in-place edit of a linked file would change the object for
+        every tree built from it.
+        """
+        tree = self.load_tree(key)
+        if not tree:
+            raise ValueError(f"{key[:12]} is not in the extraction cache")
+        if os.path.lexists(dest):
+            raise ValueError(f"{dest} already exists")
+        missing = [obj for obj in tree['objects'] if not os.path.exists(self.object_path(obj))]
+        if missing:
+            raise ValueError(f"{len(missing)} objects of {tree['name']} are missing, run verify --repair")
+        methods = {'clone': _clone, 'hardlink': os.link, 'copy': shutil.copyfile}
+        order = ['clone', 'copy'] if link == 'auto' else [link]
+        used = {}
+        tmp = dest.rstrip('/') + '.partial'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            for rel, kind, mode, data, mtime in tree['entries']:
+                full = os.path.join(tmp, rel)
+                if kind == 'd':
+                    os.mkdir(full)
+                elif kind == 'l':
+                    os.symlink(data, full)
+                else:
+                    while True:
+                        try:
+                            methods[order[0]](self.object_path(data), full)
+                            break
+                        except OSError as e:
+                            if len(order) == 1 or e.errno not in UNSUPPORTED:
+                                raise
+                            order.pop(0)
+                    used[order[0]] = used.get(order[0], 0) + 1
+                    if order[0] != 'hardlink':
+                        # a link shares the object's mode and mtime, copies get their own
+                        os.chmod(full, mode)
+                        os.utime(full, (mtime, mtime))
+            # directories last (and deepest first), creating files bumps their mtime
+            for rel, kind, mode, data, mtime in reversed(tree['entries']):
+                if kind == 'd':
+                    full = os.path.join(tmp, rel)
+                    os.chmod(full, mode)
+                    os.utime(full, (mtime, mtime))
+            os.replace(tmp, dest)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return used
+
+    # -- upkeep --------------------------------------------------------------
+
+    def verify(self, repair=False, full=False, log=print):
+        """Check objects against their manifests; returns the damaged object names
+
+        Objects whose size or mtime changed were edited through a hardlink (full
+        rehashes everything), as were objects whose mode changed. repair deletes them and the manifests that used them.
+        """
+        damaged = set()
+        trees = self.trees()
+        for tree in trees:
+            for obj, (size, mtime_ns) in tree['objects'].items():
+                path = self.object_path(obj)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    damaged.add(obj)
+                    continue
+                if (st.st_size != size or st.st_mtime_ns != mtime_ns
+                        or stat.S_IMODE(st.st_mode) != int(obj.rsplit('-', 1)[1], 8)):
+                    damaged.add(obj)
+                elif full and file_hash(path) != obj.split('-')[0]:
+                    damaged.add(obj)
+        broken = [tree for tree in trees if damaged & set(tree['objects'])]
+        for tree in broken:
+            log(f"  ✗ {tree['name']} ({tree['key'][:12]}): "
+                f"{len(damaged & set(tree['objects']))} changed or missing objects")
+        if repair:
+            for obj in damaged:
+                if os.path.exists(self.object_path(obj)):
+                    os.remove(self.object_path(obj))
+            for tree in broken:
+                os.remove(self.tree_path(tree['key']))
+            if broken:
+                log(f"  Removed {len(broken)} manifests, their images will be unsquashed again")
+        return sorted(damaged)
+
+    def gc(self, log=print):
+        """Delete objects no manifest refers to; returns bytes freed"""
+        wanted = set()
+        for tree in self.trees():
+            wanted.update(tree['objects'])
+        freed = 0
+        objects = os.path.join(self.root, 'objects')
+        for prefix in os.listdir(objects):
+            for name in os.listdir(os.path.join(objects, prefix)):
+                if name not in wanted:
+                    path = os.path.join(objects, prefix, name)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        log(f"  Freed {freed / 1024:.0f} KB")
+        return freed
+
+    def usage(self):
+        """(objects, bytes on disk, bytes the trees would take as plain copies)"""
+        count = size = 0
+        sizes = {}
+        objects = os.path.join(self.root, 'objects')
+        for prefix in os.listdir(objects):
+            for name in os.listdir(os.path.join(objects, prefix)):
+                sizes[name] = os.path.getsize(os.path.join(objects, prefix, name))
+                count += 1
+                size += sizes[name]
+        logical = sum(sizes.get(data, 0) for tree in self.trees()
+                      for _rel, kind, _mode, data, _mtime in tree['entries'] if kind == 'f')
+        return count, size, logical
+
+
+def extract(image, dest, link='auto', store=None, log=print):
+    """Materialize image's squashfs tree at dest, unsquashing it only if the store hasn't seen it"""
+    store = store or Store()
+    key = store.ingest(image, log)
+    started = time.monotonic()
+    used = store.materialize(key, dest, link)
+    log(f"  {dest}: {', '.join(f'{n} {method}' for method, n in sorted(used.items())) or 'no files'} "
+        f"in {time.monotonic() - started:.2f}s")
+    return key
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Content-addressed cache of extracted system images")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('extract', help="extract an mtdblock2/system image through the cache")
+    p.add_argument('image')
+    p.add_argument('-d', '--dest', default='squashfs-root')
+    p.add_argument('--link', choices=LINK_MODES, default='auto',
+                   help="how files get into the tree (default: clone, else copy; hardlink shares the cached files)")
+    sub.add_parser('list', help="images in the cache and the space they share")
+    p = sub.add_parser('verify', help="look for cached files that were edited through a hardlink")
+    p.add_argument('--full', action='store_true', help="rehash every object")
+    p.add_argument('--repair', action='store_true', help="drop damaged objects and their manifests")
+    sub.add_parser('gc', help="delete objects no cached image uses")
+    p = sub.add_parser('forget', help="drop an image from the cache (run gc afterwards)")
+    p.add_argument('key', help="key prefix or image name, as shown by list")
+    p = sub.add_parser('unshare', help="give hardlinked tree files their own copy before editing in place")
+    p.add_argument('paths', nargs='+', help="files or directories")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'unshare':
+            count = 0
+            for path in args.paths:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    for dirpath, _dirnames, filenames in os.walk(path):
+                        count += sum(unshare(os.path.join(dirpath, name)) for name in filenames)
+                else:
+                    count += unshare(path)
+            print(f"✓ {count} file{'s' if count != 1 else ''} unshared")
+            return 0
+
+        store = Store()
+        if args.command == 'extract':
+            extract(args.image, args.dest, args.link, store)
+            print(f"✓ Extracted to {args.dest}/")
+        elif args.command == 'list':
+            for tree in store.trees():
+                files = sum(1 for entry in tree['entries'] if entry[1] == 'f')
+                print(f"  {tree['key'][:12]}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(tree['added']))}  "
+                      f"{files:5} files  {tree['name']}")
+            count, size, logical = store.usage()
+            print(f"{count} objects, {size / 1024 / 1024:.1f} MB on disk for "
+                  f"{logical / 1024 / 1024:.1f} MB of unpacked images")
+        elif args.command == 'verify':
+            damaged = store.verify(args.repair, args.full)
+            if damaged and not args.repair:
+                print(f"✗ {len(damaged)} damaged objects, fix with: python3 -m beike.store verify --repair",
+                      file=sys.stderr)
+                return 1
+            print("✓ Extraction cache OK" if not damaged else f"✓ Dropped {len(damaged)} damaged objects")
+        elif args.command == 'gc':
+            store.gc()
+        elif args.command == 'forget':
+            matches = [tree for tree in store.trees()
+                       if tree['key'].startswith(args.key) or tree['name'] == args.key]
+            if len(matches) != 1:
+                raise ValueError(f"{args.key} matches {len(matches)} cached images")
+            os.remove(store.tree_path(matches[0]['key']))
+            print(f"✓ Forgot {matches[0]['name']} ({matches[0]['key'][:12]})")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Runtime telemetry for A/B testing mods
+Samples /proc/stat, /proc/meminfo, /proc/<pid>/stat for sdv and mediaserver and the
+thermal zones through one interactive adb shell, and stores the raw counters in a
+small columnar file (.btel). summary turns a run into CPU %, memory, faults and
+temperatures; compare puts two runs side by side and can draw them as an SVG.
+
+    python3 -m beike.telemetry record --label stock --duration 300 -o stock.btel
+    python3 -m beike.telemetry record --label debloat --duration 300 -o debloat.btel
+    python3 -m beike.telemetry summary debloat.btel
+    python3 -m beike.telemetry compare stock.btel debloat.btel --plot ab.svg
+
+The host sends one `cat` per sample down the already open shell and keeps time
+itself, so the camera pays for a single short-lived process per sample and nothing
+else (no sleep binary, no script loop). The shell's own children's CPU is recorded
+too, so the overhead shows up in the numbers instead of hiding in them.
+"""
+
+import argparse
+import array
+import json
+import math
+import os
+import queue
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+from . import cache_dir
+
+MAGIC = b'BTEL1\n'
+BLOCK = struct.Struct('<II')        # rows, compressed bytes
+BLOCK_ROWS = 60
+DEFAULT_PROCESSES = ('sdv', 'mediaserver')
+THERMAL_DIR = '/sys/class/thermal'
+CPU_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq')
+MEM_FIELDS = {'MemTotal': 'mem.total', 'MemFree': 'mem.free', 'Buffers': 'mem.buffers', 'Cached': 'mem.cached'}
+PROC_FIELDS = ('pid', 'utime', 'stime', 'rss', 'threads', 'majflt')
+PAGE_KB = 4
+PID_STAT_RE = re.compile(r'^(\d+) \((.*)\) (.*)$')
+# What compare and the plot show by default, in that order
+HEADLINE = ('cpu_busy_%', 'iowait_%', 'sdv_cpu_%', 'mediaserver_cpu_%', 'collector_cpu_%',
+            'mem_used_mb', 'sdv_rss_mb', 'mediaserver_rss_mb', 'ctxt_per_s')
+
+
+class ShellSession:
+    """A persistent interactive adb shell; run() sends a command line and returns its output"""
+
+    def __init__(self):
+        try:
+            self.process = subprocess.Popen(['adb', 'shell'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                            stderr=subprocess.STDOUT, bufsize=0)
+        except FileNotFoundError:
+            raise OSError("adb not found. Please install Android Platform Tools")
+        self.lines = queue.Queue()
+        self.count = 0
+        threading.Thread(target=self._reader, daemon=True).start()
+
+    def _reader(self):
+        for line in iter(self.process.stdout.readline, b''):
+            self.lines.put(line.decode(errors='replace').rstrip('\r\n'))
+        self.lines.put(None)
+
+    def run(self, command, timeout=10.0):
+        self.count += 1
+        marker = f"@@beike{self.count}@@"
+        self.process.stdin.write(f"{command}; echo {marker}\n".encode())
+        self.process.stdin.flush()
+        out = []
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                line = self.lines.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                raise OSError(f"no answer from the device shell within {timeout:.0f}s")
+            if line is None:
+                raise OSError("adb shell closed (device disconnected?)")
+            if line.endswith(marker):
+                if line == marker:
+                    return out
+                continue        # the pty echoing our command back
+            out.append(line)
+
+    def close(self):
+        try:
+            self.process.stdin.write(b"exit\n")
+            self.process.stdin.close()
+            self.process.wait(timeout=3)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+# ---------------------------------------------------------------------------
+# Collecting
+# ---------------------------------------------------------------------------
+
+def find_pids(session, names):
+    """{name: pid} from toolbox ps, matching the last column's basename"""
+    pids = {}
+    for line in session.run('ps'):
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].isdigit():
+            base = fields[-1].rsplit('/', 1)[-1]
+            if base in names and base not in pids:
+                pids[base] = int(fields[1])
+    return pids
+
+
+def find_zones(session):
+    """[(zone dir, type)] for the thermal zones"""
+    zones = [name for name in session.run(f'ls {THERMAL_DIR}') if name.startswith('thermal_zone')]
+    zones.sort(key=lambda name: int(re.sub(r'\D', '', name) or 0))
+    if not zones:
+        return []
+    types = session.run('cat ' + ' '.join(f'{THERMAL_DIR}/{z}/type' for z in zones))
+    return list(zip(zones, types + [''] * (len(zones) - len(types))))
+
+
+def columns_for(processes, zones):
+    columns = ['time', 'collected'] + [f'cpu.{f}' for f in CPU_FIELDS] + ['ctxt', 'intr', 'procs_running']
+    columns += list(MEM_FIELDS.values())
+    for name in list(processes) + ['collector']:
+        columns += [f'{name}.{f}' for f in PROC_FIELDS]
+    columns += [f'thermal.{zone}' for zone, _type in zones]
+    return columns
+
+
+def sample_command(pids, zones):
+    paths = ['/proc/uptime', '/proc/stat', '/proc/meminfo']
+    paths += [f'/proc/{pid}/stat' for pid in pids.values() if pid] + ['/proc/$$/stat']
+    paths += [f'{THERMAL_DIR}/{zone}/temp' for zone, _type in zones]
+    return 'cat ' + ' '.join(paths)
+
+
+def parse_sample(lines, pids, zones):
+    """Column name -> int for one sample's cat output; missing values are left out"""
+    row = {}
+    by_pid = {pid: name for name, pid in pids.items()}
+    temps = []
+    uptime_seen = False
+    for line in lines:
+        if not uptime_seen and re.match(r'^\d+\.\d+ \d+\.\d+$', line):
+            row['time'] = int(float(line.split()[0]) * 100)
+            uptime_seen = True
+            continue
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == 'cpu':
+            for name, value in zip(CPU_FIELDS, fields[1:]):
+                row[f'cpu.{name}'] = int(value)
+        elif fields[0] in ('ctxt', 'intr', 'procs_running') and len(fields) > 1:
+            row[fields[0]] = int(fields[1])
+        elif fields[0].rstrip(':') in MEM_FIELDS and fields[0].endswith(':'):
+            row[MEM_FIELDS[fields[0].rstrip(':')]] = int(fields[1])
+        elif PID_STAT_RE.match(line):
+            pid, _comm, rest = PID_STAT_RE.match(line).groups()
+            name = by_pid.get(int(pid), 'collector')
+            stat = rest.split()         # field 3 (state) is stat[0]
+            row[f'{name}.pid'] = int(pid)
+            row[f'{name}.utime'] = int(stat[11]) + (int(stat[13]) if name == 'collector' else 0)
+            row[f'{name}.stime'] = int(stat[12]) + (int(stat[14]) if name == 'collector' else 0)
+            row[f'{name}.threads'] = int(stat[17])
+            row[f'{name}.rss'] = int(stat[21])
+            row[f'{name}.majflt'] = int(stat[9])
+        elif re.match(r'^-?\d+$', line):
+            temps.append(int(line))
+    for (zone, _type), temp in zip(zones, temps):
+        row[f'thermal.{zone}'] = temp
+    return row
+
+
+class Writer:
+    """Header line of JSON, then blocks of rows stored column by column as zlib'd deltas"""
+
+    def __init__(self, path, header):
+        self.path = path
+        self.columns = header['columns']
+        self.f = open(path, 'wb')
+        self.f.write(MAGIC + json.dumps(header, sort_keys=True).encode() + b'\n')
+        self.rows = []
+        self.count = 0
+
+    def add(self, row):
+        self.rows.append([row.get(column, MISSING) for column in self.columns])
+        self.count += 1
+        if len(self.rows) >= BLOCK_ROWS:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        data = b''.join(_deltas(column).tobytes() for column in zip(*self.rows))
+        packed = zlib.compress(data, 9)
+        self.f.write(BLOCK.pack(len(self.rows), len(packed)) + packed)
+        self.f.flush()
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+MISSING = -(1 << 62)
+
+
+def _deltas(values):
+    out = array.array('q', values)
+    for n in range(len(out) - 1, 0, -1):
+        out[n] -= out[n - 1]
+    return out
+
+
+def record(output, duration=None, interval=1.0, label='', processes=DEFAULT_PROCESSES, log=print):
+    """Sample until duration (or Ctrl-C) into output; returns the number of samples"""
+    session = ShellSession()
+    writer = None
+    try:
+        pids = find_pids(session, processes)
+        for name in processes:
+            log(f"  {name}: pid {pids[name]}" if name in pids else f"  {name}: not running")
+        zones = find_zones(session)
+        if zones:
+            log(f"  thermal: {', '.join(f'{zone} ({kind})' for zone, kind in zones)}")
+        header = {'label': label, 'interval': interval, 'started': time.time(), 'hz': 100,
+                  'page_kb': PAGE_KB, 'processes': list(processes), 'columns': columns_for(processes, zones),
+                  'zones': dict(zones),
+                  'serial': subprocess.run(['adb', 'get-serialno'], capture_output=True,
+                                           text=True).stdout.strip(),
+                  'build': ' '.join(session.run('getprop ro.build.display.id')).strip()}
+        writer = Writer(output, header)
+        command = sample_command(pids, zones)
+        log(f"Sampling every {interval:g}s{f' for {duration:g}s' if duration else ' (Ctrl-C to stop)'}...")
+        started = time.monotonic()
+        next_at = started
+        while duration is None or time.monotonic() - started < duration:
+            row = parse_sample(session.run(command), pids, zones)
+            row['collected'] = int((time.monotonic() - started) * 1000)
+            missing = [name for name in processes if name in pids and f'{name}.pid' not in row]
+            if missing:
+                # restarted (or crashed): look again so the next samples follow the new pid
+                log(f"  {', '.join(missing)} went away at {row['collected'] / 1000:.0f}s")
+                pids.update(find_pids(session, missing))
+                command = sample_command(pids, zones)
+            writer.add(row)
+            if writer.count % max(1, int(30 / interval)) == 0:
+                log(f"  {writer.count} samples")
+            next_at += interval
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_at = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer:
+            writer.close()
+        session.close()
+    return writer.count if writer else 0
+
+
+# ---------------------------------------------------------------------------
+# Reading and statistics
+# ---------------------------------------------------------------------------
+
+class Run:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a telemetry file")
+            self.header = json.loads(f.readline())
+            self.columns = {name: [] for name in self.header['columns']}
+            names = self.header['columns']
+            while True:
+                head = f.read(BLOCK.size)
+                if len(head) < BLOCK.size:
+                    break
+                rows, size = BLOCK.unpack(head)
+                values = array.array('q', zlib.decompress(f.read(size)))
+                for n, name in enumerate(names):
+                    column = values[n * rows:(n + 1) * rows]
+                    for i in range(1, rows):
+                        column[i] += column[i - 1]
+                    self.columns[name].extend(column)
+        self.label = self.header.get('label') or os.path.splitext(os.path.basename(path))[0]
+
+    def __len__(self):
+        return len(self.columns['time'])
+
+    def value(self, name, i):
+        column = self.columns.get(name)
+        if column is None or column[i] == MISSING:
+            return None
+        return column[i]
+
+
+def metrics(run):
+    """{metric: [(seconds since start, value)]}, one value per interval between samples"""
+    out = {}
+
+    def add(name, t, value):
+        if value is not None:
+            out.setdefault(name, []).append((t, value))
+
+    hz = run.header.get('hz', 100)
+    page_kb = run.header.get('page_kb', PAGE_KB)
+    first = run.value('time', 0) or 0
+    for i in range(1, len(run)):
+        t = ((run.value('time', i) or 0) - first) / 100
+        dt = ((run.value('time', i) or 0) - (run.value('time', i - 1) or 0)) / 100
+        cpu = [(run.value(f'cpu.{f}', i), run.value(f'cpu.{f}', i - 1)) for f in CPU_FIELDS]
+        if any(a is None or b is None for a, b in cpu) or dt <= 0:
+            continue
+        deltas = dict(zip(CPU_FIELDS, (a - b for a, b in cpu)))
+        total = sum(deltas.values())
+        if total <= 0:
+            continue
+        add('cpu_busy_%', t, 100 * (total - deltas['idle'] - deltas['iowait']) / total)
+        add('iowait_%', t, 100 * deltas['iowait'] / total)
+        for name in ('ctxt', 'intr'):
+            a, b = run.value(name, i), run.value(name, i - 1)
+            add(f'{name}_per_s', t, (a - b) / dt if a is not None and b is not None else None)
+        add('procs_running', t, run.value('procs_running', i))
+        mem = [run.value(c, i) for c in MEM_FIELDS.values()]
+        if None not in mem:
+            add('mem_used_mb', t, (mem[0] - mem[1] - mem[2] - mem[3]) / 1024)
+        for name in list(run.header.get('processes', ())) + ['collector']:
+            pid, prev_pid = run.value(f'{name}.pid', i), run.value(f'{name}.pid', i - 1)
+            if pid is None:
+                continue
+            if name != 'collector':
+                add(f'{name}_rss_mb', t, run.value(f'{name}.rss', i) * page_kb / 1024)
+                add(f'{name}_threads', t, run.value(f'{name}.threads', i))
+            if pid == prev_pid:
+                used = sum(run.value(f'{name}.{f}', i) - run.value(f'{name}.{f}', i - 1)
+                           for f in ('utime', 'stime'))
+                add(f'{name}_cpu_%', t, 100 * used / total)
+                if name != 'collector':
+                    add(f'{name}_majflt_per_s', t,
+                        (run.value(f'{name}.majflt', i) - run.value(f'{name}.majflt', i - 1)) / dt)
+        for zone in run.header.get('zones', {}):
+            temp = run.value(f'thermal.{zone}', i)
+            if temp is not None:
+                # most zones report millidegrees, some old drivers plain degrees
+                add(f'{zone}_c', t, temp / 1000 if abs(temp) > 1000 else temp)
+    return out
+
+
+def stats(values):
+    """(n, mean, std, min, p50, p95, max) of a list of numbers"""
+    ordered = sorted(values)
+    n = len(ordered)
+    mean = sum(ordered) / n
+    std = math.sqrt(sum((v - mean) ** 2 for v in ordered) / (n - 1)) if n > 1 else 0.0
+
+    def pct(p):
+        return ordered[min(n - 1, int(round(p / 100 * (n - 1))))]
+    return n, mean, std, ordered[0], pct(50), pct(95), ordered[-1]
+
+
+def _order(names):
+    head = [m for m in HEADLINE if m in names]
+    return head + sorted(m for m in names if m not in head)
+
+
+def summary(run):
+    series = metrics(run)
+    duration = (run.value('time', len(run) - 1) - run.value('time', 0)) / 100 if len(run) else 0
+    out = [f"{run.label}: {len(run)} samples over {duration:.0f}s"
+           f"{' on ' + run.header['build'] if run.header.get('build') else ''}",
+           f"  {'metric':24} {'mean':>9} {'std':>8} {'min':>9} {'p50':>9} {'p95':>9} {'max':>9}"]
+    for name in _order(series):
+        _n, mean, std, low, p50, p95, high = stats([v for _t, v in series[name]])
+        out.append(f"  {name:24} {mean:9.2f} {std:8.2f} {low:9.2f} {p50:9.2f} {p95:9.2f} {high:9.2f}")
+    return out
+
+
+def compare(a, b):
+    """Lines comparing the runs' means; d is Cohen's d (|d| under 0.2 is noise, over 0.8 is real)"""
+    sa, sb = metrics(a), metrics(b)
+    out = [f"A = {a.label} ({len(a)} samples), B = {b.label} ({len(b)} samples)",
+           f"  {'metric':24} {'A mean':>9} {'B mean':>9} {'change':>9} {'%':>7} {'A p95':>9} {'B p95':>9} {'d':>6}"]
+    for name in _order(set(sa) & set(sb)):
+        na, ma, stda, _, _, p95a, _ = stats([v for _t, v in sa[name]])
+        nb, mb, stdb, _, _, p95b, _ = stats([v for _t, v in sb[name]])
+        pooled = math.sqrt(((na - 1) * stda ** 2 + (nb - 1) * stdb ** 2) / max(na + nb - 2, 1))
+        d = (mb - ma) / pooled if pooled else 0.0
+        pct = f"{(mb - ma) * 100 / abs(ma):+6.1f}%" if ma else '      -'
+        out.append(f"  {name:24} {ma:9.2f} {mb:9.2f} {mb - ma:+9.2f} {pct} {p95a:9.2f} {p95b:9.2f} {d:+6.2f}")
+    return out
+
+
+def plot_svg(runs, names, path, width=900, row_height=140):
+    """Stacked line charts, one per metric, every run overlaid; no plotting library needed"""
+    colors = ('#0078d4', '#ff9800', '#4caf50', '#f44336', '#9c27b0')
+    series = [metrics(run) for run in runs]
+    names = [n for n in names if any(n in s for s in series)]
+    left, right, top = 60, 20, 30
+    height = top + row_height * len(names) + 10
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+             f'font-family="sans-serif" font-size="11">',
+             f'<rect width="{width}" height="{height}" fill="#ffffff"/>']
+    for i, run in enumerate(runs):
+        parts.append(f'<text x="{left + i * 160}" y="16" fill="{colors[i % len(colors)]}" '
+                     f'font-weight="bold">■ {_xml(run.label)}</text>')
+    span = max((s[n][-1][0] for s in series for n in names if n in s and s[n]), default=1) or 1
+    for row, name in enumerate(names):
+        y0 = top + row * row_height
+        h = row_height - 30
+        values = [v for s in series for _t, v in s.get(name, ())]
+        low, high = min(values), max(values)
+        if high == low:
+            high = low + 1
+        parts.append(f'<text x="{left}" y="{y0 + 12}" font-weight="bold">{_xml(name)}</text>')
+        parts.append(f'<rect x="{left}" y="{y0 + 18}" width="{width - left - right}" height="{h}" '
+                     f'fill="none" stroke="#cccccc"/>')
+        for frac in (0, 0.5, 1):
+            y = y0 + 18 + h * (1 - frac)
+            parts.append(f'<text x="{left - 5}" y="{y + 4:.1f}" text-anchor="end" fill="#666666">'
+                         f'{low + (high - low) * frac:.1f}</text>')
+        for i, s in enumerate(series):
+            points = ' '.join(f'{left + (width - left - right) * t / span:.1f},'
+                              f'{y0 + 18 + h * (1 - (v - low) / (high - low)):.1f}' for t, v in s.get(name, ()))
+            if points:
+                parts.append(f'<polyline points="{points}" fill="none" stroke="{colors[i % len(colors)]}" '
+                             f'stroke-width="1.2"/>')
+    parts.append(f'<text x="{width - right}" y="{height - 2}" text-anchor="end" fill="#666666">'
+                 f'seconds from start (0-{span:.0f})</text>')
+    parts.append('</svg>')
+    with open(path, 'w') as f:
+        f.write('\n'.join(parts) + '\n')
+    return path
+
+
+def _xml(text):
+    return str(text).replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure what a mod does to the camera at runtime")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('record', help="sample the device over adb")
+    p.add_argument('-o', '--output', help="default: ~/.cache/beike-tools/telemetry/<label>_<time>.btel")
+    p.add_argument('--label', default='', help="name for this run in summaries and plots (e.g. stock, debloat)")
+    p.add_argument('--interval', type=float, default=1.0, help="seconds between samples (default: 1)")
+    p.add_argument('--duration', type=float, help="seconds to record (default: until Ctrl-C)")
+    p.add_argument('--process', action='append', help="processes to follow (default: sdv, mediaserver)")
+    p = sub.add_parser('summary', help="statistics for recorded runs")
+    p.add_argument('runs', nargs='+')
+    p.add_argument('--plot', help="also draw the runs into this SVG")
+    p = sub.add_parser('compare', help="A/B two runs")
+    p.add_argument('a')
+    p.add_argument('b')
+    p.add_argument('--plot', help="draw both runs into this SVG")
+    p.add_argument('--metric', action='append', help="metrics to plot (default: the headline ones)")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'record':
+            if args.interval < 0.2:
+                raise ValueError("--interval below 0.2s would cost the camera more than it measures")
+            output = args.output or os.path.join(
+                cache_dir('telemetry'), f"{args.label or 'run'}_{time.strftime('%Y%m%d_%H%M%S')}.btel")
+            count = record(output, args.duration, args.interval, args.label, tuple(args.process or DEFAULT_PROCESSES))
+            print(f"✓ {count} samples written to {output} ({os.path.getsize(output)} bytes)")
+            return 0
+        if args.command == 'summary':
+            runs = [Run(path) for path in args.runs]
+            for run in runs:
+                print('\n'.join(summary(run)))
+            if args.plot:
+                print(f"✓ Plot written to {plot_svg(runs, HEADLINE, args.plot)}")
+            return 0
+        a, b = Run(args.a), Run(args.b)
+        if len(a) < 2 or len(b) < 2:
+            raise ValueError("each run needs at least two samples")
+        print('\n'.join(compare(a, b)))
+        if args.plot:
+            print(f"✓ Plot written to {plot_svg([a, b], args.metric or HEADLINE, args.plot)}")
+    except (ValueError, OSError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
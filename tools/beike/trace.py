@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Stage timing for the tools
+Records nested spans (wall time, bytes processed, CPU time and peak memory of the
+subprocesses they ran) and saves each run as Chrome trace JSON (open in chrome://tracing or Perfetto)
+plus a line in a rolling history so runs can be compared.
+
+    python3 -m beike.trace history
+    python3 -m beike.trace history build
+    python3 -m beike.trace import build.events -o build.json --name build
+
+The shell scripts record the same spans via scripts/trace.sh when BEIKE_TRACE is set.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from . import cache_dir
+
+HISTORY_LIMIT = 500
+
+
+def traces_dir():
+    return cache_dir('traces')
+
+
+def _children_cpu():
+    """User + system CPU seconds of all reaped child processes so far"""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _rss_bytes(usage):
+    """ru_maxrss in bytes (Linux reports KB, macOS bytes)"""
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+class Span:
+    def __init__(self, name, depth, args):
+        self.name = name
+        self.depth = depth
+        self.args = dict(args)
+        self.bytes = 0
+        self.cpu = 0.0
+        self.rss = 0            # peak resident set of a subprocess reaped by Tracer.wait
+        self.start = time.perf_counter()
+        self.end = None
+        self.tid = threading.get_ident()
+
+    @property
+    def duration(self):
+        return (self.end or time.perf_counter()) - self.start
+
+
+class _SpanContext:
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer._close(self.span, exc)
+        return False
+
+
+class Tracer:
+    """One run of one tool (a build, a flash...). Spans nest per thread"""
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+        self.spans = []
+        self.started = time.perf_counter()
+        self.wall_started = time.time()
+        self.ended = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def span(self, name, **args):
+        stack = self._stack()
+        span = Span(name, len(stack), args)
+        stack.append(span)
+        with self._lock:
+            self.spans.append(span)
+        return _SpanContext(self, span)
+
+    def _close(self, span, exc=None):
+        span.end = time.perf_counter()
+        if exc is not None:
+            span.args['error'] = str(exc)
+        stack = self._stack()
+        if stack and stack[-1] is span:
+            stack.pop()
+        # subprocess CPU time rolls up into the enclosing span, peak memory is the biggest child
+        if stack:
+            stack[-1].cpu += span.cpu
+            stack[-1].rss = max(stack[-1].rss, span.rss)
+
+    def current(self):
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    def run(self, cmd, span=None, **kwargs):
+        """subprocess.run that charges the child's CPU time to span (or the current span)"""
+        before = _children_cpu()
+        result = subprocess.run(cmd, **kwargs)
+        target = span or self.current()
+        if target:
+            target.cpu += max(0.0, _children_cpu() - before)
+        return result
+
+    def wait(self, process, span=None):
+        """Reap a Popen, recording its CPU time and peak memory; returns the exit code"""
+        target = span or self.current()
+        if hasattr(os, 'wait4'):
+            try:
+                _, status, usage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                if target:
+                    target.cpu += usage.ru_utime + usage.ru_stime
+                    target.rss = max(target.rss, _rss_bytes(usage))
+                return process.returncode
+            except ChildProcessError:
+                pass
+        return process.wait()
+
+    def chrome_trace(self):
+        """The run as a Chrome trace event dict"""
+        pid = os.getpid()
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.name}}]
+        for span in self.spans:
+            args = dict(span.args)
+            if span.bytes:
+                args['bytes'] = span.bytes
+                if span.duration > 0:
+                    args['MB/s'] = round(span.bytes / span.duration / 1e6, 3)
+            if span.cpu:
+                args['subprocess_cpu_s'] = round(span.cpu, 4)
+            if span.rss:
+                args['subprocess_peak_rss_mb'] = round(span.rss / 1048576, 1)
+            events.append({'name': span.name, 'ph': 'X', 'pid': pid, 'tid': span.tid,
+                           'ts': round((span.start - self.started) * 1e6),
+                           'dur': round(span.duration * 1e6), 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms',
+                'otherData': dict(self.args, tool=self.name, started=self.wall_started)}
+
+    def summary(self):
+        """Flat per-span totals for the history file"""
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {'seconds': 0.0, 'bytes': 0, 'cpu': 0.0})
+            stage['seconds'] = round(stage['seconds'] + span.duration, 4)
+            stage['bytes'] += span.bytes
+            stage['cpu'] = round(stage['cpu'] + span.cpu, 4)
+        return {'tool': self.name, 'started': self.wall_started,
+                'seconds': round((self.ended or time.perf_counter()) - self.started, 4),
+                'args': self.args, 'stages': stages}
+
+    def finish(self, path=None):
+        """Write the Chrome trace (default: the traces cache) and append to history; returns the path"""
+        if path is None:
+            stamp = time.strftime('%Y%m%d_%H%M%S', time.localtime(self.wall_started))
+            path = os.path.join(traces_dir(), f"{self.name}_{stamp}.json")
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+        append_history(self.summary())
+        return path
+
+
+def append_history(entry):
+    path = os.path.join(traces_dir(), 'history.jsonl')
+    lines = []
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            lines = f.readlines()[-(HISTORY_LIMIT - 1):]
+    lines.append(json.dumps(entry) + '\n')
+    with open(path + '.tmp', 'w') as f:
+        f.writelines(lines)
+    os.replace(path + '.tmp', path)
+
+
+def read_history(tool=None):
+    path = os.path.join(traces_dir(), 'history.jsonl')
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [e for e in entries if tool is None or e['tool'] == tool]
+
+
+# ---------------------------------------------------------------------------
+# Shell script events (scripts/trace.sh)
+# ---------------------------------------------------------------------------
+
+def _seconds(value):
+    """'1700000000.123456' or bash `times` style '0m1.250s'"""
+    if 'm' in value and value.endswith('s'):
+        minutes, seconds = value[:-1].split('m')
+        return int(minutes) * 60 + float(seconds)
+    try:
+        return float(value)
+    except ValueError:
+        return float(value.split('.')[0])
+
+
+def import_events(path, name):
+    """Build a Tracer from the B/E lines written by scripts/trace.sh"""
+    run = Tracer(name, source=os.path.basename(path))
+    open_spans = []     # (span, cpu at begin)
+    first = None
+    with open(path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            kind, ts, user, system, span_name = parts[0], _seconds(parts[1]), parts[2], parts[3], parts[4]
+            cpu = _seconds(user) + _seconds(system)
+            if first is None:
+                first = ts
+                run.wall_started = ts
+            if kind == 'B':
+                span = Span(span_name, len(open_spans), {})
+                span.start = run.started + (ts - first)
+                open_spans.append((span, cpu))
+                run.spans.append(span)
+            elif kind == 'E' and open_spans:
+                span, cpu_start = open_spans.pop()
+                span.end = run.started + (ts - first)
+                span.cpu = max(0.0, cpu - cpu_start)
+                if len(parts) > 5:
+                    span.bytes = int(parts[5])
+    end = max((s.end for s in run.spans if s.end), default=run.started)
+    for span, _ in open_spans:
+        span.end = end
+    run.ended = end
+    return run
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage timing traces for Beike tools")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('history', help="compare recent runs")
+    p.add_argument('tool', nargs='?', help="only show this tool (build, flash, backup...)")
+    p.add_argument('-n', type=int, default=10, help="number of runs to show (default: 10)")
+    p = sub.add_parser('import', help="convert a scripts/trace.sh events file")
+    p.add_argument('events')
+    p.add_argument('-o', '--output', help="Chrome trace JSON output")
+    p.add_argument('--name', default='script')
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == 'import':
+            run = import_events(args.events, args.name)
+            path = run.finish(args.output)
+            print(f"✓ Trace written to {path}")
+            for stage, totals in run.summary()['stages'].items():
+                print(f"  {stage:24} {totals['seconds']:9.3f}s  cpu {totals['cpu']:7.3f}s  {totals['bytes']:>10} bytes")
+            return 0
+
+        entries = read_history(args.tool)[-args.n:]
+        if not entries:
+            print("No traced runs yet")
+            return 0
+        for entry in entries:
+            when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry['started']))
+            print(f"{when}  {entry['tool']:10} {entry['seconds']:9.3f}s")
+            for stage, totals in entry['stages'].items():
+                line = f"    {stage:24} {totals['seconds']:9.3f}s"
+                if totals['cpu']:
+                    line += f"  cpu {totals['cpu']:.3f}s"
+                if totals['bytes']:
+                    line += f"  {totals['bytes']} bytes"
+                print(line)
+    except (OSError, ValueError) as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
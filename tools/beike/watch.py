@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+"""
+Watch squashfs-root and keep a live size budget
+Follows the tree and the build layer (inotify on Linux, polling elsewhere), waits for a burst of saves
+to settle, then recompresses only the files that changed and prints the projected
+system image size against the mtdblock2 partition. Compressed sizes are cached per
+file (by size/mtime) so restarting is instant. Ctrl-C offers to build the real image.
+
+    python3 -m beike.watch
+    python3 -m beike.watch -C ~/rom --extra-compression
+    python3 -m beike.watch --against system_v1.0.bin
+
+The projection is xz per block like mksquashfs, scaled by how far off the same
+estimate was for the last real image (--against, else the newest system_v*.bin,
+else mtdblock2), so it tracks the real thing to within a few KB.
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import glob
+import hashlib
+import json
+import lzma
+import os
+import select
+import stat
+import struct
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from . import cache_dir, layer
+from .flash import detect_layout, partition_by_name
+
+BLOCK_SIZE = 128 * 1024             # mksquashfs default
+EXTRA_BLOCK_SIZE = 1024 * 1024      # build.sh experimental mode (-b 1M)
+SQUASHFS_MAGIC = b'hsqs'
+EXCLUDE_FILE = '.mksquashfs_exclude'
+
+# inotify(7)
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+EVENT_HEADER = struct.Struct('<iIII')
+
+
+def squashfs_bytes_used(path):
+    """Real image size from a squashfs superblock (mtdblock2 is padded), or None"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(96)
+    except OSError:
+        return None
+    if len(header) < 48 or header[:4] != SQUASHFS_MAGIC:
+        return None
+    return struct.unpack_from('<Q', header, 40)[0]
+
+
+def load_excludes(workdir):
+    """Paths the build leaves out (build layer deletions, mksquashfs -ef list), relative to squashfs-root"""
+    excludes = {os.path.normpath(rel) for rel in layer.Layer(workdir).state['delete']}
+    path = os.path.join(workdir, EXCLUDE_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            excludes.update(os.path.normpath(line.strip()) for line in f if line.strip())
+    return excludes
+
+
+def layer_files(workdir):
+    """rel -> file for everything the build layer adds or replaces (its render() outputs)"""
+    build = layer.Layer(workdir)
+    if build.empty:
+        return {}
+    return {os.path.normpath(rel): path for rel, path in build.render().items() if not build.deleted(rel)}
+
+
+def _compress(block, extra):
+    """Bytes mksquashfs would store for one block (it keeps whichever is smaller)"""
+    lzma2 = {'id': lzma.FILTER_LZMA2, 'preset': 6, 'dict_size': max(len(block), 4096)}
+    size = len(lzma.compress(block, format=lzma.FORMAT_RAW, filters=[lzma2]))
+    if extra:
+        # -Xbcj arm: mksquashfs tries the filter per block and keeps the best
+        bcj = lzma.compress(block, format=lzma.FORMAT_RAW, filters=[{'id': lzma.FILTER_ARM}, lzma2])
+        size = min(size, len(bcj))
+    return min(size, len(block))
+
+
+def compressed_size(path, block_size=BLOCK_SIZE, extra=False):
+    """(full block bytes, tail fragment bytes) for one file"""
+    blocks = tail = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(block_size)
+            if not chunk:
+                break
+            if len(chunk) == block_size:
+                blocks += _compress(chunk, extra)
+            else:
+                tail = _compress(chunk, extra)
+    return blocks, tail
+
+
+class SizeEstimator:
+    """Per-file compressed sizes for a tree, recomputed only for files that changed
+
+    overrides ({rel: file}) are sized in place of the tree's own file at rel, or as
+    extra files where the tree has none: the build layer's changes.
+    """
+    def __init__(self, root, extra=False, excludes=(), use_cache=True, jobs=None, overrides=None):
+        self.root = root
+        self.extra = extra
+        self.block_size = EXTRA_BLOCK_SIZE if extra else BLOCK_SIZE
+        self.excludes = set(excludes)
+        self.overrides = dict(overrides or {})
+        self.use_cache = use_cache
+        self.jobs = jobs or os.cpu_count() or 1
+        self.files = {}         # rel -> [size, mtime, blocks, tail]
+        self.entries = {}       # rel -> name length, for the metadata estimate
+        key = hashlib.sha256(f"{os.path.realpath(root)}:{self.block_size}:{extra}".encode()).hexdigest()[:24]
+        self.cache_path = os.path.join(cache_dir('watch'), f"{key}.json")
+        if use_cache and os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, 'r') as f:
+                    self.files = json.load(f)
+            except (OSError, ValueError):
+                self.files = {}
+
+    def _excluded(self, rel):
+        parts = rel.split(os.sep)
+        return any(os.path.join(*parts[:i]) in self.excludes for i in range(1, len(parts) + 1))
+
+    def scan(self):
+        """Stat the tree and recompress what changed; returns the changed/removed paths"""
+        entries = {}
+        todo = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames
+                           if not self._excluded(os.path.relpath(os.path.join(dirpath, d), self.root))]
+            for name in dirnames + filenames:
+                rel = os.path.relpath(os.path.join(dirpath, name), self.root)
+                if rel not in self.overrides and not self._excluded(rel):
+                    entries[rel] = len(name)
+                    self._check(rel, os.path.join(dirpath, name), todo)
+        for rel, full in self.overrides.items():
+            entries[rel] = len(os.path.basename(rel))
+            self._check(rel, full, todo)
+
+        removed = [rel for rel in self.files if rel not in entries]
+        for rel in removed:
+            del self.files[rel]
+
+        # lzma drops the GIL while compressing, so threads are enough here
+        def work(item):
+            rel, full, st = item
+            try:
+                return compressed_size(full, self.block_size, self.extra)
+            except OSError:
+                return None
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            for (rel, _full, st), sizes in zip(todo, pool.map(work, todo)):
+                if sizes is not None:
+                    self.files[rel] = [st.st_size, st.st_mtime_ns, sizes[0], sizes[1]]
+        self.entries = entries
+        return [rel for rel, _full, _st in todo] + removed
+
+    def _check(self, rel, full, todo):
+        """Queue rel for compressing if it's a regular file that changed since it was cached"""
+        try:
+            st = os.lstat(full)
+        except FileNotFoundError:
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+        old = self.files.get(rel)
+        if not old or old[0] != st.st_size or old[1] != st.st_mtime_ns:
+            todo.append((rel, full, st))
+
+    def estimate(self):
+        """Uncalibrated image size: data blocks, fragments and roughly compressed metadata"""
+        data = sum(f[2] + f[3] for f in self.files.values())
+        # inode (~32 bytes + 4 per block) and directory entry (8 + name) per entry,
+        # metadata blocks compress to about half
+        blocks = sum(f[0] // self.block_size + 1 for f in self.files.values())
+        metadata = (len(self.entries) * 40 + sum(self.entries.values()) + blocks * 4) // 2
+        size = 96 + data + metadata
+        return (size + 4095) // 4096 * 4096
+
+    def save(self):
+        if not self.use_cache:
+            return
+        tmp = self.cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.files, f)
+        os.replace(tmp, self.cache_path)
+
+
+# ---------------------------------------------------------------------------
+# Change notification
+# ---------------------------------------------------------------------------
+
+class InotifyWatcher:
+    """Recursive inotify watch on a tree (Linux only)"""
+    def __init__(self, root):
+        libc_name = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError("inotify not available")
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        self.add_tree(root)
+
+    def add_tree(self, top):
+        for dirpath, _dirnames, _filenames in os.walk(top):
+            self.add_dir(dirpath)
+
+    def add_dir(self, path):
+        """Watch one directory (directories created in it get watched recursively)"""
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def wait(self, timeout=None):
+        """Block until something changes (or timeout); returns True if it did"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and wd in self.dirs:
+                self.add_tree(os.path.join(self.dirs[wd], os.fsdecode(name)))
+            elif mask & IN_DELETE_SELF:
+                self.dirs.pop(wd, None)
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher:
+    """Fallback for macOS and friends: rescan (stat only) every interval"""
+    def __init__(self, root, interval=1.0):
+        self.interval = interval
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(self.interval, timeout))
+        return True
+
+    def close(self):
+        pass
+
+
+def make_watcher(root, poll=False):
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(root)
+        except OSError:
+            pass
+    return PollWatcher(root)
+
+
+def settle(watcher, debounce, longest=3.0):
+    """Swallow a burst of events until the tree has been quiet for debounce seconds"""
+    started = time.monotonic()
+    while time.monotonic() - started < longest and watcher.wait(debounce):
+        if isinstance(watcher, PollWatcher):
+            break
+
+
+# ---------------------------------------------------------------------------
+# Budget
+# ---------------------------------------------------------------------------
+
+def partition_limit(workdir):
+    """Size the image has to stay under: mtdblock2 if present (like build.sh), else the detected layout"""
+    mtdblock2 = os.path.join(workdir, 'mtdblock2')
+    if os.path.exists(mtdblock2):
+        return os.path.getsize(mtdblock2)
+    return partition_by_name('system', detect_layout([workdir])[0]).size
+
+
+def reference_image(workdir, against=None):
+    """The image to calibrate against: --against, newest system_v*.bin, else mtdblock2"""
+    if against:
+        return against
+    images = sorted(glob.glob(os.path.join(workdir, 'system_v*.bin')), key=os.path.getmtime)
+    candidates = images[::-1] + [os.path.join(workdir, 'mtdblock2')]
+    for path in candidates:
+        if squashfs_bytes_used(path):
+            return path
+    return None
+
+
+def _kb(n):
+    return f"{n / 1024:,.0f} KB"
+
+
+def format_budget(projected, limit):
+    pct = projected * 100 / limit
+    if projected < limit:
+        verdict = f"✓ {_kb(limit - projected)} free"
+    else:
+        verdict = f"✗ over by {_kb(projected - limit)}"
+    return f"projected {_kb(projected)} / {_kb(limit)} ({pct:.1f}%)  {verdict}"
+
+
+def offer_build(args, limit):
+    """Ask whether to build the real image, then build, size check and copy it like build.sh"""
+    if not sys.stdin.isatty():
+        return 0
+    try:
+        if input("\nBuild a flashable image now? [y/N]: ").strip().lower() not in ('y', 'yes'):
+            return 0
+        version = args.version or input("Enter version (e.g. 1.0): ").strip()
+        build_num = args.build or input("Enter build number (e.g. 8): ").strip()
+        product = args.product or input("Enter product type (e.g. Beike): ").strip()
+        manufacturer = args.manufacturer or input("Enter manufacturer (e.g. JoshAtticus): ").strip()
+    except EOFError:
+        return 0
+
+    import shutil
+    from . import core
+    image = core.build_rom(version, build_num, product, manufacturer, args.workdir,
+                           extra_compression=args.extra_compression)
+    size = os.path.getsize(image)
+    if size >= limit:
+        print(f"✗ Generated image ({image}) is too large: {size} bytes >= {limit} bytes", file=sys.stderr)
+        return 1
+    print(f"Size check passed: {size} bytes < {limit} bytes")
+    sunxi = os.path.join(args.workdir, 'sunxi-tools')
+    if os.path.isdir(sunxi):
+        shutil.copy(image, sunxi)
+    print(f"To flash: python3 -m beike.cli flash {os.path.basename(image)}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Watch squashfs-root and show the projected system image size")
+    parser.add_argument('-C', '--workdir', default='.', help="rom-building directory (default: current)")
+    parser.add_argument('--extra-compression', action='store_true',
+                        help="estimate (and build) with ARM BCJ and 1 MB blocks")
+    parser.add_argument('--against', help="squashfs image built from this tree, to calibrate against")
+    parser.add_argument('--debounce', type=float, default=0.5, help="quiet time before rescanning (default: 0.5s)")
+    parser.add_argument('--poll', action='store_true', help="poll instead of using inotify")
+    parser.add_argument('--no-cache', action='store_true', help="recompress everything on start")
+    parser.add_argument('--once', action='store_true', help="print the projection and exit")
+    parser.add_argument('--version', help="build settings for the image offered on exit")
+    parser.add_argument('--build', help="build number")
+    parser.add_argument('--product', default='Beike')
+    parser.add_argument('--manufacturer', default='JoshAtticus')
+    args = parser.parse_args(argv)
+
+    root = os.path.join(args.workdir, 'squashfs-root')
+    if not os.path.isdir(root):
+        print(f"✗ Directory 'squashfs-root' not found in {args.workdir}", file=sys.stderr)
+        return 1
+
+    limit = partition_limit(args.workdir)
+    try:
+        overrides = layer_files(args.workdir)
+    except ValueError as e:
+        print(f"✗ Build layer: {e}", file=sys.stderr)
+        return 1
+    estimator = SizeEstimator(root, args.extra_compression, load_excludes(args.workdir),
+                              use_cache=not args.no_cache, overrides=overrides)
+    print(f"Compressing {root} (only the first run does all of it)...")
+    started = time.perf_counter()
+    estimator.scan()
+    estimator.save()
+
+    scale = 1.0
+    reference = reference_image(args.workdir, args.against)
+    if reference:
+        scale = squashfs_bytes_used(reference) / estimator.estimate()
+        print(f"Calibrated against {reference} (x{scale:.3f})")
+    else:
+        print("No squashfs image to calibrate against, projection is uncalibrated")
+    print(f"[{time.strftime('%H:%M:%S')}] {format_budget(round(estimator.estimate() * scale), limit)}"
+          f"  ({time.perf_counter() - started:.1f}s)")
+    if args.once:
+        return 0
+
+    watcher = make_watcher(root, args.poll)
+    if isinstance(watcher, InotifyWatcher):
+        # the layer (and its directory appearing on the first `layer set`) counts too
+        watcher.add_dir(args.workdir)
+        if os.path.isdir(os.path.join(args.workdir, layer.LAYER_DIR)):
+            watcher.add_tree(os.path.join(args.workdir, layer.LAYER_DIR))
+    print(f"Watching {root} ({'inotify' if isinstance(watcher, InotifyWatcher) else 'polling'}), Ctrl-C to stop")
+    try:
+        while True:
+            if not watcher.wait():
+                continue
+            settle(watcher, args.debounce)
+            started = time.perf_counter()
+            estimator.excludes = load_excludes(args.workdir)
+            try:
+                estimator.overrides = layer_files(args.workdir)
+            except ValueError as e:
+                print(f"✗ Build layer: {e}", file=sys.stderr)
+            changed = estimator.scan()
+            if not changed:
+                continue
+            estimator.save()
+            shown = ', '.join(changed[:3]) + (f" +{len(changed) - 3} more" if len(changed) > 3 else '')
+            print(f"[{time.strftime('%H:%M:%S')}] {format_budget(round(estimator.estimate() * scale), limit)}"
+                  f"  ({time.perf_counter() - started:.1f}s: {shown})")
+    except KeyboardInterrupt:
+        print()
+    finally:
+        watcher.close()
+        estimator.save()
+
+    try:
+        return offer_build(args, limit)
+    except Exception as e:
+        print(f"✗ {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
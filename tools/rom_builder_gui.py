@@ -4,20 +4,40 @@ ROM Builder GUI - Allwinner V3 Action Camera Tool
 Provides a graphical interface for building, flashing, and managing ROMs
 """
 
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, filedialog, simpledialog
-from tkinterdnd2 import DND_FILES, TkinterDnD
-import subprocess
+import re
+import shutil
 import threading
+import time
 import os
 import sys
-import shutil
-from datetime import datetime
-import re
+
+from beike import core, layer
+
+# Tk and tkinterdnd2 are only imported once the GUI actually starts (see load_tk),
+# so this module and beike.core stay importable on headless machines
+tk = ttk = scrolledtext = messagebox = filedialog = simpledialog = None
+DND_FILES = TkinterDnD = None
+
+# Logcat tab: lines kept in the text widget, and how often it catches up with the stream
+LOGCAT_LINES = 5000
+LOGCAT_REFRESH_MS = 250
+
+
+def load_tk():
+    """Import Tk (and tkinterdnd2 when installed) into the module globals"""
+    global tk, ttk, scrolledtext, messagebox, filedialog, simpledialog, DND_FILES, TkinterDnD
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox, filedialog, simpledialog
+    try:
+        from tkinterdnd2 import DND_FILES, TkinterDnD
+    except ImportError:
+        DND_FILES = TkinterDnD = None
+
 
 class ROMBuilderGUI:
-    def __init__(self, root):
+    def __init__(self, root, drag_drop_enabled=True):
         self.root = root
+        self.drag_drop_enabled = drag_drop_enabled
         self.root.title("ROM Builder - Allwinner V3 Action Camera")
         self.root.geometry("1100x800")
         
@@ -130,11 +150,19 @@ class ROMBuilderGUI:
         misc_tab = ttk.Frame(notebook)
         notebook.add(misc_tab, text="🛠️ Misc")
         
-        # Setup tab contents
+        # Logcat tab
+        logcat_tab = ttk.Frame(notebook)
+        notebook.add(logcat_tab, text="📜 Logcat")
+        
+        # Setup tab contents: the build tab now, the rest the first time they are opened
         self.setup_build_tab(build_tab)
-        self.setup_flash_tab(flash_tab)
-        self.setup_backup_tab(backup_tab)
-        self.setup_misc_tab(misc_tab)
+        self.pending_tabs = {
+            str(flash_tab): (self.setup_flash_tab, flash_tab),
+            str(backup_tab): (self.setup_backup_tab, backup_tab),
+            str(misc_tab): (self.setup_misc_tab, misc_tab),
+            str(logcat_tab): (self.setup_logcat_tab, logcat_tab),
+        }
+        notebook.bind('<<NotebookTabChanged>>', self.on_tab_changed)
         
         # Output frame (shared between tabs)
         output_frame = ttk.LabelFrame(main_frame, text="📋 Output Log", padding="10")
@@ -159,6 +187,13 @@ class ROMBuilderGUI:
                                      anchor=tk.W, padx=10, pady=5, font=('Arial', 9))
         self.status_label.pack(fill=tk.X)
     
+    def on_tab_changed(self, event):
+        """Build a tab's widgets the first time it is selected"""
+        pending = self.pending_tabs.pop(event.widget.select(), None)
+        if pending:
+            setup, frame = pending
+            setup(frame)
+    
     def setup_build_tab(self, parent):
         """Setup the Build tab"""
         parent.columnconfigure(0, weight=1)
@@ -205,7 +240,9 @@ class ROMBuilderGUI:
         ttk.Button(action_frame, text="2️⃣ Build ROM Image", command=self.build_rom_gui,
                   style='Accent.TButton').pack(fill=tk.X, pady=(0, 10), ipady=8)
         
-        ttk.Button(action_frame, text="📄 Extract mtdblock2 to Edit", command=self.extract_mtdblock2_gui).pack(fill=tk.X, ipady=5)
+        ttk.Button(action_frame, text="📄 Extract mtdblock2 to Edit", command=self.extract_mtdblock2_gui).pack(fill=tk.X, pady=(0, 10), ipady=5)
+        
+        ttk.Button(action_frame, text="↩️ Reset Customizations", command=self.reset_customizations_gui).pack(fill=tk.X, ipady=5)
     
     def setup_flash_tab(self, parent):
         """Setup the Flash tab"""
@@ -234,6 +271,18 @@ class ROMBuilderGUI:
         ttk.Button(flash_frame, text="⚡ Flash ROM to Device", command=self.flash_rom_gui,
                   style='Accent.TButton').pack(fill=tk.X, ipady=8)
         
+        ttk.Label(flash_frame, text="Device already running with USB debugging? Update over ADB instead\n"
+                 "(only changed blocks are written, no FEL mode needed)",
+                 font=('Arial', 9)).pack(anchor=tk.W, pady=(10, 10))
+        
+        ttk.Button(flash_frame, text="📶 Update ROM over ADB", command=self.adb_update_gui).pack(fill=tk.X, ipady=8)
+        
+        ttk.Label(flash_frame, text="Just trying something? Boot it from RAM over FEL instead\n"
+                 "(nothing is written to flash, power cycle to go back)",
+                 font=('Arial', 9)).pack(anchor=tk.W, pady=(10, 10))
+        
+        ttk.Button(flash_frame, text="🧪 Test ROM from RAM", command=self.ram_boot_gui).pack(fill=tk.X, ipady=8)
+        
         # Full Restore section
         restore_frame = ttk.LabelFrame(scrollable_frame, text="🔄 Full Device Restore", padding="15")
         restore_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -270,6 +319,11 @@ class ROMBuilderGUI:
         ttk.Button(backup_frame, text="💾 Backup Device (ADB)", command=self.backup_device,
                   style='Accent.TButton').pack(fill=tk.X, ipady=8)
         
+        ttk.Label(backup_frame, text="Device won't boot? Read the whole flash in FEL mode instead",
+                 font=('Arial', 9)).pack(anchor=tk.W, pady=(10, 10))
+        
+        ttk.Button(backup_frame, text="💾 Backup Device (FEL)", command=self.fel_backup_gui).pack(fill=tk.X, ipady=8)
+        
         # Extract section
         extract_frame = ttk.LabelFrame(scrollable_frame, text="📂 Extract Backups", padding="15")
         extract_frame.pack(fill=tk.X, padx=10, pady=10)
@@ -349,6 +403,11 @@ class ROMBuilderGUI:
         except:
             pass
         
+        # Without tkinterdnd2 the labels are click-to-select only
+        if not self.drag_drop_enabled:
+            self.boot_logo_label.config(text="Boot Logo: Click button to select (220x176)")
+            self.shutdown_logo_label.config(text="Shutdown Logo: Click button to select")
+        
         ttk.Button(logo_frame, text="📤 Flash Logos to Device (ADB)", 
                   command=self.change_logos_gui, style='Accent.TButton').pack(fill=tk.X, ipady=8)
         
@@ -397,165 +456,130 @@ class ROMBuilderGUI:
         # Auto-check dependencies
         self.check_dependencies()
         
-    def log(self, message):
-        """Add message to output text"""
-        self.output_text.insert(tk.END, message + "\n")
-        self.output_text.see(tk.END)
-        self.root.update_idletasks()
-        
-    def run_command(self, command, shell_script=None):
-        parent.rowconfigure(0, weight=1)
-        
-        # Create canvas and scrollbar for scrolling
-        canvas = tk.Canvas(parent, bg=self.colors['bg'], highlightthickness=0)
-        scrollbar = ttk.Scrollbar(parent, orient="vertical", command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas)
-        
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
-        
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-        
-        # Bind mousewheel for scrolling
-        def _on_mousewheel(event):
-            canvas.yview_scroll(int(-1*(event.delta/120)), "units")
-        canvas.bind_all("<MouseWheel>", _on_mousewheel)
-        
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        
-        # Build Settings frame
-        settings_frame = ttk.LabelFrame(scrollable_frame, text="⚙️ Build Settings", padding="15")
-        settings_frame.pack(fill=tk.X, padx=10, pady=10)
-        
-        # Grid layout for settings
-        for i in range(4):
-            settings_frame.columnconfigure(i, weight=1)
-        
-        ttk.Label(settings_frame, text="Version:", font=('Arial', 9, 'bold')).grid(row=0, column=0, sticky=tk.W, padx=5, pady=8)
-        version_entry = ttk.Entry(settings_frame, textvariable=self.version_var, width=18)
-        version_entry.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=5, pady=8)
-        
-        ttk.Label(settings_frame, text="Build #:", font=('Arial', 9, 'bold')).grid(row=0, column=2, sticky=tk.W, padx=5, pady=8)
-        build_entry = ttk.Entry(settings_frame, textvariable=self.build_num_var, width=18)
-        build_entry.grid(row=0, column=3, sticky=(tk.W, tk.E), padx=5, pady=8)
-        
-        ttk.Label(settings_frame, text="Product:", font=('Arial', 9, 'bold')).grid(row=1, column=0, sticky=tk.W, padx=5, pady=8)
-        product_entry = ttk.Entry(settings_frame, textvariable=self.product_type_var, width=18)
-        product_entry.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=5, pady=8)
-        
-        ttk.Label(settings_frame, text="Manufacturer:", font=('Arial', 9, 'bold')).grid(row=1, column=2, sticky=tk.W, padx=5, pady=8)
-        mfr_entry = ttk.Entry(settings_frame, textvariable=self.manufacturer_var, width=18)
-        mfr_entry.grid(row=1, column=3, sticky=(tk.W, tk.E), padx=5, pady=8)
-        
-        # Button frame
-        button_frame = ttk.LabelFrame(scrollable_frame, text="🎬 Actions", padding="15")
-        button_frame.pack(fill=tk.X, padx=10, pady=10)
-        
-        # Build section
-        build_section = ttk.Frame(button_frame)
-        build_section.pack(fill=tk.X, pady=(0, 15))
-        
-        ttk.Label(build_section, text="Build & Flash", font=('Arial', 11, 'bold')).pack(anchor=tk.W, pady=(0, 8))
-        
-        btn_frame1 = ttk.Frame(build_section)
-        btn_frame1.pack(fill=tk.X)
-        
-        self.customize_btn = ttk.Button(btn_frame1, text="1️⃣ Customize ROM", command=self.customize_rom_gui, 
-                                       style='Accent.TButton', width=25)
-        self.customize_btn.pack(side=tk.LEFT, padx=(0, 10), ipady=5)
-        
-        self.build_btn = ttk.Button(btn_frame1, text="2️⃣ Build ROM", command=self.build_rom_gui,
-                                   style='Accent.TButton', width=25)
-        self.build_btn.pack(side=tk.LEFT, padx=(0, 10), ipady=5)
-        
-        self.flash_btn = ttk.Button(btn_frame1, text="3️⃣ Flash ROM", command=self.flash_rom_gui,
-                                   style='Accent.TButton', width=25)
-        self.flash_btn.pack(side=tk.LEFT, ipady=5)
+    def setup_logcat_tab(self, parent):
+        """Setup the Logcat tab (device log, filtered from beike.logcat's ring buffer)"""
+        from beike import logcat
         
-        # Separator
-        ttk.Separator(button_frame, orient='horizontal').pack(fill=tk.X, pady=15)
-        
-        # Backup section
-        backup_section = ttk.Frame(button_frame)
-        backup_section.pack(fill=tk.X, pady=(0, 15))
-        
-        ttk.Label(backup_section, text="Backup & Restore", font=('Arial', 11, 'bold')).pack(anchor=tk.W, pady=(0, 8))
-        
-        btn_frame2 = ttk.Frame(backup_section)
-        btn_frame2.pack(fill=tk.X)
-        
-        self.backup_btn = ttk.Button(btn_frame2, text="💾 Backup Device", command=self.backup_device, width=20)
-        self.backup_btn.pack(side=tk.LEFT, padx=(0, 10), ipady=3)
-        
-        self.extract_btn = ttk.Button(btn_frame2, text="📂 Extract mtdblocks", command=self.extract_mtdblocks_gui, width=20)
-        self.extract_btn.pack(side=tk.LEFT, padx=(0, 10), ipady=3)
-        
-        self.make_restore_btn = ttk.Button(btn_frame2, text="📦 Make Restore", command=self.make_restore_gui, width=20)
-        self.make_restore_btn.pack(side=tk.LEFT, ipady=3)
-        
-        btn_frame3 = ttk.Frame(backup_section)
-        btn_frame3.pack(fill=tk.X, pady=(10, 0))
-        
-        self.restore_btn = ttk.Button(btn_frame3, text="⚡ Flash Full Restore", command=self.full_restore_gui, width=20)
-        self.restore_btn.pack(side=tk.LEFT, padx=(0, 10), ipady=3)
-        
-        self.extract_single_btn = ttk.Button(btn_frame3, text="📄 Extract mtdblock2", command=self.extract_mtdblock2_gui, width=20)
-        self.extract_single_btn.pack(side=tk.LEFT, ipady=3)
-        
-        # Separator
-        ttk.Separator(button_frame, orient='horizontal').pack(fill=tk.X, pady=15)
-        
-        # Logo section
-        logo_section = ttk.Frame(button_frame)
-        logo_section.pack(fill=tk.X)
-        
-        ttk.Label(logo_section, text="Boot Logos", font=('Arial', 11, 'bold')).pack(anchor=tk.W, pady=(0, 8))
-        
-        drop_frame = ttk.Frame(logo_section)
-        drop_frame.pack(fill=tk.X)
-        
-        # Boot logo drop zone
-        boot_container = ttk.Frame(drop_frame)
-        boot_container.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
-        
-        ttk.Label(boot_container, text="Boot Logo (220x176):", font=('Arial', 9)).pack(anchor=tk.W, pady=(0, 5))
-        self.boot_logo_label = tk.Label(boot_container, text="🖼️ Drop or Click to Select", 
-                                       bg=self.colors['frame_bg'], fg='gray',
-                                       relief=tk.SOLID, borderwidth=2, cursor="hand2",
-                                       padx=20, pady=30, font=('Arial', 10))
-        self.boot_logo_label.pack(fill=tk.X)
-        try:
-            self.boot_logo_label.drop_target_register(DND_FILES)
-            self.boot_logo_label.dnd_bind('<<Drop>>', lambda e: self.on_boot_logo_drop(e))
-        except:
-            pass
+        parent.columnconfigure(0, weight=1)
+        parent.rowconfigure(1, weight=1)
+        self.logcat_ring = logcat.LogRing()
+        self.logcat_stream = None
+        self.logcat_shown = -1
+        self.logcat_filter = logcat.Filter()
+        
+        # Filters
+        filter_frame = ttk.Frame(parent, padding="5")
+        filter_frame.grid(row=0, column=0, sticky=(tk.W, tk.E))
+        
+        self.logcat_tag = tk.StringVar(self.root)
+        self.logcat_pid = tk.StringVar(self.root)
+        self.logcat_priority = tk.StringVar(self.root, value="V")
+        self.logcat_grep = tk.StringVar(self.root)
+        self.logcat_record = tk.BooleanVar(self.root, value=False)
+        
+        ttk.Label(filter_frame, text="Tags:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.logcat_tag, width=18).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="PIDs:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.logcat_pid, width=10).pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="Level:").pack(side=tk.LEFT)
+        ttk.Combobox(filter_frame, textvariable=self.logcat_priority, values=list(logcat.PRIORITIES)[:-1],
+                     width=3, state="readonly").pack(side=tk.LEFT, padx=(2, 8))
+        ttk.Label(filter_frame, text="Search:").pack(side=tk.LEFT)
+        ttk.Entry(filter_frame, textvariable=self.logcat_grep, width=20).pack(side=tk.LEFT, padx=(2, 8))
+        for var in (self.logcat_tag, self.logcat_pid, self.logcat_priority, self.logcat_grep):
+            var.trace_add('write', lambda *_: self.logcat_filter_changed())
+        
+        self.logcat_button = ttk.Button(filter_frame, text="▶ Start", command=self.logcat_toggle,
+                                        style='Accent.TButton')
+        self.logcat_button.pack(side=tk.RIGHT)
+        ttk.Checkbutton(filter_frame, text="Record", variable=self.logcat_record).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(filter_frame, text="Clear", command=self.logcat_clear).pack(side=tk.RIGHT, padx=5)
+        
+        self.logcat_text = scrolledtext.ScrolledText(parent, wrap=tk.NONE, height=20,
+                                                     bg=self.colors['frame_bg'], fg=self.colors['fg'],
+                                                     insertbackground=self.colors['fg'], borderwidth=0,
+                                                     font=('Monaco', 9))
+        self.logcat_text.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
+        for char, color in (('W', self.colors['warning']), ('E', self.colors['error']), ('F', self.colors['error'])):
+            self.logcat_text.tag_configure(char, foreground=color)
         
-        # Shutdown logo drop zone  
-        shutdown_container = ttk.Frame(drop_frame)
-        shutdown_container.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.logcat_status = tk.StringVar(self.root, value="Not running")
+        ttk.Label(parent, textvariable=self.logcat_status, font=('Arial', 9)).grid(row=2, column=0, sticky=tk.W)
+    
+    def logcat_toggle(self):
+        """Start or stop streaming logcat from the device"""
+        from beike import logcat
+        
+        if self.logcat_stream:
+            self.logcat_stream.stop()
+            self.logcat_stream = None
+            self.logcat_button.configure(text="▶ Start")
+            return
+        recorder = logcat.Recorder() if self.logcat_record.get() else None
+        self.logcat_stream = logcat.LogcatStream(
+            self.logcat_ring, recorder,
+            log=lambda message: self.root.after(0, lambda: self.logcat_status.set(message))).start()
+        self.logcat_button.configure(text="■ Stop")
+        self.logcat_started = (time.monotonic(), self.logcat_ring.next)
+        self.logcat_refresh()
+    
+    def logcat_clear(self):
+        from beike import logcat
+        
+        self.logcat_ring = logcat.LogRing(self.logcat_ring.capacity)
+        if self.logcat_stream:
+            self.logcat_stream.ring = self.logcat_ring
+        self.logcat_started = (time.monotonic(), 0)
+        self.logcat_filter_changed()
+    
+    def logcat_filter_changed(self):
+        """Rebuild the view from the indexes with the new filter"""
+        from beike import logcat
         
-        ttk.Label(shutdown_container, text="Shutdown Logo:", font=('Arial', 9)).pack(anchor=tk.W, pady=(0, 5))
-        self.shutdown_logo_label = tk.Label(shutdown_container, text="🖼️ Drop or Click to Select",
-                                           bg=self.colors['frame_bg'], fg='gray',
-                                           relief=tk.SOLID, borderwidth=2, cursor="hand2",
-                                           padx=20, pady=30, font=('Arial', 10))
-        self.shutdown_logo_label.pack(fill=tk.X)
         try:
-            self.shutdown_logo_label.drop_target_register(DND_FILES)
-            self.shutdown_logo_label.dnd_bind('<<Drop>>', lambda e: self.on_shutdown_logo_drop(e))
-        except:
-            pass
-        
-        flash_btn_frame = ttk.Frame(logo_section)
-        flash_btn_frame.pack(fill=tk.X, pady=(10, 0))
+            pids = [int(p) for p in self.logcat_pid.get().replace(',', ' ').split()]
+            self.logcat_filter = logcat.Filter(self.logcat_tag.get().replace(',', ' ').split(), pids,
+                                               logcat.parse_priority(self.logcat_priority.get()),
+                                               self.logcat_grep.get() or None)
+        except (ValueError, re.error):
+            return
+        self.logcat_text.delete('1.0', tk.END)
+        self.logcat_shown = -1
+        self.logcat_show()
+    
+    def logcat_show(self):
+        """Append what arrived (and matches) since the last redraw; never blocks the stream for long"""
+        from beike import logcat
         
-        self.logos_btn = ttk.Button(flash_btn_frame, text="📤 Flash Logos to Device (ADB)", 
-                                   command=self.change_logos_gui, style='Accent.TButton', width=35)
-        self.logos_btn.pack(ipady=5)
+        entries, self.logcat_shown = self.logcat_ring.query(self.logcat_filter, self.logcat_shown,
+                                                            LOGCAT_LINES)
+        if not entries:
+            return
+        at_bottom = self.logcat_text.yview()[1] >= 0.999
+        # One insert call for the whole batch (text, tags, text, tags, ...)
+        chunks = []
+        for entry in entries:
+            char = logcat.PRIORITY_CHARS.get(entry.priority, '')
+            chunks += [entry.line() + "\n", char if char in ('W', 'E', 'F') else ()]
+        self.logcat_text.insert(tk.END, *chunks)
+        excess = int(self.logcat_text.index('end-1c').split('.')[0]) - LOGCAT_LINES
+        if excess > 0:
+            self.logcat_text.delete('1.0', f'{excess + 1}.0')
+        if at_bottom:
+            self.logcat_text.see(tk.END)
+    
+    def logcat_refresh(self):
+        """Redraw on a timer while streaming, instead of once per entry"""
+        if not self.logcat_stream:
+            return
+        self.logcat_show()
+        started, first = self.logcat_started
+        elapsed = max(time.monotonic() - started, 0.001)
+        ring = self.logcat_ring
+        self.logcat_status.set(f"{len(ring)} entries in buffer ({len(ring) * 100 // ring.capacity}% full), "
+                               f"{(ring.next - first) / elapsed:.0f} lines/s, "
+                               f"{self.logcat_stream.bytes / 1024:.0f} KB received")
+        self.root.after(LOGCAT_REFRESH_MS, self.logcat_refresh)
     
     def setup_deps_tab(self, parent):
         """Setup the dependencies tab"""
@@ -623,67 +647,21 @@ class ROMBuilderGUI:
         self.output_text.insert(tk.END, message + "\n")
         self.output_text.see(tk.END)
         self.root.update_idletasks()
-        
-    def run_command(self, command, shell_script=None):
-        """Run a command and show output in real-time"""
-        try:
-            if shell_script:
-                # Run shell script
-                process = subprocess.Popen(
-                    ['bash', shell_script],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1
-                )
-            else:
-                # Run command directly
-                process = subprocess.Popen(
-                    command,
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1
-                )
-            
-            # Read output line by line
-            for line in process.stdout:
-                self.log(line.rstrip())
-            
-            process.wait()
-            
-            if process.returncode == 0:
-                self.log("\n✓ Command completed successfully")
-                return True
-            else:
-                self.log(f"\n✗ Command failed with exit code {process.returncode}")
-                return False
-                
-        except Exception as e:
-            self.log(f"\n✗ Error: {str(e)}")
-            return False
     
-    def run_command_list(self, cmd_list):
-        """Run a command from a list and show output"""
-        try:
-            process = subprocess.Popen(
-                cmd_list,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1
-            )
-            
-            for line in process.stdout:
-                self.log(line.rstrip())
-            
-            process.wait()
-            return process.returncode == 0
-                
-        except Exception as e:
-            self.log(f"\n✗ Error: {str(e)}")
-            return False
+    def run_in_background(self, work, done_status, failed_status):
+        """Run work() on a worker thread and report the outcome in the log and status bar"""
+        def task():
+            try:
+                work()
+                self.root.after(0, lambda: self.status_var.set(done_status))
+            except core.OperationError as e:
+                self.log(f"\n✗ {e}")
+                self.root.after(0, lambda: self.status_var.set(failed_status))
+            except Exception as e:
+                self.log(f"\n✗ Error: {str(e)}")
+                self.root.after(0, lambda: self.status_var.set(failed_status))
+        
+        threading.Thread(target=task, daemon=True).start()
     
     def on_boot_logo_drop(self, event):
         """Handle boot logo file drop"""
@@ -731,6 +709,23 @@ class ROMBuilderGUI:
         """Open customization dialog"""
         CustomizeDialog(self.root, self)
     
+    def reset_customizations_gui(self):
+        """Drop the build layer so the next build is the extracted firmware as-is"""
+        build = layer.Layer()
+        if build.empty:
+            messagebox.showinfo("Reset Customizations", "Nothing to reset, no customizations applied")
+            return
+        self.output_text.delete(1.0, tk.END)
+        self.log("Build layer:")
+        for line in build.describe():
+            self.log(line)
+        if not messagebox.askyesno("Reset Customizations", "Remove all customizations? squashfs-root is not touched."):
+            return
+        build.reset()
+        build.save()
+        self.log("✓ Customizations removed")
+        self.status_var.set("Customizations reset")
+    
     def build_rom_gui(self):
         """Build ROM with GUI"""
         self.output_text.delete(1.0, tk.END)
@@ -746,71 +741,20 @@ class ROMBuilderGUI:
         self.log("=" * 60)
         self.log(f"Captured settings: v{version}, build#{build_num}, {product_type}, {manufacturer}")
         
-        def task():
-            try:
-                current_date = datetime.now().strftime("%Y%m%d")
-                
-                if not all([version, build_num, product_type, manufacturer]):
-                    self.log("✗ Please fill in all build settings")
-                    self.root.after(0, lambda: self.status_var.set("Build failed - missing settings"))
-                    return
-                
-                out_file = f"system_v{version}.bin"
-                
-                self.log(f"Version: {version}")
-                self.log(f"Build Number: {build_num}")
-                self.log(f"Product Type: {product_type}")
-                self.log(f"Manufacturer: {manufacturer}")
-                self.log(f"Build Date: {current_date}\n")
-                
-                # Update config files
-                self.log("Updating firmware information...")
-                for cfg_file in ['squashfs-root/res/cfg/220x176.cfg', 'squashfs-root/res/cfg/320x240.cfg']:
-                    if os.path.exists(cfg_file):
-                        self.log(f"  Updating {cfg_file}")
-                        with open(cfg_file, 'r') as f:
-                            content = f.read()
-                        
-                        content = re.sub(r'^product_type=.*', f'product_type={product_type}', content, flags=re.MULTILINE)
-                        content = re.sub(r'^software_version=.*', f'software_version={build_num}', content, flags=re.MULTILINE)
-                        content = re.sub(r'^updated=.*', f'updated={current_date}', content, flags=re.MULTILINE)
-                        content = re.sub(r'^Manufacturer=.*', f'Manufacturer={manufacturer}', content, flags=re.MULTILINE)
-                        content = re.sub(r'^date_number=.*', f'date_number={current_date}', content, flags=re.MULTILINE)
-                        
-                        with open(cfg_file, 'w') as f:
-                            f.write(content)
-                
-                # Build squashfs
-                self.log(f"\nCreating {out_file}...")
-                exclude_opts = []
-                if os.path.exists('.mksquashfs_exclude'):
-                    self.log("Using debloat exclusions")
-                    exclude_opts = ['-ef', '.mksquashfs_exclude']
-                
-                cmd = ['mksquashfs', 'squashfs-root', out_file, '-comp', 'xz', '-no-xattrs'] + exclude_opts
-                if self.run_command_list(cmd):
-                    self.log(f"\n✓ Build complete: {out_file}")
-                    self.log(f"To flash: Click 'Flash ROM' button")
-                    self.root.after(0, lambda: self.status_var.set("Build complete"))
-                else:
-                    self.root.after(0, lambda: self.status_var.set("Build failed"))
-                    
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Build error"))
+        def work():
+            core.build_rom(version, build_num, product_type, manufacturer, log=self.log)
+            self.log(f"To flash: Click 'Flash ROM' button")
         
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(work, "Build complete", "Build failed")
     
     def flash_rom_gui(self):
         """Flash ROM to device with GUI"""
         # Find the latest system image
-        images = [f for f in os.listdir('.') if f.startswith('system_v') and f.endswith('.bin')]
-        if not images:
+        image = core.latest_image('system_v')
+        if not image:
             messagebox.showerror("Error", "No system image found. Build ROM first.")
             return
         
-        image = sorted(images)[-1]  # Get latest
-        
         if not messagebox.askyesno("Flash ROM", 
                                    f"Flash {image} to device?\n\n"
                                    "Make sure device is in FEL recovery mode:\n"
@@ -819,50 +763,65 @@ class ROMBuilderGUI:
                                    "- Connect USB while holding VOLUME UP"):
             return
         
+        writes = [('system', image)]
+        logos = [(name, path) for name, path in (('boot_logo', self.boot_logo_file),
+                                                 ('shutdown_logo', self.shutdown_logo_file)) if path]
+        if logos and messagebox.askyesno("Flash ROM", "Also flash the loaded logos in the same FEL session?\n\n"
+                                         + "\n".join(os.path.basename(path) for _name, path in logos)):
+            writes += logos
+        
         self.output_text.delete(1.0, tk.END)
         self.status_var.set("Flashing ROM...")
-        self.log(f"Flashing {image}...")
+        self.log(f"Flashing {', '.join(os.path.basename(path) for _name, path in writes)}...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                os.chdir('sunxi-tools')
-                shutil.copy(f'../{image}', image)
-                
-                # Verify size
-                if os.path.exists('../mtdblock2'):
-                    img_size = os.path.getsize(image)
-                    mtd_size = os.path.getsize('../mtdblock2')
-                    
-                    if img_size >= mtd_size:
-                        self.log(f"✗ Image too large: {img_size} >= {mtd_size} bytes")
-                        self.root.after(0, lambda: self.status_var.set("Flash failed - image too large"))
-                        os.chdir('..')
-                        return
-                    self.log(f"Size check passed: {img_size} < {mtd_size} bytes\n")
-                
-                # Flash
-                self.log("Flashing to device...")
-                cmd = ['./sunxi-fel', '-p', 'spiflash-write', '2883584', image]
-                if self.run_command_list(cmd):
-                    self.log("\nResetting device...")
-                    subprocess.run(['./sunxi-fel', 'wdreset'])
-                    self.log("\n✓ Flash complete! Device is rebooting.")
-                    self.root.after(0, lambda: self.status_var.set("Flash complete"))
-                else:
-                    self.root.after(0, lambda: self.status_var.set("Flash failed"))
-                
-                os.chdir('..')
-                    
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Flash error"))
-                try:
-                    os.chdir(self.script_dir)
-                except:
-                    pass
+        def work():
+            core.flash_partitions(writes, log=self.log)
+            self.log("\n✓ Flash complete! Device is rebooting.")
         
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(work, "Flash complete", "Flash failed")
+    
+    def adb_update_gui(self):
+        """Write the changed blocks of the latest system image over ADB"""
+        image = core.latest_image('system_v')
+        if not image:
+            messagebox.showerror("Error", "No system image found. Build ROM first.")
+            return
+        
+        if not messagebox.askyesno("Update over ADB", 
+                                   f"Update device to {image} over ADB?\n\n"
+                                   "Device must be connected with USB debugging enabled.\n"
+                                   "It reboots when the update is verified."):
+            return
+        
+        self.output_text.delete(1.0, tk.END)
+        self.status_var.set("Updating over ADB...")
+        self.log(f"Updating to {image} over ADB...")
+        self.log("=" * 60)
+        
+        self.run_in_background(lambda: core.adb_update_system(image, log=self.log), "Update complete", "Update failed")
+    
+    def ram_boot_gui(self):
+        """Boot the latest system image from RAM over FEL, without flashing"""
+        image = core.latest_image('system_v')
+        if not image:
+            messagebox.showerror("Error", "No system image found. Build ROM first.")
+            return
+        
+        if not messagebox.askyesno("Test from RAM", 
+                                   f"Boot {image} from RAM?\n\n"
+                                   "Nothing is written to flash. Put the device in FEL mode:\n"
+                                   "- Remove battery and SD card\n"
+                                   "- Hold VOLUME UP\n"
+                                   "- Connect USB while holding VOLUME UP"):
+            return
+        
+        self.output_text.delete(1.0, tk.END)
+        self.status_var.set("Booting from RAM...")
+        self.log(f"Booting {image} from RAM...")
+        self.log("=" * 60)
+        
+        self.run_in_background(lambda: core.ram_boot(image, log=self.log), "Running from RAM", "RAM boot failed")
     
     def backup_device(self):
         """Backup device mtdblocks via ADB"""
@@ -871,40 +830,23 @@ class ROMBuilderGUI:
         self.log("Starting device backup via ADB...")
         self.log("=" * 60)
         
-        def task():
-            # Create backup directory
-            backup_dir = f"backup_{subprocess.check_output(['date', '+%Y%m%d_%H%M%S']).decode().strip()}"
-            os.makedirs(backup_dir, exist_ok=True)
-            self.log(f"Created backup directory: {backup_dir}")
-            
-            # Check ADB connection
-            try:
-                result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
-                if 'device' not in result.stdout:
-                    self.log("✗ No device connected via ADB")
-                    self.root.after(0, lambda: self.status_var.set("Error: No device connected"))
-                    return
-            except FileNotFoundError:
-                self.log("✗ ADB not found. Please install Android Platform Tools")
-                self.root.after(0, lambda: self.status_var.set("Error: ADB not found"))
-                return
-            
-            # Backup each mtdblock
-            for i in range(8):
-                self.log(f"\nBacking up mtdblock{i}...")
-                result = subprocess.run(
-                    ['adb', 'pull', f'/dev/block/mtdblock{i}', f'{backup_dir}/mtdblock{i}'],
-                    capture_output=True, text=True
-                )
-                if result.returncode == 0:
-                    self.log(f"✓ mtdblock{i} backed up")
-                else:
-                    self.log(f"✗ Failed to backup mtdblock{i}: {result.stderr}")
-            
-            self.log(f"\n✓ Backup complete: {backup_dir}/")
-            self.root.after(0, lambda: self.status_var.set("Backup complete"))
-            
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(lambda: core.backup_device(log=self.log), "Backup complete", "Backup failed")
+    
+    def fel_backup_gui(self):
+        """Backup the whole flash over FEL"""
+        if not messagebox.askyesno("Backup over FEL", 
+                                   "Put the device in FEL recovery mode:\n"
+                                   "- Remove battery and SD card\n"
+                                   "- Hold VOLUME UP\n"
+                                   "- Connect USB while holding VOLUME UP"):
+            return
+        
+        self.output_text.delete(1.0, tk.END)
+        self.status_var.set("Backing up device over FEL...")
+        self.log("Starting device backup via FEL...")
+        self.log("=" * 60)
+        
+        self.run_in_background(lambda: core.fel_backup(log=self.log), "Backup complete", "Backup failed")
     
     def extract_mtdblocks_gui(self):
         """Extract and process mtdblocks"""
@@ -918,75 +860,8 @@ class ROMBuilderGUI:
         self.log(f"Extracting mtdblocks from: {backup_dir}")
         self.log("=" * 60)
         
-        def task():
-            extract_dir = f"{backup_dir}_extracted"
-            os.makedirs(extract_dir, exist_ok=True)
-            
-            # mtdblock0 - uboot (just copy)
-            self.log("\nmtdblock0 (uboot) - copying...")
-            if os.path.exists(f"{backup_dir}/mtdblock0"):
-                subprocess.run(['cp', f'{backup_dir}/mtdblock0', f'{extract_dir}/uboot.bin'])
-                self.log("✓ Copied as uboot.bin")
-            
-            # mtdblock1 - boot.img (just copy)
-            self.log("\nmtdblock1 (boot.img) - copying...")
-            if os.path.exists(f"{backup_dir}/mtdblock1"):
-                subprocess.run(['cp', f'{backup_dir}/mtdblock1', f'{extract_dir}/boot.img'])
-                self.log("✓ Copied as boot.img")
-            
-            # mtdblock2 - squashfs system
-            self.log("\nmtdblock2 (squashfs system) - extracting...")
-            if os.path.exists(f"{backup_dir}/mtdblock2"):
-                subprocess.run(['cp', f'{backup_dir}/mtdblock2', f'{extract_dir}/system.squashfs'])
-                result = subprocess.run(
-                    ['unsquashfs', '-d', f'{extract_dir}/squashfs-root', f'{backup_dir}/mtdblock2'],
-                    capture_output=True, text=True
-                )
-                if result.returncode == 0:
-                    self.log("✓ Extracted to squashfs-root/")
-                else:
-                    self.log(f"✗ Failed to extract: {result.stderr}")
-            
-            # mtdblock3 - jffs2 data
-            self.log("\nmtdblock3 (jffs2 data) - copying...")
-            if os.path.exists(f"{backup_dir}/mtdblock3"):
-                subprocess.run(['cp', f'{backup_dir}/mtdblock3', f'{extract_dir}/data.jffs2'])
-                self.log("✓ Copied as data.jffs2")
-                self.log("  (Use jefferson or jffs2dump to extract if needed)")
-            
-            # mtdblock4 - boot logo
-            self.log("\nmtdblock4 (boot logo) - extracting...")
-            if os.path.exists(f"{backup_dir}/mtdblock4"):
-                # Find JPEG start marker
-                with open(f"{backup_dir}/mtdblock4", 'rb') as f:
-                    data = f.read()
-                jpeg_start = data.find(b'\xff\xd8\xff')
-                if jpeg_start != -1:
-                    with open(f"{extract_dir}/boot_logo.jpg", 'wb') as out:
-                        out.write(data[jpeg_start:])
-                    self.log("✓ Extracted as boot_logo.jpg")
-                else:
-                    subprocess.run(['cp', f'{backup_dir}/mtdblock4', f'{extract_dir}/boot_logo.raw'])
-                    self.log("✓ Copied as boot_logo.raw (no JPEG marker found)")
-            
-            # mtdblock5 - shutdown logo
-            self.log("\nmtdblock5 (shutdown logo) - extracting...")
-            if os.path.exists(f"{backup_dir}/mtdblock5"):
-                with open(f"{backup_dir}/mtdblock5", 'rb') as f:
-                    data = f.read()
-                jpeg_start = data.find(b'\xff\xd8\xff')
-                if jpeg_start != -1:
-                    with open(f"{extract_dir}/shutdown_logo.jpg", 'wb') as out:
-                        out.write(data[jpeg_start:])
-                    self.log("✓ Extracted as shutdown_logo.jpg")
-                else:
-                    subprocess.run(['cp', f'{backup_dir}/mtdblock5', f'{extract_dir}/shutdown_logo.raw'])
-                    self.log("✓ Copied as shutdown_logo.raw (no JPEG marker found)")
-            
-            self.log(f"\n✓ Extraction complete: {extract_dir}/")
-            self.root.after(0, lambda: self.status_var.set("Extraction complete"))
-            
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(lambda: core.extract_mtdblocks(backup_dir, log=self.log),
+                               "Extraction complete", "Extraction failed")
     
     def extract_mtdblock2_gui(self):
         """Extract mtdblock2 only"""
@@ -996,7 +871,8 @@ class ROMBuilderGUI:
             return
         
         if os.path.exists('squashfs-root'):
-            if not messagebox.askyesno("Warning", "squashfs-root exists. Delete and re-extract?"):
+            if not messagebox.askyesno("Warning", "squashfs-root exists. Delete and re-extract?\n"
+                                                   "(Customizations are kept and applied to the new one.)"):
                 return
             shutil.rmtree('squashfs-root')
         
@@ -1005,29 +881,16 @@ class ROMBuilderGUI:
         self.log("Extracting mtdblock2...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                cmd = ['unsquashfs', mtdblock2]
-                if self.run_command_list(cmd):
-                    self.log("\n✓ Extracted to squashfs-root/")
-                    self.root.after(0, lambda: self.status_var.set("Extraction complete"))
-                else:
-                    self.root.after(0, lambda: self.status_var.set("Extraction failed"))
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Extraction error"))
-        
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(lambda: core.extract_system(mtdblock2, log=self.log),
+                               "Extraction complete", "Extraction failed")
     
     def full_restore_gui(self):
         """Flash full restore image"""
-        images = [f for f in os.listdir('.') if f.startswith('full_restore_v') and f.endswith('.bin')]
-        if not images:
+        image = core.latest_image('full_restore_v')
+        if not image:
             messagebox.showerror("Error", "No restore image found. Create one first.")
             return
         
-        image = sorted(images)[-1]
-        
         if not messagebox.askyesno("Full Restore", 
                                    f"⚠️  WARNING: FULL RESTORE ⚠️\n\n"
                                    f"This will flash {image} from sector 0.\n"
@@ -1041,32 +904,7 @@ class ROMBuilderGUI:
         self.log(f"Flashing {image}...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                os.chdir('sunxi-tools')
-                shutil.copy(f'../{image}', image)
-                
-                self.log("Flashing from sector 0...")
-                cmd = ['./sunxi-fel', '-p', 'spiflash-write', '0', image]
-                if self.run_command_list(cmd):
-                    self.log("\nResetting device...")
-                    subprocess.run(['./sunxi-fel', 'wdreset'])
-                    self.log("\n✓ Full restore complete! Device is rebooting.")
-                    self.root.after(0, lambda: self.status_var.set("Restore complete"))
-                else:
-                    self.root.after(0, lambda: self.status_var.set("Restore failed"))
-                
-                os.chdir('..')
-                    
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Restore error"))
-                try:
-                    os.chdir(self.script_dir)
-                except:
-                    pass
-        
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(lambda: core.full_restore(image, log=self.log), "Restore complete", "Restore failed")
     
     def make_restore_gui(self):
         """Create full restore image"""
@@ -1079,45 +917,8 @@ class ROMBuilderGUI:
         self.log("Creating full restore image...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                if not os.path.exists('mtdblock0'):
-                    self.log("✗ mtdblock0 not found (required)")
-                    self.root.after(0, lambda: self.status_var.set("Error: mtdblock0 required"))
-                    return
-                
-                blocks = ['mtdblock0']
-                for i in range(1, 7):
-                    if os.path.exists(f'mtdblock{i}'):
-                        blocks.append(f'mtdblock{i}')
-                    else:
-                        break
-                
-                self.log(f"Found {len(blocks)} mtdblock files:")
-                total_size = 0
-                for block in blocks:
-                    size = os.path.getsize(block)
-                    total_size += size
-                    self.log(f"  {block}: {size} bytes")
-                
-                self.log(f"\nTotal size: {total_size} bytes")
-                
-                out_file = f"full_restore_v{version}.bin"
-                self.log(f"\nCreating {out_file}...")
-                
-                with open(out_file, 'wb') as outf:
-                    for block in blocks:
-                        with open(block, 'rb') as inf:
-                            outf.write(inf.read())
-                
-                self.log(f"\n✓ Created {out_file}")
-                self.root.after(0, lambda: self.status_var.set("Restore image created"))
-                
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Creation error"))
-        
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(lambda: core.make_restore(version, log=self.log),
+                               "Restore image created", "Creation error")
     
     def change_logos_gui(self):
         """Change boot logos via ADB"""
@@ -1135,90 +936,16 @@ class ROMBuilderGUI:
         self.log("Flashing logos via ADB...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                # Check ADB
-                result = subprocess.run(['adb', 'devices'], capture_output=True, text=True)
-                if 'device' not in result.stdout:
-                    self.log("✗ No device connected via ADB")
-                    self.root.after(0, lambda: self.status_var.set("Error: No device"))
-                    return
-                
-                TARGET_SIZE = 131072
-                
-                # Process boot logo
-                if self.boot_logo_file:
-                    self.log("\nProcessing boot logo...")
-                    with open(self.boot_logo_file, 'rb') as f:
-                        data = f.read()
-                    
-                    if len(data) > TARGET_SIZE:
-                        self.log(f"✗ Boot logo too large: {len(data)} bytes")
-                        return
-                    
-                    # Pad to 128KB
-                    data += b'\x00' * (TARGET_SIZE - len(data))
-                    
-                    with open('boot_logo_new.raw', 'wb') as f:
-                        f.write(data)
-                    
-                    self.log("Flashing boot logo...")
-                    subprocess.run(['adb', 'push', 'boot_logo_new.raw', '/data/'])
-                    subprocess.run(['adb', 'shell', 'toolbox dd if=/data/boot_logo_new.raw of=/dev/block/mtdblock4 bs=131072 && sync'])
-                    self.log("✓ Boot logo flashed")
-                    os.remove('boot_logo_new.raw')
-                
-                # Process shutdown logo
-                if self.shutdown_logo_file:
-                    self.log("\nProcessing shutdown logo...")
-                    with open(self.shutdown_logo_file, 'rb') as f:
-                        data = f.read()
-                    
-                    if len(data) > TARGET_SIZE:
-                        self.log(f"✗ Shutdown logo too large: {len(data)} bytes")
-                        return
-                    
-                    data += b'\x00' * (TARGET_SIZE - len(data))
-                    
-                    with open('shutdown_logo_new.raw', 'wb') as f:
-                        f.write(data)
-                    
-                    self.log("Flashing shutdown logo...")
-                    subprocess.run(['adb', 'push', 'shutdown_logo_new.raw', '/data/'])
-                    subprocess.run(['adb', 'shell', 'toolbox dd if=/data/shutdown_logo_new.raw of=/dev/block/mtdblock5 bs=131072 && sync'])
-                    self.log("✓ Shutdown logo flashed")
-                    os.remove('shutdown_logo_new.raw')
-                
-                self.log("\n✓ Done! Power cycle device to see new logos.")
-                self.root.after(0, lambda: self.status_var.set("Logos flashed"))
-                
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Logo flash error"))
-        
-        threading.Thread(target=task, daemon=True).start()
+        boot, shutdown = self.boot_logo_file, self.shutdown_logo_file
+        self.run_in_background(lambda: core.flash_logos(boot, shutdown, log=self.log),
+                               "Logos flashed", "Logo flash error")
     
     def check_dependencies(self):
         """Check status of all dependencies"""
         def task():
-            checks = [
-                ("Homebrew", "which brew"),
-                ("squashfs-tools", "which mksquashfs"),
-                ("libusb", "brew list libusb"),
-                ("pkg-config", "which pkg-config"),
-                ("sunxi-tools", "test -f sunxi-tools/sunxi-fel && echo found"),
-                ("adb", "which adb"),
-            ]
-            
-            for name, cmd in checks:
-                try:
-                    result = subprocess.run(cmd, shell=True, capture_output=True, timeout=2)
-                    if result.returncode == 0:
-                        self.root.after(0, lambda n=name: self.dep_status_labels[n].set("✓ Installed"))
-                    else:
-                        self.root.after(0, lambda n=name: self.dep_status_labels[n].set("✗ Not Found"))
-                except:
-                    self.root.after(0, lambda n=name: self.dep_status_labels[n].set("✗ Not Found"))
+            for name, installed in core.check_dependencies().items():
+                text = "✓ Installed" if installed else "✗ Not Found"
+                self.root.after(0, lambda n=name, t=text: self.dep_status_labels[n].set(t))
         
         threading.Thread(target=task, daemon=True).start()
     
@@ -1231,35 +958,13 @@ class ROMBuilderGUI:
         self.log("=" * 60)
         self.log(f"Command: {install_cmd}\n")
         
-        def task():
-            try:
-                process = subprocess.Popen(
-                    install_cmd,
-                    shell=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1
-                )
-                
-                for line in process.stdout:
-                    self.log(line.rstrip())
-                
-                process.wait()
-                
-                if process.returncode == 0:
-                    self.log(f"\n✓ {name} installed successfully")
-                    self.root.after(0, lambda: self.status_var.set(f"{name} installed"))
-                    self.root.after(100, self.check_dependencies)
-                else:
-                    self.log(f"\n✗ Installation failed")
-                    self.root.after(0, lambda: self.status_var.set(f"Failed to install {name}"))
-                    
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Installation error"))
+        def work():
+            if core.run_command(install_cmd, self.log, shell=True):
+                raise core.OperationError("Installation failed")
+            self.log(f"\n✓ {name} installed successfully")
+            self.root.after(100, self.check_dependencies)
         
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(work, f"{name} installed", f"Failed to install {name}")
     
     def install_sunxi_tools(self):
         """Install sunxi-tools from source"""
@@ -1268,65 +973,29 @@ class ROMBuilderGUI:
         self.log("Installing sunxi-tools from source...")
         self.log("=" * 60)
         
-        def task():
-            try:
-                # Check if directory exists
-                if os.path.exists("sunxi-tools"):
-                    self.log("sunxi-tools directory already exists")
-                    self.log("Updating repository...")
-                    os.chdir("sunxi-tools")
-                    subprocess.run(["git", "pull"], check=True)
-                else:
-                    self.log("Cloning sunxi-tools repository...")
-                    result = subprocess.run(
-                        ["git", "clone", "https://github.com/linux-sunxi/sunxi-tools"],
-                        capture_output=True, text=True
-                    )
-                    self.log(result.stdout)
-                    if result.returncode != 0:
-                        self.log(result.stderr)
-                        self.root.after(0, lambda: self.status_var.set("Failed to clone repository"))
-                        return
-                    
-                    os.chdir("sunxi-tools")
-                
-                # Build
-                self.log("\nBuilding sunxi-tools...")
-                self.log("This may take a few minutes...\n")
-                
-                process = subprocess.Popen(
-                    ["make"],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1
-                )
-                
-                for line in process.stdout:
-                    self.log(line.rstrip())
-                
-                process.wait()
-                
-                os.chdir("..")
-                
-                if process.returncode == 0:
-                    self.log("\n✓ sunxi-tools built successfully")
-                    self.log("  sunxi-fel is now available in sunxi-tools/")
-                    self.root.after(0, lambda: self.status_var.set("sunxi-tools installed"))
-                    self.root.after(100, self.check_dependencies)
-                else:
-                    self.log("\n✗ Build failed")
-                    self.root.after(0, lambda: self.status_var.set("Build failed"))
-                    
-            except Exception as e:
-                self.log(f"\n✗ Error: {str(e)}")
-                self.root.after(0, lambda: self.status_var.set("Installation error"))
-                try:
-                    os.chdir(self.script_dir)
-                except:
-                    pass
+        def work():
+            # Check if directory exists
+            if os.path.exists("sunxi-tools"):
+                self.log("sunxi-tools directory already exists")
+                self.log("Updating repository...")
+                if core.run_command(["git", "pull"], self.log, cwd="sunxi-tools"):
+                    raise core.OperationError("Failed to update repository")
+            else:
+                self.log("Cloning sunxi-tools repository...")
+                if core.run_command(["git", "clone", "https://github.com/linux-sunxi/sunxi-tools"], self.log):
+                    raise core.OperationError("Failed to clone repository")
+            
+            # Build
+            self.log("\nBuilding sunxi-tools...")
+            self.log("This may take a few minutes...\n")
+            if core.run_command(["make"], self.log, cwd="sunxi-tools"):
+                raise core.OperationError("Build failed")
+            
+            self.log("\n✓ sunxi-tools built successfully")
+            self.log("  sunxi-fel is now available in sunxi-tools/")
+            self.root.after(100, self.check_dependencies)
         
-        threading.Thread(target=task, daemon=True).start()
+        self.run_in_background(work, "sunxi-tools installed", "Installation error")
 
 
 class CustomizeDialog:
@@ -1437,80 +1106,24 @@ class CustomizeDialog:
     def apply(self):
         """Apply customization settings"""
         try:
-            cfg_dir = "squashfs-root/res/cfg"
-            menu_cfg = f"{cfg_dir}/menu.cfg"
-            
-            # Update WiFi settings
-            for cfg_file in [f'{cfg_dir}/220x176.cfg', f'{cfg_dir}/320x240.cfg']:
-                if os.path.exists(cfg_file):
-                    with open(cfg_file, 'r') as f:
-                        content = f.read()
-                    content = re.sub(r'^wifi_ssid=.*', f'wifi_ssid={self.wifi_ssid.get()}', content, flags=re.MULTILINE)
-                    content = re.sub(r'^wifi_pwd=.*', f'wifi_pwd={self.wifi_pwd.get()}', content, flags=re.MULTILINE)
-                    with open(cfg_file, 'w') as f:
-                        f.write(content)
-            
-            # Update menu.cfg
-            if os.path.exists(menu_cfg):
-                with open(menu_cfg, 'r') as f:
-                    content = f.read()
-                
+            core.customize(
+                wifi_ssid=self.wifi_ssid.get(),
+                wifi_pwd=self.wifi_pwd.get(),
                 # Extract just the number from combobox value
-                lang = self.language.get().split('-')[0]
-                vid_res = self.video_res.get().split('-')[0]
-                photo_res = self.photo_res.get().split('-')[0]
-                gsensor = self.gsensor.get().split('-')[0]
-                
-                # Update menu settings
-                content = re.sub(r'(\[language\].*?current=)\d+', f'\\g<1>{lang}', content, flags=re.DOTALL)
-                content = re.sub(r'(\[video_resolution\].*?current=)\d+', f'\\g<1>{vid_res}', content, flags=re.DOTALL)
-                content = re.sub(r'(\[photo_resolution\].*?current=)\d+', f'\\g<1>{photo_res}', content, flags=re.DOTALL)
-                content = re.sub(r'(\[gsensor\].*?current=)\d+', f'\\g<1>{gsensor}', content, flags=re.DOTALL)
-                
-                # Update switches
-                content = re.sub(r'^power_on_record=.*', f'power_on_record={int(self.power_on_record.get())}', content, flags=re.MULTILINE)
-                content = re.sub(r'^record_sound=.*', f'record_sound={int(self.record_sound.get())}', content, flags=re.MULTILINE)
-                content = re.sub(r'^time_water_mark=.*', f'time_water_mark={int(self.time_watermark.get())}', content, flags=re.MULTILINE)
-                content = re.sub(r'^wifi=.*', f'wifi={int(self.wifi_enabled.get())}', content, flags=re.MULTILINE)
-                
-                with open(menu_cfg, 'w') as f:
-                    f.write(content)
-            
-            # Handle debloating
-            if self.debloat.get():
-                with open('.mksquashfs_exclude', 'w') as f:
-                    # Add fake feature drivers
-                    for driver in ['mma', 'bma']:
-                        for root, dirs, files in os.walk('squashfs-root/vendor/modules'):
-                            for file in files:
-                                if file.startswith(driver):
-                                    rel_path = os.path.join(root, file).replace('squashfs-root/', '')
-                                    f.write(rel_path + '\n')
-                    
-                    # Add from exclude.txt
-                    if os.path.exists('exclude.txt'):
-                        with open('exclude.txt', 'r') as excl:
-                            for line in excl:
-                                line = line.strip()
-                                if line and not line.startswith('#'):
-                                    if line.startswith('squashfs-root/'):
-                                        line = line.replace('squashfs-root/', '')
-                                    f.write(line + '\n')
-                
-                # Disable fake features in menu
-                if os.path.exists(menu_cfg):
-                    with open(menu_cfg, 'r') as f:
-                        content = f.read()
-                    content = re.sub(r'(\[gsensor\].*?count=)\d+', r'\g<1>0', content, flags=re.DOTALL)
-                    content = re.sub(r'(\[park_mode\].*?count=)\d+', r'\g<1>0', content, flags=re.DOTALL)
-                    with open(menu_cfg, 'w') as f:
-                        f.write(content)
-            else:
-                if os.path.exists('.mksquashfs_exclude'):
-                    os.remove('.mksquashfs_exclude')
-            
-            messagebox.showinfo("Success", "Customization applied successfully!")
-            self.main_app.log("✓ ROM customization applied")
+                language=self.language.get().split('-')[0],
+                video_res=self.video_res.get().split('-')[0],
+                photo_res=self.photo_res.get().split('-')[0],
+                gsensor=self.gsensor.get().split('-')[0],
+                switches={
+                    'power_on_record': self.power_on_record.get(),
+                    'record_sound': self.record_sound.get(),
+                    'time_water_mark': self.time_watermark.get(),
+                    'wifi': self.wifi_enabled.get(),
+                },
+                debloat=self.debloat.get(),
+                log=self.main_app.log,
+            )
+            messagebox.showinfo("Success", "Customization saved, it will be applied at build time!")
             self.dialog.destroy()
             
         except Exception as e:
@@ -1518,6 +1131,7 @@ class CustomizeDialog:
 
 
 def main():
+    load_tk()
     try:
         root = TkinterDnD.Tk()
         drag_drop_enabled = True
@@ -1527,17 +1141,7 @@ def main():
         root = tk.Tk()
         drag_drop_enabled = False
     
-    app = ROMBuilderGUI(root)
-    
-    # Disable drag and drop if not available
-    if not drag_drop_enabled:
-        app.boot_logo_label.config(text="Boot Logo: Click button to select (220x176)")
-        app.shutdown_logo_label.config(text="Shutdown Logo: Click button to select")
-        
-        # Add click handlers as fallback
-        app.boot_logo_label.bind('<Button-1>', lambda e: app.select_boot_logo())
-        app.shutdown_logo_label.bind('<Button-1>', lambda e: app.select_shutdown_logo())
-    
+    app = ROMBuilderGUI(root, drag_drop_enabled)
     root.mainloop()
 
 if __name__ == "__main__":